@@ -0,0 +1,117 @@
+"""
+Agenda en memoria de un usuario para detectar choques de horario y sugerir huecos libres.
+
+Los intervalos (inicio, fin, id) se guardan ordenados por inicio. Como ninguno dura más que
+max_length, los que pueden solaparse con [inicio, fin) empiezan entre inicio - max_length y
+fin: dos bisect acotan la búsqueda y solo se revisan esos candidatos (O(log n + k)).
+Todas las fechas son UTC naive, como en la base de datos; las horas hábiles para sugerir
+huecos se evalúan en la hora local del asistente.
+"""
+import bisect
+import os
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from timeutils import local_to_utc, make_naive, utc_to_local
+
+AGENDA_DAY_START_HOUR = int(os.getenv("AGENDA_DAY_START_HOUR", "8"))     # hora local
+AGENDA_DAY_END_HOUR = int(os.getenv("AGENDA_DAY_END_HOUR", "20"))
+AGENDA_SLOT_STEP_MINUTES = int(os.getenv("AGENDA_SLOT_STEP_MINUTES", "30"))
+AGENDA_SUGGESTION_DAYS = int(os.getenv("AGENDA_SUGGESTION_DAYS", "7"))
+
+
+def round_up(value: datetime, step: timedelta) -> datetime:
+    """Redondea hacia arriba al múltiplo de step dentro de la hora (step debe dividir 60 min)"""
+    remainder = (value - value.replace(minute=0, second=0, microsecond=0)) % step
+    return value + (step - remainder) if remainder else value
+
+
+class UserAgenda:
+    """
+    Intervalos ocupados de un usuario. Todas las operaciones deben hacerse con el lock tomado
+    (la verificación de choques y el alta de la reunión van juntas).
+    """
+
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+        self.lock = threading.Lock()
+        self._starts: List[datetime] = []
+        self._entries: List[Tuple[datetime, datetime, Any]] = []
+        self._titles: Dict[Any, str] = {}
+        self._by_id: Dict[Any, Tuple[datetime, datetime, Any]] = {}
+        self.max_length = timedelta(0)
+        # Marca para ponerse al día con una consulta incremental por _id
+        self.last_event_id: Any = None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def add(self, event_id: Any, start: datetime, end: datetime, title: Optional[str] = None):
+        if event_id in self._by_id:
+            self.remove(event_id)
+        entry = (start, end, event_id)
+        position = bisect.bisect_left(self._entries, entry)
+        self._entries.insert(position, entry)
+        self._starts.insert(position, start)
+        self._by_id[event_id] = entry
+        self._titles[event_id] = title or ""
+        self.max_length = max(self.max_length, end - start)
+        if self.last_event_id is None or event_id > self.last_event_id:
+            self.last_event_id = event_id
+
+    def remove(self, event_id: Any):
+        entry = self._by_id.pop(event_id, None)
+        if entry is None:
+            return
+        position = bisect.bisect_left(self._entries, entry)
+        del self._entries[position]
+        del self._starts[position]
+        self._titles.pop(event_id, None)
+
+    def prune(self, before: datetime):
+        """Descarta los intervalos que terminaron antes de la fecha (ya no pueden chocar)"""
+        cutoff = bisect.bisect_left(self._starts, before - self.max_length)
+        for start, end, event_id in self._entries[:cutoff]:
+            if end <= before:
+                self.remove(event_id)
+
+    def overlapping(self, start: datetime, end: datetime) -> List[Dict[str, Any]]:
+        """Intervalos que se solapan con [start, end)"""
+        low = bisect.bisect_right(self._starts, start - self.max_length)
+        high = bisect.bisect_left(self._starts, end)
+        return [
+            {"id": event_id, "title": self._titles.get(event_id), "start": entry_start, "end": entry_end}
+            for entry_start, entry_end, event_id in self._entries[low:high]
+            if entry_end > start
+        ]
+
+    def free_slots(self, start: datetime, duration: timedelta, count: int = 3,
+                   step: timedelta = timedelta(minutes=AGENDA_SLOT_STEP_MINUTES),
+                   horizon: timedelta = timedelta(days=AGENDA_SUGGESTION_DAYS)) -> List[datetime]:
+        """
+        Próximos inicios libres desde start, dentro del horario hábil local. Cada choque
+        hace saltar directamente al final del intervalo ocupado.
+        """
+        slots: List[datetime] = []
+        cursor = start
+        limit = start + horizon
+        while cursor < limit and len(slots) < count:
+            local = utc_to_local(cursor)
+            day_open = local.replace(hour=AGENDA_DAY_START_HOUR, minute=0, second=0, microsecond=0)
+            if local < day_open:
+                cursor = make_naive(local_to_utc(day_open))
+                continue
+            if local + duration > day_open.replace(hour=AGENDA_DAY_END_HOUR):
+                cursor = make_naive(local_to_utc(day_open + timedelta(days=1)))
+                continue
+            busy = self.overlapping(cursor, cursor + duration)
+            if busy:
+                cursor = round_up(max(interval["end"] for interval in busy), step)
+                continue
+            slots.append(cursor)
+            cursor += duration
+        return slots
+
+    def stats(self) -> Dict[str, Any]:
+        return {"intervals": len(self._entries), "max_length_minutes": self.max_length.total_seconds() / 60}
@@ -0,0 +1,320 @@
+"""
+Análisis batch (offline) de la colección unknown_inputs.
+
+Recorre los mensajes no reconocidos con un cursor, los normaliza, los agrupa por
+similitud (TF-IDF sobre n-gramas con hashing, en NumPy) y propone palabras clave
+nuevas para las intenciones de nlu_config.json, con estadísticas de cobertura.
+
+Uso:
+    python analyze_unknown_inputs.py --output candidatos.json
+    python analyze_unknown_inputs.py --since 2025-01-01 --threshold 0.45
+
+La memoria es acotada: el texto se procesa por bloques (--chunk-size) y solo se
+mantienen en memoria los centroides (--max-clusters x 2^--hash-bits) y contadores por grupo.
+"""
+import argparse
+import json
+import math
+import re
+import time
+import unicodedata
+import zlib
+from collections import Counter
+from datetime import datetime
+from typing import Dict, Iterator, List, Tuple
+
+import numpy as np
+
+from main import db
+from nlu import get_nlu
+
+# Palabras vacías que nunca se proponen como palabra clave
+STOPWORDS = {
+    'a', 'al', 'algo', 'como', 'con', 'de', 'del', 'el', 'en', 'es', 'esta', 'este', 'hay', 'la', 'las',
+    'le', 'lo', 'los', 'me', 'mi', 'mis', 'muy', 'no', 'para', 'pero', 'por', 'que', 'se', 'si', 'su',
+    'te', 'tu', 'un', 'una', 'uno', 'y', 'ya', 'yo', 'o', 'eso', 'esto', 'favor', 'puedes', 'quiero'
+}
+MAX_TERMS_PER_CLUSTER = 2000
+EXAMPLES_PER_CLUSTER = 3
+
+
+def normalize_text(text: str) -> str:
+    """Minúsculas, sin acentos, sin signos y con los números reemplazados por '0'"""
+    text = unicodedata.normalize('NFKD', text.lower())
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    text = re.sub(r'\d+', '0', text)
+    text = re.sub(r'[^a-z0\s]', ' ', text)
+    return ' '.join(text.split())
+
+
+def readable_terms(tokens: List[str]) -> List[str]:
+    """Unigramas y bigramas candidatos a palabra clave"""
+    words = [token for token in tokens if token not in STOPWORDS and len(token) > 2 and token != '0']
+    bigrams = [
+        f"{a} {b}" for a, b in zip(tokens, tokens[1:])
+        if '0' not in (a, b) and (a not in STOPWORDS or b not in STOPWORDS)
+    ]
+    return words + bigrams
+
+
+def feature_ids(tokens: List[str], mask: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Índices (hashing) y frecuencias de unigramas, bigramas y trigramas de caracteres"""
+    features = list(tokens)
+    features += [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+    for token in tokens:
+        padded = f"#{token}#"
+        features += [padded[i:i + 3] for i in range(len(padded) - 2)]
+
+    ids = np.fromiter((zlib.crc32(feature.encode()) & mask for feature in features), dtype=np.int64, count=len(features))
+    return np.unique(ids, return_counts=True)
+
+
+def stream_unknown_inputs(since: datetime = None, limit: int = 0, batch_size: int = 1000) -> Iterator[str]:
+    """Itera los textos de unknown_inputs con un cursor (sin cargar la colección)"""
+    query = {"timestamp": {"$gte": since}} if since else {}
+    cursor = db.unknown_inputs.find(query, {"user_input": 1, "_id": 0}).batch_size(batch_size)
+    if limit:
+        cursor = cursor.limit(limit)
+    for doc in cursor:
+        text = doc.get("user_input")
+        if text:
+            yield text
+
+
+def chunked(iterable: Iterator[str], size: int) -> Iterator[List[str]]:
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class ChunkMatrix:
+    """Bloque de documentos en formato CSR (indptr / indices / data) normalizado L2"""
+
+    def __init__(self, rows: List[Tuple[np.ndarray, np.ndarray]], idf: np.ndarray):
+        lengths = np.fromiter((len(ids) for ids, _ in rows), dtype=np.int64, count=len(rows))
+        self.indptr = np.concatenate(([0], np.cumsum(lengths)))
+        self.indices = np.concatenate([ids for ids, _ in rows]) if rows else np.zeros(0, dtype=np.int64)
+        counts = np.concatenate([c for _, c in rows]).astype(np.float32) if rows else np.zeros(0, dtype=np.float32)
+        self.data = (1.0 + np.log(counts)) * idf[self.indices]
+
+        norms = np.sqrt(np.add.reduceat(self.data ** 2, self.indptr[:-1])) if len(self.data) else np.zeros(0)
+        self.data /= np.repeat(np.maximum(norms, 1e-12), lengths).astype(np.float32)
+        self.lengths = lengths
+
+    def similarities(self, centroid_sums: np.ndarray, centroid_norms: np.ndarray, rows: np.ndarray = None) -> np.ndarray:
+        """Coseno de cada fila contra los k centroides: (filas x k)"""
+        if rows is None:
+            rows = np.arange(len(self.lengths))
+        starts, ends = self.indptr[rows], self.indptr[rows + 1]
+        positions = np.concatenate([np.arange(a, b) for a, b in zip(starts, ends)])
+        weighted = centroid_sums[self.indices[positions]] * self.data[positions, None]
+        offsets = np.concatenate(([0], np.cumsum(ends - starts)[:-1]))
+        return np.add.reduceat(weighted, offsets, axis=0) / np.maximum(centroid_norms, 1e-12)
+
+    def row(self, i: int) -> Tuple[np.ndarray, np.ndarray]:
+        return self.indices[self.indptr[i]:self.indptr[i + 1]], self.data[self.indptr[i]:self.indptr[i + 1]]
+
+
+class OnlineClusterer:
+    """Agrupamiento incremental tipo 'leader': centroides acumulados en una matriz (features x k)"""
+
+    def __init__(self, dims: int, max_clusters: int, threshold: float):
+        self.threshold = threshold
+        self.max_clusters = max_clusters
+        self.sums = np.zeros((dims, max_clusters), dtype=np.float32)
+        self.sq_norms = np.zeros(max_clusters, dtype=np.float64)
+        self.sizes = np.zeros(max_clusters, dtype=np.int64)
+        self.k = 0
+
+    def norms(self) -> np.ndarray:
+        return np.sqrt(self.sq_norms[:self.k])
+
+    def assign(self, chunk: ChunkMatrix) -> np.ndarray:
+        """Devuelve la etiqueta de cada fila (-1 si no cabe en ningún grupo)"""
+        n = len(chunk.lengths)
+        labels = np.full(n, -1, dtype=np.int64)
+
+        # 1) Todo el bloque contra los centroides existentes, vectorizado
+        if self.k:
+            norms = self.norms()
+            for start in range(0, n, 256):
+                rows = np.arange(start, min(start + 256, n))
+                rows = rows[chunk.lengths[rows] > 0]
+                if not len(rows):
+                    continue
+                sims = chunk.similarities(self.sums[:, :self.k], norms, rows)
+                best = sims.argmax(axis=1)
+                matched = sims[np.arange(len(rows)), best] >= self.threshold
+                labels[rows[matched]] = best[matched]
+            self._add_rows(chunk, np.flatnonzero(labels >= 0), labels)
+
+        # 2) Las filas sin grupo se procesan en orden y pueden crear grupos nuevos
+        for i in np.flatnonzero(labels < 0):
+            if chunk.lengths[i] == 0:
+                continue
+            ids, values = chunk.row(i)
+            if self.k:
+                sims = (self.sums[ids, :self.k] * values[:, None]).sum(axis=0) / np.maximum(self.norms(), 1e-12)
+                best = int(sims.argmax())
+                if sims[best] >= self.threshold:
+                    labels[i] = best
+            if labels[i] < 0 and self.k < self.max_clusters:
+                labels[i] = self.k
+                self.k += 1
+            if labels[i] >= 0:
+                label = labels[i]
+                column = self.sums[ids, label]
+                self.sq_norms[label] += 2.0 * float(column @ values) + float(values @ values)
+                self.sums[ids, label] = column + values
+                self.sizes[label] += 1
+
+        return labels
+
+    def _add_rows(self, chunk: ChunkMatrix, rows: np.ndarray, labels: np.ndarray):
+        """Suma un conjunto de filas a sus centroides (una sola operación vectorizada)"""
+        if not len(rows):
+            return
+        starts, ends = chunk.indptr[rows], chunk.indptr[rows + 1]
+        positions = np.concatenate([np.arange(a, b) for a, b in zip(starts, ends)])
+        row_labels = np.repeat(labels[rows], ends - starts)
+        np.add.at(self.sums, (chunk.indices[positions], row_labels), chunk.data[positions])
+        np.add.at(self.sizes, labels[rows], 1)
+        touched = np.unique(labels[rows])
+        self.sq_norms[touched] = (self.sums[:, touched].astype(np.float64) ** 2).sum(axis=0)
+
+
+def document_frequencies(args, mask: int) -> Tuple[np.ndarray, int]:
+    """Primera pasada: frecuencia de documento de cada feature (hash)"""
+    df = np.zeros(mask + 1, dtype=np.int64)
+    total = 0
+    for chunk in chunked(stream_unknown_inputs(args.since, args.limit), args.chunk_size):
+        ids = [feature_ids(normalize_text(text).split(), mask)[0] for text in chunk]
+        if ids:
+            df += np.bincount(np.concatenate(ids), minlength=mask + 1)
+        total += len(chunk)
+    return df, total
+
+
+def analyze(args) -> Dict:
+    started = time.monotonic()
+    dims = 1 << args.hash_bits
+    mask = dims - 1
+
+    df, total = document_frequencies(args, mask)
+    idf = (np.log((1.0 + total) / (1.0 + df)) + 1.0).astype(np.float32)
+    print(f"📊 Pasada 1: {total} mensajes en {time.monotonic() - started:.1f}s")
+
+    clusterer = OnlineClusterer(dims, args.max_clusters, args.threshold)
+    cluster_terms: Dict[int, Counter] = {}
+    cluster_examples: Dict[int, List[str]] = {}
+    unclustered = 0
+
+    for chunk in chunked(stream_unknown_inputs(args.since, args.limit), args.chunk_size):
+        tokens = [normalize_text(text).split() for text in chunk]
+        matrix = ChunkMatrix([feature_ids(doc_tokens, mask) for doc_tokens in tokens], idf)
+        labels = clusterer.assign(matrix)
+
+        for text, doc_tokens, label in zip(chunk, tokens, labels):
+            if label < 0:
+                unclustered += 1
+                continue
+            terms = cluster_terms.setdefault(int(label), Counter())
+            terms.update(set(readable_terms(doc_tokens)))
+            if len(terms) > MAX_TERMS_PER_CLUSTER:
+                cluster_terms[int(label)] = Counter(dict(terms.most_common(MAX_TERMS_PER_CLUSTER // 2)))
+            examples = cluster_examples.setdefault(int(label), [])
+            if len(examples) < EXAMPLES_PER_CLUSTER:
+                examples.append(text)
+
+    print(f"📊 Pasada 2: {clusterer.k} grupos en {time.monotonic() - started:.1f}s")
+
+    # Vector de cada intención existente (sus palabras clave como un documento)
+    intent_patterns = get_nlu().intent_patterns
+    intent_names = list(intent_patterns)
+    intent_matrix = ChunkMatrix(
+        [feature_ids(normalize_text(' '.join(patterns)).split(), mask) for patterns in intent_patterns.values()],
+        idf
+    )
+    intent_sims = intent_matrix.similarities(clusterer.sums[:, :clusterer.k], clusterer.norms()) if clusterer.k else None
+    known_keywords = {normalize_text(keyword) for patterns in intent_patterns.values() for keyword in patterns}
+
+    candidates = []
+    covered = 0
+    for label in np.argsort(-clusterer.sizes[:clusterer.k]):
+        size = int(clusterer.sizes[label])
+        if size < args.min_cluster_size:
+            break
+
+        def score(term: str) -> float:
+            term_df = df[zlib.crc32(term.encode()) & mask]
+            return cluster_terms[label][term] * math.log((1.0 + total) / (1.0 + term_df))
+
+        terms = [
+            term for term in sorted(cluster_terms.get(int(label), {}), key=score, reverse=True)
+            if not any(term in keyword or keyword in term for keyword in known_keywords)
+        ][:args.top_terms]
+        if not terms:
+            continue
+
+        best_intent = int(intent_sims[:, label].argmax())
+        similarity = float(intent_sims[best_intent, label])
+        # Cobertura estimada: mensajes del grupo que contienen la palabra clave más frecuente
+        cluster_coverage = max(cluster_terms[int(label)][term] for term in terms)
+        covered += cluster_coverage
+
+        candidates.append({
+            "cluster": int(label),
+            "size": size,
+            "suggested_intent": intent_names[best_intent] if similarity >= args.intent_threshold else None,
+            "intent_similarity": round(similarity, 3),
+            "keywords": terms,
+            "estimated_coverage": cluster_coverage,
+            "examples": cluster_examples.get(int(label), [])
+        })
+
+    return {
+        "generated_at": datetime.utcnow().isoformat(),
+        "total_inputs": total,
+        "clusters": clusterer.k,
+        "unclustered_inputs": unclustered,
+        "candidate_clusters": len(candidates),
+        "estimated_new_coverage": covered,
+        "estimated_new_coverage_pct": round(100.0 * covered / total, 2) if total else 0.0,
+        "elapsed_seconds": round(time.monotonic() - started, 1),
+        "candidates": candidates
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Agrupa unknown_inputs y propone nuevas palabras clave de intención")
+    parser.add_argument("--since", type=datetime.fromisoformat, help="Solo mensajes desde esta fecha (ISO)")
+    parser.add_argument("--limit", type=int, default=0, help="Máximo de mensajes a procesar (0 = todos)")
+    parser.add_argument("--chunk-size", type=int, default=2000)
+    parser.add_argument("--hash-bits", type=int, default=14, help="Dimensiones del hashing = 2^hash-bits")
+    parser.add_argument("--threshold", type=float, default=0.5, help="Similitud mínima para unir a un grupo")
+    parser.add_argument("--max-clusters", type=int, default=1000)
+    parser.add_argument("--min-cluster-size", type=int, default=5)
+    parser.add_argument("--top-terms", type=int, default=5)
+    parser.add_argument("--intent-threshold", type=float, default=0.2,
+                        help="Similitud mínima para proponer una intención existente")
+    parser.add_argument("--output", help="Archivo JSON de salida (por defecto, stdout)")
+    args = parser.parse_args()
+
+    report = analyze(args)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"✅ Reporte guardado en {args.output}: {report['candidate_clusters']} grupos candidatos, "
+              f"cobertura estimada {report['estimated_new_coverage_pct']}%")
+    else:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -4,10 +4,17 @@ import json
 from datetime import datetime
 import time
 import os  # 🆕 IMPORTANTE: agregar este import
+from collections import deque
+from itertools import chain, islice
 
 # 🆕 URL dinámica para producción
 BACKEND_URL = "https://mi-asistente-backend.onrender.com"
 
+# 🆕 Límites de lo que se guarda y se dibuja en cada ejecución
+HISTORY_MAX = 50          # interacciones que se conservan en la sesión
+HISTORY_SHOWN = 10        # interacciones que se muestran
+REMINDERS_PAGE_SIZE = 10  # recordatorios por página
+
 # Configuración de página
 st.set_page_config(
     page_title="Mi Asistente Virtual",
@@ -21,9 +28,58 @@ st.markdown("**Habla conmigo y aprenderé de tus rutinas**")
 
 # Estado de la sesión
 if 'history' not in st.session_state:
-    st.session_state.history = []
+    st.session_state.history = deque(maxlen=HISTORY_MAX)  # 🆕 lo más reciente a la izquierda
+elif not isinstance(st.session_state.history, deque):
+    st.session_state.history = deque(st.session_state.history, maxlen=HISTORY_MAX)
 if 'user_id' not in st.session_state:
     st.session_state.user_id = "usuario_principal"
+if 'http_cache' not in st.session_state:
+    st.session_state.http_cache = {}  # 🆕 url -> (etag, json) para las peticiones condicionales
+if 'reminder_pages' not in st.session_state:
+    st.session_state.reminder_pages = {}  # 🆕 url de la primera página -> páginas cargadas
+
+def get_json_cached(url):
+    """
+    GET con If-None-Match: si el backend responde 304 se reutiliza el JSON de la ejecución
+    anterior. Devuelve (status_code, json) con status 200 también en el caso 304.
+    """
+    cached = st.session_state.http_cache.get(url)
+    headers = {"If-None-Match": cached[0]} if cached else {}
+    response = requests.get(url, headers=headers, timeout=30)
+    if response.status_code == 304 and cached:
+        return 200, cached[1]
+    if response.status_code != 200:
+        return response.status_code, None
+    data = response.json()
+    if response.headers.get("ETag"):
+        st.session_state.http_cache[url] = (response.headers["ETag"], data)
+    return 200, data
+
+def get_reminder_pages(status, params=""):
+    """
+    🆕 Recordatorios paginados: la primera página se pide siempre (condicional, con ETag) y las
+    siguientes solo con "Cargar más". Si la primera página cambió se descartan las demás,
+    porque sus cursores pueden haber quedado desfasados. Devuelve (status_code, páginas).
+    """
+    url = f"{BACKEND_URL}/reminders/{st.session_state.user_id}?status={status}&limit={REMINDERS_PAGE_SIZE}{params}"
+    status_code, first = get_json_cached(url)
+    if status_code != 200:
+        return status_code, None
+    pages = st.session_state.reminder_pages.get(url)
+    if pages is None or pages["first"] is not first:
+        pages = {"url": url, "first": first, "more": [], "next_cursor": first.get("next_cursor")}
+        st.session_state.reminder_pages[url] = pages
+    return 200, pages
+
+def load_more_reminders(pages):
+    """🆕 Pide la página siguiente a partir del cursor y la agrega a las ya cargadas"""
+    response = requests.get(pages["url"], params={"cursor": pages["next_cursor"]}, timeout=30)
+    if response.status_code != 200:
+        return False
+    data = response.json()
+    pages["more"].extend(data["reminders"])
+    pages["next_cursor"] = data.get("next_cursor")
+    return True
 
 # =============================================
 # SIDEBAR MEJORADO (CON KEYS ÚNICOS)
@@ -56,6 +112,22 @@ with st.sidebar:
         except Exception as e:
             st.error(f"❌ Error: {e}")
 
+    # 🆕 Vinculación con Telegram mediante un token de un solo uso
+    if st.button("📲 Vincular Telegram", key="telegram_link"):
+        try:
+            response = requests.post(f"{BACKEND_URL}/user/{st.session_state.user_id}/telegram-link", timeout=30)
+            if response.status_code == 200:
+                link = response.json()
+                if link.get("link"):
+                    st.link_button("Abrir el bot en Telegram", link["link"])
+                st.write("O envía este mensaje al bot:")
+                st.code(link["command"])
+                st.caption("El enlace caduca en unos minutos y solo sirve una vez.")
+            else:
+                st.error("❌ No se pudo crear el enlace")
+        except Exception as e:
+            st.error(f"❌ Error: {e}")
+
 # =============================================
 # MÉTRICAS DEL SISTEMA
 # =============================================
@@ -123,7 +195,7 @@ if st.button("🚀 Enviar al Asistente", type="primary", use_container_width=Tru
                         "intent": "processed"
                     }
                     
-                    st.session_state.history.insert(0, interaction)
+                    st.session_state.history.appendleft(interaction)
                     
                     # Mostrar respuesta con estilo
                     st.success(f"**🤖 Asistente:** {data['response']}")
@@ -152,13 +224,49 @@ if st.button("🚀 Enviar al Asistente", type="primary", use_container_width=Tru
     else:
         st.warning("Por favor escribe un mensaje antes de enviar")
 
+# =============================================
+# 🆕 COMANDO DE VOZ
+# =============================================
+audio_command = st.audio_input("🎤 O graba tu comando de voz:", key="voice_input")
+if audio_command is not None and st.button("🎤 Enviar audio", key="send_audio_button"):
+    with st.spinner("Transcribiendo y procesando tu audio..."):
+        try:
+            # El archivo se envía tal cual (WAV); el backend lo transcribe a medida que llega
+            response = requests.post(
+                f"{BACKEND_URL}/interact/audio",
+                params={"user_id": st.session_state.user_id},
+                data=audio_command,
+                headers={"Content-Type": "audio/wav"},
+                timeout=60
+            )
+            if response.status_code == 200:
+                data = response.json()
+                st.session_state.history.appendleft({
+                    "timestamp": datetime.now().strftime("%H:%M:%S"),
+                    "user_input": f"🎤 {data['transcript']}",
+                    "assistant_response": data["response"],
+                    "intent": "processed"
+                })
+                st.success(f"**🤖 Asistente:** {data['response']}")
+                st.rerun()
+            else:
+                try:
+                    error_detail = response.json().get('detail', 'Error en el servidor')
+                except:
+                    error_detail = f"Error HTTP {response.status_code}"
+                st.error(f"❌ {error_detail}")
+        except requests.exceptions.Timeout:
+            st.error("⏰ El servidor tardó demasiado en responder. Por favor intenta de nuevo.")
+        except Exception as e:
+            st.error(f"Error de conexión: {e}")
+
 # =============================================
 # HISTORIAL MEJORADO
 # =============================================
 if st.session_state.history:
     st.header("📜 Historial de Conversación")
     
-    for i, interaction in enumerate(st.session_state.history[:10]):
+    for i, interaction in enumerate(islice(st.session_state.history, HISTORY_SHOWN)):
         with st.container():
             col1, col2 = st.columns([1, 4])
             
@@ -183,10 +291,12 @@ with st.expander("📊 Panel de Aprendizaje del Asistente"):
         
         # Botón para ver historial completo (CON KEY)
         if st.button("Ver mi historial completo", key="view_full_history"):
-            response = requests.get(f"{BACKEND_URL}/user/{st.session_state.user_id}/history?limit=20")
-            if response.status_code == 200:
-                data = response.json()
+            status_code, data = get_json_cached(f"{BACKEND_URL}/user/{st.session_state.user_id}/history?limit=20")
+            if status_code == 200:
                 st.json(data)
+
+        # 🆕 Descarga del historial completo (NDJSON comprimido, lo genera el backend en streaming)
+        st.link_button("⬇️ Descargar historial completo", f"{BACKEND_URL}/user/{st.session_state.user_id}/export")
     except:
         st.info("Conecta con el backend para ver estadísticas")
 
@@ -228,15 +338,16 @@ with tab1:
         # No hacemos rerun automático aquí para no molestar al usuario
     
     try:
-        reminders_response = requests.get(f"{BACKEND_URL}/reminders/{st.session_state.user_id}?status=pending")
-        if reminders_response.status_code == 200:
-            reminders_data = reminders_response.json()
+        status_code, pages = get_reminder_pages("pending")
+        if status_code == 200:
+            reminders_data = pages["first"]
             
             # 🆕 MOSTRAR CONTADOR
-            st.write(f"**Pendientes:** {reminders_data.get('count', 0)}")
+            st.write(f"**Pendientes:** {reminders_data.get('total', 0)}")
             
             if reminders_data["reminders"]:
-                for reminder in reminders_data["reminders"]:
+                # 🆕 Solo se dibujan las páginas cargadas, no todos los recordatorios
+                for reminder in chain(reminders_data["reminders"], pages["more"]):
                     with st.container():
                         col1, col2, col3 = st.columns([3, 1, 1])
                         
@@ -294,6 +405,11 @@ with tab1:
                                 st.rerun()
                         
                         st.divider()
+                
+                if pages["next_cursor"] and st.button("⬇️ Cargar más", key="more_pending"):
+                    if load_more_reminders(pages):
+                        st.rerun()
+                    st.error("Error cargando más recordatorios")
             else:
                 st.info("🎉 No tienes recordatorios pendientes.")
         else:
@@ -320,25 +436,23 @@ with tab2:
     
     try:
         # 🆕 AGREGAR PARÁMETRO DE DEBUG PARA VER MÁS INFORMACIÓN
-        reminders_response = requests.get(
-            f"{BACKEND_URL}/reminders/{st.session_state.user_id}?status=completed&include_debug=true"
-        )
+        status_code, pages = get_reminder_pages("completed", "&include_debug=true")
         
-        if reminders_response.status_code == 200:
-            reminders_data = reminders_response.json()
+        if status_code == 200:
+            reminders_data = pages["first"]
             
             # 🆕 INFORMACIÓN DE DEBUG (útil para troubleshooting)
             if reminders_data.get('debug'):
                 with st.expander("🔍 Información técnica"):
                     st.json(reminders_data['debug'])
             
-            count = reminders_data.get('count', 0)
+            count = reminders_data.get('total', 0)
             st.write(f"**📊 Total completados:** {count}")
             
             if count > 0:
                 st.success(f"🎉 Tienes {count} recordatorio(s) completado(s)")
                 
-                for reminder in reminders_data["reminders"]:
+                for reminder in chain(reminders_data["reminders"], pages["more"]):
                     with st.container():
                         col1, col2 = st.columns([4, 1])
                         
@@ -380,6 +494,11 @@ with tab2:
                                 st.info("Función de eliminación en desarrollo")
                         
                         st.divider()
+                
+                if pages["next_cursor"] and st.button("⬇️ Cargar más", key="more_completed"):
+                    if load_more_reminders(pages):
+                        st.rerun()
+                    st.error("Error cargando más recordatorios")
             else:
                 st.info("📝 Aún no has completado recordatorios. Los recordatorios se mostrarán aquí automáticamente cuando se completen.")
                 
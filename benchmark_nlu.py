@@ -0,0 +1,77 @@
+"""
+Benchmark del ejecutor del NLU: mensajes por segundo según el modo y el número de workers.
+
+No necesita MongoDB: genera mensajes sintéticos y los envía concurrentemente a NLUExecutor.
+
+Uso:
+    python benchmark_nlu.py
+    python benchmark_nlu.py --messages 20000 --modes inline process --workers 1 2 4 8
+"""
+import argparse
+import asyncio
+import os
+import random
+import time
+
+from nlu import get_nlu
+from nlu_executor import NLUExecutor, analyze_batch
+
+SAMPLE_MESSAGES = [
+    "recordarme pagar la luz mañana a las 10 am",
+    "Programar reunión con el equipo el viernes a las 3 pm",
+    "hola, ¿cómo estás?",
+    "recuérdame llamar a Juan en 2 horas",
+    "agenda una cita con el dentista el lunes a las 9:30 am",
+    "ayuda",
+    "urgente: recordarme enviar el informe hoy a las 5 pm",
+    "gracias!",
+]
+
+
+def build_messages(count: int, seed: int = 7) -> list:
+    rng = random.Random(seed)
+    return [f"{rng.choice(SAMPLE_MESSAGES)} #{index}" for index in range(count)]
+
+
+async def run_executor(mode: str, workers: int, messages: list, batch_size: int, batch_wait_ms: float) -> float:
+    """Mensajes por segundo con todos los mensajes en vuelo a la vez"""
+    executor = NLUExecutor(mode=mode, workers=workers, batch_size=batch_size, batch_wait_ms=batch_wait_ms)
+    await executor.start(get_nlu().config)
+    try:
+        started = time.perf_counter()
+        await asyncio.gather(*[executor.analyze(message) for message in messages])
+        return len(messages) / (time.perf_counter() - started)
+    finally:
+        executor.shutdown()
+
+
+def run_inline(messages: list) -> float:
+    """Referencia: un mensaje a la vez en el propio hilo (como el pipeline original)"""
+    started = time.perf_counter()
+    for message in messages:
+        analyze_batch([message])
+    return len(messages) / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del ejecutor del NLU")
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--modes", nargs="+", default=["inline", "thread", "process"])
+    parser.add_argument("--workers", nargs="+", type=int, default=sorted({1, 2, 4, os.cpu_count() or 1}))
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--batch-wait-ms", type=float, default=2)
+    args = parser.parse_args()
+
+    messages = build_messages(args.messages)
+    print(f"📊 {args.messages} mensajes, {os.cpu_count()} núcleos disponibles")
+    for mode in args.modes:
+        if mode == "inline":
+            print(f"  inline               {run_inline(messages):>10.0f} msg/s")
+            continue
+        for workers in args.workers:
+            rate = asyncio.run(run_executor(mode, workers, messages, args.batch_size, args.batch_wait_ms))
+            print(f"  {mode:<8} x{workers:<3} workers {rate:>10.0f} msg/s")
+
+
+if __name__ == "__main__":
+    main()
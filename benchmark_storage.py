@@ -0,0 +1,93 @@
+"""
+Benchmark de los backends de almacenamiento: latencia media de las operaciones típicas sobre
+recordatorios (insertar, leer por _id, listar los de un usuario y actualizar el estado).
+
+memory y sqlite no necesitan red; mongo solo se mide si se pasa --mongodb-url.
+
+Uso:
+    python benchmark_storage.py
+    python benchmark_storage.py --reminders 20000 --backends memory sqlite mongo --mongodb-url "mongodb+srv://..."
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from reminder_schema import encode_reminder
+from storage import open_client
+
+BENCHMARK_DATABASE = "virtual_assistant_benchmark"
+
+
+def build_reminder(index: int, users: int, now: datetime) -> dict:
+    return encode_reminder({
+        "user_id": f"user_{index % users}",
+        "title": f"recordatorio {index}",
+        "due_date": now + timedelta(minutes=index),
+        "status": "pending",
+        "created_at": now
+    })
+
+
+def timed(operation, repeat: int) -> float:
+    """Microsegundos por operación"""
+    started = time.perf_counter()
+    for index in range(repeat):
+        operation(index)
+    return (time.perf_counter() - started) / repeat * 1e6
+
+
+def run_backend(backend: str, reminders: int, users: int, repeat: int, mongodb_url: str = None) -> dict:
+    sqlite_path = os.path.join(tempfile.mkdtemp(), "benchmark.db")
+    client = open_client(backend, mongodb_url, sqlite_path)
+    collection = client[BENCHMARK_DATABASE].reminders
+    collection.delete_many({})
+    collection.create_index([("user_id", 1), ("due_date", 1)])
+    collection.create_index([("status", 1), ("due_date", 1)])
+
+    now = datetime.utcnow()
+    rng = random.Random(7)
+    results = {"insert_one": timed(lambda index: collection.insert_one(build_reminder(index, users, now)), reminders)}
+    ids = [doc["_id"] for doc in collection.find({}, {"_id": 1})]
+
+    results["find_one_id"] = timed(lambda _: collection.find_one({"_id": rng.choice(ids)}), repeat)
+    results["list_user"] = timed(
+        lambda index: list(collection.find({"user_id": f"user_{index % users}"}).sort("due_date", 1).limit(20)),
+        repeat
+    )
+    results["update_one"] = timed(
+        lambda index: collection.update_one({"_id": rng.choice(ids)}, {"$set": {"status": "pending", "ua": now, "n": index}}),
+        repeat
+    )
+    results["due_scan"] = timed(
+        lambda _: list(collection.find({"status": "pending", "due_date": {"$lte": now + timedelta(minutes=5), "$gt": now}})),
+        max(1, repeat // 10)
+    )
+
+    collection.delete_many({})
+    client.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de los backends de almacenamiento")
+    parser.add_argument("--reminders", type=int, default=5000)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=2000)
+    parser.add_argument("--backends", nargs="+", default=["memory", "sqlite"])
+    parser.add_argument("--mongodb-url", default=os.getenv("MONGODB_URL"))
+    args = parser.parse_args()
+
+    print(f"📊 {args.reminders} recordatorios, {args.users} usuarios (µs por operación)")
+    for backend in args.backends:
+        if backend == "mongo" and not args.mongodb_url:
+            print("  mongo    (omitido: falta --mongodb-url)")
+            continue
+        results = run_backend(backend, args.reminders, args.users, args.repeat, args.mongodb_url)
+        print(f"  {backend:<8} " + "  ".join(f"{name} {value:>9.1f}" for name, value in results.items()))
+
+
+if __name__ == "__main__":
+    main()
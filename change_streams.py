@@ -0,0 +1,238 @@
+"""
+Consumo de change streams de MongoDB y reparto de los cambios dentro del proceso.
+
+Cada ChangeStreamConsumer sigue una colección con collection.watch() en su propio hilo
+(pymongo es síncrono) y entrega los eventos al event loop, donde EventBus los reparte a:
+
+    - handlers síncronos por colección (cachés locales, cola de vencimientos del verificador)
+    - colas asyncio por clave (suscriptores push, p. ej. SSE por usuario)
+
+El resume token se guarda en la colección change_stream_tokens (uno por colección y por
+consumidor) cada CHANGE_STREAM_TOKEN_SAVE_SECONDS y al detenerse, así que tras un reinicio se
+retoma donde se quedó. Si el token ya no está en el oplog (o el stream se invalida) se
+descarta y se publica un evento "resync" para que los consumidores recarguen su estado.
+El token se guarda sin esperar a los handlers: tras una caída se puede perder algún evento,
+por eso el verificador mantiene un reescaneo completo de respaldo.
+"""
+import asyncio
+import logging
+import os
+import socket
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Set
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+CHANGE_STREAM_TOKEN_SAVE_SECONDS = float(os.getenv("CHANGE_STREAM_TOKEN_SAVE_SECONDS", "5"))
+CHANGE_STREAM_MAX_AWAIT_MS = int(os.getenv("CHANGE_STREAM_MAX_AWAIT_MS", "1000"))
+CHANGE_STREAM_CONSUMER = os.getenv("CHANGE_STREAM_CONSUMER", socket.gethostname())
+PUSH_QUEUE_SIZE = int(os.getenv("PUSH_QUEUE_SIZE", "100"))
+
+# Códigos de error del servidor
+UNSUPPORTED_CODES = {40573}          # $changeStream solo en replica sets / clusters
+HISTORY_LOST_CODES = {136, 280, 286}  # el resume token ya no está en el oplog
+
+
+class EventBus:
+    """Reparte los eventos de cambio a handlers por colección y a colas de suscriptores"""
+
+    def __init__(self, queue_size: int = PUSH_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._handlers: Dict[str, List[Callable[[Dict[str, Any]], None]]] = {}
+        self._queues: Dict[str, Set[asyncio.Queue]] = {}
+        self.counters: Counter = Counter()
+
+    def subscribe(self, collection: str, handler: Callable[[Dict[str, Any]], None]):
+        self._handlers.setdefault(collection, []).append(handler)
+
+    def publish(self, event: Dict[str, Any]):
+        """Entrega el evento a los handlers de su colección (se llama en el event loop)"""
+        self.counters["events"] += 1
+        for handler in self._handlers.get(event["collection"], []):
+            try:
+                handler(event)
+            except Exception as e:
+                self.counters["handler_errors"] += 1
+                logger.error(f"❌ Error en handler de cambios de {event['collection']}: {e}")
+
+    def open_queue(self, key: str) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        self._queues.setdefault(key, set()).add(queue)
+        return queue
+
+    def close_queue(self, key: str, queue: asyncio.Queue):
+        queues = self._queues.get(key)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self._queues[key]
+
+    def push(self, key: str, payload: Dict[str, Any]):
+        """Envía el payload a los suscriptores de la clave; si uno va atrasado se descarta lo más viejo"""
+        for queue in self._queues.get(key, ()):
+            if queue.full():
+                queue.get_nowait()
+                self.counters["dropped"] += 1
+            queue.put_nowait(payload)
+            self.counters["pushed"] += 1
+
+    def broadcast(self, payload: Dict[str, Any]):
+        for key in list(self._queues):
+            self.push(key, payload)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "subscribers": sum(len(queues) for queues in self._queues.values()),
+            "counters": dict(self.counters)
+        }
+
+
+class ResumeTokenStore:
+    """Resume tokens persistidos (un documento por colección y consumidor)"""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def load(self, key: str) -> Optional[Dict[str, Any]]:
+        doc = self.collection.find_one({"_id": key})
+        return doc.get("token") if doc else None
+
+    def save(self, key: str, token: Dict[str, Any]):
+        self.collection.update_one(
+            {"_id": key},
+            {"$set": {"token": token, "updated_at": datetime.utcnow()}},
+            upsert=True
+        )
+
+    def clear(self, key: str):
+        self.collection.delete_one({"_id": key})
+
+
+class ChangeStreamConsumer:
+    """Sigue el change stream de una colección en un hilo y publica los eventos en el bus"""
+
+    def __init__(self, collection, bus: EventBus, tokens: ResumeTokenStore,
+                 consumer: str = CHANGE_STREAM_CONSUMER):
+        self.collection = collection
+        self.name = collection.name
+        self.bus = bus
+        self.tokens = tokens
+        self.token_key = f"{self.name}:{consumer}"
+        self.active = False
+        self.supported = True
+        self.counters: Counter = Counter()
+        self.last_event_at: Optional[datetime] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._token: Optional[Dict[str, Any]] = None
+        self._saved_token: Optional[Dict[str, Any]] = None
+        self._last_save = 0.0
+
+    def start(self, loop: asyncio.AbstractEventLoop):
+        self._loop = loop
+        self._thread = threading.Thread(target=self._run, name=f"change-stream-{self.name}", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5):
+        self._stopping.set()
+        if self._thread:
+            self._thread.join(timeout)
+        self._save_token(force=True)
+
+    def _publish(self, event: Dict[str, Any]):
+        if self._loop and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self.bus.publish, event)
+
+    def _resync(self, reason: str):
+        """El historial se perdió: se descarta el token y los consumidores recargan su estado"""
+        logger.warning(f"⚠️ Change stream de {self.name} sin continuidad ({reason}); se publica resync")
+        self.tokens.clear(self.token_key)
+        self._token = self._saved_token = None
+        self.counters["resyncs"] += 1
+        self._publish({"collection": self.name, "operation": "resync", "id": None, "document": None})
+
+    def _save_token(self, force: bool = False):
+        if self._token is None or self._token == self._saved_token:
+            return
+        if not force and time.monotonic() - self._last_save < CHANGE_STREAM_TOKEN_SAVE_SECONDS:
+            return
+        try:
+            self.tokens.save(self.token_key, self._token)
+            self._saved_token = self._token
+            self._last_save = time.monotonic()
+        except PyMongoError as e:
+            logger.error(f"❌ No se pudo guardar el resume token de {self.name}: {e}")
+
+    def _run(self):
+        backoff = 1
+        while not self._stopping.is_set():
+            try:
+                self._consume()
+                backoff = 1
+            except OperationFailure as e:
+                self.active = False
+                if e.code in UNSUPPORTED_CODES:
+                    self.supported = False
+                    logger.warning(f"⚠️ Change streams no disponibles para {self.name}: {e}")
+                    return
+                if e.code in HISTORY_LOST_CODES or "resume" in str(e).lower():
+                    self._resync(str(e))
+                    continue
+                self.counters["errors"] += 1
+                logger.error(f"❌ Error en el change stream de {self.name}: {e}")
+            except PyMongoError as e:
+                self.active = False
+                self.counters["errors"] += 1
+                logger.error(f"❌ Error en el change stream de {self.name}: {e}")
+            # Reconexión con espera exponencial (el token permite retomar sin perder eventos)
+            self._stopping.wait(backoff)
+            backoff = min(backoff * 2, 60)
+
+    def _consume(self):
+        self._token = self._saved_token = self.tokens.load(self.token_key)
+        options: Dict[str, Any] = {"full_document": "updateLookup", "max_await_time_ms": CHANGE_STREAM_MAX_AWAIT_MS}
+        if self._token:
+            options["resume_after"] = self._token
+        with self.collection.watch(**options) as stream:
+            self.active = True
+            logger.info(f"👂 Change stream de {self.name} activo{' (retomado)' if self._token else ''}")
+            while not self._stopping.is_set() and stream.alive:
+                change = stream.try_next()
+                if change is not None:
+                    self._dispatch(change)
+                # Con o sin eventos el servidor devuelve un token (postBatchResumeToken)
+                self._token = stream.resume_token or self._token
+                self._save_token()
+        self.active = False
+        if not self._stopping.is_set():
+            # invalidate/drop/rename cierran el stream: no se puede retomar tras ellos
+            self._resync("stream invalidado")
+
+    def _dispatch(self, change: Dict[str, Any]):
+        operation = change.get("operationType")
+        self.counters[operation] += 1
+        self.last_event_at = datetime.utcnow()
+        if operation in ("invalidate", "drop", "rename", "dropDatabase"):
+            return
+        self._publish({
+            "collection": self.name,
+            "operation": operation,
+            "id": (change.get("documentKey") or {}).get("_id"),
+            "document": change.get("fullDocument"),
+            "updated_fields": (change.get("updateDescription") or {}).get("updatedFields")
+        })
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "active": self.active,
+            "supported": self.supported,
+            "resume_token_saved": self._saved_token is not None,
+            "last_event_at": self.last_event_at.isoformat() if self.last_event_at else None,
+            "counters": dict(self.counters)
+        }
@@ -0,0 +1,99 @@
+"""
+Compresión de respuestas con negociación por Accept-Encoding.
+
+Usa brotli si el paquete está instalado (pip install brotli) y el cliente lo acepta; si no,
+gzip. Se apoya en los responders de Starlette (respuestas completas y en streaming) y además
+deja pasar sin tocar los tipos que ya vienen comprimidos o que no se deben almacenar en un
+búfer: la exportación .ndjson.gz, SSE, imágenes y audio.
+"""
+import os
+from typing import Dict
+
+from starlette.datastructures import Headers
+from starlette.middleware.gzip import GZipResponder, IdentityResponder
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:  # dependencia opcional
+    brotli = None
+
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1000"))   # bytes
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "5"))
+
+EXCLUDED_CONTENT_TYPES = ("text/event-stream", "application/gzip", "application/zip", "image/", "audio/", "video/")
+
+
+def accepted_encodings(header: str) -> Dict[str, float]:
+    """'br;q=1.0, gzip;q=0.8, *;q=0' -> {"br": 1.0, "gzip": 0.8, "*": 0.0}"""
+    encodings: Dict[str, float] = {}
+    for item in header.split(","):
+        name, _, params = item.strip().partition(";")
+        if not name:
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        encodings[name.strip().lower()] = quality
+    return encodings
+
+
+class _SkipPrecompressed:
+    """Marca como excluidas las respuestas cuyo tipo ya está comprimido (además de SSE)"""
+
+    async def send_with_compression(self, message: Message) -> None:
+        await super().send_with_compression(message)
+        if message["type"] == "http.response.start":
+            content_type = Headers(raw=message["headers"]).get("content-type", "")
+            if content_type.startswith(EXCLUDED_CONTENT_TYPES):
+                self.content_type_is_excluded = True
+
+
+class _GZipResponder(_SkipPrecompressed, GZipResponder):
+    pass
+
+
+class _IdentityResponder(_SkipPrecompressed, IdentityResponder):
+    pass
+
+
+class _BrotliResponder(_SkipPrecompressed, IdentityResponder):
+    content_encoding = "br"
+
+    def __init__(self, app: ASGIApp, minimum_size: int, quality: int) -> None:
+        super().__init__(app, minimum_size)
+        self.compressor = brotli.Compressor(quality=quality)
+
+    def apply_compression(self, body: bytes, *, more_body: bool) -> bytes:
+        # En streaming se vacía el compresor en cada trozo para no retener datos
+        data = self.compressor.process(body)
+        return data + (self.compressor.flush() if more_body else self.compressor.finish())
+
+
+class CompressionMiddleware:
+    def __init__(self, app: ASGIApp, minimum_size: int = COMPRESSION_MIN_SIZE,
+                 gzip_level: int = GZIP_LEVEL, brotli_quality: int = BROTLI_QUALITY) -> None:
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encodings = accepted_encodings(Headers(scope=scope).get("accept-encoding", ""))
+        responder: ASGIApp
+        if brotli is not None and encodings.get("br", 0) > 0:
+            responder = _BrotliResponder(self.app, self.minimum_size, self.brotli_quality)
+        elif encodings.get("gzip", 0) > 0:
+            responder = _GZipResponder(self.app, self.minimum_size, compresslevel=self.gzip_level)
+        else:
+            responder = _IdentityResponder(self.app, self.minimum_size)
+        await responder(scope, receive, send)
@@ -0,0 +1,239 @@
+"""
+Lectura y escritura de calendarios iCalendar (RFC 5545) sin dependencias externas.
+
+- render_event / render_calendar: bloques VEVENT con el texto escapado y las líneas plegadas
+  a 75 octetos; cada evento se renderiza por separado para poder reutilizarlo en la caché
+- IcsParser: parser incremental; recibe el archivo por trozos (feed) y devuelve los VEVENT
+  completos a medida que aparecen, así que un calendario grande no se carga entero en memoria
+
+Todas las fechas que entran y salen son UTC naive, como en la base de datos. Las fechas sin
+zona (flotantes) y las de día completo se interpretan en la hora local del asistente.
+"""
+import codecs
+import re
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional
+
+import pytz
+
+from timeutils import TIMEZONE, local_to_utc, make_naive, utc_to_local
+
+PRODID = "-//Asistente Virtual//Calendario//ES"
+LINE_LIMIT = 75  # octetos por línea antes de plegar
+
+_DURATION = re.compile(r"([+-])?P(?:(\d+)W)?(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?)?$")
+_UNESCAPE = re.compile(r"\\([\\;,nN])")
+
+
+# =============================================
+# Escritura
+# =============================================
+def escape_text(value: str) -> str:
+    return value.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,").replace("\r\n", "\\n").replace("\n", "\\n")
+
+
+def fold_line(line: str) -> str:
+    """Pliega una línea larga (continuación con un espacio) sin cortar caracteres UTF-8"""
+    if len(line.encode("utf-8")) <= LINE_LIMIT:
+        return line
+    parts, current, size = [], "", 0
+    for char in line:
+        width = len(char.encode("utf-8"))
+        if size + width > LINE_LIMIT - (1 if parts else 0):
+            parts.append(current)
+            current, size = "", 0
+        current += char
+        size += width
+    parts.append(current)
+    return "\r\n ".join(parts)
+
+
+def format_datetime(value: datetime) -> str:
+    return value.strftime("%Y%m%dT%H%M%SZ")
+
+
+def format_date(value: datetime) -> str:
+    """Día local (para eventos de día completo)"""
+    return utc_to_local(value).strftime("%Y%m%d")
+
+
+def render_event(uid: str, start: datetime, end: datetime, summary: str, stamp: datetime,
+                 description: Optional[str] = None, status: Optional[str] = None,
+                 alarm_minutes: Optional[int] = None, categories: Iterable[str] = (),
+                 all_day: bool = False) -> str:
+    """Bloque VEVENT (con CRLF al final de cada línea)"""
+    if all_day:
+        dates = [f"DTSTART;VALUE=DATE:{format_date(start)}", f"DTEND;VALUE=DATE:{format_date(end)}"]
+    else:
+        dates = [f"DTSTART:{format_datetime(start)}", f"DTEND:{format_datetime(end)}"]
+    lines = [
+        "BEGIN:VEVENT",
+        f"UID:{uid}",
+        f"DTSTAMP:{format_datetime(stamp)}",
+        *dates,
+        f"SUMMARY:{escape_text(summary)}",
+    ]
+    if description:
+        lines.append(f"DESCRIPTION:{escape_text(description)}")
+    categories = [escape_text(category) for category in categories]
+    if categories:
+        lines.append(f"CATEGORIES:{','.join(categories)}")
+    if status:
+        lines.append(f"STATUS:{status}")
+    if alarm_minutes is not None:
+        lines += ["BEGIN:VALARM", "ACTION:DISPLAY", f"DESCRIPTION:{escape_text(summary)}",
+                  f"TRIGGER:-PT{alarm_minutes}M", "END:VALARM"]
+    lines.append("END:VEVENT")
+    return "".join(fold_line(line) + "\r\n" for line in lines)
+
+
+def render_calendar(name: str, events: Iterable[str]) -> str:
+    header = (
+        "BEGIN:VCALENDAR\r\nVERSION:2.0\r\n"
+        f"PRODID:{PRODID}\r\nCALSCALE:GREGORIAN\r\nMETHOD:PUBLISH\r\n"
+        f"{fold_line('X-WR-CALNAME:' + escape_text(name))}\r\n"
+    )
+    return header + "".join(events) + "END:VCALENDAR\r\n"
+
+
+# =============================================
+# Lectura
+# =============================================
+def unescape_text(value: str) -> str:
+    return _UNESCAPE.sub(lambda match: "\n" if match.group(1) in "nN" else match.group(1), value)
+
+
+def parse_duration(value: str) -> Optional[timedelta]:
+    match = _DURATION.match(value.strip().upper())
+    if not match:
+        return None
+    sign, weeks, days, hours, minutes, seconds = match.groups()
+    delta = timedelta(weeks=int(weeks or 0), days=int(days or 0), hours=int(hours or 0),
+                      minutes=int(minutes or 0), seconds=int(seconds or 0))
+    return -delta if sign == "-" else delta
+
+
+def parse_datetime(value: str, params: Dict[str, str]) -> Optional[datetime]:
+    """
+    DTSTART/DTEND a UTC naive: "...Z" es UTC, TZID=... usa esa zona y sin zona se
+    interpreta en hora local. VALUE=DATE (día completo) empieza a las 00:00 locales.
+    """
+    value = value.strip()
+    try:
+        if params.get("VALUE") == "DATE" or len(value) == 8:
+            day = datetime.strptime(value[:8], "%Y%m%d")
+            return make_naive(local_to_utc(day))
+        if value.endswith("Z"):
+            return datetime.strptime(value[:15], "%Y%m%dT%H%M%S")
+        moment = datetime.strptime(value[:15], "%Y%m%dT%H%M%S")
+    except ValueError:
+        return None
+    zone = TIMEZONE
+    if "TZID" in params:
+        try:
+            zone = pytz.timezone(params["TZID"].strip('"'))
+        except pytz.UnknownTimeZoneError:
+            pass
+    return make_naive(local_to_utc(zone.localize(moment)))
+
+
+def parse_property(line: str):
+    """'NOMBRE;PARAM=VALOR:valor' -> (NOMBRE, {PARAM: VALOR}, valor)"""
+    head, _, value = line.partition(":")
+    name, *raw_params = head.split(";")
+    params = {}
+    for raw in raw_params:
+        key, _, param_value = raw.partition("=")
+        params[key.upper()] = param_value
+    return name.upper(), params, value
+
+
+class IcsParser:
+    """
+    Parser incremental de VEVENT. feed() acepta bytes o texto en trozos de cualquier tamaño y
+    devuelve los eventos completos encontrados: {uid, summary, description, location, start,
+    end, all_day, status, rrule}. Solo se guarda en memoria la línea y el evento en curso.
+    """
+
+    def __init__(self):
+        self._decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+        self._buffer = ""
+        self._line: Optional[str] = None
+        self._event: Optional[Dict[str, Any]] = None
+        self._depth = 0  # componentes anidados dentro del VEVENT (VALARM)
+        self.skipped = 0
+
+    def feed(self, chunk) -> List[Dict[str, Any]]:
+        text = self._decoder.decode(chunk) if isinstance(chunk, (bytes, bytearray)) else chunk
+        self._buffer += text
+        *lines, self._buffer = re.split(r"\r?\n", self._buffer)
+        return self._consume(lines)
+
+    def close(self) -> List[Dict[str, Any]]:
+        lines = [self._buffer + self._decoder.decode(b"", final=True)]
+        self._buffer = ""
+        events = self._consume(lines)
+        if self._line is not None:
+            events += self._handle(self._line)
+            self._line = None
+        return events
+
+    def _consume(self, lines: List[str]) -> List[Dict[str, Any]]:
+        events: List[Dict[str, Any]] = []
+        for line in lines:
+            if line[:1] in (" ", "\t"):
+                # Línea plegada: continúa la anterior
+                if self._line is not None:
+                    self._line += line[1:]
+                continue
+            if self._line is not None:
+                events += self._handle(self._line)
+            self._line = line or None
+        return events
+
+    def _handle(self, line: str) -> List[Dict[str, Any]]:
+        name, params, value = parse_property(line)
+        if name == "BEGIN":
+            if value.upper() == "VEVENT" and self._event is None:
+                self._event = {"_params": {}}
+            elif self._event is not None:
+                self._depth += 1
+            return []
+        if name == "END":
+            if self._event is not None and self._depth:
+                self._depth -= 1
+            elif self._event is not None and value.upper() == "VEVENT":
+                event, self._event = self._finish(self._event), None
+                if event is None:
+                    self.skipped += 1
+                    return []
+                return [event]
+            return []
+        if self._event is not None and not self._depth:
+            self._event[name] = value
+            self._event["_params"][name] = params
+        return []
+
+    def _finish(self, raw: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        params = raw["_params"]
+        start = parse_datetime(raw.get("DTSTART", ""), params.get("DTSTART", {}))
+        if start is None:
+            return None
+        all_day = params.get("DTSTART", {}).get("VALUE") == "DATE" or len(raw["DTSTART"].strip()) == 8
+        end = parse_datetime(raw["DTEND"], params.get("DTEND", {})) if "DTEND" in raw else None
+        if end is None and "DURATION" in raw:
+            duration = parse_duration(raw["DURATION"])
+            end = start + duration if duration else None
+        if end is None or end < start:
+            end = start + (timedelta(days=1) if all_day else timedelta(0))
+        return {
+            "uid": raw.get("UID") or f"{format_datetime(start)}-{unescape_text(raw.get('SUMMARY', ''))}",
+            "summary": unescape_text(raw.get("SUMMARY", "")).strip() or "Evento",
+            "description": unescape_text(raw["DESCRIPTION"]) if raw.get("DESCRIPTION") else None,
+            "location": unescape_text(raw["LOCATION"]) if raw.get("LOCATION") else None,
+            "start": start,
+            "end": end,
+            "all_day": all_day,
+            "status": (raw.get("STATUS") or "CONFIRMED").upper(),
+            "rrule": raw.get("RRULE"),
+        }
@@ -0,0 +1,292 @@
+"""
+Clasificador de intenciones local (opcional): regresión logística multiclase sobre
+n-gramas de caracteres con hashing. La inferencia usa solo NumPy.
+
+El modelo se entrena offline con la colección interaction_analysis (y, opcionalmente,
+un archivo JSONL de ejemplos etiquetados a mano) y se guarda en un .npz. En main.py se
+activa con INTENT_BACKEND=model; si la confianza es baja se usa el motor de palabras clave.
+
+Uso:
+    python intent_classifier.py train --output models/intent_model.npz
+    python intent_classifier.py train --labels ejemplos.jsonl --epochs 20
+    python intent_classifier.py evaluate --model models/intent_model.npz --labels ejemplos.jsonl
+"""
+import argparse
+import json
+import os
+import re
+import time
+import unicodedata
+import zlib
+from collections import Counter
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+
+DEFAULT_MODEL_PATH = "models/intent_model.npz"
+DEFAULT_HASH_BITS = 18
+DEFAULT_NGRAM_RANGE = (2, 4)
+
+
+def normalize_text(text: str) -> str:
+    """Minúsculas, sin acentos, números como '0' y espacios simples"""
+    text = unicodedata.normalize('NFKD', text.lower())
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    text = re.sub(r'\d+', '0', text)
+    text = re.sub(r'[^a-z0\s]', ' ', text)
+    return ' '.join(text.split())
+
+
+def char_ngram_ids(text: str, mask: int, ngram_min: int, ngram_max: int) -> np.ndarray:
+    """Ids (crc32 con máscara, estables entre procesos) de los n-gramas de caracteres; nunca vacío"""
+    padded = f" {normalize_text(text)} ".encode()
+    ids = {
+        zlib.crc32(padded[start:start + n]) & mask
+        for n in range(ngram_min, ngram_max + 1)
+        for start in range(len(padded) - n + 1)
+    }
+    return np.fromiter(ids, dtype=np.int64, count=len(ids)) if ids else np.zeros(1, dtype=np.int64)
+
+
+class IntentClassifier:
+    """Pesos (2^hash_bits x clases) y sesgo de una regresión logística multiclase"""
+
+    def __init__(self, weights: np.ndarray, bias: np.ndarray, labels: List[str],
+                 hash_bits: int = DEFAULT_HASH_BITS, ngram_range: Tuple[int, int] = DEFAULT_NGRAM_RANGE):
+        self.weights = weights
+        self.bias = bias
+        self.labels = list(labels)
+        self.hash_bits = hash_bits
+        self.mask = (1 << hash_bits) - 1
+        self.ngram_range = tuple(ngram_range)
+
+    # ---------- características ----------
+    def featurize(self, texts: Iterable[str]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Matriz dispersa (CSR) de los textos: índices, valores (norma L2 = 1) e inicio de cada fila"""
+        rows = [char_ngram_ids(text, self.mask, *self.ngram_range) for text in texts]
+        lengths = np.fromiter((len(row) for row in rows), dtype=np.int64, count=len(rows))
+        indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=indptr[1:])
+        indices = np.concatenate(rows) if rows else np.zeros(0, dtype=np.int64)
+        values = np.repeat(1.0 / np.sqrt(lengths), lengths).astype(np.float32)
+        return indices, values, indptr
+
+    def _scores(self, indices: np.ndarray, values: np.ndarray, indptr: np.ndarray) -> np.ndarray:
+        weighted = self.weights[indices] * values[:, None]
+        return np.add.reduceat(weighted, indptr[:-1], axis=0) + self.bias
+
+    @staticmethod
+    def _softmax(scores: np.ndarray) -> np.ndarray:
+        scores = scores - scores.max(axis=1, keepdims=True)
+        exp = np.exp(scores)
+        return exp / exp.sum(axis=1, keepdims=True)
+
+    # ---------- inferencia ----------
+    def predict_proba(self, texts: List[str]) -> np.ndarray:
+        """Probabilidades (textos x clases) en una sola operación vectorizada"""
+        if not texts:
+            return np.zeros((0, len(self.labels)), dtype=np.float32)
+        return self._softmax(self._scores(*self.featurize(texts)))
+
+    def predict(self, texts: List[str]) -> List[Tuple[str, float]]:
+        """(intención, confianza) para cada texto"""
+        proba = self.predict_proba(texts)
+        best = proba.argmax(axis=1)
+        return [(self.labels[index], float(proba[row, index])) for row, index in enumerate(best)]
+
+    def predict_one(self, text: str) -> Tuple[str, float]:
+        """Camino rápido para un único mensaje (sin construir la matriz CSR)"""
+        ids = char_ngram_ids(text, self.mask, *self.ngram_range)
+        scores = self.weights[ids].sum(axis=0) / np.sqrt(len(ids)) + self.bias
+        scores = np.exp(scores - scores.max())
+        index = int(scores.argmax())
+        return self.labels[index], float(scores[index] / scores.sum())
+
+    # ---------- persistencia ----------
+    def save(self, path: str):
+        np.savez_compressed(
+            path,
+            weights=self.weights.astype(np.float32),
+            bias=self.bias.astype(np.float32),
+            labels=np.array(self.labels),
+            hash_bits=np.array(self.hash_bits),
+            ngram_range=np.array(self.ngram_range)
+        )
+
+    @classmethod
+    def load(cls, path: str) -> "IntentClassifier":
+        with np.load(path, allow_pickle=False) as data:
+            return cls(
+                data["weights"], data["bias"], [str(label) for label in data["labels"]],
+                int(data["hash_bits"]), tuple(int(n) for n in data["ngram_range"])
+            )
+
+    # ---------- entrenamiento ----------
+    @classmethod
+    def train(cls, texts: List[str], labels: List[str], hash_bits: int = DEFAULT_HASH_BITS,
+              ngram_range: Tuple[int, int] = DEFAULT_NGRAM_RANGE, epochs: int = 15,
+              learning_rate: float = 5.0, batch_size: int = 32, seed: int = 13) -> "IntentClassifier":
+        """Descenso de gradiente por mini-lotes sobre la entropía cruzada"""
+        names = sorted(set(labels))
+        model = cls(
+            np.zeros((1 << hash_bits, len(names)), dtype=np.float32),
+            np.zeros(len(names), dtype=np.float32),
+            names, hash_bits, ngram_range
+        )
+        label_index = {name: index for index, name in enumerate(names)}
+        targets = np.array([label_index[label] for label in labels], dtype=np.int64)
+        rows = [char_ngram_ids(text, model.mask, *ngram_range) for text in texts]
+        rng = np.random.default_rng(seed)
+
+        for epoch in range(epochs):
+            order = rng.permutation(len(rows))
+            rate = learning_rate / (1 + epoch * 0.2)
+            for start in range(0, len(order), batch_size):
+                batch = order[start:start + batch_size]
+                batch_rows = [rows[i] for i in batch]
+                lengths = np.fromiter((len(row) for row in batch_rows), dtype=np.int64, count=len(batch_rows))
+                indptr = np.zeros(len(batch_rows) + 1, dtype=np.int64)
+                np.cumsum(lengths, out=indptr[1:])
+                indices = np.concatenate(batch_rows)
+                values = np.repeat(1.0 / np.sqrt(lengths), lengths).astype(np.float32)
+
+                gradient = model._softmax(model._scores(indices, values, indptr))
+                gradient[np.arange(len(batch)), targets[batch]] -= 1.0
+                gradient *= rate / len(batch)
+                row_of_value = np.repeat(np.arange(len(batch)), lengths)
+                np.add.at(model.weights, indices, -values[:, None] * gradient[row_of_value])
+                model.bias -= gradient.sum(axis=0)
+        return model
+
+
+# =============================================
+# Datos de entrenamiento y evaluación
+# =============================================
+def load_labeled_file(path: str) -> List[Tuple[str, str]]:
+    """Ejemplos curados: una línea JSON por ejemplo con {"text": ..., "intent": ...}"""
+    examples = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                row = json.loads(line)
+                examples.append((row["text"], row["intent"]))
+    return examples
+
+
+def load_interaction_examples(limit: int = 0, include_unknown: bool = False) -> List[Tuple[str, str]]:
+    """Ejemplos de interaction_analysis (etiquetados por el motor de palabras clave)"""
+    from main import db  # Importación diferida: main usa este módulo
+
+    query = {} if include_unknown else {"intent": {"$ne": "unknown"}}
+    cursor = db.interaction_analysis.find(query, {"_id": 0, "user_input": 1, "intent": 1}).batch_size(2000)
+    if limit:
+        cursor = cursor.limit(limit)
+    return [(row["user_input"], row["intent"]) for row in cursor if row.get("user_input") and row.get("intent")]
+
+
+def split_holdout(examples: List[Tuple[str, str]], test_fraction: float) -> Tuple[list, list]:
+    """Separación determinista por hash del texto (el mismo texto cae siempre del mismo lado)"""
+    train, test = [], []
+    for example in examples:
+        bucket = zlib.crc32(normalize_text(example[0]).encode()) % 1000
+        (test if bucket < test_fraction * 1000 else train).append(example)
+    return train, test
+
+
+def evaluate(model: IntentClassifier, examples: List[Tuple[str, str]], min_confidence: float = 0.0) -> Dict:
+    """Exactitud global y por intención, comparada con el motor de palabras clave"""
+    from nlu import get_nlu
+
+    texts = [text for text, _ in examples]
+    expected = [intent for _, intent in examples]
+    predictions = model.predict(texts)
+    nlu = get_nlu()
+    keyword = [nlu.detect_intent(text.lower()) for text in texts]
+    hybrid = [
+        label if confidence >= min_confidence else fallback
+        for (label, confidence), fallback in zip(predictions, keyword)
+    ]
+
+    per_intent = {}
+    support = Counter(expected)
+    for intent in sorted(support):
+        hits = sum(1 for e, (p, _) in zip(expected, predictions) if e == intent and p == intent)
+        predicted = sum(1 for p, _ in predictions if p == intent)
+        per_intent[intent] = {
+            "support": support[intent],
+            "precision": round(hits / predicted, 3) if predicted else 0.0,
+            "recall": round(hits / support[intent], 3)
+        }
+
+    def accuracy(predicted_labels: List[str]) -> float:
+        return round(sum(1 for e, p in zip(expected, predicted_labels) if e == p) / max(len(expected), 1), 4)
+
+    started = time.perf_counter()
+    for text in texts[:1000]:
+        model.predict_one(text)
+    single_us = (time.perf_counter() - started) / max(min(len(texts), 1000), 1) * 1e6
+    started = time.perf_counter()
+    model.predict(texts)
+    batch_us = (time.perf_counter() - started) / max(len(texts), 1) * 1e6
+
+    return {
+        "examples": len(examples),
+        "model_accuracy": accuracy([label for label, _ in predictions]),
+        "keyword_accuracy": accuracy(keyword),
+        "hybrid_accuracy": accuracy(hybrid),
+        "min_confidence": min_confidence,
+        "per_intent": per_intent,
+        "latency_us": {"single": round(single_us, 1), "batch_per_item": round(batch_us, 2)}
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Entrena o evalúa el clasificador local de intenciones")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    train_parser = subparsers.add_parser("train", help="Entrena y guarda el modelo (.npz)")
+    train_parser.add_argument("--output", default=DEFAULT_MODEL_PATH)
+    train_parser.add_argument("--labels", help="JSONL con ejemplos curados {text, intent}")
+    train_parser.add_argument("--no-db", action="store_true", help="No usar interaction_analysis")
+    train_parser.add_argument("--limit", type=int, default=0, help="Máximo de ejemplos de la base de datos")
+    train_parser.add_argument("--hash-bits", type=int, default=DEFAULT_HASH_BITS)
+    train_parser.add_argument("--epochs", type=int, default=15)
+    train_parser.add_argument("--learning-rate", type=float, default=5.0)
+    train_parser.add_argument("--test-fraction", type=float, default=0.2)
+    train_parser.add_argument("--min-confidence", type=float, default=0.6)
+
+    eval_parser = subparsers.add_parser("evaluate", help="Evalúa un modelo guardado")
+    eval_parser.add_argument("--model", default=DEFAULT_MODEL_PATH)
+    eval_parser.add_argument("--labels", help="JSONL con ejemplos curados {text, intent}")
+    eval_parser.add_argument("--limit", type=int, default=0)
+    eval_parser.add_argument("--min-confidence", type=float, default=0.6)
+    args = parser.parse_args()
+
+    examples = load_labeled_file(args.labels) if args.labels else []
+    if args.command == "train":
+        if not args.no_db:
+            examples += load_interaction_examples(args.limit)
+        if len({intent for _, intent in examples}) < 2:
+            parser.error("Se necesitan ejemplos de al menos dos intenciones para entrenar")
+        train, test = split_holdout(examples, args.test_fraction)
+        print(f"📚 Entrenando con {len(train)} ejemplos ({len(test)} reservados para evaluación)")
+        started = time.perf_counter()
+        model = IntentClassifier.train(
+            [text for text, _ in train], [intent for _, intent in train],
+            hash_bits=args.hash_bits, epochs=args.epochs, learning_rate=args.learning_rate
+        )
+        print(f"⏱️ Entrenamiento: {time.perf_counter() - started:.1f}s")
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        model.save(args.output)
+        print(f"💾 Modelo guardado en {args.output} (intenciones: {', '.join(model.labels)})")
+        if test:
+            print(json.dumps(evaluate(model, test, args.min_confidence), indent=2, ensure_ascii=False))
+    else:
+        if not examples:
+            examples = load_interaction_examples(args.limit)
+        model = IntentClassifier.load(args.model)
+        print(json.dumps(evaluate(model, examples, args.min_confidence), indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
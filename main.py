@@ -1,55 +1,59 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Header, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pymongo import MongoClient
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from pymongo import ReplaceOne, UpdateOne
+from pymongo.errors import BulkWriteError, OperationFailure, ConfigurationError, DuplicateKeyError
 from pydantic import BaseModel
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Tuple, Iterable
 from bson import ObjectId
 import os
 from dotenv import load_dotenv
 import re
 from datetime import datetime, timedelta
 from enum import Enum
+from collections import OrderedDict, Counter
+from contextlib import asynccontextmanager
 import logging
+import time
+import heapq
+import itertools
+import hashlib
+import secrets
+import base64
+import zlib
+import threading
+import queue
+import random
 import aiohttp
+import orjson
 import asyncio
 from datetime import datetime, timedelta, timezone
-import pytz
+from timeutils import get_local_now, get_utc_now, local_to_utc, utc_to_local, make_naive
+from nlu import get_nlu, reload_nlu_from_file, reload_nlu_from_collection, extract_entities, parse_natural_time
+from rendering import Markup, Reply, render, format_date
+from nlu_executor import NLUExecutor
+from speech import AudioFormatError, AudioTooLongError, SpeechPipeline
+from storage import open_client
+from compression import CompressionMiddleware
+from change_streams import ChangeStreamConsumer, EventBus, ResumeTokenStore
+from search_index import UserSearchIndex, build_index, index_interaction, index_reminder
+from agenda import UserAgenda
+from ics import IcsParser, render_calendar, render_event
+from email.utils import format_datetime as http_date, parsedate_to_datetime
+from reminder_schema import encode_reminder, encode_update, decode_reminder, serialize_reminder, migrate_reminder, compact_projection
 
 # Cargar variables de entorno
 load_dotenv()
 
-# 🆕 CONFIGURACIÓN PARA VENEZUELA (Caracas)
-TIMEZONE = pytz.timezone('America/Caracas')  # UTC-4
-
-def get_local_now():
-    """Obtiene la fecha/hora actual en la zona horaria de Venezuela"""
-    return datetime.now(TIMEZONE)
-
-def get_utc_now():
-    """Obtiene la fecha/hora actual en UTC"""
-    return datetime.now(timezone.utc)
-
-def local_to_utc(local_dt):
-    """Convierte datetime local a UTC"""
-    if local_dt.tzinfo is None:
-        local_dt = TIMEZONE.localize(local_dt)
-    return local_dt.astimezone(timezone.utc)
-
-def utc_to_local(utc_dt):
-    """Convierte datetime UTC a local"""
-    if utc_dt.tzinfo is None:
-        utc_dt = utc_dt.replace(tzinfo=timezone.utc)
-    return utc_dt.astimezone(TIMEZONE)
-
-def make_naive(dt):
-    """Convierte datetime aware a naive (sin timezone)"""
-    if dt.tzinfo is not None:
-        return dt.replace(tzinfo=None)
-    return dt
-
 # Configuración de Telegram
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
-TELEGRAM_CHAT_ID = os.getenv("TELEGRAM_CHAT_ID")
+TELEGRAM_CHAT_ID = os.getenv("TELEGRAM_CHAT_ID")  # Chat por defecto (usuarios sin vincular)
+TELEGRAM_WEBHOOK_SECRET = os.getenv("TELEGRAM_WEBHOOK_SECRET")
+TELEGRAM_CHAT_CACHE_TTL = int(os.getenv("TELEGRAM_CHAT_CACHE_TTL", "300"))  # segundos
+TELEGRAM_BOT_USERNAME = os.getenv("TELEGRAM_BOT_USERNAME")  # Para el enlace t.me/<bot>?start=<token>
+TELEGRAM_LINK_TOKEN_TTL = int(os.getenv("TELEGRAM_LINK_TOKEN_TTL", "600"))  # segundos
+# Si es "false", los recordatorios de usuarios sin chat vinculado no se envían al chat por defecto
+TELEGRAM_FALLBACK_TO_DEFAULT_CHAT = os.getenv("TELEGRAM_FALLBACK_TO_DEFAULT_CHAT", "true").lower() == "true"
 
 # 🆕 DEBUG DETALLADO
 print("=== CONFIGURACIÓN TELEGRAM ===")
@@ -76,58 +80,86 @@ async def test_telegram_connection():
     else:
         print("❌ Prueba de Telegram: TOKENS NO CONFIGURADOS")
 
-# Ejecutar la prueba al inicio
-import asyncio
-asyncio.create_task(test_telegram_connection())
+# 🆕 POOL DE ENVÍO: una sola sesión HTTP compartida y un límite de envíos simultáneos
+TELEGRAM_SEND_CONCURRENCY = int(os.getenv("TELEGRAM_SEND_CONCURRENCY", "8"))
+_telegram_session: Optional[aiohttp.ClientSession] = None
+_telegram_send_semaphore: Optional[asyncio.Semaphore] = None
 
-async def send_telegram_message(message: str):
-    """Envía un mensaje a través de Telegram"""
-    if not TELEGRAM_BOT_TOKEN or not TELEGRAM_CHAT_ID:
-        logger.error("❌ Tokens de Telegram no configurados")
-        return False
-    
-    url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
-    
-    payload = {
-        "chat_id": TELEGRAM_CHAT_ID,
-        "text": message,
-        "parse_mode": "HTML"
-    }
+def get_telegram_session() -> aiohttp.ClientSession:
+    """Devuelve la sesión HTTP compartida con la API de Telegram (se crea la primera vez)"""
+    global _telegram_session, _telegram_send_semaphore
+    if _telegram_session is None or _telegram_session.closed:
+        # Configurar connector para evitar problemas de SSL en desarrollo
+        connector = aiohttp.TCPConnector(ssl=False, limit=TELEGRAM_SEND_CONCURRENCY)
+        _telegram_session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=30)
+        )
+        _telegram_send_semaphore = asyncio.Semaphore(TELEGRAM_SEND_CONCURRENCY)
+    return _telegram_session
+
+async def close_telegram_session():
+    """Cierra la sesión compartida de Telegram"""
+    global _telegram_session
+    if _telegram_session is not None and not _telegram_session.closed:
+        await _telegram_session.close()
+    _telegram_session = None
+
+async def call_telegram_api(method: str, payload: Dict[str, Any]) -> bool:
+    """Llama a un método de la API de Telegram usando el pool compartido"""
+    url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/{method}"
     
     try:
-        print(f"📤 Enviando mensaje a Telegram: {message[:50]}...")
-        
-        # Configurar connector para evitar problemas de SSL en desarrollo
-        connector = aiohttp.TCPConnector(verify_ssl=False)
-        
-        async with aiohttp.ClientSession(connector=connector) as session:
-            async with session.post(url, json=payload, timeout=30) as response:
+        session = get_telegram_session()
+        async with _telegram_send_semaphore:
+            async with session.post(url, json=payload) as response:
                 if response.status == 200:
-                    print("✅ Mensaje de Telegram enviado exitosamente")
                     return True
                 else:
                     error_text = await response.text()
-                    print(f"❌ Error Telegram API (HTTP {response.status}): {error_text}")
+                    print(f"❌ Error Telegram API {method} (HTTP {response.status}): {error_text}")
                     return False
                     
     except asyncio.TimeoutError:
-        print("❌ Timeout enviando mensaje a Telegram")
+        print(f"❌ Timeout llamando a Telegram ({method})")
         return False
     except Exception as e:
         print(f"❌ Error de conexión Telegram: {e}")
         return False
 
-def send_telegram_message_sync(message: str):
+async def send_telegram_message(message: str, chat_id: Optional[str] = None, reply_markup: Optional[Dict[str, Any]] = None):
+    """Envía un mensaje a través de Telegram (al chat indicado o al chat por defecto)"""
+    chat_id = chat_id or TELEGRAM_CHAT_ID
+    if not TELEGRAM_BOT_TOKEN or not chat_id:
+        logger.error("❌ Tokens de Telegram no configurados")
+        return False
+    
+    payload = {
+        "chat_id": chat_id,
+        "text": message,
+        "parse_mode": "HTML"
+    }
+    if reply_markup:
+        payload["reply_markup"] = reply_markup
+    
+    print(f"📤 Enviando mensaje a Telegram ({chat_id}): {message[:50]}...")
+    success = await call_telegram_api("sendMessage", payload)
+    if success:
+        print("✅ Mensaje de Telegram enviado exitosamente")
+    return success
+
+def send_telegram_message_sync(message: str, chat_id: Optional[str] = None):
     """Versión síncrona para usar en funciones no async"""
     import requests
-    if not TELEGRAM_BOT_TOKEN or not TELEGRAM_CHAT_ID:
+    chat_id = chat_id or TELEGRAM_CHAT_ID
+    if not TELEGRAM_BOT_TOKEN or not chat_id:
         logger.warning("Tokens de Telegram no configurados")
         return False
     
     url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
     
     payload = {
-        "chat_id": TELEGRAM_CHAT_ID,
+        "chat_id": chat_id,
         "text": message,
         "parse_mode": "HTML"
     }
@@ -171,74 +203,161 @@ class ReminderCreate(BaseModel):
     is_recurring: bool = False
     recurrence_pattern: Optional[str] = None  # "daily", "weekly", "monthly"
 
+# 🆕 Caché LRU con expiración (acotada en memoria)
+class LRUTTLCache:
+    """Diccionario LRU con tamaño máximo y expiración por entrada; seguro entre hilos"""
+    
+    def __init__(self, max_size: int, ttl_seconds: float):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._items: "OrderedDict[Any, Tuple[Any, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return default
+            value, expires_at = item
+            if expires_at <= time.monotonic():
+                del self._items[key]
+                return default
+            self._items.move_to_end(key)
+            return value
+    
+    def set(self, key, value, ttl_seconds: Optional[float] = None):
+        with self._lock:
+            self._items[key] = (value, time.monotonic() + (ttl_seconds or self.ttl_seconds))
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+    
+    def pop(self, key, default=None):
+        with self._lock:
+            item = self._items.pop(key, None)
+            return item[0] if item else default
+    
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+    
+    def __len__(self):
+        with self._lock:
+            return len(self._items)
+
 # Sistema de memoria de contexto
+CONTEXT_BACKEND = os.getenv("CONTEXT_BACKEND", "memory")          # "memory" o "mongo" (varios workers)
+CONTEXT_MAX_SESSIONS = int(os.getenv("CONTEXT_MAX_SESSIONS", "10000"))
+CONTEXT_TTL_SECONDS = int(os.getenv("CONTEXT_TTL_SECONDS", "900"))
+
 class ConversationContext:
-    def __init__(self):
-        self.last_intent = None
-        self.pending_actions = []
-        self.user_preferences = {}
+    def __init__(self, last_intent: Optional[str] = None, pending_action: Optional[Dict[str, Any]] = None,
+                 user_preferences: Optional[Dict[str, Any]] = None):
+        self.last_intent = last_intent
+        # 🆕 Acción incompleta esperando datos: {"intent", "slots", "user_input"}
+        self.pending_action = pending_action
+        self.user_preferences = user_preferences or {}
     
     def update_context(self, intent: str, entities: Dict):
         self.last_intent = intent
-        # Aquí agregaremos más lógica después
-    
-conversation_context = ConversationContext()
-
-# Sistema de entidades (información extraída)
-def extract_entities(user_input: str) -> Dict[str, Any]:
-    """Extrae información importante del texto del usuario"""
-    entities = {}
-    input_lower = user_input.lower()
-    
-    # Extraer horas
-    time_pattern = r'(\d{1,2}):?(\d{2})?\s*(am|pm|hrs)?'
-    time_matches = re.findall(time_pattern, input_lower)
-    if time_matches:
-        entities['time'] = time_matches[0][0] + ':00'
-    
-    # Extraer días
-    days = ['lunes', 'martes', 'miércoles', 'jueves', 'viernes', 'sábado', 'domingo', 'hoy', 'mañana']
-    for day in days:
-        if day in input_lower:
-            entities['day'] = day
-            break
-    
-    # Extraer tipos de eventos
-    event_keywords = {
-        'reunión': 'meeting',
-        'reunion': 'meeting', 
-        'llamada': 'call',
-        'tarea': 'task',
-        'recordatorio': 'reminder',
-        'evento': 'event'
-    }
     
-    for keyword, event_type in event_keywords.items():
-        if keyword in input_lower:
-            entities['event_type'] = event_type
-            break
+    def set_pending(self, intent: str, slots: Dict[str, Any], user_input: str):
+        self.pending_action = {"intent": intent, "slots": slots, "user_input": user_input}
+    
+    def clear_pending(self):
+        self.pending_action = None
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "last_intent": self.last_intent,
+            "pending_action": self.pending_action,
+            "user_preferences": self.user_preferences
+        }
+    
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "ConversationContext":
+        return cls(data.get("last_intent"), data.get("pending_action"), data.get("user_preferences"))
+
+class ConversationContextStore:
+    """
+    Contexto de diálogo por usuario. En memoria es un LRU con TTL (máximo CONTEXT_MAX_SESSIONS);
+    con CONTEXT_BACKEND=mongo se lee y escribe en conversation_contexts para compartirlo entre workers.
+    """
+    
+    def __init__(self, backend: str, max_sessions: int, ttl_seconds: int):
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+        self.cache = LRUTTLCache(max_sessions, ttl_seconds)
+    
+    def get(self, user_id: str) -> ConversationContext:
+        if self.backend == "mongo":
+            try:
+                doc = db.conversation_contexts.find_one({"_id": user_id})
+                if doc and doc["updated_at"] > datetime.utcnow() - timedelta(seconds=self.ttl_seconds):
+                    return ConversationContext.from_dict(doc)
+                return ConversationContext()
+            except Exception as e:
+                logger.error(f"Error leyendo contexto de {user_id}, usando memoria: {e}")
+        return self.cache.get(user_id) or ConversationContext()
     
-    return entities
+    def save(self, user_id: str, context: ConversationContext):
+        self.cache.set(user_id, context)
+        if self.backend == "mongo":
+            db.conversation_contexts.replace_one(
+                {"_id": user_id},
+                {"_id": user_id, **context.to_dict(), "updated_at": datetime.utcnow()},
+                upsert=True
+            )
+
+conversation_contexts = ConversationContextStore(CONTEXT_BACKEND, CONTEXT_MAX_SESSIONS, CONTEXT_TTL_SECONDS)
 
 # Sistema de intenciones mejorado
+# (las palabras clave viven en nlu_config.json / colección nlu_config y se recargan en caliente)
+# 🆕 Clasificador local opcional (INTENT_BACKEND=model); el motor de palabras clave queda de respaldo
+INTENT_BACKEND = os.getenv("INTENT_BACKEND", "keyword")   # "keyword" o "model"
+INTENT_MODEL_PATH = os.getenv("INTENT_MODEL_PATH", "models/intent_model.npz")
+INTENT_MIN_CONFIDENCE = float(os.getenv("INTENT_MIN_CONFIDENCE", "0.6"))
+intent_model = None
+
+def load_intent_model():
+    """Carga el modelo entrenado con intent_classifier.py; si falla se usan las palabras clave"""
+    global intent_model
+    if INTENT_BACKEND != "model":
+        return
+    try:
+        from intent_classifier import IntentClassifier
+        intent_model = IntentClassifier.load(INTENT_MODEL_PATH)
+        print(f"🧠 Clasificador de intenciones cargado ({', '.join(intent_model.labels)})")
+    except Exception as e:
+        intent_model = None
+        logger.error(f"No se pudo cargar el clasificador de intenciones, usando palabras clave: {e}")
+
 def detect_intent(user_input: str) -> str:
     """Detecta la intención del usuario de manera más inteligente"""
-    input_lower = user_input.lower()
-    
-    intent_patterns = {
-        'greeting': ['hola', 'hi', 'buenos días', 'buenas tardes'],
-        'schedule_meeting': ['reunión', 'reunion', 'meeting', 'programar reunión'],
-        'create_reminder': ['recordar', 'recordatorio', 'reminder', 'no olvidar'],
-        'create_task': ['tarea', 'task', 'pendiente', 'por hacer'],
-        'ask_help': ['ayuda', 'help', 'qué puedes hacer'],
-        'thank_you': ['gracias', 'thanks', 'thank you']
-    }
-    
-    for intent, patterns in intent_patterns.items():
-        if any(pattern in input_lower for pattern in patterns):
+    if intent_model is not None:
+        intent, confidence = intent_model.predict_one(user_input)
+        if confidence >= INTENT_MIN_CONFIDENCE:
             return intent
-    
-    return 'unknown'
+    return get_nlu().detect_intent(user_input.lower())
+
+# 🆕 Etapa de análisis fuera del pipeline (inline, hilos o procesos; ver nlu_executor.py)
+nlu_executor = NLUExecutor(
+    model_path=INTENT_MODEL_PATH if INTENT_BACKEND == "model" else None,
+    min_confidence=INTENT_MIN_CONFIDENCE
+)
+
+# 🆕 Reconocimiento de voz local para /interact/audio (ver speech.py)
+speech_pipeline = SpeechPipeline()
+
+def detect_intents(user_inputs: List[str]) -> List[str]:
+    """Versión por lotes de detect_intent (ráfagas del webhook, importaciones masivas)"""
+    nlu = get_nlu()
+    if intent_model is None:
+        return [nlu.detect_intent(text.lower()) for text in user_inputs]
+    return [
+        intent if confidence >= INTENT_MIN_CONFIDENCE else nlu.detect_intent(text.lower())
+        for text, (intent, confidence) in zip(user_inputs, intent_model.predict(user_inputs))
+    ]
 
 
 app = FastAPI(title="Virtual Assistant API")
@@ -254,17 +373,25 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# 🆕 gzip (o brotli si está instalado) para las respuestas grandes
+app.add_middleware(CompressionMiddleware)
 
 # Conexión MongoDB Atlas - SEGURO
 MONGODB_URL = os.getenv("MONGODB_URL")
 DATABASE_NAME = os.getenv("DATABASE_NAME", "virtual_assistant")
+# 🆕 Almacenamiento: "mongo" (Atlas), "sqlite" (embebido, un solo nodo) o "memory" (pruebas sin red)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "mongo")
+SQLITE_PATH = os.getenv("SQLITE_PATH", "data/assistant.db")
 
 try:
-    client = MongoClient(MONGODB_URL)
+    client = open_client(STORAGE_BACKEND, MONGODB_URL, SQLITE_PATH)
     db = client[DATABASE_NAME]
     # Verificar conexión
     client.admin.command('ping')
-    print("✅ Conectado a MongoDB Atlas exitosamente!")
+    if STORAGE_BACKEND == "mongo":
+        print("✅ Conectado a MongoDB Atlas exitosamente!")
+    else:
+        print(f"✅ Almacenamiento embebido listo ({STORAGE_BACKEND}{': ' + SQLITE_PATH if STORAGE_BACKEND == 'sqlite' else ''})")
 except Exception as e:
     print(f"❌ Error conectando a MongoDB: {e}")
     raise e
@@ -280,96 +407,337 @@ class LearningPattern(BaseModel):
 
 @app.get("/")
 async def root():
-    return {"message": "¡API del Asistente Virtual funcionando!", "database": "MongoDB Atlas"}
+    return {
+        "message": "¡API del Asistente Virtual funcionando!",
+        "database": "MongoDB Atlas" if STORAGE_BACKEND == "mongo" else f"Embebida ({STORAGE_BACKEND})"
+    }
 
-@app.post("/interact")
-async def interact(interaction: Interaction):
-    """Guarda interacción y responde inteligentemente"""
+# =============================================
+# 🆕 IDEMPOTENCIA (reenvíos de Streamlit / doble clic)
+# =============================================
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "600"))
+IDEMPOTENCY_BUCKET_SECONDS = int(os.getenv("IDEMPOTENCY_BUCKET_SECONDS", "60"))  # Ventana para claves derivadas
+IDEMPOTENCY_MAX_KEYS = int(os.getenv("IDEMPOTENCY_MAX_KEYS", "50000"))
+
+idempotency_cache = LRUTTLCache(IDEMPOTENCY_MAX_KEYS, IDEMPOTENCY_TTL_SECONDS)
+_inflight_requests: Dict[str, asyncio.Future] = {}
+
+def idempotency_keys(scope: str, user_id: str, explicit_key: Optional[str], text: str) -> List[str]:
+    """
+    Claves candidatas de una petición. Con Idempotency-Key se usa esa; si no, se deriva de
+    usuario + texto normalizado + ventana de tiempo (también se mira la ventana anterior
+    para que un reenvío justo en el cambio de ventana no se duplique).
+    """
+    if explicit_key:
+        return [f"{scope}:{user_id}:key:{explicit_key}"]
+    digest = hashlib.sha1(" ".join(text.lower().split()).encode()).hexdigest()
+    bucket = int(time.time() // IDEMPOTENCY_BUCKET_SECONDS)
+    return [f"{scope}:{user_id}:{digest}:{bucket}", f"{scope}:{user_id}:{digest}:{bucket - 1}"]
+
+async def run_idempotent(keys: List[str], operation, response: Optional[Response] = None):
+    """
+    Devuelve el resultado guardado si la petición ya se procesó (o espera a la que está en
+    curso con la misma clave); si no, ejecuta operation() y guarda el resultado.
+    Los errores no se guardan: un reintento vuelve a ejecutar la operación.
+    """
+    for key in keys:
+        cached = idempotency_cache.get(key)
+        if cached is None and key in _inflight_requests:
+            cached = await asyncio.shield(_inflight_requests[key])
+        if cached is not None:
+            logger.info(f"♻️ Petición repetida ({key}), devolviendo la respuesta guardada")
+            if response is not None:
+                response.headers["Idempotent-Replayed"] = "true"
+            return cached
     
+    key = keys[0]
+    future = asyncio.get_running_loop().create_future()
+    _inflight_requests[key] = future
     try:
-        logger.info(f"Procesando interacción: {interaction.user_input} para usuario: {interaction.user_id}")
-        
-        # Guardar en MongoDB
-        interaction_data = {
-            "user_id": interaction.user_id,
-            "user_input": interaction.user_input,
-            "timestamp": datetime.utcnow(),
-            "processed": False
-        }
-        
-        result = db.interactions.insert_one(interaction_data)
-        logger.info(f"Interacción guardada con ID: {result.inserted_id}")
-        
-        # Lógica de respuesta mejorada
-        response = generate_response_complete(interaction.user_input, interaction.user_id)
-        logger.info(f"Respuesta generada: {response}")
-        
-        # Actualizar con respuesta
-        db.interactions.update_one(
-            {"_id": result.inserted_id},
-            {"$set": {"assistant_response": response, "processed": True}}
+        result = await operation()
+        idempotency_cache.set(key, result)
+        future.set_result(result)
+        return result
+    except Exception as e:
+        future.set_exception(e)
+        future.exception()  # Evita el aviso de excepción no recuperada si nadie esperaba
+        raise
+    finally:
+        _inflight_requests.pop(key, None)
+
+# =============================================
+# 🆕 CONTROL DE ADMISIÓN (límites de concurrencia y backpressure)
+# =============================================
+ADMISSION_MAX_CONCURRENCY = int(os.getenv("ADMISSION_MAX_CONCURRENCY", "16"))  # Peticiones en ejecución (global)
+ADMISSION_PER_USER = int(os.getenv("ADMISSION_PER_USER", "2"))                 # En cola + en ejecución por usuario
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "200"))              # Peticiones en espera por carril
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "5"))     # segundos
+ADMISSION_RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER", "1"))           # segundos
+
+# Carriles: menor número = mayor prioridad (las lecturas de la UI no esperan detrás de ráfagas de mensajes)
+ADMISSION_LANES = {"read": 0, "write": 1, "interact": 2}
+
+class AdmissionController:
+    """
+    Semáforo global con cola acotada por prioridad y límite por usuario.
+    Si la cola está llena (o el usuario ya tiene demasiadas peticiones) se rechaza al instante
+    con 429 y Retry-After en lugar de dejar que la latencia crezca para todos.
+    """
+    
+    def __init__(self, max_concurrency: int, per_user: int, max_queue: int, queue_timeout: float):
+        self.max_concurrency = max_concurrency
+        self.per_user = per_user
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.available = max_concurrency
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._sequence = itertools.count()
+        self._user_inflight: Dict[Tuple[str, str], int] = {}
+        self.queued: Counter = Counter()
+        self.counters: Counter = Counter()
+    
+    def _reject(self, reason: str, lane: str):
+        self.counters[f"rejected_{reason}"] += 1
+        self.counters[f"rejected_{lane}"] += 1
+        raise HTTPException(
+            status_code=429,
+            detail=f"Servidor ocupado ({reason}), intenta de nuevo en unos segundos",
+            headers={"Retry-After": str(ADMISSION_RETRY_AFTER)}
         )
-        
+    
+    async def _acquire(self, lane: str):
+        if self.available > 0 and not self._waiters:
+            self.available -= 1
+            return
+        if self.queued[lane] >= self.max_queue:  # Cola acotada por carril
+            self._reject("queue_full", lane)
+        
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (ADMISSION_LANES[lane], next(self._sequence), future))
+        self.queued[lane] += 1
+        try:
+            await asyncio.wait_for(future, self.queue_timeout)
+        except asyncio.TimeoutError:
+            if future.done() and not future.cancelled():
+                self._release()  # Se concedió justo al expirar: devolver el permiso
+            self._reject("timeout", lane)
+        finally:
+            self.queued[lane] -= 1
+    
+    def _release(self):
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(True)
+                return
+        self.available += 1
+    
+    @asynccontextmanager
+    async def slot(self, user_id: str, lane: str = "interact"):
+        """Reserva un permiso para ejecutar la petición (lanza HTTPException 429 si no hay)"""
+        user_key = (user_id, lane)  # El límite es por carril: una ráfaga de mensajes no bloquea las lecturas
+        if self._user_inflight.get(user_key, 0) >= self.per_user:
+            self._reject("user_limit", lane)
+        self._user_inflight[user_key] = self._user_inflight.get(user_key, 0) + 1
+        try:
+            started = time.monotonic()
+            await self._acquire(lane)
+            self.counters["admitted"] += 1
+            self.counters["queue_wait_ms_total"] += int((time.monotonic() - started) * 1000)
+            try:
+                yield
+            finally:
+                self._release()
+        finally:
+            self._user_inflight[user_key] -= 1
+            if self._user_inflight[user_key] == 0:
+                del self._user_inflight[user_key]
+    
+    def stats(self) -> Dict[str, Any]:
         return {
-            "response": response,
-            "interaction_id": str(result.inserted_id),
-            "status": "success"
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self.max_concurrency - self.available,
+            "queued": dict(self.queued),
+            "queue_depth": sum(self.queued.values()),
+            "max_queue": self.max_queue,
+            "active_users": len({user_id for user_id, _ in self._user_inflight}),
+            "counters": dict(self.counters)
         }
+
+admission = AdmissionController(ADMISSION_MAX_CONCURRENCY, ADMISSION_PER_USER, ADMISSION_MAX_QUEUE, ADMISSION_QUEUE_TIMEOUT)
+
+async def run_admitted(user_id: str, lane: str, func, *args):
+    """Ejecuta una función síncrona en un hilo, dentro de un permiso de admisión"""
+    async with admission.slot(user_id, lane):
+        return await asyncio.to_thread(func, *args)
+
+async def run_interaction(user_id: str, user_input: str, channel: str = "api") -> Dict[str, Any]:
+    """Análisis en el ejecutor del NLU (micro-lotes) y luego el pipeline en un hilo"""
+    analysis = await nlu_executor.analyze(user_input)
+    return await asyncio.to_thread(process_interaction, user_id, user_input, channel, analysis)
+
+async def run_admitted_interaction(user_id: str, user_input: str, channel: str = "api") -> Dict[str, Any]:
+    async with admission.slot(user_id, "interact"):
+        return await run_interaction(user_id, user_input, channel)
+
+@app.post("/interact")
+async def interact(interaction: Interaction, response: Response, idempotency_key: Optional[str] = Header(None)):
+    """Guarda interacción y responde inteligentemente"""
+    
+    try:
+        keys = idempotency_keys("interact", interaction.user_id, idempotency_key, interaction.user_input)
+        return await run_idempotent(
+            keys,
+            lambda: run_admitted_interaction(interaction.user_id, interaction.user_input),
+            response
+        )
     
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error procesando interacción: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Error procesando interacción: {str(e)}")
 
-def generate_response_complete(user_input: str, user_id: str) -> str:
+@app.post("/interact/audio")
+async def interact_audio(user_id: str, request: Request, sample_rate: Optional[int] = None):
+    """
+    🆕 Comando de voz. El cuerpo es el audio (WAV PCM 16 bits mono, o PCM crudo con
+    Content-Type audio/L16 y sample_rate), que puede llegar en chunks. Se transcribe a
+    medida que llega y el texto sigue el mismo camino que /interact.
+    """
+    if not speech_pipeline.available:
+        raise HTTPException(status_code=503, detail="El reconocimiento de voz no está disponible")
+    if speech_pipeline.busy():
+        raise HTTPException(
+            status_code=429,
+            detail="Hay demasiados audios en proceso, intenta de nuevo en unos segundos",
+            headers={"Retry-After": str(ADMISSION_RETRY_AFTER)}
+        )
+    try:
+        transcript = await speech_pipeline.transcribe(request.stream(), request.headers.get("content-type", ""), sample_rate)
+        if not transcript["text"]:
+            raise HTTPException(status_code=422, detail="No se reconoció ninguna frase en el audio")
+        logger.info(f"🎤 Transcripción de {user_id} ({transcript['seconds']}s): {transcript['text']}")
+        
+        result = await run_admitted_interaction(user_id, transcript["text"], channel="voice")
+        return {**result, "transcript": transcript["text"], "audio_seconds": transcript["seconds"]}
+    
+    except HTTPException:
+        raise
+    except AudioFormatError as e:
+        raise HTTPException(status_code=415, detail=str(e))
+    except AudioTooLongError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error procesando audio: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Error procesando audio: {str(e)}")
+
+def process_interaction(user_id: str, user_input: str, channel: str = "api",
+                        analysis: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Pipeline completo de una interacción: guardar, responder y actualizar (API y Telegram)"""
+    logger.info(f"Procesando interacción: {user_input} para usuario: {user_id}")
+    
+    # Guardar en MongoDB
+    interaction_data = {
+        "user_id": user_id,
+        "user_input": user_input,
+        "timestamp": datetime.utcnow(),
+        "processed": False,
+        "channel": channel
+    }
+    
+    result = db.interactions.insert_one(interaction_data)
+    logger.info(f"Interacción guardada con ID: {result.inserted_id}")
+    
+    # Lógica de respuesta mejorada (🆕 se renderiza para el canal desde la plantilla)
+    reply = generate_response_complete(user_input, user_id, analysis)
+    response = reply.render("markdown")
+    logger.info(f"Respuesta generada: {response}")
+    
+    # Actualizar con respuesta
+    db.interactions.update_one(
+        {"_id": result.inserted_id},
+        {"$set": {"assistant_response": response, "processed": True}}
+    )
+    
+    result_data = {
+        "response": response,
+        "interaction_id": str(result.inserted_id),
+        "status": "success",
+        # 🆕 Sugerencias de las próximas 24 horas (desde la caché, sin consultar la base de datos)
+        "suggestions": get_upcoming_suggestions(user_id, hours_ahead=24, limit=3)
+    }
+    if channel == "telegram":
+        result_data["response_html"] = reply.render("html")
+    return result_data
+
+def generate_response_complete(user_input: str, user_id: str, analysis: Optional[Dict[str, Any]] = None) -> Reply:
     """Lógica de respuesta completa con todas las intenciones"""
     try:
         logger.info(f"Generando respuesta para: {user_input}")
         
-        intent = detect_intent(user_input)
-        entities = extract_entities(user_input)
+        # 🆕 El análisis puede venir ya hecho por el ejecutor del NLU
+        if analysis:
+            intent, entities = analysis["intent"], analysis["entities"]
+        else:
+            intent = detect_intent(user_input)
+            entities = extract_entities(user_input)
         
         logger.info(f"Intención detectada: {intent}, Entidades: {entities}")
         
         # Guardar el análisis para aprendizaje futuro
         save_interaction_analysis(user_id, user_input, intent, entities)
         
+        # 🆕 Completar una reunión/recordatorio que quedó a medias en el turno anterior
+        context = conversation_contexts.get(user_id)
+        pending = context.pending_action
+        context.update_context(intent, entities)
+        if pending and intent in ('unknown', pending['intent']):
+            new_slots = {key: entities[key] for key in ('day', 'time') if key in entities}
+            if new_slots:
+                logger.info(f"Completando {pending['intent']} pendiente con {new_slots}")
+                context.clear_pending()
+                conversation_contexts.save(user_id, context)
+                if pending['intent'] == 'schedule_meeting':
+                    return handle_meeting_scheduling(pending['user_input'], user_id, {**pending['slots'], **new_slots})
+                # El texto sigue siendo el del pedido original; la fecha sale de los datos nuevos
+                slots = {**pending['slots'], **new_slots}
+                return handle_reminder_creation(pending['user_input'], user_id, slots, {"due_date": slots_due_date(slots, user_input)})
+        if pending and intent not in ('unknown', pending['intent']):
+            # El usuario cambió de tema
+            context.clear_pending()
+        conversation_contexts.save(user_id, context)
+        
         # Manejo específico de recordatorios
         if intent == 'create_reminder':
-            return handle_reminder_creation(user_input, user_id, entities)
+            return handle_reminder_creation(user_input, user_id, entities, analysis)
         
         # Respuestas basadas en intención + entidades
         if intent == 'greeting':
-            return "¡Hola! Soy tu asistente inteligente. Puedo ayudarte a programar reuniones, crear recordatorios, y aprender de tus rutinas. ¿En qué te puedo ayudar hoy?"
+            return Reply('greeting')
         
         elif intent == 'schedule_meeting':
-            return handle_meeting_scheduling(user_input, user_id, entities)
+            return handle_meeting_scheduling(user_input, user_id, entities, analysis)
         
         elif intent == 'create_task':
-            return "📝 Anotado! He agregado esta tarea a tu lista. ¿Tiene alguna fecha límite específica?"
+            return Reply('task_noted')
         
         elif intent == 'ask_help':
-            return """🤖 **Puedo ayudarte con:**
-• 📅 Programar reuniones y eventos
-• 🔔 Crear recordatorios inteligentes  
-• 📝 Gestionar tus tareas pendientes
-• 🧠 Aprender de tus rutinas de trabajo
-• ⏰ Predecir tus necesidades futuras
-
-Solo dime qué necesitas en lenguaje natural!"""
+            return Reply('help')
         
         elif intent == 'thank_you':
-            return "¡De nada! Estoy aquí para hacer tu día más productivo. ¿Hay algo más en lo que pueda ayudarte?"
+            return Reply('thank_you')
         
         else:
             # Análisis de intención no reconocida para aprendizaje futuro
             learn_from_unknown_input(user_input, user_id)
-            return "🤔 Interesante! Todavía estoy aprendiendo a entender solicitudes como esta. ¿Podrías reformularlo de otra manera? Por ejemplo: 'Programar reunión mañana a las 3 PM' o 'Recordarme llamar a Juan'."
+            return Reply('unknown')
     
     except Exception as e:
         logger.error(f"Error en generate_response_complete: {str(e)}", exc_info=True)
-        return f"❌ Lo siento, hubo un error procesando tu solicitud. Por favor intenta de nuevo. Error: {str(e)}"
+        return Reply('error_generic', error=str(e))
 
-def handle_meeting_scheduling(user_input: str, user_id: str, entities: Dict) -> str:
+def handle_meeting_scheduling(user_input: str, user_id: str, entities: Dict, parsed: Optional[Dict[str, Any]] = None) -> Reply:
     """Maneja específicamente la programación de reuniones"""
     try:
         time_info = entities.get('time', '')
@@ -380,27 +748,50 @@ def handle_meeting_scheduling(user_input: str, user_id: str, entities: Dict) ->
         if time_info and day_info:
             # Parsear el tiempo natural para obtener datetime
             time_text_for_parsing = f"{day_info} a las {time_info}"
-            meeting_time = parse_natural_time(time_text_for_parsing)
+            if parsed and "meeting_time" in parsed:
+                meeting_time = parsed["meeting_time"]
+            else:
+                meeting_time = parse_natural_time(time_text_for_parsing)
             
             if not meeting_time:
-                return f"❌ No pude entender la fecha y hora '{time_text_for_parsing}'. ¿Podrías ser más específico? Ej: 'mañana a las 10 AM'"
+                return Reply('meeting_unparsed', text=time_text_for_parsing)
             
             # Extraer título de la reunión
             meeting_title = extract_meeting_title(user_input)
-
-            # Guardar en la base de datos como reunión programada
-            save_scheduled_event(user_id, 'meeting', {
-                'scheduled_time': time_info,
-                'scheduled_day': day_info,
-                'description': user_input,
-                'scheduled_datetime': meeting_time,
-                'title': meeting_title
-            })
+            meeting_end = meeting_time + timedelta(minutes=MEETING_DURATION_MINUTES)
+
+            # 🆕 Verificar choques con la agenda y guardar con el lock del usuario tomado
+            agenda = get_agenda(user_id)
+            with agenda.lock:
+                catch_up_agenda(agenda)
+                conflicts = agenda.overlapping(meeting_time, meeting_end)
+                if conflicts:
+                    free_slots = agenda.free_slots(meeting_time, meeting_end - meeting_time, MEETING_SUGGESTIONS)
+                    logger.info(f"Choque de horario para {user_id}: {len(conflicts)} eventos, {len(free_slots)} huecos libres")
+                    remember_pending_action(user_id, 'schedule_meeting', {'day': day_info}, user_input)
+                    return Reply(
+                        'meeting_conflict',
+                        title=meeting_title,
+                        conflict=conflicts[0]['title'] or "otra reunión",
+                        conflict_at=utc_to_local(conflicts[0]['start']),
+                        suggestions=", ".join(format_date(utc_to_local(slot), "long") for slot in free_slots)
+                    )
+
+                # Guardar en la base de datos como reunión programada
+                event_id = save_scheduled_event(user_id, 'meeting', {
+                    'scheduled_time': time_info,
+                    'scheduled_day': day_info,
+                    'description': user_input,
+                    'scheduled_datetime': meeting_time,
+                    'title': meeting_title
+                })
+                agenda.add(event_id, meeting_time, meeting_end, meeting_title)
+            mark_calendar_dirty(user_id)
             
             # CREAR RECORDATORIO AUTOMÁTICO 15 MINUTOS ANTES
             reminder_time = meeting_time - timedelta(minutes=15)
             
-            reminder_data = {
+            reminder_data = encode_reminder({
                 "user_id": user_id,
                 "title": f"Reunión: {meeting_title}",
                 "description": f"Reunión programada: {user_input}",
@@ -409,55 +800,69 @@ def handle_meeting_scheduling(user_input: str, user_id: str, entities: Dict) ->
                 "tags": ["reunión", "automático"],
                 "created_at": datetime.utcnow(),
                 "status": ReminderStatus.PENDING.value
-            }
+            })
             
             result = db.reminders.insert_one(reminder_data)
             logger.info(f"Reunión y recordatorio creados. Recordatorio ID: {result.inserted_id}")
             
-            meeting_time_str = meeting_time.strftime("%A %d de %B a las %H:%M")
-            reminder_time_str = reminder_time.strftime("%H:%M")
+            # 🆕 Aprendizaje de rutinas
+            update_routine_profile(user_id, event_kind="meeting", event_time=meeting_time, title=meeting_title)
             
-            return f"✅ **¡Reunión programada!**\n\n📅 **{meeting_title}**\n🕐 **Cuándo:** {meeting_time_str}\n🔔 **Recordatorio:** {reminder_time_str} (15 minutos antes)\n\n¡El recordatorio ya está en tu lista!"
+            # Las fechas se guardan en UTC; al usuario se le muestran en su hora local
+            return Reply('meeting_scheduled', title=meeting_title,
+                         when=utc_to_local(meeting_time), reminder_at=utc_to_local(reminder_time))
         
         elif time_info:
-            return f"🕐 Entendido, programar reunión a las {time_info}. ¿Para qué día sería?"
+            remember_pending_action(user_id, 'schedule_meeting', {'time': time_info}, user_input)
+            return Reply('meeting_ask_day', time=time_info)
         
         elif day_info:
-            return f"📅 Reunión programada para el {day_info}. ¿A qué hora?"
+            remember_pending_action(user_id, 'schedule_meeting', {'day': day_info}, user_input)
+            return Reply('meeting_ask_time', day=day_info)
         
         else:
-            return "📅 Veo que quieres programar una reunión. ¿Para qué día y hora te gustaría?\n\n**Ejemplos:**\n- 'Mañana a las 10 AM'\n- 'El viernes a las 3 PM'\n- 'Hoy a las 2 de la tarde'"
+            remember_pending_action(user_id, 'schedule_meeting', {}, user_input)
+            return Reply('meeting_ask_both')
     
     except Exception as e:
         logger.error(f"Error en handle_meeting_scheduling: {str(e)}", exc_info=True)
-        return f"❌ Error programando la reunión: {str(e)}"
+        return Reply('meeting_error', error=str(e))
+
+def remember_pending_action(user_id: str, intent: str, slots: Dict[str, Any], user_input: str):
+    """Guarda en el contexto del usuario una acción a la que le faltan datos"""
+    context = conversation_contexts.get(user_id)
+    context.set_pending(intent, slots, user_input)
+    conversation_contexts.save(user_id, context)
+
+def slots_due_date(slots: Dict[str, Any], answer: str) -> Optional[datetime]:
+    """Fecha de un recordatorio que se completa en varios turnos: día y hora acumulados o la respuesta"""
+    if slots.get('day') and slots.get('time'):
+        return parse_natural_time(f"{slots['day']} a las {slots['time']}")
+    return parse_natural_time(answer)
 
 def extract_meeting_title(user_input: str) -> str:
     """Extrae el título de la reunión del texto del usuario"""
-    # Remover palabras de tiempo
-    time_keywords = ['mañana', 'hoy', 'lunes', 'martes', 'miércoles', 'jueves', 'viernes', 
-                    'sábado', 'domingo', 'a las', 'las', 'pm', 'am', 'hrs', 'horas', 'reunión', 'reunion']
-    
-    title = user_input
-    for keyword in time_keywords:
-        title = title.replace(keyword, '')
-    
-    # Limpiar espacios extras
-    title = ' '.join(title.split()).strip()
+    # Remover palabras de tiempo y limpiar espacios extras
+    title = get_nlu().strip_title('meeting', user_input)
     
     return title if title else "Reunión importante"
 
-def handle_reminder_creation(user_input: str, user_id: str, entities: Dict) -> str:
+def handle_reminder_creation(user_input: str, user_id: str, entities: Dict, parsed: Optional[Dict[str, Any]] = None) -> Reply:
     """Maneja la creación de recordatorios"""
     try:
         # Extraer título del recordatorio
         title = extract_reminder_title(user_input)
         
         # Parsear tiempo natural
-        due_date_naive = parse_natural_time(user_input)
+        if parsed and "due_date" in parsed:
+            due_date_naive = parsed["due_date"]
+        else:
+            due_date_naive = parse_natural_time(user_input)
         
         if not due_date_naive:
-            return "❌ No pude entender la fecha y hora. ¿Podrías ser más específico? Ej: 'mañana a las 10 AM' o 'en 2 horas'"
+            slots = {key: entities[key] for key in ('day', 'time') if key in entities}
+            remember_pending_action(user_id, 'create_reminder', slots, user_input)
+            return Reply('reminder_unparsed')
         
         # 🆕 Convertir a UTC aware para cálculos
         due_date_utc = due_date_naive.replace(tzinfo=timezone.utc)
@@ -470,27 +875,29 @@ def handle_reminder_creation(user_input: str, user_id: str, entities: Dict) -> s
         tags = extract_tags(user_input)
         
         # 🆕 Si es un recordatorio de reunión, agregar tag específico
-        if any(word in user_input.lower() for word in ['reunión', 'reunion', 'meeting']):
+        if get_nlu().mentions_meeting(user_input.lower()):
             tags.append('reunión')
         
-        # Crear recordatorio
-        reminder_data = {
+        # Crear recordatorio (🆕 esquema compacto: sin nulos)
+        now = datetime.utcnow()
+        reminder_data = encode_reminder({
             "user_id": user_id,
             "title": title,
             "description": user_input,
             "due_date": due_date_naive,
             "priority": priority.value,
             "tags": tags,
-            "created_at": datetime.utcnow(),
+            "created_at": now,
             "status": ReminderStatus.PENDING.value,
-            "last_reminded": None,
-            "immediate_notified": False,      # 🆕 Control de notificación inmediata
-            "completed_at": None,             # 🆕 Se llenará cuando se complete
-            "updated_at": datetime.utcnow()   # 🆕 Última actualización
-        }
+            "updated_at": now
+        })
         
         # Guardar en base de datos
         result = db.reminders.insert_one(reminder_data)
+        mark_calendar_dirty(user_id)
+        
+        # 🆕 Aprendizaje de rutinas
+        update_routine_profile(user_id, event_kind="reminder", event_time=due_date_naive, title=title)
         
         # 🆕 Calcular tiempo hasta el recordatorio (usando UTC aware)
         time_until = due_date_utc - now_utc
@@ -498,80 +905,147 @@ def handle_reminder_creation(user_input: str, user_id: str, entities: Dict) -> s
         
         # Convertir a texto legible
         if total_seconds < 60:
-            time_info = "en menos de 1 minuto"
+            time_info = render('until_now')
         elif total_seconds < 3600:
-            minutes = int(total_seconds / 60)
-            time_info = f"en {minutes} minutos"
+            time_info = render('until_minutes', count=int(total_seconds / 60))
         elif total_seconds < 86400:
-            hours = int(total_seconds / 3600)
-            time_info = f"en {hours} horas"
+            time_info = render('until_hours', count=int(total_seconds / 3600))
         else:
-            days = int(total_seconds / 86400)
-            time_info = f"en {days} días"
+            time_info = render('until_days', count=int(total_seconds / 86400))
         
         # 🆕 Mostrar hora local en la respuesta
         due_date_local = utc_to_local(due_date_utc)
-        due_date_str = due_date_local.strftime("%d/%m/%Y a las %H:%M")
-                
-        return f"🔔 **Recordatorio creado:** '{title}' para el {due_date_str} ({time_info}). ¡Te avisaré y se completará automáticamente!"
+        
+        return Reply('reminder_created', title=title, due=due_date_local, time_until=time_info)
     
     except Exception as e:
         logger.error(f"Error en handle_reminder_creation: {str(e)}", exc_info=True)
-        return f"❌ No pude crear el recordatorio. Error: {str(e)}"
+        return Reply('reminder_error', error=str(e))
 
 def extract_reminder_title(user_input: str) -> str:
     """Extrae el título del recordatorio del texto del usuario"""
     # Remover palabras de tiempo para obtener el título
-    time_keywords = ['mañana', 'hoy', 'lunes', 'martes', 'miércoles', 'jueves', 'viernes', 
-                    'sábado', 'domingo', 'a las', 'las', 'pm', 'am', 'hrs', 'horas']
-    
-    title = user_input
-    for keyword in time_keywords:
-        title = title.replace(keyword, '')
-    
-    # Limpiar espacios extras
-    title = ' '.join(title.split())
+    title = get_nlu().strip_title('reminder', user_input)
     
     return title if title else "Recordatorio importante"
 
 def detect_priority(user_input: str) -> ReminderPriority:
     """Detecta la prioridad basada en palabras clave"""
-    input_lower = user_input.lower()
-    
-    if any(word in input_lower for word in ['urgente', 'importante', 'crítico', 'inmediato']):
-        return ReminderPriority.URGENT
-    elif any(word in input_lower for word in ['alto', 'prioridad', 'esencial']):
-        return ReminderPriority.HIGH
-    elif any(word in input_lower for word in ['bajo', 'cuando puedas', 'sin prisa']):
-        return ReminderPriority.LOW
-    else:
-        return ReminderPriority.MEDIUM
+    level = get_nlu().detect_priority(user_input.lower())
+    return ReminderPriority(level) if level else ReminderPriority.MEDIUM
 
 def extract_tags(user_input: str) -> List[str]:
     """Extrae tags relevantes del texto"""
-    tags = []
-    input_lower = user_input.lower()
-    
-    category_keywords = {
-        'trabajo': ['reunión', 'oficina', 'proyecto', 'cliente', 'jefe'],
-        'personal': ['casa', 'familia', 'amigos', 'personal', 'cita'],
-        'salud': ['doctor', 'médico', 'ejercicio', 'gimnasio', 'salud'],
-        'compras': ['comprar', 'supermercado', 'tienda', 'mercado']
+    return get_nlu().extract_tags(user_input.lower())
+
+# =============================================
+# 🆕 CONFIGURACIÓN DEL NLU (recarga en caliente)
+# =============================================
+NLU_CONFIG_SOURCE = os.getenv("NLU_CONFIG_SOURCE", "file")  # "file" o "mongo"
+NLU_RELOAD_SECONDS = int(os.getenv("NLU_RELOAD_SECONDS", "30"))
+
+def reload_nlu_config(force: bool = False) -> bool:
+    """Recarga la configuración del NLU desde su origen; devuelve True si cambió"""
+    if NLU_CONFIG_SOURCE == "mongo":
+        return reload_nlu_from_collection(db.nlu_config, force=force)
+    return reload_nlu_from_file(force=force)
+
+def seed_nlu_collection():
+    """Si el origen es MongoDB y la colección está vacía, la inicializa con el archivo"""
+    if NLU_CONFIG_SOURCE == "mongo" and db.nlu_config.count_documents({}) == 0:
+        config = dict(get_nlu().config)
+        config["created_at"] = datetime.utcnow()
+        db.nlu_config.insert_one(config)
+        logger.info(f"🧩 Colección nlu_config inicializada con la versión {config.get('version')}")
+
+async def nlu_config_watcher():
+    """Revisa periódicamente si cambió la configuración del NLU y la activa sin reiniciar"""
+    while True:
+        await asyncio.sleep(NLU_RELOAD_SECONDS)
+        try:
+            if await asyncio.to_thread(reload_nlu_config):
+                await nlu_executor.refresh(get_nlu().config)
+        except Exception as e:
+            # Una configuración inválida no reemplaza a la activa
+            logger.error(f"❌ Configuración del NLU inválida, se mantiene la versión {get_nlu().version}: {e}")
+
+@app.get("/admin/nlu")
+async def get_nlu_status(x_admin_token: Optional[str] = Header(None)):
+    """Versión y origen de la configuración del NLU activa"""
+    require_admin(x_admin_token)
+    nlu = get_nlu()
+    return {
+        "version": nlu.version,
+        "source": nlu.source,
+        "loaded_at": nlu.loaded_at.isoformat(),
+        "intents": {intent: len(patterns) for intent, patterns in nlu.intent_patterns.items()},
+        "intent_backend": "model" if intent_model is not None else "keyword",
+        "executor": nlu_executor.stats(),
+        "speech": speech_pipeline.stats()
     }
-    
-    for category, keywords in category_keywords.items():
-        if any(keyword in input_lower for keyword in keywords):
-            tags.append(category)
-    
-    return tags
+
+@app.post("/admin/nlu/reload")
+async def force_nlu_reload(x_admin_token: Optional[str] = Header(None)):
+    """Fuerza la recarga de la configuración del NLU"""
+    require_admin(x_admin_token)
+    try:
+        await asyncio.to_thread(reload_nlu_config, True)
+        await nlu_executor.refresh(get_nlu().config)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Configuración del NLU inválida: {str(e)}")
+    return {"status": "success", "version": get_nlu().version, "source": get_nlu().source}
+
+# =============================================
+# 🆕 RESPUESTAS CONDICIONALES (ETag / If-None-Match)
+# =============================================
+RESPONSE_ETAG_VERSION = "1"   # subirlo si cambia la forma de las respuestas con ETag
+CONDITIONAL_CACHE_CONTROL = "private, no-cache"
+
+def make_etag(*parts: Any) -> str:
+    """ETag fuerte a partir de un validador barato (conteo, última modificación...)"""
+    digest = hashlib.sha1(repr((RESPONSE_ETAG_VERSION,) + parts).encode()).hexdigest()[:24]
+    return f'"{digest}"'
+
+def etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": CONDITIONAL_CACHE_CONTROL})
+
+def reminders_validator(query: Dict[str, Any]) -> Tuple[Any, ...]:
+    """
+    Conteo y último updated_at ("ua") de los recordatorios de la consulta: toda escritura
+    fija ua a la hora actual, así que cualquier alta, cambio o baja cambia el validador.
+    """
+    latest = db.reminders.find_one(query, {"ua": 1, "updated_at": 1}, sort=[("ua", -1)])
+    if latest is None:
+        return (0,)
+    return db.reminders.count_documents(query), latest.get("ua") or latest.get("updated_at"), latest["_id"]
+
+def history_validator(user_id: str) -> Tuple[Any, ...]:
+    """Conteo y la última interacción (con su marca processed: la respuesta se guarda después)"""
+    latest = db.interactions.find_one({"user_id": user_id}, {"processed": 1}, sort=[("timestamp", -1)])
+    if latest is None:
+        return (0,)
+    return db.interactions.count_documents({"user_id": user_id}), latest["_id"], latest.get("processed")
 
 @app.get("/user/{user_id}/history")
-async def get_history(user_id: str, limit: int = 10):
-    """Obtiene historial de interacciones"""
+async def get_history(user_id: str, request: Request, response: Response, limit: int = 10):
+    """Obtiene historial de interacciones (🆕 con ETag: si no cambió responde 304 sin consultarlo)"""
     try:
-        interactions = list(db.interactions.find(
-            {"user_id": user_id}
-        ).sort("timestamp", -1).limit(limit))
+        async with admission.slot(user_id, "read"):
+            etag = make_etag("history", user_id, limit, *await asyncio.to_thread(history_validator, user_id))
+            if etag_matches(request, etag):
+                return not_modified(etag)
+            interactions = await asyncio.to_thread(lambda: list(db.interactions.find(
+                {"user_id": user_id}
+            ).sort("timestamp", -1).limit(limit)))
+        response.headers["ETag"] = etag
+        response.headers["Cache-Control"] = CONDITIONAL_CACHE_CONTROL
         
         for interaction in interactions:
             interaction["_id"] = str(interaction["_id"])
@@ -581,17 +1055,521 @@ async def get_history(user_id: str, limit: int = 10):
         
         return {"interactions": interactions, "count": len(interactions)}
     
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error obteniendo historial: {str(e)}")
 
+# =============================================
+# 🆕 EXPORTACIÓN DEL HISTORIAL (NDJSON + GZIP EN STREAMING)
+# =============================================
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "500"))
+EXPORT_MAX_CONCURRENT = int(os.getenv("EXPORT_MAX_CONCURRENT", "2"))
+EXPORT_GZIP_LEVEL = int(os.getenv("EXPORT_GZIP_LEVEL", "6"))
+EXPORT_QUEUE_CHUNKS = int(os.getenv("EXPORT_QUEUE_CHUNKS", "4"))  # bloques listos a la espera del cliente
+
+# Orden de la exportación: (nombre en el archivo, colección). Dentro de cada colección se
+# recorre por _id (orden de creación), así que el último _id recibido sirve para reanudar.
+EXPORT_COLLECTIONS = [("interactions", "interactions"), ("reminders", "reminders"), ("events", "scheduled_events")]
+# Campo de fecha de cada colección sobre el que se aplican since/until: el momento de la
+# interacción, la última modificación del recordatorio (ua) y cuándo se agendó el evento
+EXPORT_TIME_FIELDS = {"interactions": "timestamp", "reminders": "ua", "scheduled_events": "scheduled_at"}
+
+_export_slots = threading.BoundedSemaphore(EXPORT_MAX_CONCURRENT)
+
+def export_default(value: Any) -> Any:
+    if isinstance(value, ObjectId):
+        return str(value)
+    raise TypeError(f"Tipo no serializable: {type(value).__name__}")
+
+def export_record(name: str, doc: Dict[str, Any]) -> bytes:
+    """Una línea NDJSON: {"collection": ..., "_id": ..., campos del documento}"""
+    if name == "reminders":
+        doc = serialize_reminder(doc)
+    return orjson.dumps({"collection": name, **doc}, default=export_default, option=orjson.OPT_APPEND_NEWLINE)
+
+def parse_export_resume(resume: Optional[str]) -> Tuple[int, Optional[ObjectId]]:
+    """'coleccion:ultimo_id' -> (posición de la colección, _id desde el que continuar)"""
+    if not resume:
+        return 0, None
+    name, _, last_id = resume.partition(":")
+    names = [export_name for export_name, _ in EXPORT_COLLECTIONS]
+    if name not in names or not ObjectId.is_valid(last_id):
+        raise HTTPException(status_code=400, detail="resume debe tener la forma coleccion:ultimo_id")
+    return names.index(name), ObjectId(last_id)
+
+def export_cursors(user_id: str, since: Optional[datetime], until: Optional[datetime],
+                   start: int, resume_after: Optional[ObjectId]):
+    """
+    Genera (nombre, cursor) en orden, con lotes acotados. since/until filtran por la fecha
+    propia de cada documento (EXPORT_TIME_FIELDS); el orden sigue siendo por _id.
+    """
+    time_range: Dict[str, Any] = {}
+    if since:
+        time_range["$gte"] = make_naive(since.astimezone(timezone.utc)) if since.tzinfo else since
+    if until:
+        time_range["$lt"] = make_naive(until.astimezone(timezone.utc)) if until.tzinfo else until
+    for position, (name, collection) in enumerate(EXPORT_COLLECTIONS):
+        if position < start:
+            continue
+        query: Dict[str, Any] = {"user_id": user_id}
+        if time_range:
+            query[EXPORT_TIME_FIELDS[collection]] = time_range
+        if position == start and resume_after is not None:
+            # Se reanuda justo después del último documento recibido
+            query["_id"] = {"$gt": resume_after}
+        yield name, db[collection].find(query).sort("_id", 1).batch_size(EXPORT_BATCH_SIZE)
+
+def export_user_data(user_id: str, since: Optional[datetime], until: Optional[datetime],
+                     start: int, resume_after: Optional[ObjectId]):
+    """
+    Generador síncrono de bloques gzip: lee de a un lote del cursor, lo comprime y lo entrega.
+    La memoria usada no depende del tamaño del historial.
+    """
+    compressor = zlib.compressobj(EXPORT_GZIP_LEVEL, zlib.DEFLATED, 31)  # 31 = formato gzip
+    counts = {name: 0 for name, _ in EXPORT_COLLECTIONS}
+    for name, cursor in export_cursors(user_id, since, until, start, resume_after):
+        batch = []
+        for doc in cursor:
+            batch.append(export_record(name, doc))
+            counts[name] += 1
+            if len(batch) >= EXPORT_BATCH_SIZE:
+                chunk = compressor.compress(b"".join(batch))
+                batch = []
+                if chunk:
+                    yield chunk
+        if batch:
+            chunk = compressor.compress(b"".join(batch))
+            if chunk:
+                yield chunk
+    # Última línea: si no llega, la exportación se cortó y se puede reanudar
+    trailer = orjson.dumps({"collection": "_export", "complete": True, "counts": counts}, option=orjson.OPT_APPEND_NEWLINE)
+    yield compressor.compress(trailer) + compressor.flush()
+
+class ExportJob:
+    """
+    Exportación en curso. Un hilo productor recorre el generador síncrono y deja los bloques
+    en una cola acotada; el event loop solo espera en la cola. Para detenerla se usa una
+    bandera: el generador se cierra en su propio hilo (cerrarlo desde otro mientras se
+    ejecuta falla). El permiso de exportación se libera siempre, una sola vez.
+    """
+    _DONE = object()
+    
+    def __init__(self, chunks, release):
+        self._chunks = chunks
+        self._release = release
+        self._released = False
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._queue: "queue.Queue[Any]" = queue.Queue(maxsize=EXPORT_QUEUE_CHUNKS)
+        self._thread: Optional[threading.Thread] = None
+    
+    def release(self):
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        self._release()
+    
+    def start(self):
+        with self._lock:
+            if self._thread is None and not self._stop.is_set():
+                self._thread = threading.Thread(target=self._produce, name="export", daemon=True)
+                self._thread.start()
+    
+    def stop(self):
+        """Pide al productor que pare; si nunca arrancó, libera el permiso aquí mismo"""
+        with self._lock:
+            self._stop.set()
+            started = self._thread is not None
+        if not started:
+            self.release()
+    
+    def _put(self, item) -> bool:
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+    
+    def _produce(self):
+        last: Any = self._DONE
+        try:
+            for chunk in self._chunks:
+                if not self._put(chunk):
+                    break
+        except Exception as e:
+            logger.error(f"❌ Error exportando historial: {e}")
+            last = e
+        finally:
+            try:
+                self.release()
+            finally:
+                self._chunks.close()
+                # Si ya se pidió parar, igual se despierta a una lectura que siga esperando
+                if not self._put(last):
+                    try:
+                        self._queue.put_nowait(self._DONE)
+                    except queue.Full:
+                        pass
+    
+    async def stream(self):
+        self.start()
+        try:
+            while True:
+                item = await asyncio.to_thread(self._queue.get)
+                if item is self._DONE:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            self.stop()
+
+class ExportResponse(StreamingResponse):
+    """Detiene la exportación aunque el cliente se desconecte antes de empezar a leer"""
+    
+    def __init__(self, job: ExportJob, **kwargs):
+        super().__init__(job.stream(), **kwargs)
+        self.job = job
+    
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.job.stop()
+
+@app.get("/user/{user_id}/export")
+async def export_history(user_id: str, since: Optional[datetime] = None, until: Optional[datetime] = None,
+                         resume: Optional[str] = None):
+    """
+    Exporta interacciones, recordatorios y eventos del usuario como NDJSON comprimido (gzip).
+    since/until se aplican a la fecha de la interacción, a la última modificación del
+    recordatorio y a la fecha en que se agendó el evento.
+    Cada línea trae "collection" y "_id"; para reanudar una descarga cortada se pasa
+    resume=<collection>:<_id> de la última línea recibida (con el mismo since/until).
+    """
+    start, resume_after = parse_export_resume(resume)
+    if not _export_slots.acquire(blocking=False):
+        raise HTTPException(
+            status_code=429,
+            detail="Hay demasiadas exportaciones en curso, intenta de nuevo en unos segundos",
+            headers={"Retry-After": str(ADMISSION_RETRY_AFTER)}
+        )
+    try:
+        chunks = export_user_data(user_id, since, until, start, resume_after)
+    except Exception as e:
+        _export_slots.release()
+        raise HTTPException(status_code=500, detail=f"Error exportando historial: {str(e)}")
+    
+    filename = f"{user_id}-export-{datetime.utcnow():%Y%m%d%H%M%S}.ndjson.gz"
+    return ExportResponse(
+        ExportJob(chunks, _export_slots.release),
+        media_type="application/gzip",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"', "Cache-Control": "no-store"}
+    )
+
+# =============================================
+# 🆕 BÚSQUEDA EN RECORDATORIOS E HISTORIAL
+# =============================================
+SEARCH_MAX_USERS = int(os.getenv("SEARCH_MAX_USERS", "200"))       # Índices de usuario en memoria (LRU)
+SEARCH_TTL_SECONDS = int(os.getenv("SEARCH_TTL_SECONDS", "3600"))
+SEARCH_MAX_LIMIT = 50
+
+class SearchScope(str, Enum):
+    ALL = "all"
+    REMINDERS = "reminders"
+    INTERACTIONS = "interactions"
+
+SEARCH_KINDS = {
+    SearchScope.ALL: {"reminder", "interaction"},
+    SearchScope.REMINDERS: {"reminder"},
+    SearchScope.INTERACTIONS: {"interaction"},
+}
+SEARCH_REMINDER_FIELDS = ["title", "description", "tags", "due_date", "created_at", "updated_at"]
+
+search_indexes = LRUTTLCache(SEARCH_MAX_USERS, SEARCH_TTL_SECONDS)
+_search_build_lock = threading.Lock()
+
+def load_search_index(user_id: str) -> UserSearchIndex:
+    """Construye el índice del usuario leyendo solo los campos que se indexan"""
+    interactions = db.interactions.find({"user_id": user_id}, {"user_input": 1, "timestamp": 1}).batch_size(5000)
+    reminders = (
+        decode_reminder(doc)
+        for doc in db.reminders.find({"user_id": user_id}, compact_projection(SEARCH_REMINDER_FIELDS))
+    )
+    index = build_index(user_id, interactions, reminders)
+    logger.info(f"🔎 Índice de búsqueda de {user_id}: {len(index)} documentos")
+    return index
+
+def get_search_index(user_id: str) -> UserSearchIndex:
+    """Índice del usuario (se construye una vez; el TTL cuenta desde la última búsqueda)"""
+    index = search_indexes.get(user_id)
+    if index is None:
+        with _search_build_lock:
+            index = search_indexes.get(user_id)
+            if index is None:
+                index = load_search_index(user_id)
+    search_indexes.set(user_id, index)
+    return index
+
+def prune_search_index(index: UserSearchIndex, kind: str, collection):
+    """Quita del índice los documentos borrados; solo lee los ids si el conteo no coincide"""
+    if collection.count_documents({"user_id": index.user_id}) >= index.count(kind):
+        return
+    alive = {doc["_id"] for doc in collection.find({"user_id": index.user_id}, {"_id": 1})}
+    for doc_id in index.ids(kind):
+        if doc_id not in alive:
+            index.remove(doc_id)
+
+def catch_up_search_index(index: UserSearchIndex):
+    """
+    Pone el índice al día desde la última búsqueda (consultas por índice que casi siempre
+    vuelven vacías): interacciones nuevas (su texto no cambia), recordatorios nuevos o
+    editados (toda escritura actualiza ua) y documentos borrados de ambos tipos. Con change
+    streams activos no hace falta: los eventos mantienen el índice.
+    """
+    user_id = index.user_id
+    if not change_feed_active("interactions"):
+        query: Dict[str, Any] = {"user_id": user_id}
+        if index.last_interaction_at:
+            query["timestamp"] = {"$gte": index.last_interaction_at}
+        for interaction in db.interactions.find(query, {"user_input": 1, "timestamp": 1}):
+            if interaction["_id"] not in index.docs:
+                index_interaction(index, interaction)
+        prune_search_index(index, "interaction", db.interactions)
+    if not change_feed_active("reminders"):
+        query = {"user_id": user_id}
+        if index.last_reminder_update:
+            # $gte: otra escritura en el mismo milisegundo también se relee; lo ya indexado se salta
+            query["ua"] = {"$gte": index.last_reminder_update}
+        for doc in db.reminders.find(query, compact_projection(SEARCH_REMINDER_FIELDS)):
+            reminder = decode_reminder(doc)
+            if index.versions.get(reminder["_id"]) != (reminder.get("updated_at") or reminder.get("created_at")):
+                index_reminder(index, reminder)
+        prune_search_index(index, "reminder", db.reminders)
+
+def on_search_change(event: Dict[str, Any]):
+    """Mantiene los índices cargados con los eventos de los change streams"""
+    doc = event.get("document")
+    if event["operation"] == "resync":
+        search_indexes.clear()
+        return
+    if doc is None or not doc.get("user_id"):
+        return
+    index = search_indexes.get(doc["user_id"])
+    if index is None:
+        return
+    with index.lock:
+        if event["collection"] == "interactions":
+            index_interaction(index, doc)
+        else:
+            index_reminder(index, decode_reminder(doc))
+
+def hydrate_search_hits(user_id: str, index: UserSearchIndex, hits: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Lee solo los campos que se devuelven de los documentos encontrados (una consulta por tipo)"""
+    reminder_ids = [hit["id"] for hit in hits if hit["kind"] == "reminder"]
+    interaction_ids = [hit["id"] for hit in hits if hit["kind"] == "interaction"]
+    docs: Dict[Any, Dict[str, Any]] = {}
+    if reminder_ids:
+        for doc in db.reminders.find(
+            {"_id": {"$in": reminder_ids}, "user_id": user_id},
+            compact_projection(["title", "description", "tags", "due_date", "status", "priority"])
+        ):
+            fields = decode_reminder(doc)
+            docs[doc["_id"]] = {
+                "type": "reminder",
+                "_id": str(doc["_id"]),
+                **{field: fields[field] for field in ("title", "description", "tags", "due_date", "status", "priority")}
+            }
+    if interaction_ids:
+        for doc in db.interactions.find(
+            {"_id": {"$in": interaction_ids}, "user_id": user_id},
+            {"user_input": 1, "assistant_response": 1, "timestamp": 1}
+        ):
+            docs[doc["_id"]] = {
+                "type": "interaction",
+                "_id": str(doc["_id"]),
+                "user_input": doc.get("user_input"),
+                "assistant_response": doc.get("assistant_response"),
+                "timestamp": doc.get("timestamp")
+            }
+    
+    results = []
+    for hit in hits:
+        doc = docs.get(hit["id"])
+        if doc is None:
+            # Se borró: se quita del índice
+            with index.lock:
+                index.remove(hit["id"])
+            continue
+        results.append({**doc, "score": hit["score"], "matched": hit["matched"]})
+    return results
+
+def search_user_documents(user_id: str, q: str, scope: SearchScope, limit: int) -> Dict[str, Any]:
+    started = time.perf_counter()
+    index = get_search_index(user_id)
+    with index.lock:
+        catch_up_search_index(index)
+        hits = index.search(q, SEARCH_KINDS[scope], limit)
+    results = hydrate_search_hits(user_id, index, hits)
+    return {
+        "user_id": user_id,
+        "query": q,
+        "results": results,
+        "count": len(results),
+        "took_ms": round((time.perf_counter() - started) * 1000, 2)
+    }
+
+@app.get("/search/{user_id}", response_class=ORJSONResponse)
+async def search_user(user_id: str, q: str, scope: SearchScope = SearchScope.ALL, limit: int = 20):
+    """Búsqueda por texto (sin acentos, con prefijos y ranking) en recordatorios e historial"""
+    try:
+        if not q.strip():
+            raise HTTPException(status_code=400, detail="La búsqueda está vacía")
+        limit = max(1, min(limit, SEARCH_MAX_LIMIT))
+        async with admission.slot(user_id, "read"):
+            return await asyncio.to_thread(search_user_documents, user_id, q, scope, limit)
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error buscando: {str(e)}")
+
+# =============================================
+# 🆕 SONDAS DE SALUD (VIVACIDAD Y DISPONIBILIDAD)
+# =============================================
+HEALTH_PROBE_SECONDS = int(os.getenv("HEALTH_PROBE_SECONDS", "15"))
+HEALTH_PROBE_TIMEOUT = float(os.getenv("HEALTH_PROBE_TIMEOUT", "5"))
+TELEGRAM_PROBE_SECONDS = int(os.getenv("TELEGRAM_PROBE_SECONDS", "300"))
+OUTBOX_READY_MAX_PENDING = int(os.getenv("OUTBOX_READY_MAX_PENDING", "10000"))
+
+process_started_at = time.monotonic()
+scheduler_last_tick: Optional[datetime] = None   # lo actualiza background_reminder_checker
+health_snapshot: Optional[Dict[str, Any]] = None
+_telegram_probe: Dict[str, Any] = {"status": "disabled"}
+_telegram_probed_at = 0.0
+
+async def probe_mongo() -> Dict[str, Any]:
+    started = time.monotonic()
+    try:
+        await asyncio.wait_for(asyncio.to_thread(client.admin.command, 'ping'), HEALTH_PROBE_TIMEOUT)
+        return {"status": "ok", "latency_ms": round((time.monotonic() - started) * 1000, 1)}
+    except asyncio.TimeoutError:
+        return {"status": "failed", "error": f"sin respuesta en {HEALTH_PROBE_TIMEOUT:g}s"}
+    except Exception as e:
+        return {"status": "failed", "error": str(e)}
+
+async def probe_telegram() -> Dict[str, Any]:
+    """getMe con menos frecuencia que el resto (es una llamada externa); entre medias se reutiliza"""
+    global _telegram_probe, _telegram_probed_at
+    if not TELEGRAM_BOT_TOKEN:
+        return {"status": "disabled"}
+    if time.monotonic() - _telegram_probed_at >= TELEGRAM_PROBE_SECONDS:
+        try:
+            ok = await asyncio.wait_for(call_telegram_api("getMe", {}), HEALTH_PROBE_TIMEOUT)
+        except asyncio.TimeoutError:
+            ok = False
+        _telegram_probe = {"status": "ok" if ok else "failed", "checked_at": datetime.utcnow().isoformat()}
+        _telegram_probed_at = time.monotonic()
+    return _telegram_probe
+
+def probe_scheduler() -> Dict[str, Any]:
+    """El verificador duerme como mucho un intervalo de reescaneo; más del doble es que se colgó"""
+    interval = REMINDER_RESCAN_SECONDS if change_feed_active("reminders") else REMINDER_POLL_SECONDS
+    limit = interval * 2 + HEALTH_PROBE_SECONDS
+    if scheduler_last_tick is None:
+        grace = time.monotonic() - process_started_at < limit
+        return {"status": "starting" if grace else "stale", "last_tick": None}
+    age = (datetime.utcnow() - scheduler_last_tick).total_seconds()
+    return {
+        "status": "ok" if age <= limit else "stale",
+        "last_tick": scheduler_last_tick.isoformat(),
+        "age_seconds": round(age, 1)
+    }
+
+async def probe_queues(mongo_ok: bool) -> Dict[str, Any]:
+    queues: Dict[str, Any] = {
+        "admission": admission.stats()["queue_depth"],
+        "telegram_updates": telegram_update_queue.qsize() if telegram_update_queue else 0,
+        "telegram_updates_max": TELEGRAM_QUEUE_SIZE
+    }
+    if mongo_ok:
+        try:
+            queues["outbox_pending"] = await asyncio.to_thread(
+                db.notification_outbox.count_documents, {"status": OutboxStatus.PENDING.value}
+            )
+        except Exception as e:
+            queues["outbox_pending"] = None
+            logger.warning(f"⚠️ No se pudo contar el outbox: {e}")
+    saturated = (
+        queues["telegram_updates"] >= TELEGRAM_QUEUE_SIZE
+        or (queues.get("outbox_pending") or 0) > OUTBOX_READY_MAX_PENDING
+    )
+    queues["status"] = "saturated" if saturated else "ok"
+    return queues
+
+async def run_health_probes() -> Dict[str, Any]:
+    mongo = await probe_mongo()
+    checks = {
+        "mongo": mongo,
+        "telegram": await probe_telegram(),
+        "scheduler": probe_scheduler(),
+        "queues": await probe_queues(mongo["status"] == "ok")
+    }
+    # Telegram caído no impide atender: el outbox reintenta los envíos
+    ready = (
+        mongo["status"] == "ok"
+        and checks["scheduler"]["status"] in ("ok", "starting")
+        and checks["queues"]["status"] == "ok"
+    )
+    return {"ready": ready, "checked_at": datetime.utcnow(), "checks": checks}
+
+async def health_prober():
+    """Tarea en segundo plano: las sondas HTTP solo leen la última foto"""
+    global health_snapshot
+    while True:
+        try:
+            health_snapshot = await run_health_probes()
+        except Exception as e:
+            logger.error(f"Error en health_prober: {e}")
+        await asyncio.sleep(HEALTH_PROBE_SECONDS)
+
+def current_health() -> Optional[Dict[str, Any]]:
+    """La última foto, o None si todavía no hay o el prober dejó de actualizarla"""
+    snapshot = health_snapshot
+    if snapshot is None:
+        return None
+    if (datetime.utcnow() - snapshot["checked_at"]).total_seconds() > HEALTH_PROBE_SECONDS * 3 + HEALTH_PROBE_TIMEOUT:
+        return None
+    return snapshot
+
+@app.get("/livez")
+async def liveness():
+    """Vivacidad: el proceso y el event loop responden (sin E/S)"""
+    return {"status": "alive", "uptime_seconds": round(time.monotonic() - process_started_at, 1)}
+
+@app.get("/readyz", response_class=ORJSONResponse)
+async def readiness():
+    """Disponibilidad según la última foto del prober (503 si no está listo)"""
+    snapshot = current_health()
+    if snapshot is None:
+        return ORJSONResponse({"status": "not_ready", "reason": "sin sondeo reciente"}, status_code=503)
+    return ORJSONResponse(
+        {"status": "ready" if snapshot["ready"] else "not_ready", **snapshot},
+        status_code=200 if snapshot["ready"] else 503
+    )
+
 @app.get("/health")
 async def health_check():
-    try:
-        # Verificar conexión a la base de datos
-        client.admin.command('ping')
-        db_status = "connected"
-    except:
-        db_status = "disconnected"
+    # 🆕 Estado de la base de datos desde la foto del prober (sin ping por petición)
+    snapshot = current_health()
+    if snapshot is None:
+        db_status = "unknown"
+    else:
+        db_status = "connected" if snapshot["checks"]["mongo"]["status"] == "ok" else "disconnected"
     
     return {
         "status": "healthy", 
@@ -600,22 +1578,43 @@ async def health_check():
         "environment": "production"
     }
 
+class StatsCache:
+    """
+    Conteos de /stats. Con los change streams de interactions y reminders activos se
+    recalculan solo después de un cambio; sin ellos se consultan en cada petición.
+    """
+    
+    def __init__(self, compute):
+        self._compute = compute
+        self._value: Optional[Dict[str, Any]] = None
+        self._dirty = True
+    
+    def invalidate(self):
+        self._dirty = True
+    
+    def get(self, cacheable: bool) -> Dict[str, Any]:
+        if not cacheable or self._dirty or self._value is None:
+            # Se limpia antes de consultar: un cambio que llegue mientras tanto vuelve a marcarla
+            self._dirty = False
+            self._value = self._compute()
+        return self._value
+
+def compute_stats() -> Dict[str, Any]:
+    return {
+        "total_interactions": db.interactions.count_documents({}),
+        "user_interactions": db.interactions.count_documents({"user_id": "default_user"}),
+        "total_reminders": db.reminders.count_documents({}),
+        "pending_reminders": db.reminders.count_documents({"status": "pending"}),
+        "database": DATABASE_NAME
+    }
+
+stats_cache = StatsCache(compute_stats)
+
 @app.get("/stats")
 async def get_stats():
     """Estadísticas básicas de la base de datos"""
     try:
-        total_interactions = db.interactions.count_documents({})
-        user_interactions = db.interactions.count_documents({"user_id": "default_user"})
-        total_reminders = db.reminders.count_documents({})
-        pending_reminders = db.reminders.count_documents({"status": "pending"})
-        
-        return {
-            "total_interactions": total_interactions,
-            "user_interactions": user_interactions,
-            "total_reminders": total_reminders,
-            "pending_reminders": pending_reminders,
-            "database": DATABASE_NAME
-        }
+        return stats_cache.get(cacheable=change_feed_active("interactions", "reminders"))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error obteniendo estadísticas: {str(e)}")
 
@@ -630,244 +1629,930 @@ def save_interaction_analysis(user_id: str, user_input: str, intent: str, entiti
         "used_for_training": False
     }
     db.interaction_analysis.insert_one(analysis_data)
+    
+    # 🆕 Mantener el perfil de rutinas al día (en vez de reprocesar el historial)
+    update_routine_profile(user_id, intent=intent)
 
-def save_scheduled_event(user_id: str, event_type: str, event_data: Dict):
-    """Guarda eventos programados"""
-    event = {
-        "user_id": user_id,
-        "event_type": event_type,
-        "event_data": event_data,
-        "scheduled_at": datetime.utcnow(),
-        "status": "scheduled"
-    }
-    db.scheduled_events.insert_one(event)
-
-def learn_from_unknown_input(user_input: str, user_id: str):
-    """Aprende de inputs no reconocidos"""
-    # Por ahora solo guardamos para análisis futuro
-    db.unknown_inputs.insert_one({
-        "user_id": user_id,
-        "user_input": user_input,
-        "timestamp": datetime.utcnow()
-    })
+# =============================================
+# 🆕 PERFIL DE RUTINAS (agregados incrementales por usuario)
+# =============================================
+ROUTINE_MAX_TITLES = int(os.getenv("ROUTINE_MAX_TITLES", "50"))    # Títulos frecuentes que se conservan
+ROUTINE_TRIM_EVERY = int(os.getenv("ROUTINE_TRIM_EVERY", "100"))   # Cada cuántos títulos se recorta
+ROUTINE_FLUSH_SECONDS = float(os.getenv("ROUTINE_FLUSH_SECONDS", "5"))  # Cada cuánto se escriben los incrementos
 
-def parse_natural_time(time_text: str) -> Optional[datetime]:
+class RoutineProfileBuffer:
     """
-    Convierte texto natural en datetime (en timezone local)
+    Incrementos pendientes del perfil de rutinas por usuario. Las peticiones solo suman en
+    memoria; routine_profile_flusher los escribe cada ROUTINE_FLUSH_SECONDS con un solo
+    bulk_write, así que varias interacciones seguidas de un usuario cuestan una escritura.
+    Si el proceso muere se pierden como mucho los incrementos de una ventana (el perfil es
+    auxiliar) y /user/{user_id}/routine los ve con ese retraso.
     """
-    now_local = get_local_now()
-    time_text = time_text.lower().strip()
     
-    logger.info(f"Parseando tiempo natural: '{time_text}' (hora local: {now_local})")
+    def __init__(self):
+        self._pending: Dict[str, Counter] = {}
+        self._lock = threading.Lock()
     
-    # Patrones de intervalo "en X minutos/horas"
-    interval_patterns = [
-        (r'en\s*(\d+)\s*minutos?\s*(?:a partir de ahora)?', lambda x: timedelta(minutes=int(x))),
-        (r'en\s*(\d+)\s*horas?\s*(?:a partir de ahora)?', lambda x: timedelta(hours=int(x))),
-        (r'en\s*(\d+)\s*días?\s*(?:a partir de ahora)?', lambda x: timedelta(days=int(x))),
-        (r'en\s*(\d+)\s*semanas?\s*(?:a partir de ahora)?', lambda x: timedelta(weeks=int(x))),
-    ]
+    def add(self, user_id: str, inc: Dict[str, int]):
+        with self._lock:
+            self._pending.setdefault(user_id, Counter()).update(inc)
     
-    for pattern, delta_func in interval_patterns:
-        matches = re.findall(pattern, time_text)
-        if matches:
-            amount = int(matches[0])
-            time_delta = delta_func(amount)
-            result_time = now_local + time_delta
-            logger.info(f"Intervalo detectado: {amount} -> {result_time}")
-            return make_naive(local_to_utc(result_time))  # 🆕 Convertir a UTC y hacer naive
-    
-    # Palabras clave para días (usando hora local)
-    day_mappings = {
-        'mañana': now_local + timedelta(days=1),
-        'hoy': now_local,
-        'ahora': now_local,
-        'pasado mañana': now_local + timedelta(days=2),
-        'lunes': get_next_weekday(0, now_local),
-        'martes': get_next_weekday(1, now_local),
-        'miércoles': get_next_weekday(2, now_local),
-        'miercoles': get_next_weekday(2, now_local),
-        'jueves': get_next_weekday(3, now_local),
-        'viernes': get_next_weekday(4, now_local),
-        'sábado': get_next_weekday(5, now_local),
-        'sabado': get_next_weekday(5, now_local),
-        'domingo': get_next_weekday(6, now_local),
-    }
+    def drain(self) -> Dict[str, Counter]:
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        return pending
     
-    # Buscar día
-    target_date = now_local
-    day_found = False
-    for day_keyword, date_value in day_mappings.items():
-        if day_keyword in time_text:
-            target_date = date_value
-            time_text = time_text.replace(day_keyword, '')
-            day_found = True
-            logger.info(f"Día detectado: {day_keyword} -> {target_date}")
-            break
-    
-    # Buscar hora
-    hour, minute = now_local.hour, now_local.minute
-    
-    # Si no se encontró día específico y no hay hora, usar 1 hora por defecto
-    if not day_found and not any(time_keyword in time_text for time_keyword in ['a las', 'las', 'am', 'pm', 'hrs', 'horas', ':']):
-        result_time = now_local + timedelta(hours=1)
-        logger.info("Usando hora por defecto (1 hora desde ahora)")
-        return make_naive(local_to_utc(result_time))
-    
-    # Patrones de hora
-    time_pattern_1 = r'(\d{1,2}):(\d{2})\s*(am|pm)?'
-    time_pattern_2 = r'(\d{1,2})\s*(am|pm)'
-    time_pattern_3 = r'(?:a las|las)\s*(\d{1,2})'
-    
-    matches_1 = re.findall(time_pattern_1, time_text)
-    matches_2 = re.findall(time_pattern_2, time_text) 
-    matches_3 = re.findall(time_pattern_3, time_text)
-    
-    time_found = False
-    
-    if matches_1:
-        match = matches_1[0]
-        hour_str = match[0]
-        minute_str = match[1]
-        period = match[2] if len(match) > 2 else ''
-        
-        hour = int(hour_str)
-        minute = int(minute_str) if minute_str else 0
-        time_found = True
-        
-        # Manejar formato 12h
-        if period:
-            if 'pm' in period and hour < 12:
-                hour += 12
-            elif 'am' in period and hour == 12:
-                hour = 0
-        logger.info(f"Hora detectada (formato 1): {hour}:{minute}")
-            
-    elif matches_2:
-        match = matches_2[0]
-        hour_str = match[0]
-        period = match[1] if len(match) > 1 else ''
-        
-        hour = int(hour_str)
-        minute = 0
-        time_found = True
-        
-        if period:
-            if 'pm' in period and hour < 12:
-                hour += 12
-            elif 'am' in period and hour == 12:
-                hour = 0
-        logger.info(f"Hora detectada (formato 2): {hour}:00")
-            
-    elif matches_3:
-        hour_str = matches_3[0]
-        hour = int(hour_str)
-        minute = 0
-        time_found = True
-        # Asumir PM si es temprano
-        if hour < 8:
-            hour += 12
-        logger.info(f"Hora detectada (formato 3): {hour}:00")
-    
-    # Asegurar que la hora esté en rango válido
-    hour = min(max(hour, 0), 23)
-    minute = min(max(minute, 0), 59)
-    
-    # Crear datetime final en timezone local
-    try:
-        due_date_local = TIMEZONE.localize(datetime(
-            year=target_date.year,
-            month=target_date.month, 
-            day=target_date.day,
-            hour=hour,
-            minute=minute
-        ))
-        
-        # Si no se encontró hora específica y es hoy, usar 1 hora por defecto
-        if not time_found and target_date.date() == now_local.date():
-            due_date_local = now_local + timedelta(hours=1)
-            logger.info("Usando hora por defecto (1 hora desde ahora)")
-        
-        # Si la fecha/hora ya pasó, mover al siguiente día
-        if due_date_local <= now_local:
-            due_date_local += timedelta(days=1)
-            logger.info("Fecha/hora en pasado, moviendo al siguiente día")
-            
-        # 🆕 CONVERTIR A UTC y hacer naive para la base de datos
-        due_date_utc = local_to_utc(due_date_local)
-        due_date_naive = make_naive(due_date_utc)
-        
-        logger.info(f"Tiempo parseado - Local: {due_date_local}, UTC: {due_date_utc}, Naive: {due_date_naive}")
-        return due_date_naive
-        
+    def __len__(self):
+        with self._lock:
+            return len(self._pending)
+
+routine_buffer = RoutineProfileBuffer()
+
+def routine_title_key(title: str) -> str:
+    """Normaliza un título para usarlo como clave del perfil (sin '.' ni '$')"""
+    key = re.sub(r"[^\w\s]", " ", title.lower())
+    return " ".join(key.split())[:60]
+
+def update_routine_profile(user_id: str, intent: Optional[str] = None, event_kind: Optional[str] = None,
+                           event_time: Optional[datetime] = None, title: Optional[str] = None):
+    """
+    Suma al perfil de rutinas del usuario (uno por usuario) sin tocar la base de datos: los
+    incrementos se acumulan en routine_buffer y flush_routine_profiles los escribe con $inc.
+    event_kind es "reminder" o "meeting" y event_time un datetime UTC naive.
+    """
+    try:
+        inc: Dict[str, int] = {}
+        
+        if intent:
+            now_local = get_local_now()
+            inc[f"intents.{intent}"] = 1
+            inc[f"interaction_hours.{now_local.hour}"] = 1
+            inc[f"interaction_weekdays.{now_local.weekday()}"] = 1
+            inc["total_interactions"] = 1
+        
+        if event_kind and event_time:
+            event_local = utc_to_local(event_time)
+            inc[f"{event_kind}_hours.{event_local.hour}"] = 1
+            inc[f"{event_kind}_weekdays.{event_local.weekday()}"] = 1
+            inc[f"total_{event_kind}s"] = 1
+        
+        title_key = routine_title_key(title) if title else ""
+        if title_key:
+            inc[f"titles.{title_key}"] = 1
+            inc["total_titles"] = 1
+        
+        if inc:
+            routine_buffer.add(user_id, inc)
+    
+    except Exception as e:
+        # El perfil es auxiliar: nunca debe romper la interacción
+        logger.error(f"Error actualizando perfil de rutinas: {e}")
+
+def flush_routine_profiles() -> int:
+    """Escribe los incrementos acumulados (un UpdateOne con upsert por usuario); devuelve cuántos usuarios"""
+    pending = routine_buffer.drain()
+    if not pending:
+        return 0
+    now = datetime.utcnow()
+    try:
+        db.user_routine_profiles.bulk_write([
+            UpdateOne({"_id": user_id}, {"$inc": dict(inc), "$set": {"updated_at": now}}, upsert=True)
+            for user_id, inc in pending.items()
+        ], ordered=False)
+    except Exception:
+        # Se reintentan en la siguiente pasada
+        for user_id, inc in pending.items():
+            routine_buffer.add(user_id, inc)
+        raise
+    
+    # Se recortan los títulos de quien cruzó un múltiplo de ROUTINE_TRIM_EVERY en esta pasada
+    titled = {user_id: inc["total_titles"] for user_id, inc in pending.items() if inc.get("total_titles")}
+    if titled:
+        for profile in db.user_routine_profiles.find({"_id": {"$in": list(titled)}}, {"total_titles": 1}):
+            total = profile.get("total_titles", 0)
+            if total // ROUTINE_TRIM_EVERY > (total - titled[profile["_id"]]) // ROUTINE_TRIM_EVERY:
+                trim_routine_titles(profile["_id"])
+    return len(pending)
+
+async def routine_profile_flusher():
+    """Escribe el perfil de rutinas fuera del camino de las peticiones"""
+    while True:
+        await asyncio.sleep(ROUTINE_FLUSH_SECONDS)
+        try:
+            await asyncio.to_thread(flush_routine_profiles)
+        except Exception as e:
+            logger.error(f"❌ Error guardando perfiles de rutinas: {e}")
+
+def trim_routine_titles(user_id: str):
+    """Conserva solo los títulos más frecuentes para que el documento siga siendo compacto"""
+    profile = db.user_routine_profiles.find_one({"_id": user_id}, {"titles": 1})
+    titles = (profile or {}).get("titles", {})
+    if len(titles) > ROUTINE_MAX_TITLES:
+        top = dict(sorted(titles.items(), key=lambda item: item[1], reverse=True)[:ROUTINE_MAX_TITLES])
+        db.user_routine_profiles.update_one({"_id": user_id}, {"$set": {"titles": top}})
+
+def get_routine_profile(user_id: str) -> Optional[Dict[str, Any]]:
+    """Lee el perfil de rutinas del usuario (una sola lectura por _id)"""
+    return db.user_routine_profiles.find_one({"_id": user_id})
+
+@app.get("/user/{user_id}/routine")
+async def get_routine(user_id: str, top: int = 10):
+    """Perfil de rutinas aprendido del usuario"""
+    try:
+        profile = get_routine_profile(user_id)
+        if not profile:
+            raise HTTPException(status_code=404, detail="El usuario aún no tiene perfil de rutinas")
+        
+        def as_list(counts: Dict[str, int], size: int) -> List[int]:
+            return [counts.get(str(i), 0) for i in range(size)]
+        
+        titles = sorted(profile.get("titles", {}).items(), key=lambda item: item[1], reverse=True)
+        
+        return {
+            "user_id": user_id,
+            "intents": profile.get("intents", {}),
+            "total_interactions": profile.get("total_interactions", 0),
+            "interaction_hours": as_list(profile.get("interaction_hours", {}), 24),
+            "interaction_weekdays": as_list(profile.get("interaction_weekdays", {}), 7),
+            "reminder_hours": as_list(profile.get("reminder_hours", {}), 24),
+            "reminder_weekdays": as_list(profile.get("reminder_weekdays", {}), 7),
+            "meeting_hours": as_list(profile.get("meeting_hours", {}), 24),
+            "meeting_weekdays": as_list(profile.get("meeting_weekdays", {}), 7),
+            "frequent_titles": [{"title": title, "count": count} for title, count in titles[:top]],
+            "updated_at": profile["updated_at"].isoformat() if profile.get("updated_at") else None
+        }
+    
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Error creando datetime: {e}")
+        raise HTTPException(status_code=500, detail=f"Error obteniendo perfil de rutinas: {str(e)}")
+
+# =============================================
+# 🆕 SUGERENCIAS PREDICTIVAS (modelos precalculados + caché en memoria)
+# =============================================
+# Los modelos los genera el job programado (cron): python main.py build-suggestions
+# La API solo recarga lo que el job dejó en user_suggestions.
+SUGGESTION_MIN_WEEKS = int(os.getenv("SUGGESTION_MIN_WEEKS", "3"))         # Semanas distintas con el mismo patrón
+SUGGESTION_MAX_PER_USER = int(os.getenv("SUGGESTION_MAX_PER_USER", "10"))
+SUGGESTIONS_RELOAD_MINUTES = float(os.getenv("SUGGESTIONS_RELOAD_MINUTES", "10"))
+
+
+# user_id -> lista de sugerencias precalculadas (solo se lee en las peticiones)
+_suggestions_cache: Dict[str, List[Dict[str, Any]]] = {}
+
+def build_user_suggestions(events: List[Tuple[str, datetime]], titles: Optional[Dict[str, int]] = None) -> List[Dict[str, Any]]:
+    """
+    Detecta patrones semanales (mismo título, día y hora) en los eventos de un usuario.
+    events es una lista de (título, datetime UTC naive) y titles los títulos frecuentes de su
+    perfil de rutinas: a igual número de semanas gana el título que el usuario más repite.
+    """
+    titles = titles or {}
+    weeks: Dict[Tuple[str, int, int], set] = {}
+    display_titles: Dict[str, str] = {}
+    minutes: Dict[Tuple[str, int, int], Dict[int, int]] = {}
+    
+    for title, event_time in events:
+        title_key = routine_title_key(title)
+        if not title_key:
+            continue
+        local = utc_to_local(event_time)
+        slot = (title_key, local.weekday(), local.hour)
+        weeks.setdefault(slot, set()).add(local.isocalendar()[:2])
+        slot_minutes = minutes.setdefault(slot, {})
+        slot_minutes[local.minute] = slot_minutes.get(local.minute, 0) + 1
+        display_titles[title_key] = title
+    
+    suggestions = []
+    for slot, slot_weeks in weeks.items():
+        if len(slot_weeks) < SUGGESTION_MIN_WEEKS:
+            continue
+        title_key, weekday, hour = slot
+        minute = max(minutes[slot].items(), key=lambda item: item[1])[0]
+        title = display_titles[title_key]
+        suggestions.append({
+            "title": title,
+            "weekday": weekday,
+            "hour": hour,
+            "minute": minute,
+            "support": len(slot_weeks),
+            "frequency": titles.get(title_key, 0),
+            "text": render("suggestion_routine", title=title, weekday=weekday, time=f"{hour:02d}:{minute:02d}")
+        })
+    
+    suggestions.sort(key=lambda item: (item["support"], item["frequency"]), reverse=True)
+    return suggestions[:SUGGESTION_MAX_PER_USER]
+
+def build_suggestion_models() -> int:
+    """
+    Job batch (python main.py build-suggestions): recorre los recordatorios ordenados por
+    usuario (un usuario en memoria a la vez) junto con los perfiles de rutinas en el mismo
+    orden, calcula sus patrones y guarda las listas en user_suggestions. Devuelve cuántos
+    usuarios tienen sugerencias.
+    """
+    started = time.monotonic()
+    users_with_suggestions = 0
+    # Perfiles por _id (= user_id): se avanzan a la par del cursor de recordatorios
+    profiles = iter(db.user_routine_profiles.find({}, {"titles": 1}).sort("_id", 1).batch_size(1000))
+    profile = next(profiles, None)
+    
+    def profile_titles(user_id: str) -> Dict[str, int]:
+        nonlocal profile
+        while profile is not None and profile["_id"] < user_id:
+            profile = next(profiles, None)
+        return profile.get("titles", {}) if profile is not None and profile["_id"] == user_id else {}
+    
+    def flush(user_id: Optional[str], events: List[Tuple[str, datetime]]):
+        nonlocal users_with_suggestions
+        if user_id is None:
+            return
+        suggestions = build_user_suggestions(events, profile_titles(user_id))
+        if suggestions:
+            users_with_suggestions += 1
+            db.user_suggestions.replace_one(
+                {"_id": user_id},
+                {"_id": user_id, "suggestions": suggestions, "built_at": datetime.utcnow()},
+                upsert=True
+            )
+        else:
+            db.user_suggestions.delete_one({"_id": user_id})
+    
+    cursor = db.reminders.find(
+        {"due_date": {"$ne": None}},
+        compact_projection(["user_id", "title", "due_date"])
+    ).sort("user_id", 1).batch_size(1000)
+    
+    current_user, events = None, []
+    for reminder in cursor:
+        if reminder.get("user_id") != current_user:
+            flush(current_user, events)
+            current_user, events = reminder.get("user_id"), []
+        events.append((reminder.get("t") or reminder.get("title") or "", reminder["due_date"]))
+    flush(current_user, events)
+    
+    logger.info(f"🧠 Modelos de sugerencias generados: {users_with_suggestions} usuarios en {time.monotonic() - started:.1f}s")
+    return users_with_suggestions
+
+def load_suggestions_cache():
+    """Carga todas las sugerencias precalculadas en memoria (reemplazo atómico)"""
+    global _suggestions_cache
+    _suggestions_cache = {
+        doc["_id"]: doc.get("suggestions", [])
+        for doc in db.user_suggestions.find({}, {"suggestions": 1})
+    }
+    logger.info(f"🧠 Sugerencias en caché para {len(_suggestions_cache)} usuarios")
+
+def get_upcoming_suggestions(user_id: str, hours_ahead: int = 24 * 7, limit: int = SUGGESTION_MAX_PER_USER) -> List[Dict[str, Any]]:
+    """Sugerencias del usuario ordenadas por su próxima ocurrencia (solo memoria, sin consultas)"""
+    now_local = get_local_now()
+    upcoming = []
+    for suggestion in _suggestions_cache.get(user_id, []):
+        days_ahead = (suggestion["weekday"] - now_local.weekday()) % 7
+        next_time = (now_local + timedelta(days=days_ahead)).replace(
+            hour=suggestion["hour"], minute=suggestion["minute"], second=0, microsecond=0
+        )
+        if next_time <= now_local:
+            next_time += timedelta(days=7)
+        if next_time - now_local <= timedelta(hours=hours_ahead):
+            upcoming.append({**suggestion, "next_occurrence": next_time.isoformat()})
+    
+    upcoming.sort(key=lambda item: item["next_occurrence"])
+    return upcoming[:limit]
+
+async def suggestion_cache_reloader():
+    """Tarea en segundo plano: recoge los modelos que generó el job programado"""
+    while True:
+        try:
+            await asyncio.to_thread(load_suggestions_cache)
+        except Exception as e:
+            logger.error(f"Error recargando sugerencias: {e}")
+        await asyncio.sleep(SUGGESTIONS_RELOAD_MINUTES * 60)
+
+@app.get("/suggestions/{user_id}")
+async def get_suggestions(user_id: str, hours_ahead: int = 24 * 7):
+    """Sugerencias predictivas del usuario (servidas desde memoria)"""
+    suggestions = get_upcoming_suggestions(user_id, hours_ahead)
+    return {"user_id": user_id, "suggestions": suggestions, "count": len(suggestions)}
+
+def save_scheduled_event(user_id: str, event_type: str, event_data: Dict):
+    """Guarda eventos programados (🆕 devuelve el _id)"""
+    event = {
+        "user_id": user_id,
+        "event_type": event_type,
+        "event_data": event_data,
+        "scheduled_at": datetime.utcnow(),
+        "status": "scheduled"
+    }
+    # 🆕 Inicio y fin en la raíz del documento para las consultas de agenda por rango
+    if isinstance(event_data.get("scheduled_datetime"), datetime):
+        event["scheduled_datetime"] = event_data["scheduled_datetime"]
+        event["ends_at"] = event_data["scheduled_datetime"] + timedelta(minutes=MEETING_DURATION_MINUTES)
+    return db.scheduled_events.insert_one(event).inserted_id
+
+# =============================================
+# 🆕 AGENDA: CONSULTAS POR RANGO Y CHOQUES DE HORARIO
+# =============================================
+MEETING_DURATION_MINUTES = int(os.getenv("MEETING_DURATION_MINUTES", "60"))
+MEETING_SUGGESTIONS = int(os.getenv("MEETING_SUGGESTIONS", "3"))
+AGENDA_MAX_USERS = int(os.getenv("AGENDA_MAX_USERS", "1000"))
+AGENDA_TTL_SECONDS = int(os.getenv("AGENDA_TTL_SECONDS", "3600"))
+AGENDA_DEFAULT_DAYS = int(os.getenv("AGENDA_DEFAULT_DAYS", "7"))
+AGENDA_MAX_RANGE_DAYS = int(os.getenv("AGENDA_MAX_RANGE_DAYS", "92"))
+AGENDA_BACKFILL_BATCH = int(os.getenv("AGENDA_BACKFILL_BATCH", "500"))
+
+AGENDA_EVENT_FIELDS = {"event_type": 1, "status": 1, "scheduled_datetime": 1, "ends_at": 1, "event_data.title": 1}
+ACTIVE_EVENT_STATUSES = ["scheduled"]
+NON_BLOCKING_EVENT_TYPES = {"all_day"}  # p. ej. cumpleaños importados: no ocupan horario
+
+agenda_indexes = LRUTTLCache(AGENDA_MAX_USERS, AGENDA_TTL_SECONDS)
+_agenda_build_lock = threading.Lock()
+
+def event_interval(doc: Dict[str, Any]) -> Optional[Tuple[datetime, datetime]]:
+    """(inicio, fin) de un evento; los documentos antiguos solo tienen event_data.scheduled_datetime"""
+    start = doc.get("scheduled_datetime") or (doc.get("event_data") or {}).get("scheduled_datetime")
+    if not isinstance(start, datetime):
         return None
+    return start, doc.get("ends_at") or start + timedelta(minutes=MEETING_DURATION_MINUTES)
+
+def add_agenda_event(agenda: UserAgenda, doc: Dict[str, Any]):
+    interval = event_interval(doc)
+    blocking = doc.get("event_type") not in NON_BLOCKING_EVENT_TYPES
+    if interval is None or not blocking or doc.get("status", "scheduled") not in ACTIVE_EVENT_STATUSES:
+        agenda.remove(doc["_id"])
+        return
+    agenda.add(doc["_id"], *interval, title=(doc.get("event_data") or {}).get("title"))
+
+def load_agenda(user_id: str) -> UserAgenda:
+    """Eventos del usuario que todavía pueden chocar con uno nuevo (desde ayer en adelante)"""
+    agenda = UserAgenda(user_id)
+    # Lo creado en el último minuto se vuelve a leer en la primera puesta al día
+    marker = ObjectId.from_datetime(datetime.utcnow() - timedelta(minutes=1))
+    query = {
+        "user_id": user_id,
+        "scheduled_datetime": {"$gte": datetime.utcnow() - timedelta(days=1)},
+        "status": {"$in": ACTIVE_EVENT_STATUSES}
+    }
+    for doc in db.scheduled_events.find(query, AGENDA_EVENT_FIELDS):
+        add_agenda_event(agenda, doc)
+    if agenda.last_event_id is None or agenda.last_event_id < marker:
+        agenda.last_event_id = marker
+    logger.info(f"📅 Agenda de {user_id}: {len(agenda)} eventos")
+    return agenda
+
+def get_agenda(user_id: str) -> UserAgenda:
+    """Agenda en memoria del usuario (el TTL cuenta desde el último uso)"""
+    agenda = agenda_indexes.get(user_id)
+    if agenda is None:
+        with _agenda_build_lock:
+            agenda = agenda_indexes.get(user_id)
+            if agenda is None:
+                agenda = load_agenda(user_id)
+    agenda_indexes.set(user_id, agenda)
+    return agenda
+
+def catch_up_agenda(agenda: UserAgenda):
+    """
+    Agrega los eventos creados desde la última consulta, también por otros workers
+    (consulta por el índice (user_id, _id) que casi siempre vuelve vacía)
+    """
+    query = {"user_id": agenda.user_id, "_id": {"$gt": agenda.last_event_id}}
+    for doc in db.scheduled_events.find(query, AGENDA_EVENT_FIELDS):
+        add_agenda_event(agenda, doc)
+    agenda.prune(datetime.utcnow() - timedelta(days=1))
+
+def backfill_event_datetimes() -> int:
+    """Copia event_data.scheduled_datetime a la raíz en los eventos antiguos; devuelve cuántos"""
+    updated = 0
+    query = {"scheduled_datetime": {"$exists": False}, "event_data.scheduled_datetime": {"$exists": True}}
+    while True:
+        docs = list(db.scheduled_events.find(query, {"event_data.scheduled_datetime": 1}).limit(AGENDA_BACKFILL_BATCH))
+        operations = []
+        for doc in docs:
+            interval = event_interval(doc)
+            if interval:
+                operations.append(UpdateOne({"_id": doc["_id"]}, {"$set": {"scheduled_datetime": interval[0], "ends_at": interval[1]}}))
+        if not operations:
+            return updated
+        updated += db.scheduled_events.bulk_write(operations, ordered=False).modified_count
+
+async def agenda_backfiller():
+    try:
+        updated = await asyncio.to_thread(backfill_event_datetimes)
+        if updated:
+            logger.info(f"📅 {updated} eventos con fecha copiada a la raíz para la agenda")
+    except Exception as e:
+        logger.error(f"❌ Error completando fechas de eventos: {e}")
+
+def utc_naive(value: datetime) -> datetime:
+    """Fecha de la consulta a UTC naive (sin zona se interpreta como hora local del asistente)"""
+    return make_naive(local_to_utc(value))
+
+def find_overlaps(meetings: List[Dict[str, Any]]) -> List[List[str]]:
+    """Pares de reuniones que se solapan (barrido sobre la lista ordenada por inicio)"""
+    overlaps = []
+    active: List[Dict[str, Any]] = []
+    for meeting in meetings:
+        active = [other for other in active if other["end"] > meeting["start"]]
+        overlaps.extend([other["_id"], meeting["_id"]] for other in active)
+        active.append(meeting)
+    return overlaps
+
+def load_agenda_range(user_id: str, start: datetime, end: datetime) -> Dict[str, Any]:
+    """Reuniones y recordatorios del rango: una consulta por índice en cada colección"""
+    meetings = []
+    event_query = {"user_id": user_id, "scheduled_datetime": {"$gte": start, "$lt": end}}
+    for doc in db.scheduled_events.find(event_query).sort("scheduled_datetime", 1):
+        meeting_start, meeting_end = event_interval(doc)
+        data = doc.get("event_data") or {}
+        meetings.append({
+            "_id": str(doc["_id"]),
+            "type": doc.get("event_type"),
+            "title": data.get("title"),
+            "description": data.get("description"),
+            "start": meeting_start,
+            "end": meeting_end,
+            "status": doc.get("status")
+        })
+    reminder_query = {"user_id": user_id, "due_date": {"$gte": start, "$lt": end}}
+    reminders = [serialize_reminder(doc) for doc in db.reminders.find(reminder_query).sort("due_date", 1)]
+    active_meetings = [meeting for meeting in meetings if meeting["status"] in ACTIVE_EVENT_STATUSES]
+    return {
+        "user_id": user_id,
+        "from": start,
+        "to": end,
+        "meetings": meetings,
+        "reminders": reminders,
+        "conflicts": find_overlaps(active_meetings),
+        "count": len(meetings) + len(reminders)
+    }
+
+@app.get("/agenda/{user_id}", response_class=ORJSONResponse)
+async def get_user_agenda(user_id: str, start: Optional[datetime] = Query(None, alias="from"),
+                          end: Optional[datetime] = Query(None, alias="to")):
+    """
+    Agenda del usuario entre from y to (por defecto, los próximos 7 días desde hoy a las 00:00
+    hora local). Las fechas sin zona horaria se interpretan en hora local.
+    """
+    try:
+        if start is None:
+            start = get_local_now().replace(hour=0, minute=0, second=0, microsecond=0)
+        start = utc_naive(start)
+        end = utc_naive(end) if end is not None else start + timedelta(days=AGENDA_DEFAULT_DAYS)
+        if end <= start:
+            raise HTTPException(status_code=400, detail="'to' debe ser posterior a 'from'")
+        if end - start > timedelta(days=AGENDA_MAX_RANGE_DAYS):
+            raise HTTPException(status_code=400, detail=f"El rango máximo es de {AGENDA_MAX_RANGE_DAYS} días")
+        async with admission.slot(user_id, "read"):
+            return await asyncio.to_thread(load_agenda_range, user_id, start, end)
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error obteniendo la agenda: {str(e)}")
+
+# =============================================
+# 🆕 CALENDARIO ICS: SUSCRIPCIÓN E IMPORTACIÓN
+# =============================================
+CALENDAR_MAX_USERS = int(os.getenv("CALENDAR_MAX_USERS", "1000"))
+CALENDAR_TTL_SECONDS = int(os.getenv("CALENDAR_TTL_SECONDS", "3600"))
+CALENDAR_REVALIDATE_SECONDS = int(os.getenv("CALENDAR_REVALIDATE_SECONDS", "60"))
+CALENDAR_PAST_DAYS = int(os.getenv("CALENDAR_PAST_DAYS", "30"))
+CALENDAR_REMINDER_MINUTES = 15   # duración con la que se muestra un recordatorio
+CALENDAR_UID_DOMAIN = os.getenv("CALENDAR_UID_DOMAIN", "asistente-virtual")
+ICS_IMPORT_BATCH = int(os.getenv("ICS_IMPORT_BATCH", "500"))
+ICS_IMPORT_MAX_EVENTS = int(os.getenv("ICS_IMPORT_MAX_EVENTS", "50000"))
+
+CALENDAR_REMINDER_FIELDS = ["title", "description", "due_date", "status", "tags", "created_at", "updated_at"]
+CALENDAR_EVENT_FIELDS = {
+    "event_type": 1, "status": 1, "scheduled_at": 1, "scheduled_datetime": 1, "ends_at": 1,
+    "event_data.title": 1, "event_data.description": 1, "event_data.scheduled_datetime": 1
+}
+# Versión de cada documento: si no cambia, se reutiliza el VEVENT ya renderizado
+CALENDAR_VERSION_FIELDS = {
+    "reminder": {"ua": 1, "updated_at": 1},
+    "event": {"status": 1, "scheduled_datetime": 1, "ends_at": 1}
+}
+
+def render_reminder_vevent(doc: Dict[str, Any]) -> str:
+    fields = decode_reminder(doc)
+    due = fields.get("due_date")
+    # Los recordatorios automáticos de reunión ya van como alarma del evento
+    if not isinstance(due, datetime) or "automático" in fields["tags"]:
+        return ""
+    return render_event(
+        f"reminder-{doc['_id']}@{CALENDAR_UID_DOMAIN}", due, due + timedelta(minutes=CALENDAR_REMINDER_MINUTES),
+        fields["title"], fields.get("updated_at") or fields.get("created_at") or due,
+        description=fields.get("description"),
+        status="CANCELLED" if fields["status"] == ReminderStatus.CANCELLED.value else "CONFIRMED",
+        alarm_minutes=0, categories=fields["tags"]
+    )
+
+def render_meeting_vevent(doc: Dict[str, Any]) -> str:
+    interval = event_interval(doc)
+    if interval is None:
+        return ""
+    data = doc.get("event_data") or {}
+    all_day = doc.get("event_type") == "all_day"
+    return render_event(
+        f"event-{doc['_id']}@{CALENDAR_UID_DOMAIN}", *interval, data.get("title") or "Reunión",
+        doc.get("scheduled_at") or interval[0], description=data.get("description"),
+        status="CONFIRMED" if doc.get("status") in ACTIVE_EVENT_STATUSES else "CANCELLED",
+        alarm_minutes=None if all_day else 15, all_day=all_day
+    )
+
+class CalendarFeed:
+    """
+    Feed ICS de un usuario. Cada VEVENT se guarda renderizado junto con la versión de su
+    documento; al revalidar se leen solo las versiones y se vuelven a renderizar los que
+    cambiaron. El cuerpo se ordena por documento, así que el ETag (hash del cuerpo) es el
+    mismo en todos los workers y solo cambia cuando cambia el calendario.
+    """
+    
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+        self.lock = threading.Lock()
+        self.components: Dict[Tuple[str, Any], Tuple[Any, str]] = {}
+        self.snapshot: Optional[Tuple[bytes, str, datetime]] = None  # (cuerpo, etag, last_modified)
+        self.checked_at = 0.0
+        self.dirty = True
+        self.renders = 0
+    
+    def stale(self) -> bool:
+        return self.dirty or time.monotonic() - self.checked_at > CALENDAR_REVALIDATE_SECONDS
+    
+    def refresh(self):
+        since = datetime.utcnow() - timedelta(days=CALENDAR_PAST_DAYS)
+        sources = {
+            "reminder": (db.reminders, {"user_id": self.user_id, "due_date": {"$gte": since}}),
+            "event": (db.scheduled_events, {"user_id": self.user_id, "scheduled_datetime": {"$gte": since}})
+        }
+        versions: Dict[Tuple[str, Any], Any] = {}
+        for kind, (collection, query) in sources.items():
+            for doc in collection.find(query, CALENDAR_VERSION_FIELDS[kind]):
+                versions[(kind, doc["_id"])] = tuple(doc.get(field) for field in CALENDAR_VERSION_FIELDS[kind])
+        
+        removed = [key for key in self.components if key not in versions]
+        for key in removed:
+            del self.components[key]
+        changed = [key for key, version in versions.items() if self.components.get(key, (None,))[0] != version]
+        if changed:
+            reminder_ids = [doc_id for kind, doc_id in changed if kind == "reminder"]
+            event_ids = [doc_id for kind, doc_id in changed if kind == "event"]
+            if reminder_ids:
+                for doc in db.reminders.find({"_id": {"$in": reminder_ids}}, compact_projection(CALENDAR_REMINDER_FIELDS)):
+                    self.components[("reminder", doc["_id"])] = (versions[("reminder", doc["_id"])], render_reminder_vevent(doc))
+            if event_ids:
+                for doc in db.scheduled_events.find({"_id": {"$in": event_ids}}, CALENDAR_EVENT_FIELDS):
+                    self.components[("event", doc["_id"])] = (versions[("event", doc["_id"])], render_meeting_vevent(doc))
+        
+        if changed or removed or self.snapshot is None:
+            events = (self.components[key][1] for key in sorted(self.components))
+            body = render_calendar(f"Asistente ({self.user_id})", events).encode("utf-8")
+            etag = f'"{hashlib.sha1(body).hexdigest()[:24]}"'
+            if self.snapshot is None or etag != self.snapshot[1]:
+                self.snapshot = (body, etag, datetime.utcnow().replace(microsecond=0))
+                self.renders += 1
+        self.checked_at = time.monotonic()
+        self.dirty = False
+
+calendar_feeds = LRUTTLCache(CALENDAR_MAX_USERS, CALENDAR_TTL_SECONDS)
+
+def get_calendar_feed(user_id: str) -> CalendarFeed:
+    feed = calendar_feeds.get(user_id)
+    if feed is None:
+        feed = CalendarFeed(user_id)
+    calendar_feeds.set(user_id, feed)
+    return feed
+
+def refresh_calendar_feed(feed: CalendarFeed) -> Tuple[bytes, str, datetime]:
+    with feed.lock:
+        if feed.stale():
+            feed.refresh()
+        return feed.snapshot
+
+def mark_calendar_dirty(user_id: Optional[str]):
+    feed = calendar_feeds.get(user_id) if user_id else None
+    if feed is not None:
+        feed.dirty = True
+
+def on_calendar_change(event: Dict[str, Any]):
+    """Con change streams, un cambio en un recordatorio revalida el feed en la siguiente consulta"""
+    if event["operation"] == "resync":
+        calendar_feeds.clear()
+        return
+    doc = event.get("document")
+    if doc is not None:
+        mark_calendar_dirty(doc.get("user_id"))
+
+def calendar_not_modified(request: Request, etag: str, last_modified: datetime) -> bool:
+    """Validación condicional: If-None-Match tiene prioridad sobre If-Modified-Since"""
+    if request.headers.get("if-none-match") is not None:
+        return etag_matches(request, etag)
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return last_modified <= make_naive(parsedate_to_datetime(if_modified_since).astimezone(timezone.utc))
+        except (TypeError, ValueError):
+            return False
+    return False
 
-def get_next_weekday(weekday: int, reference_date=None):
-    """Obtiene la próxima ocurrencia de un día de la semana"""
-    if reference_date is None:
-        reference_date = get_local_now()
+@app.get("/calendar/{user_id}.ics")
+async def calendar_feed(user_id: str, request: Request):
+    """Calendario suscribible (reuniones y recordatorios); los clientes que revalidan reciben 304"""
+    try:
+        feed = get_calendar_feed(user_id)
+        snapshot = feed.snapshot
+        if snapshot is None or feed.stale():
+            async with admission.slot(user_id, "read"):
+                snapshot = await asyncio.to_thread(refresh_calendar_feed, feed)
+        body, etag, last_modified = snapshot
+        headers = {
+            "ETag": etag,
+            "Last-Modified": http_date(last_modified.replace(tzinfo=timezone.utc), usegmt=True),
+            "Cache-Control": "private, no-cache"
+        }
+        if calendar_not_modified(request, etag, last_modified):
+            return Response(status_code=304, headers=headers)
+        return Response(body, media_type="text/calendar; charset=utf-8", headers=headers)
     
-    days_ahead = weekday - reference_date.weekday()
-    if days_ahead <= 0:
-        days_ahead += 7
-    return reference_date + timedelta(days=days_ahead)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error generando el calendario: {str(e)}")
 
-@app.post("/reminders")
-async def create_reminder(reminder: ReminderCreate):
-    """Crea un nuevo recordatorio"""
+def ics_event_operation(user_id: str, event: Dict[str, Any], now: datetime) -> UpdateOne:
+    """Upsert idempotente por UID: reimportar el mismo archivo no duplica eventos"""
+    key = f"ics:{user_id}:{event['uid']}"
+    doc = {
+        "user_id": user_id,
+        "event_type": "all_day" if event["all_day"] else "meeting",
+        "event_data": {
+            "title": event["summary"],
+            "description": event["description"],
+            "location": event["location"],
+            "scheduled_datetime": event["start"],
+            "recurrence_rule": event["rrule"],
+            "source": "ics",
+            "uid": event["uid"]
+        },
+        "scheduled_at": now,
+        "status": "cancelled" if event["status"] == "CANCELLED" else "scheduled",
+        "scheduled_datetime": event["start"],
+        "ends_at": event["end"]
+    }
+    return UpdateOne({"idempotency_key": key}, {"$setOnInsert": doc}, upsert=True)
+
+def write_ics_batch(user_id: str, events: List[Dict[str, Any]]) -> Tuple[int, int]:
+    """Escribe un lote con un bulk_write sin orden; devuelve (insertados, ya existentes)"""
+    now = datetime.utcnow()
+    result = db.scheduled_events.bulk_write([ics_event_operation(user_id, event, now) for event in events], ordered=False)
+    return result.upserted_count, result.matched_count
+
+@app.post("/calendar/{user_id}/import")
+async def import_calendar(user_id: str, request: Request):
+    """
+    Importa un archivo .ics enviado como cuerpo de la petición (text/calendar). Se procesa en
+    streaming y se escribe por lotes de ICS_IMPORT_BATCH. Las recurrencias (RRULE) se guardan
+    como dato pero solo se importa la primera ocurrencia.
+    """
     try:
-        reminder_data = reminder.dict()
-        reminder_data["created_at"] = datetime.utcnow()
-        reminder_data["status"] = ReminderStatus.PENDING.value
-        reminder_data["last_reminded"] = None
-        
-        result = db.reminders.insert_one(reminder_data)
-        
+        counts = Counter()
+        async with admission.slot(user_id, "write"):
+            parser = IcsParser()
+            pending: List[Dict[str, Any]] = []
+            
+            async def flush():
+                imported, existing = await asyncio.to_thread(write_ics_batch, user_id, pending)
+                counts["imported"] += imported
+                counts["duplicates"] += existing
+                pending.clear()
+            
+            def accept(events: List[Dict[str, Any]]):
+                for event in events:
+                    counts["events"] += 1
+                    if counts["events"] > ICS_IMPORT_MAX_EVENTS:
+                        raise HTTPException(status_code=413, detail=f"El calendario tiene más de {ICS_IMPORT_MAX_EVENTS} eventos")
+                    pending.append(event)
+            
+            async for chunk in request.stream():
+                accept(parser.feed(chunk))
+                if len(pending) >= ICS_IMPORT_BATCH:
+                    await flush()
+            # Lo que queda en el parser al cerrar pasa por el mismo conteo y límite
+            accept(parser.close())
+            if pending:
+                await flush()
+        
+        mark_calendar_dirty(user_id)
+        logger.info(f"📥 ICS importado para {user_id}: {dict(counts)}")
         return {
-            "id": str(result.inserted_id),
             "status": "success",
-            "message": f"Recordatorio '{reminder.title}' creado exitosamente"
+            "events": counts["events"],
+            "imported": counts["imported"],
+            "duplicates": counts["duplicates"],
+            "skipped": parser.skipped
         }
     
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error importando el calendario: {str(e)}")
+
+def learn_from_unknown_input(user_input: str, user_id: str):
+    """Aprende de inputs no reconocidos"""
+    # Por ahora solo guardamos para análisis futuro
+    db.unknown_inputs.insert_one({
+        "user_id": user_id,
+        "user_input": user_input,
+        "timestamp": datetime.utcnow()
+    })
+
+@app.post("/reminders")
+async def create_reminder(reminder: ReminderCreate, response: Response, idempotency_key: Optional[str] = Header(None)):
+    """
+    Crea un nuevo recordatorio. Solo se deduplica con una Idempotency-Key explícita: dos
+    recordatorios con el mismo título y fecha pueden ser legítimos, así que sin clave no se
+    deriva ninguna. La respuesta guardada en idempotency_cache es local al proceso; entre
+    workers (o tras reiniciar) la garantía la da la clave guardada en el propio recordatorio,
+    con índice único.
+    """
+    try:
+        if not idempotency_key:
+            return await run_admitted(reminder.user_id, "write", insert_reminder, reminder, None)
+        keys = idempotency_keys("reminders", reminder.user_id, idempotency_key, reminder.title)
+        return await run_idempotent(keys, lambda: run_admitted(reminder.user_id, "write", insert_reminder, reminder, keys[0]), response)
+    
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error creando recordatorio: {str(e)}")
 
-@app.get("/reminders/{user_id}")
-async def get_user_reminders(user_id: str, status: str = "pending"):
-    """Obtiene recordatorios del usuario"""
+def insert_reminder(reminder: ReminderCreate, idempotency_key: Optional[str]) -> Dict[str, Any]:
+    """Inserta el recordatorio; la clave única evita duplicados aunque el reenvío llegue a otro worker"""
+    now = datetime.utcnow()
+    reminder_data = encode_reminder({
+        **reminder.dict(),
+        "created_at": now,
+        "updated_at": now,
+        "status": ReminderStatus.PENDING.value,
+        # Sin clave el campo no se guarda (el índice único es sparse)
+        **({"idempotency_key": idempotency_key} if idempotency_key else {})
+    })
+    
+    try:
+        reminder_id = db.reminders.insert_one(reminder_data).inserted_id
+    except DuplicateKeyError:
+        existing = db.reminders.find_one({"idempotency_key": idempotency_key}, {"_id": 1})
+        logger.info(f"♻️ Recordatorio duplicado ignorado ({idempotency_key})")
+        return {
+            "id": str(existing["_id"]),
+            "status": "success",
+            "message": f"Recordatorio '{reminder.title}' creado exitosamente"
+        }
+    
+    # 🆕 Aprendizaje de rutinas
+    due_date = reminder.due_date
+    if due_date and due_date.tzinfo is not None:
+        due_date = make_naive(due_date.astimezone(timezone.utc))
+    update_routine_profile(reminder.user_id, event_kind="reminder", event_time=due_date, title=reminder.title)
+    mark_calendar_dirty(reminder.user_id)
+    
+    return {
+        "id": str(reminder_id),
+        "status": "success",
+        "message": f"Recordatorio '{reminder.title}' creado exitosamente"
+    }
+
+REMINDERS_MAX_PAGE = int(os.getenv("REMINDERS_MAX_PAGE", "100"))
+REMINDERS_SORT = [("due_date", 1), ("_id", 1)]
+
+def encode_reminders_cursor(doc: Dict[str, Any]) -> str:
+    """Cursor opaco con la posición (due_date, _id) del último recordatorio de la página"""
+    due_date = doc.get("due_date")
+    position = [due_date.isoformat() if isinstance(due_date, datetime) else None, str(doc["_id"])]
+    return base64.urlsafe_b64encode(orjson.dumps(position)).decode().rstrip("=")
+
+def reminders_after_cursor(cursor: str) -> Dict[str, Any]:
+    """Filtro de paginación por posición: siguiente página sin skip, con el índice (user_id, due_date)"""
+    try:
+        due_date, last_id = orjson.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        due_date = datetime.fromisoformat(due_date) if due_date else None
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+    if not ObjectId.is_valid(last_id):
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+    last_id = ObjectId(last_id)
+    if due_date is None:
+        # Los recordatorios sin fecha van primero (null ordena antes que cualquier fecha)
+        return {"$or": [{"due_date": None, "_id": {"$gt": last_id}}, {"due_date": {"$ne": None}}]}
+    return {"$or": [{"due_date": {"$gt": due_date}}, {"due_date": due_date, "_id": {"$gt": last_id}}]}
+
+@app.get("/reminders/{user_id}", response_class=ORJSONResponse)
+async def get_user_reminders(user_id: str, request: Request, status: str = "pending",
+                             limit: Optional[int] = None, cursor: Optional[str] = None):
+    """
+    Obtiene recordatorios del usuario (🆕 con ETag: si no cambió responde 304 sin consultarlos).
+    🆕 Con limit se pagina: la respuesta trae total y next_cursor para pedir la página siguiente.
+    """
     try:
         query = {"user_id": user_id}
         if status != "all":
             query["status"] = status
+        page_query = {**query, **reminders_after_cursor(cursor)} if cursor else query
+        if limit is not None:
+            limit = max(1, min(limit, REMINDERS_MAX_PAGE))
+        
+        async with admission.slot(user_id, "read"):
+            validator = await asyncio.to_thread(reminders_validator, query)
+            etag = make_etag("reminders", user_id, status, limit, cursor, *validator)
+            if etag_matches(request, etag):
+                return not_modified(etag)
+            cursor_docs = db.reminders.find(page_query).sort(REMINDERS_SORT)
+            if limit is not None:
+                cursor_docs = cursor_docs.limit(limit + 1)
+            reminders = await asyncio.to_thread(list, cursor_docs)
+        
+        page_info: Dict[str, Any] = {}
+        if limit is not None:
+            has_more = len(reminders) > limit
+            reminders = reminders[:limit]
+            page_info = {
+                "total": validator[0],
+                "next_cursor": encode_reminders_cursor(reminders[-1]) if has_more else None
+            }
         
-        reminders = list(db.reminders.find(query).sort("due_date", 1))
+        # 🆕 Los documentos del esquema antiguo se convierten en segundo plano
+        legacy = [reminder for reminder in reminders if "v" not in reminder]
+        if legacy:
+            schedule_reminder_migration(legacy)
         
-        for reminder in reminders:
-            reminder["_id"] = str(reminder["_id"])
-            # Convertir fechas a strings
-            date_fields = ["due_date", "created_at", "completed_at", "updated_at", "last_reminded"]
-            for field in date_fields:
-                if field in reminder and reminder[field]:
-                    reminder[field] = reminder[field].isoformat()
-        
-        return {
-            "reminders": reminders,
+        # 🆕 Forma pública en una pasada; ORJSONResponse serializa las fechas directamente
+        return ORJSONResponse({
+            "reminders": [serialize_reminder(reminder) for reminder in reminders],
             "count": len(reminders),
-            "status": status
-        }
+            "status": status,
+            **page_info
+        }, headers={"ETag": etag, "Cache-Control": CONDITIONAL_CACHE_CONTROL})
     
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error obteniendo recordatorios: {str(e)}")
 
+# =============================================
+# 🆕 MIGRACIÓN AL ESQUEMA COMPACTO (v2)
+# =============================================
+REMINDER_MIGRATION_BATCH = int(os.getenv("REMINDER_MIGRATION_BATCH", "500"))
+
+def migrate_reminder_docs(docs: List[Dict[str, Any]]) -> int:
+    """Reescribe documentos del esquema antiguo; el filtro evita pisar un documento ya migrado"""
+    operations = [
+        ReplaceOne({"_id": doc["_id"], "v": {"$exists": False}}, migrate_reminder(doc))
+        for doc in docs
+    ]
+    if not operations:
+        return 0
+    return db.reminders.bulk_write(operations, ordered=False).modified_count
+
+# Referencias a las migraciones en curso: sin ellas el event loop puede recolectar la tarea
+reminder_migration_tasks: set = set()
+
+def finish_reminder_migration(task: asyncio.Task):
+    reminder_migration_tasks.discard(task)
+    if not task.cancelled() and task.exception():
+        logger.error(f"❌ Error migrando recordatorios leídos: {task.exception()}")
+
+def schedule_reminder_migration(docs: List[Dict[str, Any]]):
+    """Migra en segundo plano los documentos del esquema antiguo que acaba de leer una petición"""
+    task = asyncio.create_task(asyncio.to_thread(migrate_reminder_docs, docs))
+    reminder_migration_tasks.add(task)
+    task.add_done_callback(finish_reminder_migration)
+
+
+def migrate_legacy_reminders() -> int:
+    """Migra por lotes todos los recordatorios del esquema antiguo; devuelve cuántos convirtió"""
+    migrated = 0
+    while True:
+        docs = list(db.reminders.find({"v": {"$exists": False}}).limit(REMINDER_MIGRATION_BATCH))
+        if not docs:
+            return migrated
+        migrated += migrate_reminder_docs(docs)
+
+async def reminder_schema_migrator():
+    """Migración en segundo plano al arrancar (los documentos que se leen antes se migran al leerlos)"""
+    try:
+        migrated = await asyncio.to_thread(migrate_legacy_reminders)
+        if migrated:
+            logger.info(f"🗜️ {migrated} recordatorios migrados al esquema compacto")
+    except Exception as e:
+        logger.error(f"❌ Error migrando recordatorios: {e}")
+
 @app.put("/reminders/{reminder_id}")
 async def update_reminder_status(reminder_id: str, status: ReminderStatus):
     """Actualiza el estado de un recordatorio"""
     try:
         result = db.reminders.update_one(
             {"_id": ObjectId(reminder_id)},
-            {"$set": {"status": status.value, "updated_at": datetime.utcnow()}}
+            {"$set": encode_update({"status": status.value, "updated_at": datetime.utcnow()})}
         )
         
         if result.modified_count == 0:
@@ -878,8 +2563,12 @@ async def update_reminder_status(reminder_id: str, status: ReminderStatus):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error actualizando recordatorio: {str(e)}")
 
-async def check_pending_reminders():
-    """Verifica recordatorios pendientes y envía notificaciones"""
+# 🆕 Ventanas de aviso de los verificadores (la cola de vencimientos despierta dentro de ellas)
+UPCOMING_NOTICE_MINUTES = (1, 2)   # Aviso previo: faltan entre 1 y 2 minutos (enteros)
+IMMEDIATE_NOTICE_SECONDS = 60      # Aviso final: faltan como mucho 60 segundos
+
+async def check_pending_reminders() -> List[Dict[str, Any]]:
+    """Verifica recordatorios pendientes y prepara sus notificaciones"""
     try:
         now_utc = get_utc_now()
         now_utc_naive = make_naive(now_utc)
@@ -901,11 +2590,11 @@ async def check_pending_reminders():
             ]
         })
         
-        notified_count = 0
+        notifications = []
         for reminder in pending_reminders:
             due_date_naive = reminder.get("due_date")
-            title = reminder.get("title", "Recordatorio")
-            description = reminder.get("description", "")
+            fields = decode_reminder(reminder)
+            title, description = fields["title"], fields["description"]
             
             if due_date_naive:
                 # Convertir a UTC aware para cálculos
@@ -915,45 +2604,35 @@ async def check_pending_reminders():
                 minutes_until = int(time_until.total_seconds() / 60)
                 
                 # 🆕 NOTIFICAR SOLO SI ESTÁ ENTRE 1-2 MINUTOS (más preciso)
-                if 1 <= minutes_until <= 2:
+                if UPCOMING_NOTICE_MINUTES[0] <= minutes_until <= UPCOMING_NOTICE_MINUTES[1]:
                     # Convertir a hora local para el mensaje
                     due_date_local = utc_to_local(due_date_utc)
                     
-                    message = f"🔔 <b>RECORDATORIO PRÓXIMO</b>\n\n"
-                    message += f"<b>{title}</b>\n"
-                    if description:
-                        message += f"📝 {description}\n"
-                    message += f"\n⏰ <b>Hora:</b> {due_date_local.strftime('%d/%m/%Y a las %H:%M')}\n"
-                    message += f"⏳ <i>Faltan {minutes_until} minutos</i>"
-                    
-                    logger.info(f"📤 Enviando notificación para: {title} (en {minutes_until} minutos)")
+                    message = render("notify_upcoming", "html", title=title, description=description,
+                                     due=due_date_local, minutes=minutes_until)
                     
-                    # Enviar notificación
-                    success = await send_telegram_message(message)
-                    
-                    if success:
-                        # Marcar como notificado
-                        db.reminders.update_one(
-                            {"_id": reminder["_id"]},
-                            {"$set": {"last_reminded": datetime.utcnow()}}
-                        )
-                        notified_count += 1
-                        logger.info(f"✅ Notificación enviada: {title}")
-        
-        if notified_count > 0:
-            logger.info(f"📨 Se enviaron {notified_count} notificaciones")
+                    logger.info(f"📤 Notificación preparada para: {title} (en {minutes_until} minutos)")
+                    notifications.append({
+                        "reminder": reminder,
+                        "kind": "upcoming",
+                        "message": message,
+                        "summary": render("summary_upcoming", "html", minutes=minutes_until, due=due_date_local)
+                    })
+        
+        return notifications
         
     except Exception as e:
         logger.error(f"❌ Error verificando recordatorios: {e}")
+        return []
 
-async def check_immediate_reminders():
-    """Verifica recordatorios que están justo por vencer (0-1 minuto) y los COMPLETA"""
+async def check_immediate_reminders() -> List[Dict[str, Any]]:
+    """Verifica recordatorios que están justo por vencer (0-1 minuto); se COMPLETAN al notificarse"""
     try:
         now_utc = get_utc_now()
         now_utc_naive = make_naive(now_utc)
         
         # Buscar recordatorios que vencen en los próximos 0-1 minutos
-        time_threshold = now_utc_naive + timedelta(minutes=1)
+        time_threshold = now_utc_naive + timedelta(seconds=IMMEDIATE_NOTICE_SECONDS)
         
         immediate_reminders = db.reminders.find({
             "status": ReminderStatus.PENDING.value,
@@ -964,11 +2643,11 @@ async def check_immediate_reminders():
             "immediate_notified": {"$ne": True}  # Solo los que no han sido notificados inmediatamente
         })
         
-        completed_count = 0
+        notifications = []
         for reminder in immediate_reminders:
             due_date_naive = reminder.get("due_date")
-            title = reminder.get("title", "Recordatorio")
-            description = reminder.get("description", "")
+            fields = decode_reminder(reminder)
+            title, description = fields["title"], fields["description"]
             
             if due_date_naive:
                 due_date_utc = due_date_naive.replace(tzinfo=timezone.utc)
@@ -978,52 +2657,36 @@ async def check_immediate_reminders():
                 seconds_until = int(time_until.total_seconds())
                 
                 # Notificar si está por vencer (0-60 segundos)
-                if 0 <= seconds_until <= 60:
-                    message = f"⏰ <b>RECORDATORIO INMEDIATO</b>\n\n"
-                    message += f"<b>{title}</b>\n"
-                    if description:
-                        message += f"📝 {description}\n"
-                    message += f"\n🕐 <b>Es ahora:</b> {due_date_local.strftime('%d/%m/%Y a las %H:%M')}"
-                    message += f"\n\n✅ <i>Este recordatorio se ha completado automáticamente</i>"
-                    
-                    logger.info(f"🚨 Enviando notificación INMEDIATA y COMPLETANDO: {title}")
+                if 0 <= seconds_until <= IMMEDIATE_NOTICE_SECONDS:
+                    message = render("notify_immediate", "html", title=title, description=description, due=due_date_local)
                     
-                    success = await send_telegram_message(message)
-                    
-                    if success:
-                        # 🆕 MARCAR COMO COMPLETADO INMEDIATAMENTE
-                        db.reminders.update_one(
-                            {"_id": reminder["_id"]},
-                            {"$set": {
-                                "status": ReminderStatus.COMPLETED.value,  # 🆕 COMPLETADO
-                                "completed_at": datetime.utcnow(),         # 🆕 Fecha de completado
-                                "immediate_notified": True,
-                                "last_reminded": datetime.utcnow(),
-                                "updated_at": datetime.utcnow()
-                            }}
-                        )
-                        completed_count += 1
-                        logger.info(f"✅ Notificación enviada y recordatorio COMPLETADO: {title}")
-                    else:
-                        logger.error(f"❌ Error enviando notificación, no se completó: {title}")
-        
-        if completed_count > 0:
-            logger.info(f"📝 Se completaron {completed_count} recordatorios")
+                    logger.info(f"🚨 Notificación INMEDIATA preparada: {title}")
+                    notifications.append({
+                        "reminder": reminder,
+                        "kind": "immediate",
+                        "message": message,
+                        "summary": render("summary_immediate", "html", due=due_date_local)
+                    })
+        
+        return notifications
             
     except Exception as e:
         logger.error(f"❌ Error en check_immediate_reminders: {e}")
+        return []
 
 @app.post("/send-notification")
-async def send_notification(message: str, reminder_id: Optional[str] = None):
+async def send_notification(message: str, reminder_id: Optional[str] = None, user_id: Optional[str] = None):
     """Envía una notificación inmediata por Telegram"""
     try:
-        success = await send_telegram_message(message)
+        chat_id = get_user_chat_id(user_id) if user_id else None
+        success = await send_telegram_message(message, chat_id)
         
         if success and reminder_id:
             # Marcar recordatorio como notificado
+            now = datetime.utcnow()
             db.reminders.update_one(
                 {"_id": ObjectId(reminder_id)},
-                {"$set": {"last_reminded": datetime.utcnow()}}
+                {"$set": encode_update({"last_reminded": now, "updated_at": now})}
             )
         
         return {"status": "success" if success else "error"}
@@ -1031,15 +2694,856 @@ async def send_notification(message: str, reminder_id: Optional[str] = None):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error enviando notificación: {str(e)}")
 
+# =============================================
+# 🆕 REGISTRO USUARIO -> CHAT DE TELEGRAM
+# =============================================
+TELEGRAM_CACHE_MAX_USERS = int(os.getenv("TELEGRAM_CACHE_MAX_USERS", "50000"))
+# Caché en memoria acotada: user_id -> chat_id (o None si no tiene chat)
+_telegram_chat_cache = LRUTTLCache(TELEGRAM_CACHE_MAX_USERS, TELEGRAM_CHAT_CACHE_TTL)
+# Y en sentido inverso: chat_id -> user_id
+_telegram_user_cache = LRUTTLCache(TELEGRAM_CACHE_MAX_USERS, TELEGRAM_CHAT_CACHE_TTL)
+_NOT_CACHED = object()  # distingue "sin entrada" de un usuario guardado sin chat (None)
+
+def link_telegram_chat(user_id: str, chat_id: str, username: Optional[str] = None):
+    """
+    Vincula un usuario con su chat de Telegram. Un chat pertenece a un solo usuario (índice
+    único): el usuario que lo tenía antes (p. ej. el automático tg_<chat_id>) queda desvinculado.
+    """
+    previous = db.telegram_users.find_one({"user_id": user_id}, {"chat_id": 1})
+    displaced = [
+        doc["user_id"]
+        for doc in db.telegram_users.find({"chat_id": chat_id, "user_id": {"$ne": user_id}}, {"user_id": 1})
+    ]
+    if displaced:
+        db.telegram_users.delete_many({"chat_id": chat_id, "user_id": {"$in": displaced}})
+    db.telegram_users.update_one(
+        {"user_id": user_id},
+        {
+            "$set": {"chat_id": chat_id, "username": username, "linked_at": datetime.utcnow()}
+        },
+        upsert=True
+    )
+    
+    # Las dos cachés (usuario -> chat y chat -> usuario) se corrigen en ambos sentidos
+    for other in displaced:
+        _telegram_chat_cache.pop(other, None)
+    _telegram_chat_cache.set(user_id, chat_id)
+    _telegram_user_cache.pop(chat_id, None)
+    if previous and previous.get("chat_id") != chat_id:
+        _telegram_user_cache.pop(previous.get("chat_id"), None)
+    logger.info(f"🔗 Usuario {user_id} vinculado al chat {chat_id}{f' (antes de {displaced})' if displaced else ''}")
+
+def ensure_telegram_user_indexes():
+    """Crea los índices únicos del registro; antes elimina los chats repetidos (gana el último vínculo)"""
+    seen = set()
+    duplicates = []
+    for doc in db.telegram_users.find({}, {"chat_id": 1, "linked_at": 1}).sort("linked_at", -1):
+        if doc.get("chat_id") in seen:
+            duplicates.append(doc["_id"])
+        else:
+            seen.add(doc.get("chat_id"))
+    if duplicates:
+        db.telegram_users.delete_many({"_id": {"$in": duplicates}})
+        logger.warning(f"⚠️ {len(duplicates)} vínculos de Telegram repetidos eliminados")
+    
+    db.telegram_users.create_index([("user_id", 1)], unique=True)
+    try:
+        db.telegram_users.create_index([("chat_id", 1)], unique=True)
+    except OperationFailure as e:
+        if e.code not in (85, 86):
+            raise
+        # Las versiones anteriores tenían un índice no único con el mismo nombre
+        db.telegram_users.drop_index("chat_id_1")
+        db.telegram_users.create_index([("chat_id", 1)], unique=True)
+
+def hash_link_token(token: str) -> str:
+    """Solo se guarda el hash: quien lea la colección no puede canjear los tokens"""
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+def issue_telegram_link_token(user_id: str) -> Dict[str, Any]:
+    """Crea un token de un solo uso para vincular un chat con el usuario (/start <token>)"""
+    token = secrets.token_urlsafe(24)  # 32 caracteres válidos para el parámetro start de Telegram
+    now = datetime.utcnow()
+    expires_at = now + timedelta(seconds=TELEGRAM_LINK_TOKEN_TTL)
+    db.telegram_link_tokens.insert_one({
+        "token_hash": hash_link_token(token),
+        "user_id": user_id,
+        "created_at": now,
+        "expires_at": expires_at
+    })
+    return {
+        "token": token,
+        "command": f"/start {token}",
+        "link": f"https://t.me/{TELEGRAM_BOT_USERNAME}?start={token}" if TELEGRAM_BOT_USERNAME else None,
+        "expires_at": expires_at.isoformat()
+    }
+
+def redeem_telegram_link_token(token: str) -> Optional[str]:
+    """Canjea el token (una sola vez y antes de que caduque); devuelve el usuario o None"""
+    now = datetime.utcnow()
+    doc = db.telegram_link_tokens.find_one_and_update(
+        {"token_hash": hash_link_token(token), "redeemed_at": None, "expires_at": {"$gt": now}},
+        {"$set": {"redeemed_at": now}},
+        projection={"user_id": 1}
+    )
+    return doc["user_id"] if doc else None
+
+def get_user_chat_ids(user_ids: Iterable[str]) -> Dict[str, Optional[str]]:
+    """Resuelve el chat de varios usuarios con una sola consulta para los que no están en caché"""
+    chat_ids: Dict[str, Optional[str]] = {}
+    missing = []
+    
+    for user_id in set(user_ids):
+        cached = _telegram_chat_cache.get(user_id, _NOT_CACHED)
+        if cached is not _NOT_CACHED:
+            chat_ids[user_id] = cached
+        else:
+            missing.append(user_id)
+    
+    if missing:
+        found = {
+            doc["user_id"]: doc.get("chat_id")
+            for doc in db.telegram_users.find(
+                {"user_id": {"$in": missing}},
+                {"user_id": 1, "chat_id": 1}
+            )
+        }
+        for user_id in missing:
+            chat_ids[user_id] = found.get(user_id)
+            _telegram_chat_cache.set(user_id, chat_ids[user_id])
+    
+    if TELEGRAM_FALLBACK_TO_DEFAULT_CHAT:
+        return {user_id: chat_id or TELEGRAM_CHAT_ID for user_id, chat_id in chat_ids.items()}
+    return chat_ids
+
+def get_user_chat_id(user_id: str) -> Optional[str]:
+    """Obtiene el chat de Telegram de un usuario"""
+    return get_user_chat_ids([user_id]).get(user_id)
+
+# =============================================
+# 🆕 RESUMEN (DIGEST) DE NOTIFICACIONES POR CHAT
+# =============================================
+# Segundos que se acumulan notificaciones de un chat antes de enviarlas juntas (0 = en cuanto se drenan).
+# Con 10 s el aviso previo y el final de una ráfaga salen en un solo mensaje y el retraso es pequeño
+# frente a la antelación del aviso previo (1-2 minutos).
+DIGEST_WINDOW_SECONDS = int(os.getenv("DIGEST_WINDOW_SECONDS", "10"))
+DIGEST_MAX_ITEMS = int(os.getenv("DIGEST_MAX_ITEMS", "20"))  # Recordatorios por mensaje
+SNOOZE_MINUTES = int(os.getenv("SNOOZE_MINUTES", "10"))
+
+def reminder_actions_keyboard(reminder_ids: List[str]) -> Dict[str, Any]:
+    """Botones en línea (completar / posponer) para cada recordatorio"""
+    rows = []
+    for index, reminder_id in enumerate(reminder_ids, start=1):
+        prefix = f"{index}. " if len(reminder_ids) > 1 else ""
+        rows.append([
+            {"text": f"{prefix}✅ Hecho", "callback_data": f"done:{reminder_id}"},
+            {"text": f"{prefix}⏰ +{SNOOZE_MINUTES} min", "callback_data": f"snooze:{reminder_id}"}
+        ])
+    return {"inline_keyboard": rows}
+
+def build_digest_message(items: List[Dict[str, Any]]) -> str:
+    """Un solo mensaje con todos los recordatorios de un chat"""
+    parts = [render("digest_header", "html", count=len(items))]
+    for index, item in enumerate(items, start=1):
+        # El resumen ya viene renderizado en HTML
+        parts.append(render("digest_item", "html", index=index, title=item.get("title") or "Recordatorio",
+                            summary=Markup(item["summary"])))
+    return "".join(parts)
+
+# =============================================
+# 🆕 OUTBOX DE NOTIFICACIONES (entrega con reintentos)
+# =============================================
+OUTBOX_POLL_SECONDS = int(os.getenv("OUTBOX_POLL_SECONDS", "2"))
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "500"))
+OUTBOX_ENQUEUE_BATCH = int(os.getenv("OUTBOX_ENQUEUE_BATCH", "200"))  # notificaciones por transacción
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_BACKOFF_BASE = int(os.getenv("OUTBOX_BACKOFF_BASE", "15"))      # segundos
+OUTBOX_BACKOFF_MAX = int(os.getenv("OUTBOX_BACKOFF_MAX", "3600"))      # segundos
+OUTBOX_LEASE_SECONDS = int(os.getenv("OUTBOX_LEASE_SECONDS", "120"))
+OUTBOX_RETENTION_DAYS = int(os.getenv("OUTBOX_RETENTION_DAYS", "7"))
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+class OutboxStatus(str, Enum):
+    PENDING = "pending"
+    SENDING = "sending"
+    SENT = "sent"
+    DEAD = "dead"
+
+_transactions_supported = True
+
+def run_in_transaction(callback):
+    """
+    Ejecuta callback(session) dentro de una transacción de MongoDB.
+    Si el servidor no soporta transacciones (standalone) se ejecuta sin sesión;
+    la clave de idempotencia del outbox evita duplicados en ese caso.
+    """
+    global _transactions_supported
+    if _transactions_supported:
+        try:
+            with client.start_session() as session:
+                return session.with_transaction(callback)
+        except (OperationFailure, ConfigurationError) as e:
+            if isinstance(e, OperationFailure) and e.code not in (20, 263) and "Transaction numbers" not in str(e):
+                raise
+            _transactions_supported = False
+            logger.warning(f"⚠️ Transacciones no disponibles, usando escrituras sin sesión: {e}")
+    return callback(None)
+
+def reminder_state_change(kind: str) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """Filtro y actualización que marcan un recordatorio como notificado según el tipo de aviso"""
+    now = datetime.utcnow()
+    if kind == "immediate":
+        # 🆕 MARCAR COMO COMPLETADO INMEDIATAMENTE
+        return (
+            {"status": ReminderStatus.PENDING.value, "immediate_notified": {"$ne": True}},
+            {"$set": encode_update({
+                "status": ReminderStatus.COMPLETED.value,  # 🆕 COMPLETADO
+                "completed_at": now,                       # 🆕 Fecha de completado
+                "immediate_notified": True,
+                "last_reminded": now,
+                "updated_at": now
+            })}
+        )
+    return {"last_reminded": None}, {"$set": encode_update({"last_reminded": now, "updated_at": now})}
+
+def outbox_entry(notification: Dict[str, Any], now: datetime) -> Tuple[Dict[str, Any], UpdateOne]:
+    """Documento del outbox y cambio de estado del recordatorio para una notificación"""
+    reminder = notification["reminder"]
+    kind = notification["kind"]
+    due_date = reminder.get("due_date")
+    state_filter, state_update = reminder_state_change(kind)
+    entry = {
+        # La fecha forma parte de la clave: un recordatorio pospuesto puede volver a notificarse
+        "idempotency_key": f"{reminder['_id']}:{kind}:{due_date.isoformat() if due_date else ''}",
+        "user_id": reminder.get("user_id"),
+        "reminder_id": str(reminder["_id"]),
+        "kind": kind,
+        "title": decode_reminder(reminder)["title"],
+        "message": notification["message"],
+        "summary": notification["summary"],
+        "status": OutboxStatus.PENDING.value,
+        "attempts": 0,
+        "next_attempt_at": now,
+        "created_at": now
+    }
+    return entry, UpdateOne({"_id": reminder["_id"], **state_filter}, state_update)
+
+def enqueue_batch(notifications: List[Dict[str, Any]]) -> int:
+    """
+    Registra un lote de notificaciones en el outbox y cambia el estado de sus recordatorios
+    en una sola transacción: una consulta de claves existentes, un insert_many y un
+    bulk_write. Devuelve cuántas son nuevas.
+    """
+    now = datetime.utcnow()
+    entries, state_updates = {}, []
+    for notification in notifications:
+        entry, state_update = outbox_entry(notification, now)
+        entries.setdefault(entry["idempotency_key"], entry)
+        state_updates.append(state_update)
+    
+    def write(session):
+        existing = {doc["idempotency_key"] for doc in db.notification_outbox.find(
+            {"idempotency_key": {"$in": list(entries)}}, {"idempotency_key": 1}, session=session
+        )}
+        new_entries = [entry for key, entry in entries.items() if key not in existing]
+        if new_entries:
+            db.notification_outbox.insert_many(new_entries, ordered=False, session=session)
+        db.reminders.bulk_write(state_updates, ordered=False, session=session)
+        return len(new_entries)
+    
+    return run_in_transaction(write)
+
+def enqueue_notification(notification: Dict[str, Any]) -> bool:
+    """
+    Registra la notificación en el outbox y cambia el estado del recordatorio en la
+    misma transacción. Devuelve False si ya estaba encolada.
+    """
+    try:
+        return enqueue_batch([notification]) == 1
+    except (DuplicateKeyError, BulkWriteError):
+        # Otro worker la encoló al mismo tiempo
+        return False
+
+def enqueue_notifications(notifications: List[Dict[str, Any]]) -> int:
+    """
+    Encola varias notificaciones por lotes de OUTBOX_ENQUEUE_BATCH; devuelve cuántas son
+    nuevas. Si un lote choca con otro worker (clave duplicada) o falla, ese lote se
+    reintenta de a una para no perder las demás.
+    """
+    created = 0
+    for start in range(0, len(notifications), OUTBOX_ENQUEUE_BATCH):
+        batch = notifications[start:start + OUTBOX_ENQUEUE_BATCH]
+        try:
+            created += enqueue_batch(batch)
+            continue
+        except Exception as e:
+            logger.warning(f"⚠️ Lote del outbox rechazado, encolando de a una: {e}")
+        for notification in batch:
+            try:
+                if enqueue_notification(notification):
+                    created += 1
+            except Exception as e:
+                logger.error(f"❌ Error encolando notificación {notification['reminder'].get('_id')}: {e}")
+    if created:
+        logger.info(f"📥 {created} notificaciones agregadas al outbox")
+    return created
+
+def outbox_backoff_seconds(attempts: int) -> int:
+    """Espera exponencial con jitter para el siguiente intento"""
+    delay = min(OUTBOX_BACKOFF_BASE * (2 ** max(attempts - 1, 0)), OUTBOX_BACKOFF_MAX)
+    return int(delay * random.uniform(0.8, 1.2))
+
+def claim_outbox_batch() -> List[Dict[str, Any]]:
+    """Reserva (lease) las filas listas para enviar, respetando la ventana del digest"""
+    now = datetime.utcnow()
+    
+    # Filas de un worker que murió mientras enviaba vuelven a estar disponibles
+    db.notification_outbox.update_many(
+        {"status": OutboxStatus.SENDING.value, "lease_until": {"$lt": now}},
+        {"$set": {"status": OutboxStatus.PENDING.value}}
+    )
+    
+    candidates = list(db.notification_outbox.find(
+        {"status": OutboxStatus.PENDING.value, "next_attempt_at": {"$lte": now}},
+        {"_id": 1, "user_id": 1, "created_at": 1}
+    ).sort("created_at", 1).limit(OUTBOX_BATCH_SIZE))
+    
+    # Un chat se envía cuando su fila más antigua cumplió la ventana del digest; varios usuarios
+    # pueden compartir chat (el chat por defecto), y sus filas salen en el mismo mensaje.
+    # Las filas sin chat se agrupan por usuario para que sigan su camino de reintentos.
+    chat_ids = get_user_chat_ids([row.get("user_id") for row in candidates])
+    chat_key = lambda row: chat_ids.get(row.get("user_id")) or ("user", row.get("user_id"))
+    window_start = now - timedelta(seconds=DIGEST_WINDOW_SECONDS)
+    ready_chats = {chat_key(row) for row in candidates if row["created_at"] <= window_start}
+    ids = [row["_id"] for row in candidates if chat_key(row) in ready_chats]
+    if not ids:
+        return []
+    
+    claim_token = str(ObjectId())
+    db.notification_outbox.update_many(
+        {"_id": {"$in": ids}, "status": OutboxStatus.PENDING.value},
+        {"$set": {
+            "status": OutboxStatus.SENDING.value,
+            "claim": claim_token,
+            "lease_until": now + timedelta(seconds=OUTBOX_LEASE_SECONDS)
+        }}
+    )
+    rows = list(db.notification_outbox.find({"claim": claim_token}).sort("created_at", 1))
+    for row in rows:
+        row["chat_id"] = chat_ids.get(row.get("user_id"))
+    return rows
+
+def record_outbox_failure(rows: List[Dict[str, Any]], error: str):
+    """Programa el reintento o manda a dead-letter las filas que fallaron"""
+    now = datetime.utcnow()
+    for row in rows:
+        attempts = row.get("attempts", 0) + 1
+        update = {"attempts": attempts, "last_error": error, "updated_at": now}
+        if attempts >= OUTBOX_MAX_ATTEMPTS:
+            update["status"] = OutboxStatus.DEAD.value
+            logger.error(f"☠️ Notificación enviada a dead-letter tras {attempts} intentos: {row['idempotency_key']}")
+        else:
+            update["status"] = OutboxStatus.PENDING.value
+            update["next_attempt_at"] = now + timedelta(seconds=outbox_backoff_seconds(attempts))
+        db.notification_outbox.update_one({"_id": row["_id"]}, {"$set": update, "$unset": {"claim": ""}})
+
+async def send_outbox_chat(chat_id: Optional[str], rows: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """Envía las filas de un chat como digest; devuelve (enviadas, fallidas)"""
+    if not chat_id:
+        return [], rows
+    
+    sent, failed = [], []
+    for start in range(0, len(rows), DIGEST_MAX_ITEMS):
+        chunk = rows[start:start + DIGEST_MAX_ITEMS]
+        message = chunk[0]["message"] if len(chunk) == 1 else build_digest_message(chunk)
+        keyboard = reminder_actions_keyboard([row["reminder_id"] for row in chunk])
+        if await send_telegram_message(message, chat_id, reply_markup=keyboard):
+            sent.extend(chunk)
+        else:
+            failed.extend(chunk)
+    return sent, failed
+
+def finish_outbox_batch(sent: List[Dict[str, Any]], failed: List[Dict[str, Any]]):
+    """Marca como enviadas las filas entregadas y programa el reintento de las demás"""
+    if sent:
+        db.notification_outbox.update_many(
+            {"_id": {"$in": [row["_id"] for row in sent]}},
+            {"$set": {"status": OutboxStatus.SENT.value, "sent_at": datetime.utcnow()}, "$unset": {"claim": ""}}
+        )
+    if failed:
+        record_outbox_failure(failed, "Error enviando a Telegram o usuario sin chat vinculado")
+
+async def drain_outbox() -> int:
+    """Envía un lote del outbox: un mensaje por chat, en paralelo entre chats"""
+    rows = await asyncio.to_thread(claim_outbox_batch)
+    if not rows:
+        return 0
+    
+    # claim_outbox_batch ya resolvió el chat de cada fila
+    by_chat: Dict[Optional[str], List[Dict[str, Any]]] = {}
+    for row in rows:
+        by_chat.setdefault(row["chat_id"], []).append(row)
+    
+    results = await asyncio.gather(*(send_outbox_chat(chat_id, chat_rows) for chat_id, chat_rows in by_chat.items()))
+    
+    sent = [row for chat_sent, _ in results for row in chat_sent]
+    failed = [row for _, chat_failed in results for row in chat_failed]
+    
+    await asyncio.to_thread(finish_outbox_batch, sent, failed)
+    logger.info(f"📨 Outbox: {len(sent)} enviadas, {len(failed)} con reintento ({len(by_chat)} chats)")
+    return len(rows)
+
+async def outbox_worker():
+    """Tarea en segundo plano que drena el outbox"""
+    while True:
+        try:
+            processed = await drain_outbox()
+            # Si el lote venía lleno, seguir drenando sin esperar
+            if processed < OUTBOX_BATCH_SIZE:
+                await asyncio.sleep(OUTBOX_POLL_SECONDS)
+        except Exception as e:
+            logger.error(f"Error en outbox_worker: {e}")
+            await asyncio.sleep(OUTBOX_POLL_SECONDS * 5)
+
+def require_admin(x_admin_token: Optional[str]):
+    """Valida el token de administración (si está configurado)"""
+    if ADMIN_TOKEN and x_admin_token != ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Token de administración inválido")
+
+@app.get("/admin/admission")
+async def get_admission_stats(x_admin_token: Optional[str] = Header(None)):
+    """Profundidad de cola, peticiones en curso y contadores de rechazo del control de admisión"""
+    require_admin(x_admin_token)
+    return admission.stats()
+
+@app.get("/admin/change-streams")
+async def get_change_stream_stats(x_admin_token: Optional[str] = Header(None)):
+    """Estado de los change streams, del reparto de eventos y de la cola de vencimientos"""
+    require_admin(x_admin_token)
+    return {
+        "enabled": bool(change_consumers),
+        "consumers": {name: consumer.stats() for name, consumer in change_consumers.items()},
+        "bus": change_bus.stats(),
+        "due_queue": reminder_due_queue.stats()
+    }
+
+@app.get("/admin/outbox")
+async def list_outbox(status: OutboxStatus = OutboxStatus.DEAD, limit: int = 50, x_admin_token: Optional[str] = Header(None)):
+    """Lista las notificaciones del outbox (por defecto, las que están en dead-letter)"""
+    require_admin(x_admin_token)
+    try:
+        def load_outbox():
+            counts = {
+                item.value: db.notification_outbox.count_documents({"status": item.value})
+                for item in OutboxStatus
+            }
+            return counts, list(db.notification_outbox.find({"status": status.value}).sort("created_at", -1).limit(limit))
+        
+        counts, rows = await asyncio.to_thread(load_outbox)
+        
+        for row in rows:
+            row["_id"] = str(row["_id"])
+            for field in ["created_at", "next_attempt_at", "lease_until", "sent_at", "updated_at"]:
+                if row.get(field):
+                    row[field] = row[field].isoformat()
+        
+        return {"counts": counts, "items": rows, "status": status.value}
+    
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error obteniendo outbox: {str(e)}")
+
+@app.post("/admin/outbox/{outbox_id}/retry")
+async def retry_outbox_item(outbox_id: str, x_admin_token: Optional[str] = Header(None)):
+    """Vuelve a poner en cola una notificación en dead-letter"""
+    require_admin(x_admin_token)
+    if not ObjectId.is_valid(outbox_id):
+        raise HTTPException(status_code=404, detail="Notificación no encontrada")
+    
+    result = await asyncio.to_thread(
+        db.notification_outbox.update_one,
+        {"_id": ObjectId(outbox_id), "status": OutboxStatus.DEAD.value},
+        {"$set": {"status": OutboxStatus.PENDING.value, "attempts": 0, "next_attempt_at": datetime.utcnow()}}
+    )
+    if result.modified_count == 0:
+        raise HTTPException(status_code=404, detail="Notificación no encontrada en dead-letter")
+    
+    return {"status": "success", "message": "Notificación reencolada"}
+
+async def handle_reminder_action(callback: Dict[str, Any]):
+    """Procesa los botones en línea de las notificaciones (completar / posponer)"""
+    data = callback.get("data") or ""
+    chat_id = str(((callback.get("message") or {}).get("chat") or {}).get("id", ""))
+    action, _, reminder_id = data.partition(":")
+    
+    answer = render("action_invalid")
+    if action in ("done", "snooze") and ObjectId.is_valid(reminder_id) and chat_id:
+        user_id = await asyncio.to_thread(get_chat_user_id, chat_id)
+        now = datetime.utcnow()
+        if action == "done":
+            update = encode_update({"status": ReminderStatus.COMPLETED.value, "completed_at": now, "updated_at": now})
+            answer = render("action_done")
+        else:
+            update = encode_update({
+                "status": ReminderStatus.PENDING.value,
+                "due_date": now + timedelta(minutes=SNOOZE_MINUTES),
+                "last_reminded": None,
+                "immediate_notified": False,
+                "updated_at": now
+            })
+            answer = render("action_snoozed", minutes=SNOOZE_MINUTES)
+        
+        # Solo se pueden modificar recordatorios del usuario vinculado a este chat
+        result = await asyncio.to_thread(
+            db.reminders.update_one,
+            {"_id": ObjectId(reminder_id), "user_id": user_id},
+            {"$set": update}
+        )
+        if result.matched_count == 0:
+            answer = render("action_not_found")
+    
+    await call_telegram_api("answerCallbackQuery", {"callback_query_id": callback.get("id"), "text": answer})
+
+async def handle_telegram_start(chat_id: str, text: str, sender: Dict[str, Any]):
+    """
+    Procesa /start <token> para vincular el chat con un usuario. El token lo emite la app
+    (POST /user/{user_id}/telegram-link): nunca se acepta un user_id escrito en el chat.
+    """
+    parts = text.split(maxsplit=1)
+    token = parts[1].strip() if len(parts) > 1 else ""
+    
+    if not token:
+        await send_telegram_message(render("telegram_start_help", "html"), chat_id)
+        return
+    
+    user_id = await asyncio.to_thread(redeem_telegram_link_token, token)
+    if user_id is None:
+        await send_telegram_message(render("telegram_link_invalid", "html"), chat_id)
+        return
+    
+    await asyncio.to_thread(link_telegram_chat, user_id, chat_id, sender.get("username"))
+    await send_telegram_message(render("telegram_linked", "html", user_id=user_id), chat_id)
+
+@app.post("/user/{user_id}/telegram-link")
+async def create_telegram_link(user_id: str):
+    """🆕 Token de un solo uso para vincular Telegram: se abre el enlace o se envía /start <token> al bot"""
+    try:
+        link = await run_admitted(user_id, "write", issue_telegram_link_token, user_id)
+        return {"status": "success", **link}
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error creando el enlace de Telegram: {str(e)}")
+
+# =============================================
+# 🆕 ENTRADA DE MENSAJES DESDE TELEGRAM (webhook + cola de trabajo)
+# =============================================
+TELEGRAM_WORKERS = int(os.getenv("TELEGRAM_WORKERS", "4"))
+TELEGRAM_QUEUE_SIZE = int(os.getenv("TELEGRAM_QUEUE_SIZE", "1000"))
+
+telegram_update_queue: Optional[asyncio.Queue] = None
+# Updates ya recibidos (Telegram reintenta si no respondemos a tiempo)
+_recent_update_ids: "OrderedDict[int, None]" = OrderedDict()
+
+def get_chat_user_id(chat_id: str) -> str:
+    """Obtiene el usuario vinculado a un chat; si no existe, lo vincula como tg_<chat_id>"""
+    cached = _telegram_user_cache.get(chat_id)
+    if cached:
+        return cached
+    
+    doc = db.telegram_users.find_one({"chat_id": chat_id}, {"user_id": 1})
+    if doc:
+        user_id = doc["user_id"]
+    else:
+        user_id = f"tg_{chat_id}"
+        try:
+            db.telegram_users.insert_one({"user_id": user_id, "chat_id": chat_id, "username": None, "linked_at": datetime.utcnow()})
+        except DuplicateKeyError:
+            # Otro mensaje (o un /start) vinculó el chat a la vez: manda lo que quedó guardado
+            doc = db.telegram_users.find_one({"chat_id": chat_id}, {"user_id": 1})
+            user_id = doc["user_id"] if doc else user_id
+        _telegram_chat_cache.set(user_id, chat_id)
+    
+    _telegram_user_cache.set(chat_id, user_id)
+    return user_id
+
+async def process_telegram_update(update: Dict[str, Any]):
+    """Procesa un update de Telegram con el mismo pipeline que /interact"""
+    if update.get("callback_query"):
+        await handle_reminder_action(update["callback_query"])
+        return
+    
+    message = update.get("message") or {}
+    text = (message.get("text") or "").strip()
+    chat_id = (message.get("chat") or {}).get("id")
+    
+    if not chat_id or not text:
+        return
+    chat_id = str(chat_id)
+    
+    if text.startswith("/start"):
+        await handle_telegram_start(chat_id, text, message.get("from") or {})
+        return
+    
+    user_id = await asyncio.to_thread(get_chat_user_id, chat_id)
+    # El pipeline usa PyMongo síncrono: se ejecuta fuera del event loop
+    result = await run_interaction(user_id, text, "telegram")
+    await send_telegram_message(result["response_html"], chat_id)
+
+async def telegram_update_worker(worker_id: int):
+    """Worker que consume la cola de updates de Telegram"""
+    while True:
+        update = await telegram_update_queue.get()
+        try:
+            await process_telegram_update(update)
+        except Exception as e:
+            logger.error(f"❌ Worker Telegram {worker_id}: error procesando update {update.get('update_id')}: {e}", exc_info=True)
+        finally:
+            telegram_update_queue.task_done()
+
+def start_telegram_workers():
+    """Crea la cola de updates y lanza los workers"""
+    global telegram_update_queue
+    telegram_update_queue = asyncio.Queue(maxsize=TELEGRAM_QUEUE_SIZE)
+    for worker_id in range(TELEGRAM_WORKERS):
+        asyncio.create_task(telegram_update_worker(worker_id))
+    logger.info(f"✅ {TELEGRAM_WORKERS} workers de Telegram iniciados")
+
+@app.post("/telegram/webhook")
+async def telegram_webhook(update: Dict[str, Any], x_telegram_bot_api_secret_token: Optional[str] = Header(None)):
+    """
+    Recibe updates del bot de Telegram y los encola; responde de inmediato.
+    Para probar en local: curl -X POST localhost:8000/telegram/webhook
+    -H 'Content-Type: application/json' -d @tests/fixtures/telegram/message.json
+    """
+    if TELEGRAM_WEBHOOK_SECRET and x_telegram_bot_api_secret_token != TELEGRAM_WEBHOOK_SECRET:
+        raise HTTPException(status_code=403, detail="Token secreto inválido")
+    
+    update_id = update.get("update_id")
+    if update_id is not None and update_id in _recent_update_ids:
+        return {"ok": True, "duplicate": True}
+    
+    # Con 503 Telegram reintenta: el update solo cuenta como recibido una vez encolado
+    if telegram_update_queue is None:
+        raise HTTPException(status_code=503, detail="Workers de Telegram no iniciados")
+    try:
+        telegram_update_queue.put_nowait(update)
+    except asyncio.QueueFull:
+        raise HTTPException(status_code=503, detail="Cola de mensajes llena")
+    
+    if update_id is not None:
+        _recent_update_ids[update_id] = None
+        if len(_recent_update_ids) > TELEGRAM_QUEUE_SIZE:
+            _recent_update_ids.popitem(last=False)
+    
+    return {"ok": True, "queued": True}
+
+# =============================================
+# 🆕 CAMBIOS EN TIEMPO REAL (CHANGE STREAMS)
+# =============================================
+# "auto": se activan con MongoDB (Atlas es un replica set); "off": solo reescaneo periódico
+CHANGE_STREAMS = os.getenv("CHANGE_STREAMS", "auto")
+REMINDER_POLL_SECONDS = int(os.getenv("REMINDER_POLL_SECONDS", "30"))        # Reescaneo sin change streams
+REMINDER_RESCAN_SECONDS = int(os.getenv("REMINDER_RESCAN_SECONDS", "300"))   # Reescaneo de respaldo con change streams
+REMINDER_MIN_CHECK_SECONDS = float(os.getenv("REMINDER_MIN_CHECK_SECONDS", "1"))
+SSE_KEEPALIVE_SECONDS = int(os.getenv("SSE_KEEPALIVE_SECONDS", "15"))
+
+# Momentos en que se despierta al verificador para cada recordatorio, sacados de las ventanas
+# de check_*_reminders: el aviso previo se evalúa al límite superior de su ventana (queda
+# un minuto de margen para la latencia), el inmediato al abrirse la suya y el vencido en 0
+REMINDER_WAKE_OFFSETS = (
+    timedelta(minutes=UPCOMING_NOTICE_MINUTES[1]),
+    timedelta(seconds=IMMEDIATE_NOTICE_SECONDS),
+    timedelta(0)
+)
+
+change_bus = EventBus()
+change_consumers: Dict[str, ChangeStreamConsumer] = {}
+scheduler_wake = asyncio.Event()
+
+def change_feed_active(*collections: str) -> bool:
+    """True si los change streams de todas las colecciones están conectados"""
+    return bool(collections) and all(
+        name in change_consumers and change_consumers[name].active for name in collections
+    )
+
+class ReminderDueQueue:
+    """
+    Próximos instantes en que el verificador tiene trabajo, para despertarlo justo a tiempo.
+    Contiene los recordatorios pendientes que vencen antes del siguiente reescaneo; los
+    eventos de cambio la mantienen al día entre reescaneos. Las entradas reemplazadas se
+    descartan al salir del heap.
+    """
+    
+    def __init__(self):
+        self._heap: List[Tuple[datetime, str, datetime]] = []
+        self._due: Dict[str, datetime] = {}
+        self._owners: Dict[str, str] = {}
+        self.horizon = datetime.min
+        self.stale = True
+    
+    def track(self, reminder_id: Any, due_date: datetime, user_id: Optional[str] = None) -> bool:
+        """Registra el vencimiento; True si es nuevo o cambió y cae antes del próximo reescaneo"""
+        key = str(reminder_id)
+        if user_id:
+            self._owners[key] = user_id
+        if due_date > self.horizon:
+            self._due.pop(key, None)
+            return False
+        if self._due.get(key) == due_date:
+            return False
+        self._due[key] = due_date
+        for offset in REMINDER_WAKE_OFFSETS:
+            heapq.heappush(self._heap, (due_date - offset, key, due_date))
+        return True
+    
+    def discard(self, reminder_id: Any) -> Optional[str]:
+        """Quita el recordatorio; devuelve su usuario si se conocía"""
+        key = str(reminder_id)
+        self._due.pop(key, None)
+        return self._owners.pop(key, None)
+    
+    def owner(self, reminder_id: Any) -> Optional[str]:
+        return self._owners.get(str(reminder_id))
+    
+    def replace_all(self, reminders: List[Dict[str, Any]], horizon: datetime):
+        self._heap, self._due, self._owners = [], {}, {}
+        self.horizon = horizon
+        for reminder in reminders:
+            self.track(reminder["_id"], reminder["due_date"], reminder.get("user_id"))
+        self.stale = False
+    
+    def next_wake(self, now: datetime) -> Optional[datetime]:
+        while self._heap:
+            wake_at, key, due_date = self._heap[0]
+            if wake_at > now and self._due.get(key) == due_date:
+                return wake_at
+            heapq.heappop(self._heap)
+        return None
+    
+    def stats(self) -> Dict[str, Any]:
+        return {"tracked": len(self._due), "heap": len(self._heap), "horizon": self.horizon.isoformat(), "stale": self.stale}
+
+reminder_due_queue = ReminderDueQueue()
+
+def reload_due_queue(interval_seconds: float):
+    """Carga los pendientes que vencen antes del siguiente reescaneo (más la ventana de aviso)"""
+    horizon = datetime.utcnow() + timedelta(seconds=interval_seconds) + max(REMINDER_WAKE_OFFSETS)
+    reminders = list(db.reminders.find(
+        {"status": ReminderStatus.PENDING.value, "due_date": {"$lte": horizon}},
+        {"_id": 1, "user_id": 1, "due_date": 1}
+    ))
+    reminder_due_queue.replace_all(reminders, horizon)
+
+def on_reminder_change(event: Dict[str, Any]):
+    """Mantiene la cola de vencimientos y las estadísticas, y avisa a los suscriptores del usuario"""
+    stats_cache.invalidate()
+    if event["operation"] == "resync":
+        reminder_due_queue.stale = True
+        scheduler_wake.set()
+        change_bus.broadcast({"type": "resync"})
+        return
+    
+    doc = event.get("document")
+    if doc is None:
+        # Borrado (o borrado antes de leer el documento completo)
+        user_id = reminder_due_queue.discard(event["id"])
+        if user_id:
+            change_bus.push(user_id, {"type": "delete", "reminder": {"_id": str(event["id"])}})
+        return
+    
+    fields = decode_reminder(doc)
+    if fields.get("status") == ReminderStatus.PENDING.value and isinstance(fields.get("due_date"), datetime):
+        if reminder_due_queue.track(doc["_id"], fields["due_date"], fields.get("user_id")):
+            scheduler_wake.set()
+    else:
+        reminder_due_queue.discard(doc["_id"])
+    
+    if fields.get("user_id"):
+        change_bus.push(fields["user_id"], {"type": event["operation"], "reminder": serialize_reminder(doc)})
+
+def on_interaction_change(event: Dict[str, Any]):
+    stats_cache.invalidate()
+
+def start_change_streams():
+    """Arranca un consumidor por colección (reminders e interactions)"""
+    if CHANGE_STREAMS == "off" or STORAGE_BACKEND != "mongo":
+        logger.info("👂 Change streams desactivados: el verificador reescanea periódicamente")
+        return
+    tokens = ResumeTokenStore(db.change_stream_tokens)
+    change_bus.subscribe("reminders", on_reminder_change)
+    change_bus.subscribe("interactions", on_interaction_change)
+    change_bus.subscribe("reminders", on_search_change)
+    change_bus.subscribe("interactions", on_search_change)
+    change_bus.subscribe("reminders", on_calendar_change)
+    loop = asyncio.get_running_loop()
+    for collection in (db.reminders, db.interactions):
+        consumer = ChangeStreamConsumer(collection, change_bus, tokens)
+        change_consumers[consumer.name] = consumer
+        consumer.start(loop)
+
+def stop_change_streams():
+    for consumer in change_consumers.values():
+        consumer.stop()
+
+@app.get("/events/{user_id}")
+async def stream_user_events(user_id: str, request: Request):
+    """Eventos en vivo (SSE) de los recordatorios del usuario, sin consultar la base de datos"""
+    queue = change_bus.open_queue(user_id)
+    
+    async def events():
+        try:
+            yield f"retry: 5000\nevent: ready\ndata: {orjson.dumps({'live': change_feed_active('reminders')}).decode()}\n\n"
+            while not await request.is_disconnected():
+                try:
+                    payload = await asyncio.wait_for(queue.get(), SSE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"event: {payload['type']}\ndata: {orjson.dumps(payload).decode()}\n\n"
+        finally:
+            change_bus.close_queue(user_id, queue)
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 async def background_reminder_checker():
-    """Tarea en segundo plano para verificar recordatorios cada 30 segundos"""
+    """
+    Tarea en segundo plano que verifica recordatorios. Duerme hasta el próximo vencimiento
+    conocido o hasta que un cambio la despierte; el reescaneo completo queda de respaldo
+    (cada 30 segundos sin change streams, cada 5 minutos con ellos).
+    """
+    global scheduler_last_tick
+    last_rescan = 0.0
     while True:
         try:
-            await check_pending_reminders()     # Avisos 1-2 minutos antes
-            await check_immediate_reminders()   # 🆕 Notificación FINAL + COMPLETAR
-            await check_overdue_reminders()      # Recordatorios que se pasaron sin notificar
+            scheduler_last_tick = datetime.utcnow()
+            scheduler_wake.clear()
+            notifications = []
+            notifications += await check_pending_reminders()     # Avisos 1-2 minutos antes
+            notifications += await check_immediate_reminders()   # 🆕 Notificación FINAL + COMPLETAR
+            notifications += await check_overdue_reminders()     # Recordatorios que se pasaron sin notificar
+            # 🆕 Se encolan en el outbox junto con el cambio de estado; el outbox_worker los envía
+            if notifications:
+                await asyncio.to_thread(enqueue_notifications, notifications)
             # 🚫 Ya no llamamos a complete_expired_reminders()
-            await asyncio.sleep(30)  # Verificar cada 30 segundos
+            
+            interval = REMINDER_RESCAN_SECONDS if change_feed_active("reminders") else REMINDER_POLL_SECONDS
+            if reminder_due_queue.stale or time.monotonic() - last_rescan >= interval:
+                await asyncio.to_thread(reload_due_queue, interval)
+                last_rescan = time.monotonic()
+            
+            timeout = interval - (time.monotonic() - last_rescan)
+            next_wake = reminder_due_queue.next_wake(datetime.utcnow())
+            if next_wake:
+                timeout = min(timeout, (next_wake - datetime.utcnow()).total_seconds())
+            try:
+                await asyncio.wait_for(scheduler_wake.wait(), max(timeout, REMINDER_MIN_CHECK_SECONDS))
+            except asyncio.TimeoutError:
+                pass
         except Exception as e:
             logger.error(f"Error en background_reminder_checker: {e}")
             await asyncio.sleep(60)
@@ -1047,11 +3551,61 @@ async def background_reminder_checker():
 @app.on_event("startup")
 async def startup_event():
     try:
+        # 🆕 Sondas de salud: primero, para que /readyz refleje también un arranque fallido
+        asyncio.create_task(health_prober())
+        
         # Crear índices para mejor performance
         db.interactions.create_index([("user_id", 1), ("timestamp", -1)])
         db.interactions.create_index([("intent", 1)])
         db.reminders.create_index([("user_id", 1), ("due_date", 1)])
         db.reminders.create_index([("status", 1), ("due_date", 1)])
+        db.reminders.create_index([("idempotency_key", 1)], unique=True, sparse=True)
+        db.reminders.create_index([("user_id", 1), ("ua", -1)])   # 🆕 validador de los ETag
+        asyncio.create_task(reminder_schema_migrator())
+        ensure_telegram_user_indexes()
+        db.telegram_link_tokens.create_index([("token_hash", 1)], unique=True)
+        db.telegram_link_tokens.create_index([("expires_at", 1)], expireAfterSeconds=0)
+        if CONTEXT_BACKEND == "mongo":
+            db.conversation_contexts.create_index([("updated_at", 1)], expireAfterSeconds=CONTEXT_TTL_SECONDS)
+        
+        # Probar Telegram (ya dentro del event loop)
+        asyncio.create_task(test_telegram_connection())
+        
+        # 🆕 Agenda: consultas por rango de fechas
+        db.scheduled_events.create_index([("user_id", 1), ("scheduled_datetime", 1)])
+        db.scheduled_events.create_index([("idempotency_key", 1)], unique=True, sparse=True)
+        asyncio.create_task(agenda_backfiller())
+        
+        # 🆕 Exportación: recorrido por usuario en orden de _id
+        for collection in ("interactions", "reminders", "scheduled_events"):
+            db[collection].create_index([("user_id", 1), ("_id", 1)])
+        
+        # 🆕 Workers para los mensajes que llegan por el webhook de Telegram
+        start_telegram_workers()
+        
+        # 🆕 Outbox de notificaciones
+        db.notification_outbox.create_index([("idempotency_key", 1)], unique=True)
+        db.notification_outbox.create_index([("status", 1), ("next_attempt_at", 1)])
+        db.notification_outbox.create_index([("claim", 1)], sparse=True)
+        db.notification_outbox.create_index([("sent_at", 1)], expireAfterSeconds=OUTBOX_RETENTION_DAYS * 86400)
+        asyncio.create_task(outbox_worker())
+        
+        # 🆕 Perfil de rutinas: los incrementos se escriben por lotes
+        asyncio.create_task(routine_profile_flusher())
+        
+        # 🆕 Modelos de sugerencias (los genera el job build-suggestions; aquí solo se recargan)
+        asyncio.create_task(suggestion_cache_reloader())
+        
+        # 🆕 Configuración del NLU: carga inicial y recarga en caliente
+        seed_nlu_collection()
+        reload_nlu_config(force=True)
+        asyncio.create_task(nlu_config_watcher())
+        load_intent_model()
+        await nlu_executor.start(get_nlu().config)
+        await speech_pipeline.start()
+        
+        # 🆕 Change streams: despiertan al verificador y mantienen las cachés locales
+        start_change_streams()
         
         # 🆕 INICIAR VERIFICADOR DE RECORDATORIOS EN SEGUNDO PLANO
         asyncio.create_task(background_reminder_checker())
@@ -1060,6 +3614,17 @@ async def startup_event():
     except Exception as e:
         logger.error(f"Error en startup: {e}")
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    await close_telegram_session()
+    try:
+        await asyncio.to_thread(flush_routine_profiles)
+    except Exception as e:
+        logger.error(f"❌ Error guardando perfiles de rutinas al cerrar: {e}")
+    nlu_executor.shutdown()
+    speech_pipeline.shutdown()
+    await asyncio.to_thread(stop_change_streams)
+
 @app.get("/test-telegram-manual")
 async def test_telegram_manual():
     """Endpoint para probar Telegram manualmente"""
@@ -1073,7 +3638,7 @@ async def test_telegram_manual():
         "message": "Prueba completada - revisa la terminal y Telegram"
     }
 
-async def check_overdue_reminders():
+async def check_overdue_reminders() -> List[Dict[str, Any]]:
     """Verifica recordatorios que ya vencieron pero están pendientes"""
     try:
         now = datetime.utcnow()
@@ -1084,27 +3649,23 @@ async def check_overdue_reminders():
             "last_reminded": None  # Y no han sido notificados
         })
         
+        notifications = []
         for reminder in overdue_reminders:
-            title = reminder.get("title", "Recordatorio")
-            description = reminder.get("description", "")
-            
-            message = f"🔔 <b>RECORDATORIO VENCIDO</b>\n\n"
-            message += f"<b>{title}</b>\n"
-            if description:
-                message += f"{description}\n"
-            message += f"\n⏰ <i>¡Este recordatorio ya venció!</i>"
+            fields = decode_reminder(reminder)
+            title, description = fields["title"], fields["description"]
             
-            success = await send_telegram_message(message)
-            
-            if success:
-                db.reminders.update_one(
-                    {"_id": reminder["_id"]},
-                    {"$set": {"last_reminded": now}}
-                )
-                logger.info(f"Notificación de vencimiento enviada: {title}")
+            notifications.append({
+                "reminder": reminder,
+                "kind": "overdue",
+                "message": render("notify_overdue", "html", title=title, description=description),
+                "summary": render("summary_overdue", "html")
+            })
+        
+        return notifications
         
     except Exception as e:
         logger.error(f"Error verificando recordatorios vencidos: {e}")
+        return []
 
 @app.post("/test-reminder-2min")
 async def test_reminder_2min():
@@ -1112,7 +3673,7 @@ async def test_reminder_2min():
     try:
         due_date = datetime.utcnow() + timedelta(minutes=2)
         
-        reminder_data = {
+        reminder_data = encode_reminder({
             "user_id": "test_user",
             "title": "PRUEBA - Recordatorio en 2 minutos",
             "description": "Este es un recordatorio de prueba programado para 2 minutos en el futuro",
@@ -1120,9 +3681,8 @@ async def test_reminder_2min():
             "priority": ReminderPriority.MEDIUM.value,
             "tags": ["prueba"],
             "created_at": datetime.utcnow(),
-            "status": ReminderStatus.PENDING.value,
-            "last_reminded": None
-        }
+            "status": ReminderStatus.PENDING.value
+        })
         
         result = db.reminders.insert_one(reminder_data)
         
@@ -1165,39 +3725,35 @@ async def test_timezone():
     }
 
 @app.get("/reminders-debug/{user_id}")
-async def debug_reminders_status(user_id: str):
+async def debug_reminders_status(user_id: str, request: Request, response: Response):
     """Endpoint de debug para ver todos los estados de recordatorios"""
     try:
-        # Contar por estado
-        pending_count = db.reminders.count_documents({
-            "user_id": user_id, 
-            "status": ReminderStatus.PENDING.value
-        })
-        
-        completed_count = db.reminders.count_documents({
-            "user_id": user_id, 
-            "status": ReminderStatus.COMPLETED.value
-        })
-        
-        # Obtener algunos ejemplos de cada estado
-        pending_examples = list(db.reminders.find({
-            "user_id": user_id,
-            "status": ReminderStatus.PENDING.value
-        }).limit(3))
-        
-        completed_examples = list(db.reminders.find({
-            "user_id": user_id, 
-            "status": ReminderStatus.COMPLETED.value
-        }).limit(3))
+        # 🆕 Si nada cambió no se repiten los conteos ni las consultas de ejemplo
+        etag = make_etag("reminders-debug", user_id, *await asyncio.to_thread(reminders_validator, {"user_id": user_id}))
+        if etag_matches(request, etag):
+            return not_modified(etag)
+        response.headers["ETag"] = etag
+        response.headers["Cache-Control"] = CONDITIONAL_CACHE_CONTROL
+        
+        # Contar por estado y obtener algunos ejemplos de cada uno (fuera del event loop)
+        def load_status(status: ReminderStatus):
+            query = {"user_id": user_id, "status": status.value}
+            return db.reminders.count_documents(query), list(db.reminders.find(query).limit(3))
+        
+        (pending_count, pending_examples), (completed_count, completed_examples) = await asyncio.gather(
+            asyncio.to_thread(load_status, ReminderStatus.PENDING),
+            asyncio.to_thread(load_status, ReminderStatus.COMPLETED)
+        )
         
         # Formatear para respuesta
         def format_reminder(reminder):
+            fields = decode_reminder(reminder)
             return {
-                "id": str(reminder["_id"]),
-                "title": reminder.get("title"),
-                "status": reminder.get("status"),
-                "due_date": reminder.get("due_date").isoformat() if reminder.get("due_date") else None,
-                "completed_at": reminder.get("completed_at").isoformat() if reminder.get("completed_at") else None
+                "id": str(fields["_id"]),
+                "title": fields["title"],
+                "status": fields.get("status"),
+                "due_date": fields["due_date"].isoformat() if fields["due_date"] else None,
+                "completed_at": fields["completed_at"].isoformat() if fields["completed_at"] else None
             }
         
         return {
@@ -1214,6 +3770,17 @@ async def debug_reminders_status(user_id: str):
         raise HTTPException(status_code=500, detail=f"Error en debug: {str(e)}")
 
 if __name__ == "__main__":
+    import sys
+    
+    # 🆕 Job batch programado (cron), p. ej. cada 6 horas: python main.py build-suggestions
+    if len(sys.argv) > 1 and sys.argv[1] == "build-suggestions":
+        try:
+            build_suggestion_models()
+        except Exception as e:
+            logger.error(f"❌ Error generando sugerencias: {e}")
+            sys.exit(1)
+        sys.exit(0)
+    
     import uvicorn
     import os
     port = int(os.environ.get("PORT", 8000))
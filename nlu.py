@@ -0,0 +1,368 @@
+"""
+Configuración del NLU (intenciones, palabras clave, prioridades, tags y palabras
+de título) compilada en un matcher y recargable en caliente, junto con la
+extracción de entidades y el parser de fechas en lenguaje natural.
+
+La configuración vive en nlu_config.json o en la colección nlu_config de MongoDB
+(el documento con mayor "version"). Se compila una sola vez y el matcher activo
+se reemplaza de forma atómica: las peticiones en curso siguen usando el anterior.
+"""
+import json
+import logging
+import os
+import re
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Set
+
+from timeutils import TIMEZONE, get_local_now, get_next_weekday, local_to_utc, make_naive
+
+logger = logging.getLogger(__name__)
+
+NLU_CONFIG_PATH = os.getenv("NLU_CONFIG_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "nlu_config.json"))
+
+REQUIRED_SECTIONS = {
+    "intents": dict,
+    "days": list,
+    "event_keywords": dict,
+    "priority_keywords": dict,
+    "tag_categories": dict,
+    "meeting_keywords": list,
+    "title_stopwords": dict,
+}
+
+
+class OrderedMatcher:
+    """
+    Grupos de palabras (subcadenas) congelados en tuplas al compilar la configuración.
+    Con listas cortas, 'palabra in texto' (búsqueda en C) es más rápido que una regex
+    con alternativas; first() respeta el orden de los grupos y corta en la primera coincidencia.
+    """
+
+    def __init__(self, groups: List[List[str]]):
+        self._groups = tuple((index, tuple(words)) for index, words in enumerate(groups))
+
+    def first(self, text: str) -> Optional[int]:
+        """Índice del primer grupo (en orden de configuración) con alguna palabra en el texto"""
+        for index, words in self._groups:
+            for word in words:
+                if word in text:
+                    return index
+        return None
+
+    def all(self, text: str) -> Set[int]:
+        """Índices de todos los grupos con alguna palabra en el texto"""
+        return {index for index, words in self._groups if any(word in text for word in words)}
+
+
+def _stopword_regex(words: List[str]) -> re.Pattern:
+    """Regex que elimina todas las palabras en una sola pasada (sensible a mayúsculas, como antes)"""
+    return re.compile("|".join(re.escape(word) for word in words)) if words else re.compile("(?!)")
+
+
+class CompiledNLU:
+    """Tablas del NLU precompiladas; es inmutable una vez construida"""
+
+    def __init__(self, config: Dict[str, Any], source: str):
+        validate_nlu_config(config)
+        self.config = config
+        self.version = config.get("version", 0)
+        self.source = source
+        self.loaded_at = datetime.utcnow()
+
+        self.intent_patterns: Dict[str, List[str]] = {intent: list(words) for intent, words in config["intents"].items()}
+        self._intent_names = list(self.intent_patterns)
+        self._intents = OrderedMatcher(list(self.intent_patterns.values()))
+
+        self._days = list(config["days"])
+        self._days_matcher = OrderedMatcher([[day] for day in self._days])
+
+        self._event_types = list(config["event_keywords"].values())
+        self._events_matcher = OrderedMatcher([[keyword] for keyword in config["event_keywords"]])
+
+        self._priority_levels = list(config["priority_keywords"])
+        self._priority_matcher = OrderedMatcher(list(config["priority_keywords"].values()))
+
+        self._tag_names = list(config["tag_categories"])
+        self._tags_matcher = OrderedMatcher(list(config["tag_categories"].values()))
+
+        self._meeting_matcher = OrderedMatcher([list(config["meeting_keywords"])])
+
+        self._title_stopwords = {
+            kind: _stopword_regex(words) for kind, words in config["title_stopwords"].items()
+        }
+
+    def detect_intent(self, input_lower: str) -> str:
+        index = self._intents.first(input_lower)
+        return self._intent_names[index] if index is not None else "unknown"
+
+    def find_day(self, input_lower: str) -> Optional[str]:
+        index = self._days_matcher.first(input_lower)
+        return self._days[index] if index is not None else None
+
+    def find_event_type(self, input_lower: str) -> Optional[str]:
+        index = self._events_matcher.first(input_lower)
+        return self._event_types[index] if index is not None else None
+
+    def detect_priority(self, input_lower: str) -> Optional[str]:
+        """Nivel de prioridad configurado ("urgent", "high", "low") o None"""
+        index = self._priority_matcher.first(input_lower)
+        return self._priority_levels[index] if index is not None else None
+
+    def extract_tags(self, input_lower: str) -> List[str]:
+        found = self._tags_matcher.all(input_lower)
+        return [name for index, name in enumerate(self._tag_names) if index in found]
+
+    def mentions_meeting(self, input_lower: str) -> bool:
+        return self._meeting_matcher.first(input_lower) is not None
+
+    def strip_title(self, kind: str, text: str) -> str:
+        """Quita las palabras de tiempo del título y limpia espacios"""
+        regex = self._title_stopwords.get(kind)
+        title = regex.sub("", text) if regex else text
+        return " ".join(title.split())
+
+
+def validate_nlu_config(config: Dict[str, Any]):
+    """Valida la estructura de la configuración; lanza ValueError si no es válida"""
+    if not isinstance(config, dict):
+        raise ValueError("La configuración del NLU debe ser un objeto JSON")
+    for section, expected_type in REQUIRED_SECTIONS.items():
+        if not isinstance(config.get(section), expected_type):
+            raise ValueError(f"Sección '{section}' ausente o inválida en la configuración del NLU")
+    for section in ("intents", "priority_keywords", "tag_categories", "title_stopwords"):
+        for name, words in config[section].items():
+            if not isinstance(words, list) or not all(isinstance(word, str) and word for word in words):
+                raise ValueError(f"'{section}.{name}' debe ser una lista de textos no vacíos")
+
+
+# =============================================
+# Matcher activo y recarga en caliente
+# =============================================
+_active_nlu: Optional[CompiledNLU] = None
+_reload_lock = threading.Lock()
+_file_mtime: Optional[float] = None
+
+
+def get_nlu() -> CompiledNLU:
+    """Devuelve el matcher activo (lo carga desde el archivo la primera vez)"""
+    if _active_nlu is None:
+        reload_nlu_from_file(force=True)
+    return _active_nlu
+
+
+def swap_nlu(compiled: CompiledNLU):
+    """Reemplaza el matcher activo (asignación atómica)"""
+    global _active_nlu
+    _active_nlu = compiled
+    logger.info(f"🧩 NLU versión {compiled.version} activa (origen: {compiled.source})")
+
+
+def reload_nlu_from_file(force: bool = False, path: str = NLU_CONFIG_PATH) -> bool:
+    """Recarga desde el archivo si cambió; devuelve True si se activó una versión nueva"""
+    global _file_mtime
+    with _reload_lock:
+        mtime = os.path.getmtime(path)
+        if not force and mtime == _file_mtime:
+            return False
+        with open(path, encoding="utf-8") as f:
+            compiled = CompiledNLU(json.load(f), source=f"file:{path}")
+        _file_mtime = mtime
+        swap_nlu(compiled)
+        return True
+
+
+def reload_nlu_from_collection(collection, force: bool = False) -> bool:
+    """Recarga desde MongoDB (documento con mayor versión) si hay una versión distinta"""
+    with _reload_lock:
+        doc = collection.find_one({}, {"_id": 0}, sort=[("version", -1)])
+        if not doc:
+            return False
+        if not force and _active_nlu is not None and _active_nlu.source == "mongo" and doc.get("version") == _active_nlu.version:
+            return False
+        swap_nlu(CompiledNLU(doc, source="mongo"))
+        return True
+
+
+# =============================================
+# Entidades y fechas (sin estado: se pueden ejecutar en workers)
+# =============================================
+TIME_ENTITY_PATTERN = re.compile(r'(\d{1,2}):?(\d{2})?\s*(am|pm|hrs)?')
+
+
+def extract_entities(user_input: str) -> Dict[str, Any]:
+    """Extrae información importante del texto del usuario"""
+    entities = {}
+    input_lower = user_input.lower()
+    nlu = get_nlu()
+    
+    # Extraer horas
+    time_matches = TIME_ENTITY_PATTERN.findall(input_lower)
+    if time_matches:
+        entities['time'] = time_matches[0][0] + ':00'
+    
+    # Extraer días
+    day = nlu.find_day(input_lower)
+    if day:
+        entities['day'] = day
+    
+    # Extraer tipos de eventos
+    event_type = nlu.find_event_type(input_lower)
+    if event_type:
+        entities['event_type'] = event_type
+    
+    return entities
+
+
+def parse_natural_time(time_text: str) -> Optional[datetime]:
+    """
+    Convierte texto natural en datetime (en timezone local)
+    """
+    now_local = get_local_now()
+    time_text = time_text.lower().strip()
+    
+    logger.info(f"Parseando tiempo natural: '{time_text}' (hora local: {now_local})")
+    
+    # Patrones de intervalo "en X minutos/horas"
+    interval_patterns = [
+        (r'en\s*(\d+)\s*minutos?\s*(?:a partir de ahora)?', lambda x: timedelta(minutes=int(x))),
+        (r'en\s*(\d+)\s*horas?\s*(?:a partir de ahora)?', lambda x: timedelta(hours=int(x))),
+        (r'en\s*(\d+)\s*días?\s*(?:a partir de ahora)?', lambda x: timedelta(days=int(x))),
+        (r'en\s*(\d+)\s*semanas?\s*(?:a partir de ahora)?', lambda x: timedelta(weeks=int(x))),
+    ]
+    
+    for pattern, delta_func in interval_patterns:
+        matches = re.findall(pattern, time_text)
+        if matches:
+            amount = int(matches[0])
+            time_delta = delta_func(amount)
+            result_time = now_local + time_delta
+            logger.info(f"Intervalo detectado: {amount} -> {result_time}")
+            return make_naive(local_to_utc(result_time))  # 🆕 Convertir a UTC y hacer naive
+    
+    # Palabras clave para días (usando hora local)
+    day_mappings = {
+        'mañana': now_local + timedelta(days=1),
+        'hoy': now_local,
+        'ahora': now_local,
+        'pasado mañana': now_local + timedelta(days=2),
+        'lunes': get_next_weekday(0, now_local),
+        'martes': get_next_weekday(1, now_local),
+        'miércoles': get_next_weekday(2, now_local),
+        'miercoles': get_next_weekday(2, now_local),
+        'jueves': get_next_weekday(3, now_local),
+        'viernes': get_next_weekday(4, now_local),
+        'sábado': get_next_weekday(5, now_local),
+        'sabado': get_next_weekday(5, now_local),
+        'domingo': get_next_weekday(6, now_local),
+    }
+    
+    # Buscar día
+    target_date = now_local
+    day_found = False
+    for day_keyword, date_value in day_mappings.items():
+        if day_keyword in time_text:
+            target_date = date_value
+            time_text = time_text.replace(day_keyword, '')
+            day_found = True
+            logger.info(f"Día detectado: {day_keyword} -> {target_date}")
+            break
+    
+    # Buscar hora
+    hour, minute = now_local.hour, now_local.minute
+    
+    # Si no se encontró día específico y no hay hora, usar 1 hora por defecto
+    if not day_found and not any(time_keyword in time_text for time_keyword in ['a las', 'las', 'am', 'pm', 'hrs', 'horas', ':']):
+        result_time = now_local + timedelta(hours=1)
+        logger.info("Usando hora por defecto (1 hora desde ahora)")
+        return make_naive(local_to_utc(result_time))
+    
+    # Patrones de hora
+    time_pattern_1 = r'(\d{1,2}):(\d{2})\s*(am|pm)?'
+    time_pattern_2 = r'(\d{1,2})\s*(am|pm)'
+    time_pattern_3 = r'(?:a las|las)\s*(\d{1,2})'
+    
+    matches_1 = re.findall(time_pattern_1, time_text)
+    matches_2 = re.findall(time_pattern_2, time_text) 
+    matches_3 = re.findall(time_pattern_3, time_text)
+    
+    time_found = False
+    
+    if matches_1:
+        match = matches_1[0]
+        hour_str = match[0]
+        minute_str = match[1]
+        period = match[2] if len(match) > 2 else ''
+        
+        hour = int(hour_str)
+        minute = int(minute_str) if minute_str else 0
+        time_found = True
+        
+        # Manejar formato 12h
+        if period:
+            if 'pm' in period and hour < 12:
+                hour += 12
+            elif 'am' in period and hour == 12:
+                hour = 0
+        logger.info(f"Hora detectada (formato 1): {hour}:{minute}")
+            
+    elif matches_2:
+        match = matches_2[0]
+        hour_str = match[0]
+        period = match[1] if len(match) > 1 else ''
+        
+        hour = int(hour_str)
+        minute = 0
+        time_found = True
+        
+        if period:
+            if 'pm' in period and hour < 12:
+                hour += 12
+            elif 'am' in period and hour == 12:
+                hour = 0
+        logger.info(f"Hora detectada (formato 2): {hour}:00")
+            
+    elif matches_3:
+        hour_str = matches_3[0]
+        hour = int(hour_str)
+        minute = 0
+        time_found = True
+        # Asumir PM si es temprano
+        if hour < 8:
+            hour += 12
+        logger.info(f"Hora detectada (formato 3): {hour}:00")
+    
+    # Asegurar que la hora esté en rango válido
+    hour = min(max(hour, 0), 23)
+    minute = min(max(minute, 0), 59)
+    
+    # Crear datetime final en timezone local
+    try:
+        due_date_local = TIMEZONE.localize(datetime(
+            year=target_date.year,
+            month=target_date.month, 
+            day=target_date.day,
+            hour=hour,
+            minute=minute
+        ))
+        
+        # Si no se encontró hora específica y es hoy, usar 1 hora por defecto
+        if not time_found and target_date.date() == now_local.date():
+            due_date_local = now_local + timedelta(hours=1)
+            logger.info("Usando hora por defecto (1 hora desde ahora)")
+        
+        # Si la fecha/hora ya pasó, mover al siguiente día
+        if due_date_local <= now_local:
+            due_date_local += timedelta(days=1)
+            logger.info("Fecha/hora en pasado, moviendo al siguiente día")
+            
+        # 🆕 CONVERTIR A UTC y hacer naive para la base de datos
+        due_date_utc = local_to_utc(due_date_local)
+        due_date_naive = make_naive(due_date_utc)
+        
+        logger.info(f"Tiempo parseado - Local: {due_date_local}, UTC: {due_date_utc}, Naive: {due_date_naive}")
+        return due_date_naive
+        
+    except Exception as e:
+        logger.error(f"Error creando datetime: {e}")
+        return None
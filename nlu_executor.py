@@ -0,0 +1,199 @@
+"""
+Ejecutor de la etapa de análisis (intención, entidades y fechas) de cada mensaje.
+
+Modos (NLU_EXECUTOR):
+    inline   -> el análisis se hace dentro del pipeline de la petición (comportamiento original)
+    thread   -> pool de hilos del mismo proceso
+    process  -> ProcessPoolExecutor (spawn) con workers precalentados que tienen su propia
+                copia compilada del NLU (y del clasificador, si está activo); escala con los núcleos
+
+Los mensajes se agrupan en micro-lotes (hasta NLU_BATCH_SIZE mensajes o NLU_BATCH_WAIT_MS de
+espera) para repartir el costo de enviar trabajo a otro proceso y para clasificar el lote con
+una sola operación vectorizada. Este módulo no importa main, así que los workers arrancan sin
+conectarse a MongoDB ni levantar la API.
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+from collections import Counter
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from nlu import CompiledNLU, extract_entities, get_nlu, parse_natural_time, swap_nlu
+
+logger = logging.getLogger(__name__)
+
+NLU_EXECUTOR = os.getenv("NLU_EXECUTOR", "inline")  # "inline", "thread" o "process"
+NLU_WORKERS = int(os.getenv("NLU_WORKERS", str(os.cpu_count() or 1)))
+NLU_BATCH_SIZE = int(os.getenv("NLU_BATCH_SIZE", "32"))
+NLU_BATCH_WAIT_MS = float(os.getenv("NLU_BATCH_WAIT_MS", "2"))
+
+WARMUP_TEXTS = ["hola", "recordarme pagar la luz mañana a las 10 am", "reunión el viernes a las 3 pm"]
+
+# Estado de cada worker (en modo thread es el del propio proceso)
+_worker_model = None
+_worker_min_confidence = 0.0
+
+
+def init_worker(config: Optional[Dict[str, Any]], model_path: Optional[str], min_confidence: float):
+    """Inicializa un worker: compila el NLU recibido, carga el clasificador y calienta las regex"""
+    global _worker_model, _worker_min_confidence
+    if config is not None:
+        swap_nlu(CompiledNLU(config, source="executor"))
+    _worker_model = None
+    _worker_min_confidence = min_confidence
+    if model_path:
+        try:
+            from intent_classifier import IntentClassifier
+            _worker_model = IntentClassifier.load(model_path)
+        except Exception as e:
+            logger.error(f"Worker del NLU sin clasificador, usando palabras clave: {e}")
+    analyze_batch(WARMUP_TEXTS)
+
+
+def warmup() -> int:
+    """Tarea vacía para forzar el arranque de los procesos del pool"""
+    time.sleep(0.05)
+    return os.getpid()
+
+
+def analyze_batch(texts: List[str]) -> List[Dict[str, Any]]:
+    """
+    Analiza un lote de mensajes. Devuelve por mensaje: intent, entities y, cuando aplica,
+    due_date (recordatorios) o meeting_time (reuniones con día y hora), ya en UTC naive.
+    """
+    nlu = get_nlu()
+    if _worker_model is not None:
+        intents = [
+            intent if confidence >= _worker_min_confidence else nlu.detect_intent(text.lower())
+            for text, (intent, confidence) in zip(texts, _worker_model.predict(texts))
+        ]
+    else:
+        intents = [nlu.detect_intent(text.lower()) for text in texts]
+
+    results = []
+    for text, intent in zip(texts, intents):
+        entities = extract_entities(text)
+        analysis = {"intent": intent, "entities": entities}
+        if intent == "create_reminder":
+            analysis["due_date"] = parse_natural_time(text)
+        elif intent == "schedule_meeting" and entities.get("day") and entities.get("time"):
+            analysis["meeting_time"] = parse_natural_time(f"{entities['day']} a las {entities['time']}")
+        results.append(analysis)
+    return results
+
+
+class NLUExecutor:
+    """Envía los mensajes al pool en micro-lotes y devuelve el análisis de cada uno"""
+
+    def __init__(self, mode: str = NLU_EXECUTOR, workers: int = NLU_WORKERS, batch_size: int = NLU_BATCH_SIZE,
+                 batch_wait_ms: float = NLU_BATCH_WAIT_MS, model_path: Optional[str] = None, min_confidence: float = 0.0):
+        self.mode = mode
+        self.workers = max(1, workers)
+        self.batch_size = max(1, batch_size)
+        self.batch_wait = batch_wait_ms / 1000
+        self.model_path = model_path
+        self.min_confidence = min_confidence
+        self._pool: Optional[Executor] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._batcher: Optional[asyncio.Task] = None
+        self._running: set = set()
+        self.counters: Counter = Counter()
+
+    def _create_pool(self, config: Optional[Dict[str, Any]]) -> Executor:
+        if self.mode == "process":
+            return ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=init_worker,
+                initargs=(config, self.model_path, self.min_confidence)
+            )
+        init_worker(None, self.model_path, self.min_confidence)
+        return ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="nlu")
+
+    async def start(self, config: Optional[Dict[str, Any]] = None):
+        """Crea el pool, arranca (y calienta) los workers y el agrupador de lotes"""
+        if self.mode == "inline":
+            return
+        self._pool = self._create_pool(config)
+        await self._warm_pool(self._pool)
+        self._queue = asyncio.Queue()
+        self._batcher = asyncio.create_task(self._batch_loop())
+        logger.info(f"🧵 Ejecutor del NLU en modo {self.mode} con {self.workers} workers")
+
+    async def _warm_pool(self, pool: Executor):
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*[loop.run_in_executor(pool, warmup) for _ in range(self.workers)])
+
+    async def refresh(self, config: Dict[str, Any]):
+        """Tras recargar la configuración del NLU: los procesos reciben un pool nuevo ya calentado"""
+        if self.mode != "process" or self._pool is None:
+            return
+        new_pool = self._create_pool(config)
+        await self._warm_pool(new_pool)
+        old_pool, self._pool = self._pool, new_pool
+        old_pool.shutdown(wait=False)
+        logger.info("🔄 Workers del NLU reiniciados con la nueva configuración")
+
+    def shutdown(self):
+        if self._batcher:
+            self._batcher.cancel()
+        if self._pool:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+
+    async def analyze(self, text: str) -> Optional[Dict[str, Any]]:
+        """Análisis del mensaje, o None en modo inline (el pipeline lo calcula por su cuenta)"""
+        if self.mode == "inline" or self._queue is None:
+            return None
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((text, future))
+        return await future
+
+    async def _batch_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.batch_wait
+            while len(batch) < self.batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            # Los lotes se ejecutan en paralelo (uno por worker libre)
+            task = asyncio.create_task(self._run_batch(batch))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _run_batch(self, batch: List[Tuple[str, asyncio.Future]]):
+        texts = [text for text, _ in batch]
+        self.counters["batches"] += 1
+        self.counters["messages"] += len(batch)
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(self._pool, analyze_batch, texts)
+        except Exception as e:
+            self.counters["errors"] += 1
+            logger.error(f"❌ Error en el lote del NLU: {e}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    def stats(self) -> Dict[str, Any]:
+        batches = self.counters["batches"]
+        return {
+            "mode": self.mode,
+            "workers": self.workers if self.mode != "inline" else 0,
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "batches": batches,
+            "messages": self.counters["messages"],
+            "avg_batch_size": round(self.counters["messages"] / batches, 2) if batches else 0,
+            "errors": self.counters["errors"]
+        }
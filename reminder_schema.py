@@ -0,0 +1,139 @@
+"""
+Esquema compacto (v2) de los documentos de la colección reminders.
+
+    v   versión del esquema (2)
+    t   title                  d   description
+    p   priority (código)      tg  tags (solo si hay)
+    ca  created_at             ua  updated_at (siempre presente)
+    co  completed_at           rc  is_recurring (solo si es True)
+    rp  recurrence_pattern
+
+Los campos que se consultan o indexan (user_id, status, due_date, last_reminded,
+immediate_notified, idempotency_key) conservan su nombre. Los valores nulos, falsos o por
+defecto no se guardan: las consultas existentes ({"last_reminded": None},
+{"immediate_notified": {"$ne": True}}) también coinciden con el campo ausente.
+
+Los documentos antiguos (sin "v") se siguen leyendo con decode_reminder y se convierten
+con migrate_reminder (al leerlos o con la migración en segundo plano).
+"""
+from typing import Any, Dict, Iterable, Optional
+
+SCHEMA_VERSION = 2
+
+SHORT_KEYS = {
+    "title": "t",
+    "description": "d",
+    "priority": "p",
+    "tags": "tg",
+    "created_at": "ca",
+    "updated_at": "ua",
+    "completed_at": "co",
+    "is_recurring": "rc",
+    "recurrence_pattern": "rp",
+}
+LONG_KEYS = {short: long for long, short in SHORT_KEYS.items()}
+
+PRIORITY_CODES = {"low": 0, "medium": 1, "high": 2, "urgent": 3}
+PRIORITY_NAMES = {code: name for name, code in PRIORITY_CODES.items()}
+DEFAULT_PRIORITY = "medium"
+
+# Forma pública (API) de un recordatorio, en orden
+PUBLIC_FIELDS = (
+    "_id", "user_id", "title", "description", "due_date", "priority", "tags", "status",
+    "created_at", "updated_at", "completed_at", "last_reminded", "immediate_notified",
+    "is_recurring", "recurrence_pattern",
+)
+DEFAULTS = {
+    "title": "Recordatorio",
+    "description": None,
+    "priority": DEFAULT_PRIORITY,
+    "tags": [],
+    "due_date": None,
+    "created_at": None,
+    "updated_at": None,
+    "completed_at": None,
+    "last_reminded": None,
+    "immediate_notified": False,
+    "is_recurring": False,
+    "recurrence_pattern": None,
+}
+
+
+def _encode_value(field: str, value: Any) -> Any:
+    if field == "priority":
+        return PRIORITY_CODES.get(getattr(value, "value", value), PRIORITY_CODES[DEFAULT_PRIORITY])
+    return value
+
+
+def encode_reminder(fields: Dict[str, Any]) -> Dict[str, Any]:
+    """Documento v2 a partir de los campos con nombre largo (omite nulos y valores por defecto)"""
+    doc: Dict[str, Any] = {"v": SCHEMA_VERSION}
+    for field, value in fields.items():
+        if value is None or value is False or value == [] or field == "v":
+            continue
+        if field == "priority" and getattr(value, "value", value) == DEFAULT_PRIORITY:
+            continue
+        doc[SHORT_KEYS.get(field, field)] = _encode_value(field, value)
+    doc.setdefault("ua", fields.get("updated_at") or fields.get("created_at"))
+    return doc
+
+
+def encode_update(fields: Dict[str, Any]) -> Dict[str, Any]:
+    """Traduce un $set con nombres largos al esquema v2 (aquí los nulos sí se escriben)"""
+    return {SHORT_KEYS.get(field, field): _encode_value(field, value) for field, value in fields.items()}
+
+
+def _long_fields(doc: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Campos con nombre largo. Acepta documentos v2, antiguos y antiguos que ya recibieron
+    algún $set con claves cortas (la clave corta, escrita después, prevalece).
+    """
+    fields = {LONG_KEYS.get(key, key): value for key, value in doc.items() if key != "v"}
+    if "priority" in fields:
+        fields["priority"] = public_priority(fields["priority"])
+    return fields
+
+
+def decode_reminder(doc: Dict[str, Any]) -> Dict[str, Any]:
+    """Campos con nombre largo y valores por defecto, para documentos v2 y antiguos"""
+    fields = _long_fields(doc)
+    for field, default in DEFAULTS.items():
+        if fields.get(field) is None:
+            fields[field] = list(default) if isinstance(default, list) else default
+    return fields
+
+
+def serialize_reminder(doc: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Forma pública en una sola pasada. Las fechas se dejan como datetime: el ORJSONResponse
+    las serializa directamente (ISO 8601) sin recorrer el documento con isoformat().
+    """
+    fields = decode_reminder(doc)
+    public = {field: fields.get(field) for field in PUBLIC_FIELDS}
+    public["_id"] = str(public["_id"])
+    return public
+
+
+def migrate_reminder(doc: Dict[str, Any]) -> Dict[str, Any]:
+    """Documento v2 equivalente a un documento antiguo (conserva _id y los campos extra)"""
+    fields = _long_fields(doc)
+    fields.setdefault("updated_at", fields.get("created_at"))
+    return encode_reminder(fields)
+
+
+def compact_projection(fields: Iterable[str]) -> Dict[str, int]:
+    """Proyección que funciona con ambos esquemas (pide el nombre largo y el corto)"""
+    projection: Dict[str, int] = {}
+    for field in fields:
+        projection[field] = 1
+        if field in SHORT_KEYS:
+            projection[SHORT_KEYS[field]] = 1
+    projection["v"] = 1
+    return projection
+
+
+def public_priority(value: Optional[Any]) -> str:
+    """Nombre de la prioridad a partir del código (v2) o del texto (esquema antiguo)"""
+    if isinstance(value, int):
+        return PRIORITY_NAMES.get(value, DEFAULT_PRIORITY)
+    return value or DEFAULT_PRIORITY
@@ -0,0 +1,296 @@
+"""
+Plantillas de respuesta precompiladas por idioma y formateadores de fechas.
+
+Las plantillas se escriben una sola vez en un marcado neutro y se compilan al importar
+el módulo para cada canal:
+    "markdown" -> respuestas de la API / Streamlit (**negrita**, _cursiva_, `código`)
+    "html"     -> Telegram (parse_mode=HTML; el texto y los valores se escapan)
+
+Marcado de las plantillas:
+    **texto**         negrita
+    __texto__         cursiva
+    `texto`           código
+    {campo}           valor (con html se escapa, salvo que sea Markup)
+    {fecha:long}      fecha con el formateador del idioma (long, short, time) o
+    {dia:weekdays}    nombre del día en plural a partir de su número (0 = lunes)
+    [[ ... ]]         bloque opcional: se omite si algún campo de dentro está vacío
+
+Cada mensaje se renderiza en una sola pasada (concatenación de segmentos), sin
+convertir después de markdown a HTML.
+"""
+import html
+import os
+import re
+from datetime import datetime
+from functools import lru_cache
+from string import Formatter
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+DEFAULT_LOCALE = os.getenv("RESPONSE_LOCALE", "es")
+FORMATS = ("markdown", "html")
+
+# =============================================
+# Datos de cada idioma (no dependen del locale del proceso)
+# =============================================
+LOCALES: Dict[str, Dict[str, Any]] = {
+    "es": {
+        "days": ["lunes", "martes", "miércoles", "jueves", "viernes", "sábado", "domingo"],
+        "days_plural": ["lunes", "martes", "miércoles", "jueves", "viernes", "sábados", "domingos"],
+        "months": ["enero", "febrero", "marzo", "abril", "mayo", "junio", "julio",
+                   "agosto", "septiembre", "octubre", "noviembre", "diciembre"],
+        "date_patterns": {
+            "long": "{weekday} {day:02d} de {month} a las {hour:02d}:{minute:02d}",
+            "short": "{day:02d}/{month_number:02d}/{year} a las {hour:02d}:{minute:02d}",
+            "time": "{hour:02d}:{minute:02d}",
+        },
+    },
+}
+
+TEMPLATES: Dict[str, Dict[str, str]] = {
+    "es": {
+        # ---------- conversación ----------
+        "greeting": "¡Hola! Soy tu asistente inteligente. Puedo ayudarte a programar reuniones, crear recordatorios, y aprender de tus rutinas. ¿En qué te puedo ayudar hoy?",
+        "task_noted": "📝 Anotado! He agregado esta tarea a tu lista. ¿Tiene alguna fecha límite específica?",
+        "help": (
+            "🤖 **Puedo ayudarte con:**\n"
+            "• 📅 Programar reuniones y eventos\n"
+            "• 🔔 Crear recordatorios inteligentes  \n"
+            "• 📝 Gestionar tus tareas pendientes\n"
+            "• 🧠 Aprender de tus rutinas de trabajo\n"
+            "• ⏰ Predecir tus necesidades futuras\n"
+            "\n"
+            "Solo dime qué necesitas en lenguaje natural!"
+        ),
+        "thank_you": "¡De nada! Estoy aquí para hacer tu día más productivo. ¿Hay algo más en lo que pueda ayudarte?",
+        "unknown": "🤔 Interesante! Todavía estoy aprendiendo a entender solicitudes como esta. ¿Podrías reformularlo de otra manera? Por ejemplo: 'Programar reunión mañana a las 3 PM' o 'Recordarme llamar a Juan'.",
+        "error_generic": "❌ Lo siento, hubo un error procesando tu solicitud. Por favor intenta de nuevo. Error: {error}",
+
+        # ---------- reuniones ----------
+        "meeting_scheduled": (
+            "✅ **¡Reunión programada!**\n\n"
+            "📅 **{title}**\n"
+            "🕐 **Cuándo:** {when:long}\n"
+            "🔔 **Recordatorio:** {reminder_at:time} (15 minutos antes)\n\n"
+            "¡El recordatorio ya está en tu lista!"
+        ),
+        "meeting_conflict": (
+            "⚠️ **Ese horario ya está ocupado**\n\n"
+            "📅 **{title}** choca con **{conflict}** ({conflict_at:long})\n"
+            "[[\n🕐 **Horarios libres:** {suggestions}\n]]"
+            "\n¿A qué hora la programo?"
+        ),
+        "meeting_unparsed": "❌ No pude entender la fecha y hora '{text}'. ¿Podrías ser más específico? Ej: 'mañana a las 10 AM'",
+        "meeting_ask_day": "🕐 Entendido, programar reunión a las {time}. ¿Para qué día sería?",
+        "meeting_ask_time": "📅 Reunión programada para el {day}. ¿A qué hora?",
+        "meeting_ask_both": (
+            "📅 Veo que quieres programar una reunión. ¿Para qué día y hora te gustaría?\n\n"
+            "**Ejemplos:**\n"
+            "- 'Mañana a las 10 AM'\n"
+            "- 'El viernes a las 3 PM'\n"
+            "- 'Hoy a las 2 de la tarde'"
+        ),
+        "meeting_error": "❌ Error programando la reunión: {error}",
+
+        # ---------- recordatorios ----------
+        "reminder_created": "🔔 **Recordatorio creado:** '{title}' para el {due:short} ({time_until}). ¡Te avisaré y se completará automáticamente!",
+        "reminder_unparsed": "❌ No pude entender la fecha y hora. ¿Podrías ser más específico? Ej: 'mañana a las 10 AM' o 'en 2 horas'",
+        "reminder_error": "❌ No pude crear el recordatorio. Error: {error}",
+        "until_now": "en menos de 1 minuto",
+        "until_minutes": "en {count} minutos",
+        "until_hours": "en {count} horas",
+        "until_days": "en {count} días",
+
+        # ---------- notificaciones ----------
+        "notify_upcoming": (
+            "🔔 **RECORDATORIO PRÓXIMO**\n\n"
+            "**{title}**\n"
+            "[[📝 {description}\n]]"
+            "\n⏰ **Hora:** {due:short}\n"
+            "⏳ __Faltan {minutes} minutos__"
+        ),
+        "notify_immediate": (
+            "⏰ **RECORDATORIO INMEDIATO**\n\n"
+            "**{title}**\n"
+            "[[📝 {description}\n]]"
+            "\n🕐 **Es ahora:** {due:short}"
+            "\n\n✅ __Este recordatorio se ha completado automáticamente__"
+        ),
+        "notify_overdue": (
+            "🔔 **RECORDATORIO VENCIDO**\n\n"
+            "**{title}**\n"
+            "[[{description}\n]]"
+            "\n⏰ __¡Este recordatorio ya venció!__"
+        ),
+        "summary_upcoming": "⏳ en {minutes} min ({due:time})",
+        "summary_immediate": "🕐 es ahora ({due:time}) ✅",
+        "summary_overdue": "⚠️ vencido",
+        "digest_header": "🔔 **TIENES {count} RECORDATORIOS**\n",
+        "digest_item": "\n{index}. **{title}**\n    {summary}",
+
+        # ---------- Telegram ----------
+        "telegram_start_help": (
+            "👋 **¡Hola!**\n\nPara recibir tus recordatorios aquí, abre el enlace de vinculación "
+            "desde la app (⚙️ Configuración → 📲 Vincular Telegram)."
+        ),
+        "telegram_link_invalid": "❌ **Enlace no válido o caducado**\n\nGenera uno nuevo desde la app.",
+        "telegram_linked": "✅ **Chat vinculado**\n\nRecibirás aquí los recordatorios de **{user_id}**.",
+        "action_invalid": "❌ Acción no válida",
+        "action_done": "✅ Recordatorio completado",
+        "action_snoozed": "⏰ Pospuesto {minutes} minutos",
+        "action_not_found": "❌ Recordatorio no encontrado",
+
+        # ---------- sugerencias ----------
+        "suggestion_routine": "Sueles programar '{title}' los {weekday:weekdays} a las {time}. ¿Quieres que lo agende?",
+    },
+}
+
+
+# =============================================
+# Formateadores por idioma (cacheados)
+# =============================================
+@lru_cache(maxsize=None)
+def value_formatter(locale: str, spec: str) -> Optional[Callable[[Any], str]]:
+    """Formateador del idioma para un especificador ('long', 'short', 'time', 'weekdays') o None"""
+    data = LOCALES.get(locale) or LOCALES[DEFAULT_LOCALE]
+    if spec == "weekdays":
+        plural = tuple(data["days_plural"])
+        return lambda weekday: plural[int(weekday)]
+    pattern = data["date_patterns"].get(spec)
+    if pattern is None:
+        return None
+    days, months = tuple(data["days"]), tuple(data["months"])
+
+    def format_date(value: datetime) -> str:
+        return pattern.format(
+            weekday=days[value.weekday()], day=value.day, month=months[value.month - 1],
+            month_number=value.month, year=value.year, hour=value.hour, minute=value.minute
+        )
+    return format_date
+
+
+def format_date(value: datetime, pattern: str = "short", locale: Optional[str] = None) -> str:
+    """Fecha con el formato del idioma, independiente del locale del proceso"""
+    return value_formatter(locale or DEFAULT_LOCALE, pattern)(value)
+
+
+# =============================================
+# Compilación de plantillas
+# =============================================
+_MARKERS = {
+    "markdown": {"**": ("**", "**"), "__": ("_", "_"), "`": ("`", "`")},
+    "html": {"**": ("<b>", "</b>"), "__": ("<i>", "</i>"), "`": ("<code>", "</code>")},
+}
+_MARKER_PATTERN = re.compile(r"\*\*|__|`")
+_OPTIONAL_PATTERN = re.compile(r"\[\[(.*?)\]\]", re.DOTALL)
+
+class Markup(str):
+    """Texto ya renderizado en el formato de destino: se inserta sin escapar"""
+
+
+# Segmento: texto literal | (campo, formateador) | ("?", campos, segmentos)
+Segment = Any
+
+
+class CompiledTemplate:
+    """Plantilla lista para renderizar en un idioma y formato concretos"""
+
+    __slots__ = ("key", "fmt", "segments")
+
+    def __init__(self, key: str, source: str, locale: str, fmt: str):
+        self.key = key
+        self.fmt = fmt
+        open_markers: Dict[str, bool] = {}
+        self.segments: List[Segment] = []
+        position = 0
+        for match in _OPTIONAL_PATTERN.finditer(source):
+            self.segments += _compile_text(source[position:match.start()], locale, fmt, open_markers)
+            inner = _compile_text(match.group(1), locale, fmt, open_markers)
+            fields = tuple(segment[0] for segment in inner if isinstance(segment, tuple))
+            self.segments.append(("?", fields, inner))
+            position = match.end()
+        self.segments += _compile_text(source[position:], locale, fmt, open_markers)
+        if any(open_markers.values()):
+            raise ValueError(f"Plantilla '{key}': marcado sin cerrar")
+
+    def render(self, values: Dict[str, Any]) -> str:
+        return "".join(_render_segments(self.segments, values, self.fmt == "html"))
+
+
+def _compile_text(text: str, locale: str, fmt: str, open_markers: Dict[str, bool]) -> List[Segment]:
+    """Literales ya traducidos al formato (escapados en html) y campos con su formateador"""
+    segments: List[Segment] = []
+    for literal, field, spec, _ in Formatter().parse(text):
+        if literal:
+            segments.append(_compile_literal(literal, fmt, open_markers))
+        if field is not None:
+            formatter = value_formatter(locale, spec) if spec else None
+            if spec and formatter is None:
+                formatter = (lambda spec: lambda value: format(value, spec))(spec)
+            segments.append((field, formatter))
+    return segments
+
+
+def _compile_literal(literal: str, fmt: str, open_markers: Dict[str, bool]) -> str:
+    markers = _MARKERS[fmt]
+    out, position = [], 0
+    for match in _MARKER_PATTERN.finditer(literal):
+        out.append(literal[position:match.start()])
+        marker = match.group(0)
+        is_open = open_markers.get(marker, False)
+        out.append(markers[marker][1 if is_open else 0])
+        open_markers[marker] = not is_open
+        position = match.end()
+    out.append(literal[position:])
+    if fmt == "html":
+        # Escapar solo el texto; las etiquetas generadas se conservan
+        return "".join(part if index % 2 else html.escape(part, quote=False) for index, part in enumerate(out))
+    return "".join(out)
+
+
+def _render_segments(segments: List[Segment], values: Dict[str, Any], escape: bool):
+    for segment in segments:
+        if isinstance(segment, str):
+            yield segment
+        elif segment[0] == "?":
+            if all(values.get(field) not in (None, "") for field in segment[1]):
+                yield from _render_segments(segment[2], values, escape)
+        else:
+            field, formatter = segment
+            value = values.get(field, "")
+            text = formatter(value) if formatter and value not in (None, "") else str(value if value is not None else "")
+            yield html.escape(text, quote=False) if escape and not isinstance(value, Markup) else text
+
+
+_compiled: Dict[Tuple[str, str, str], CompiledTemplate] = {
+    (locale, key, fmt): CompiledTemplate(key, source, locale, fmt)
+    for locale, templates in TEMPLATES.items()
+    for key, source in templates.items()
+    for fmt in FORMATS
+}
+
+
+def get_template(key: str, fmt: str = "markdown", locale: Optional[str] = None) -> CompiledTemplate:
+    """Plantilla compilada; si el idioma no la tiene se usa la del idioma por defecto"""
+    template = _compiled.get((locale or DEFAULT_LOCALE, key, fmt))
+    return template or _compiled[(DEFAULT_LOCALE, key, fmt)]
+
+
+def render(key: str, fmt: str = "markdown", locale: Optional[str] = None, **values) -> str:
+    """Renderiza una plantilla en el formato del canal ("markdown" o "html")"""
+    return get_template(key, fmt, locale).render(values)
+
+
+class Reply:
+    """Respuesta pendiente de renderizar: la API y Telegram la formatean cada uno en una pasada"""
+
+    __slots__ = ("key", "values")
+
+    def __init__(self, key: str, **values):
+        self.key = key
+        self.values = values
+
+    def render(self, fmt: str = "markdown", locale: Optional[str] = None) -> str:
+        return get_template(self.key, fmt, locale).render(self.values)
+
+    def __str__(self) -> str:
+        return self.render()
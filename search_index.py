@@ -0,0 +1,270 @@
+"""
+Índice invertido en memoria para buscar en los recordatorios y el historial de un usuario.
+
+- Texto normalizado sin acentos ni mayúsculas ("Reunión" == "reunion") y sin palabras vacías
+- Coincidencia por prefijo: "llam" encuentra "llamada" y "llamar" (vocabulario ordenado + bisect)
+- Ranking BM25; primero los documentos que contienen más términos de la consulta, luego el
+  puntaje y por último los más recientes. Un término que solo coincide por prefijo pesa menos.
+
+El índice solo guarda lo necesario para buscar (términos, tipo, largo y fecha); los campos
+que se devuelven se leen después con una proyección sobre los ids ganadores. El puntaje se
+calcula con numpy sobre todos los postings de los términos de la consulta a la vez, así que
+una búsqueda sobre 100k interacciones tarda unos pocos milisegundos.
+"""
+import bisect
+import math
+import re
+import threading
+import unicodedata
+from array import array
+from collections import Counter
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+PREFIX_WEIGHT = 0.7       # peso de un término que solo coincide por prefijo
+PREFIX_MIN_LENGTH = 2
+PREFIX_MAX_EXPANSIONS = 64
+INITIAL_CAPACITY = 256
+COMPACT_MIN_DEAD = 1000   # se compacta cuando hay más slots muertos que esto y que vivos
+
+KIND_CODES = {"interaction": 0, "reminder": 1}
+KIND_NAMES = {code: kind for kind, code in KIND_CODES.items()}
+
+SPANISH_STOPWORDS = frozenset("""
+a al algo algun alguna algunas alguno algunos ante antes como con contra cual cuando de del desde
+donde durante e el ella ellas ellos en entre era es esa esas ese eso esos esta estas este esto estos
+fue ha han hasta hay la las le les lo los me mi mis muy mas ni no nos o os otra otro para pero poco
+por porque que quien se sea ser si sin sobre su sus tambien te tu tus un una unas uno unos y ya yo
+""".split())
+
+_TOKEN = re.compile(r"[a-z0-9ñ]+")
+
+
+_ACCENTS = str.maketrans("áéíóúüàèìòùâêîôû", "aeiouuaeiouaeiou")
+
+
+def fold_text(text: str) -> str:
+    """Minúsculas y sin acentos (la ñ se conserva)"""
+    text = text.lower().translate(_ACCENTS)
+    if text.replace("ñ", "").isascii():
+        return text
+    # Otros diacríticos (poco frecuentes en español): descomposición Unicode
+    text = unicodedata.normalize("NFKD", text.replace("ñ", "\0"))
+    return "".join(ch for ch in text if not unicodedata.combining(ch)).replace("\0", "ñ")
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    if not text:
+        return []
+    return [token for token in _TOKEN.findall(fold_text(text)) if token not in SPANISH_STOPWORDS]
+
+
+class UserSearchIndex:
+    """
+    Índice de un usuario. Cada documento ocupa un slot; las listas de postings (slot, frecuencia)
+    crecen con array y se convierten a numpy (con caché) para puntuar de forma vectorizada.
+    Un documento borrado o reindexado deja su slot muerto hasta la siguiente compactación.
+    Todas las operaciones deben hacerse con el lock del índice tomado.
+    """
+
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+        self.lock = threading.Lock()
+        self.postings: Dict[str, Tuple[array, array]] = {}
+        self.vocabulary: List[str] = []  # ordenado, para los prefijos
+        self.docs: Dict[Any, int] = {}   # doc_id -> slot
+        self.versions: Dict[Any, Any] = {}  # doc_id -> updated_at de lo indexado (recordatorios)
+        self._slot_ids: List[Any] = []
+        self._lengths = np.zeros(INITIAL_CAPACITY, dtype=np.float32)
+        self._kinds = np.zeros(INITIAL_CAPACITY, dtype=np.int8)
+        self._dates = np.zeros(INITIAL_CAPACITY, dtype=np.float64)
+        self._alive = np.zeros(INITIAL_CAPACITY, dtype=bool)
+        self._arrays: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        self.total_length = 0
+        # Marcas para ponerse al día con consultas incrementales
+        self.last_interaction_at: Optional[datetime] = None
+        self.last_reminder_update: Optional[datetime] = None
+
+    def __len__(self) -> int:
+        return len(self.docs)
+
+    def _grow(self):
+        capacity = len(self._lengths) * 2
+        self._lengths = np.resize(self._lengths, capacity)
+        self._kinds = np.resize(self._kinds, capacity)
+        self._dates = np.resize(self._dates, capacity)
+        alive = np.zeros(capacity, dtype=bool)
+        alive[:len(self._alive)] = self._alive
+        self._alive = alive
+
+    def add(self, doc_id: Any, kind: str, text: str, sort_date: Optional[datetime] = None):
+        """Indexa (o reindexa) un documento"""
+        if doc_id in self.docs:
+            self.remove(doc_id)
+        slot = len(self._slot_ids)
+        if slot == len(self._lengths):
+            self._grow()
+        tokens = tokenize(text)
+        counts = Counter(tokens)
+        for term, count in counts.items():
+            postings = self.postings.get(term)
+            if postings is None:
+                postings = self.postings[term] = (array("i"), array("i"))
+                bisect.insort(self.vocabulary, term)
+            postings[0].append(slot)
+            postings[1].append(count)
+            self._arrays.pop(term, None)
+        self._slot_ids.append(doc_id)
+        self._lengths[slot] = len(tokens)
+        self._kinds[slot] = KIND_CODES[kind]
+        self._dates[slot] = sort_date.timestamp() if sort_date else 0.0
+        self._alive[slot] = True
+        self.docs[doc_id] = slot
+        self.total_length += len(tokens)
+
+    def remove(self, doc_id: Any):
+        slot = self.docs.pop(doc_id, None)
+        self.versions.pop(doc_id, None)
+        if slot is None:
+            return
+        self._alive[slot] = False
+        self.total_length -= int(self._lengths[slot])
+        dead = len(self._slot_ids) - len(self.docs)
+        if dead > COMPACT_MIN_DEAD and dead > len(self.docs):
+            self._compact()
+
+    def _compact(self):
+        """Reasigna los slots vivos y elimina de los postings los muertos"""
+        live = np.flatnonzero(self._alive[:len(self._slot_ids)])
+        remap = np.full(len(self._slot_ids), -1, dtype=np.int64)
+        remap[live] = np.arange(len(live))
+        for term in list(self.postings):
+            slots = np.frombuffer(self.postings[term][0], dtype=np.int32).copy()
+            counts = np.frombuffer(self.postings[term][1], dtype=np.int32).copy()
+            keep = remap[slots] >= 0
+            if not keep.any():
+                del self.postings[term]
+                continue
+            self.postings[term] = (array("i", remap[slots[keep]].astype(np.int32).tobytes()),
+                                   array("i", counts[keep].tobytes()))
+        self.vocabulary = sorted(self.postings)
+        self._arrays.clear()
+        self._slot_ids = [self._slot_ids[slot] for slot in live]
+        self._lengths[:len(live)] = self._lengths[live]
+        self._kinds[:len(live)] = self._kinds[live]
+        self._dates[:len(live)] = self._dates[live]
+        self._alive[:] = False
+        self._alive[:len(live)] = True
+        self.docs = {doc_id: slot for slot, doc_id in enumerate(self._slot_ids)}
+
+    def _term_arrays(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        cached = self._arrays.get(term)
+        if cached is None:
+            slots, counts = self.postings[term]
+            cached = self._arrays[term] = (np.array(slots, dtype=np.int64), np.array(counts, dtype=np.float32))
+        return cached
+
+    def expand(self, token: str) -> List[Tuple[str, float]]:
+        """Términos del vocabulario para un token: él mismo y los que empiezan por él"""
+        terms = [(token, 1.0)] if token in self.postings else []
+        if len(token) < PREFIX_MIN_LENGTH:
+            return terms
+        position = bisect.bisect_right(self.vocabulary, token)
+        for term in self.vocabulary[position:position + PREFIX_MAX_EXPANSIONS]:
+            if not term.startswith(token):
+                break
+            terms.append((term, PREFIX_WEIGHT))
+        return terms
+
+    def search(self, query: str, kinds: Optional[Set[str]] = None, limit: int = 20) -> List[Dict[str, Any]]:
+        """[{id, kind, score, matched}] ordenados por relevancia"""
+        tokens = list(dict.fromkeys(tokenize(query)))
+        if not tokens or not self.docs:
+            return []
+        size = len(self._slot_ids)
+        doc_count = len(self.docs)
+        average_length = self.total_length / doc_count or 1.0
+        # Denominador de BM25 sin la frecuencia (depende solo del largo del documento)
+        length_norm = BM25_K1 * (1 - BM25_B + BM25_B * self._lengths[:size] / average_length)
+
+        total = np.zeros(size, dtype=np.float32)
+        matched_count = np.zeros(size, dtype=np.int8)
+        per_token = []
+        for token in tokens:
+            # Por documento, el mejor término de la expansión de este token
+            best = np.zeros(size, dtype=np.float32)
+            for term, weight in self.expand(token):
+                slots, counts = self._term_arrays(term)
+                # Frecuencia de documento sin los slots muertos (reindexados o borrados)
+                frequency = int(np.count_nonzero(self._alive[slots]))
+                if not frequency:
+                    continue
+                idf = math.log(1 + (doc_count - frequency + 0.5) / (frequency + 0.5))
+                scores = weight * idf * counts * (BM25_K1 + 1) / (counts + length_norm[slots])
+                best[slots] = np.maximum(best[slots], scores)
+            total += best
+            matched_count += best > 0
+            per_token.append(best)
+
+        eligible = self._alive[:size] & (matched_count > 0)
+        if kinds:
+            eligible &= np.isin(self._kinds[:size], [KIND_CODES[kind] for kind in kinds])
+        candidates = np.flatnonzero(eligible)
+        if not len(candidates):
+            return []
+        # Más términos encontrados primero; el puntaje BM25 está acotado muy por debajo de 1000
+        combined = matched_count[candidates] * 1000.0 + total[candidates]
+        if len(candidates) > limit:
+            # Se conservan todos los empatados con el último para desempatar por fecha
+            threshold = -np.partition(-combined, limit - 1)[limit - 1]
+            keep = combined >= threshold
+            candidates, combined = candidates[keep], combined[keep]
+        order = np.lexsort((-self._dates[candidates], -combined))[:limit]
+        return [
+            {"id": self._slot_ids[slot], "kind": KIND_NAMES[int(self._kinds[slot])], "score": round(float(total[slot]), 4),
+             "matched": [token for token, best in zip(tokens, per_token) if best[slot] > 0]}
+            for slot in candidates[order]
+        ]
+
+    def ids(self, kind: str) -> List[Any]:
+        """Ids indexados de un tipo (para detectar los que se borraron)"""
+        code = KIND_CODES[kind]
+        return [doc_id for doc_id, slot in self.docs.items() if self._kinds[slot] == code]
+
+    def count(self, kind: str) -> int:
+        size = len(self._slot_ids)
+        return int(np.count_nonzero(self._alive[:size] & (self._kinds[:size] == KIND_CODES[kind])))
+
+    def stats(self) -> Dict[str, Any]:
+        return {"documents": len(self.docs), "terms": len(self.postings), "slots": len(self._slot_ids)}
+
+
+def build_index(user_id: str, interactions: Iterable[Dict[str, Any]], reminders: Iterable[Dict[str, Any]]) -> UserSearchIndex:
+    """Construye el índice a partir de documentos ya proyectados (ver main.load_search_index)"""
+    index = UserSearchIndex(user_id)
+    for interaction in interactions:
+        index_interaction(index, interaction)
+    for reminder in reminders:
+        index_reminder(index, reminder)
+    return index
+
+
+def index_interaction(index: UserSearchIndex, interaction: Dict[str, Any]):
+    timestamp = interaction.get("timestamp")
+    index.add(interaction["_id"], "interaction", interaction.get("user_input") or "", timestamp)
+    if timestamp and (index.last_interaction_at is None or timestamp > index.last_interaction_at):
+        index.last_interaction_at = timestamp
+
+
+def index_reminder(index: UserSearchIndex, reminder: Dict[str, Any]):
+    """reminder con nombres largos (decode_reminder): título, descripción y etiquetas"""
+    text = " ".join([reminder.get("title") or "", reminder.get("description") or "", *(reminder.get("tags") or [])])
+    index.add(reminder["_id"], "reminder", text, reminder.get("due_date") or reminder.get("created_at"))
+    updated_at = reminder.get("updated_at") or reminder.get("created_at")
+    index.versions[reminder["_id"]] = updated_at
+    if updated_at and (index.last_reminder_update is None or updated_at > index.last_reminder_update):
+        index.last_reminder_update = updated_at
@@ -0,0 +1,267 @@
+"""
+Reconocimiento de voz local para los comandos por audio (/interact/audio).
+
+El audio llega por trozos y se procesa a medida que llega: WavStreamDecoder separa la
+cabecera WAV (o acepta PCM crudo) y entrega muestras PCM de 16 bits, que se pasan al motor
+en bloques de STT_CHUNK_SECONDS. Nunca se guarda el audio completo en memoria.
+
+Motores (STT_ENGINE):
+    auto  -> vosk si el paquete y el modelo (VOSK_MODEL_PATH) están disponibles; si no, desactivado
+    vosk  -> Vosk/Kaldi, streaming real (pip install vosk + modelo en español)
+    stub  -> determinista, para pruebas: devuelve STT_STUB_TRANSCRIPT
+    off   -> desactivado
+
+Cada reconocedor tiene estado, así que un audio se procesa entero en el mismo reconocedor:
+los trozos se envían en orden a un pool de hilos (Vosk libera el GIL mientras decodifica),
+y el event loop de la API solo espera. Este módulo no importa main.
+"""
+import asyncio
+import json
+import logging
+import os
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+STT_ENGINE = os.getenv("STT_ENGINE", "auto")
+VOSK_MODEL_PATH = os.getenv("VOSK_MODEL_PATH", "models/vosk-model-small-es")
+STT_WORKERS = int(os.getenv("STT_WORKERS", "2"))
+STT_MAX_STREAMS = int(os.getenv("STT_MAX_STREAMS", "4"))          # audios en curso a la vez
+STT_MAX_SECONDS = int(os.getenv("STT_MAX_SECONDS", "60"))
+STT_CHUNK_SECONDS = float(os.getenv("STT_CHUNK_SECONDS", "0.5"))
+STT_DEFAULT_SAMPLE_RATE = int(os.getenv("STT_DEFAULT_SAMPLE_RATE", "16000"))
+STT_STUB_TRANSCRIPT = os.getenv("STT_STUB_TRANSCRIPT", "recordarme revisar el audio en 5 minutos")
+
+WAV_CONTENT_TYPES = ("audio/wav", "audio/x-wav", "audio/wave", "audio/vnd.wave")
+PCM_CONTENT_TYPES = ("audio/l16", "audio/pcm", "application/octet-stream")
+WAV_HEADER_MAX_BYTES = 64 * 1024
+
+
+class AudioFormatError(ValueError):
+    """Formato de audio no soportado (solo WAV PCM 16 bits mono o PCM crudo)"""
+
+
+class AudioTooLongError(ValueError):
+    """El audio supera STT_MAX_SECONDS"""
+
+
+class SpeechUnavailableError(RuntimeError):
+    """No hay motor de reconocimiento configurado"""
+
+
+# =============================================
+# Decodificación incremental
+# =============================================
+class WavStreamDecoder:
+    """
+    Recibe bytes de un WAV (o PCM crudo) por trozos y devuelve PCM 16 bits mono. Solo retiene
+    la cabecera mientras no está completa y, como mucho, un byte suelto entre trozos.
+    """
+
+    def __init__(self, wav: bool, sample_rate: int = STT_DEFAULT_SAMPLE_RATE):
+        self.sample_rate = sample_rate
+        self.bytes_decoded = 0
+        self._header: Optional[bytearray] = bytearray() if wav else None
+        self._carry = b""
+
+    @property
+    def seconds(self) -> float:
+        return self.bytes_decoded / 2 / self.sample_rate
+
+    def feed(self, data: bytes) -> bytes:
+        if self._header is not None:
+            self._header += data
+            data = self._parse_header()
+            if data is None:
+                return b""
+        data = self._carry + data
+        usable = len(data) - len(data) % 2
+        self._carry = data[usable:]
+        self.bytes_decoded += usable
+        return data[:usable]
+
+    def _parse_header(self) -> Optional[bytes]:
+        """Recorre los chunks RIFF hasta "data"; devuelve lo que sigue o None si falta cabecera"""
+        header = self._header
+        if len(header) >= 12 and (header[:4] != b"RIFF" or header[8:12] != b"WAVE"):
+            raise AudioFormatError("El archivo no es un WAV válido")
+        position = 12
+        while len(header) >= position + 8:
+            chunk_id = bytes(header[position:position + 4])
+            chunk_size = struct.unpack("<I", header[position + 4:position + 8])[0]
+            body = position + 8
+            if chunk_id == b"data":
+                self._header = None
+                return bytes(header[body:])
+            if len(header) < body + chunk_size:
+                break
+            if chunk_id == b"fmt ":
+                audio_format, channels, sample_rate = struct.unpack("<HHI", header[body:body + 8])
+                bits = struct.unpack("<H", header[body + 14:body + 16])[0]
+                if audio_format != 1 or channels != 1 or bits != 16:
+                    raise AudioFormatError("Se necesita WAV PCM de 16 bits y un solo canal")
+                self.sample_rate = sample_rate
+            position = body + chunk_size + (chunk_size & 1)
+        if len(header) > WAV_HEADER_MAX_BYTES:
+            raise AudioFormatError("Cabecera WAV demasiado grande")
+        return None
+
+
+# =============================================
+# Motores
+# =============================================
+class StubRecognizer:
+    """Determinista: ignora el audio y devuelve el texto configurado"""
+
+    def __init__(self, sample_rate: int):
+        self.sample_rate = sample_rate
+
+    def accept(self, pcm: bytes):
+        pass
+
+    def result(self) -> str:
+        return STT_STUB_TRANSCRIPT
+
+
+class VoskRecognizer:
+    def __init__(self, model, sample_rate: int):
+        from vosk import KaldiRecognizer
+        self._recognizer = KaldiRecognizer(model, sample_rate)
+        self._parts = []
+
+    def accept(self, pcm: bytes):
+        # Al cerrar una frase Vosk la entrega y empieza la siguiente
+        if self._recognizer.AcceptWaveform(pcm):
+            self._parts.append(json.loads(self._recognizer.Result()).get("text", ""))
+
+    def result(self) -> str:
+        self._parts.append(json.loads(self._recognizer.FinalResult()).get("text", ""))
+        return " ".join(part for part in self._parts if part)
+
+
+class SpeechEngine:
+    """Carga el modelo una vez y crea un reconocedor por audio"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._model = None
+
+    def load(self):
+        if self.name == "vosk":
+            from vosk import Model, SetLogLevel
+            SetLogLevel(-1)
+            self._model = Model(VOSK_MODEL_PATH)
+
+    def recognizer(self, sample_rate: int):
+        if self.name == "vosk":
+            return VoskRecognizer(self._model, sample_rate)
+        return StubRecognizer(sample_rate)
+
+
+def resolve_engine(name: str = STT_ENGINE) -> Optional[str]:
+    if name == "auto":
+        try:
+            import vosk  # noqa: F401
+        except ImportError:
+            return None
+        return "vosk" if os.path.isdir(VOSK_MODEL_PATH) else None
+    return None if name == "off" else name
+
+
+# =============================================
+# Pipeline
+# =============================================
+class SpeechPipeline:
+    def __init__(self, engine: str = STT_ENGINE, workers: int = STT_WORKERS, max_streams: int = STT_MAX_STREAMS):
+        self.requested = engine
+        self.workers = workers
+        self.engine: Optional[SpeechEngine] = None
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._streams: Optional[asyncio.Semaphore] = None
+        self._max_streams = max_streams
+        self.active = 0
+        self.counters: Dict[str, float] = {"transcribed": 0, "seconds": 0.0, "rejected": 0, "errors": 0}
+
+    async def start(self):
+        name = resolve_engine(self.requested)
+        if name is None:
+            logger.info("🎤 Reconocimiento de voz desactivado (sin motor disponible)")
+            return
+        engine = SpeechEngine(name)
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="stt")
+        try:
+            await asyncio.get_running_loop().run_in_executor(self._pool, engine.load)
+        except Exception as e:
+            logger.error(f"❌ No se pudo cargar el motor de voz {name}: {e}")
+            self._pool.shutdown(wait=False)
+            self._pool = None
+            return
+        self._streams = asyncio.Semaphore(self._max_streams)
+        self.engine = engine
+        logger.info(f"🎤 Reconocimiento de voz: {name} ({self.workers} hilos)")
+
+    def shutdown(self):
+        if self._pool:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+
+    @property
+    def available(self) -> bool:
+        return self.engine is not None
+
+    def busy(self) -> bool:
+        return self._streams is not None and self._streams.locked()
+
+    async def transcribe(self, chunks: AsyncIterator[bytes], content_type: str,
+                         sample_rate: Optional[int] = None) -> Dict[str, Any]:
+        """Transcribe el audio a medida que llega; devuelve {text, seconds, engine}"""
+        if self.engine is None:
+            raise SpeechUnavailableError("Reconocimiento de voz no disponible")
+        media_type = content_type.split(";")[0].strip().lower()
+        if media_type not in WAV_CONTENT_TYPES + PCM_CONTENT_TYPES:
+            raise AudioFormatError(f"Tipo de audio no soportado: {media_type or 'desconocido'}")
+        decoder = WavStreamDecoder(media_type in WAV_CONTENT_TYPES, sample_rate or STT_DEFAULT_SAMPLE_RATE)
+
+        loop = asyncio.get_running_loop()
+        async with self._streams:
+            self.active += 1
+            try:
+                recognizer = None
+                pending = bytearray()
+                async for data in chunks:
+                    pending += decoder.feed(data)
+                    if decoder.seconds > STT_MAX_SECONDS:
+                        raise AudioTooLongError(f"El audio supera {STT_MAX_SECONDS} segundos")
+                    # La frecuencia se conoce al terminar la cabecera; desde ahí se envía por bloques
+                    block = int(decoder.sample_rate * STT_CHUNK_SECONDS) * 2
+                    if len(pending) >= block:
+                        if recognizer is None:
+                            recognizer = self.engine.recognizer(decoder.sample_rate)
+                        await loop.run_in_executor(self._pool, recognizer.accept, bytes(pending))
+                        pending.clear()
+                if recognizer is None:
+                    recognizer = self.engine.recognizer(decoder.sample_rate)
+                if pending:
+                    await loop.run_in_executor(self._pool, recognizer.accept, bytes(pending))
+                text = await loop.run_in_executor(self._pool, recognizer.result)
+            except (AudioFormatError, AudioTooLongError):
+                self.counters["rejected"] += 1
+                raise
+            except Exception:
+                self.counters["errors"] += 1
+                raise
+            finally:
+                self.active -= 1
+        self.counters["transcribed"] += 1
+        self.counters["seconds"] += decoder.seconds
+        return {"text": text.strip(), "seconds": round(decoder.seconds, 2), "engine": self.engine.name}
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "engine": self.engine.name if self.engine else None,
+            "workers": self.workers,
+            "active_streams": self.active,
+            "max_streams": self._max_streams,
+            "counters": dict(self.counters)
+        }
@@ -0,0 +1,699 @@
+"""
+Backends de almacenamiento (STORAGE_BACKEND).
+
+    mongo   -> MongoClient contra Atlas (comportamiento original)
+    sqlite  -> almacenamiento embebido para despliegues de un solo nodo, sobre un archivo SQLite (modo WAL)
+    memory  -> el mismo almacenamiento sobre una base SQLite en memoria (pruebas y benchmarks sin red)
+
+El almacenamiento embebido no es un MongoDB: es el repositorio que main necesita, con las
+colecciones declaradas en COLLECTIONS y las consultas que main hace sobre ellas, expuesto con
+los mismos métodos, resultados y errores que pymongo (find/find_one/count_documents/insert_one/
+insert_many/update_one/update_many/replace_one/find_one_and_update/delete_one/delete_many/
+bulk_write/create_index/drop_index), así que main no distingue el backend.
+
+Cada colección es una tabla (id, doc, <campos declarados>): el documento completo en BSON y
+una columna real por cada campo que main filtra u ordena. Los filtros se traducen a SQL sobre
+esas columnas y create_index crea un índice de SQLite sobre ellas (UNIQUE si es único; como
+SQLite no compara los NULL, un índice único ya se comporta como sparse).
+
+Consultas: igualdad, $eq, $ne, $lt, $lte, $gt, $gte, $in, $exists, $or y $and sobre _id y los
+campos declarados, con valores escalares. null y el campo ausente son lo mismo, también para
+$exists (main no guarda null en los campos que consulta con $exists). Actualizaciones: $set,
+$unset, $inc y $setOnInsert, o documento de reemplazo. Los índices TTL se purgan cada
+TTL_CHECK_SECONDS; main los declara en cada arranque, así que el plazo vive en memoria.
+
+Lo demás lanza UnsupportedOperation, una OperationFailure con el código que daría MongoDB en
+el mismo caso: start_session -> 20 (como un servidor standalone: main usa su ruta sin sesión),
+watch -> 40573 (sin change streams), colecciones, campos u operadores fuera del repositorio
+-> 2 y comandos desconocidos -> 59. Una consulta nueva en main se declara aquí.
+"""
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import bson
+from bson import ObjectId
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+from pymongo.operations import InsertOne, ReplaceOne, UpdateMany, UpdateOne
+from pymongo.results import BulkWriteResult, DeleteResult, InsertManyResult, InsertOneResult, UpdateResult
+
+STORAGE_BACKENDS = ("mongo", "sqlite", "memory")
+TTL_CHECK_SECONDS = 60
+CURSOR_BATCH_SIZE = 1000  # documentos que un cursor lee a la vez
+
+# Campos que main consulta en cada colección (filtros, sort e índices); _id siempre lo es
+COLLECTIONS: Dict[str, Tuple[str, ...]] = {
+    "interactions": ("user_id", "timestamp", "intent"),
+    "interaction_analysis": (),
+    "reminders": ("user_id", "status", "due_date", "last_reminded", "immediate_notified", "ua", "v", "idempotency_key"),
+    "scheduled_events": ("user_id", "status", "scheduled_datetime", "event_data.scheduled_datetime", "scheduled_at",
+                         "idempotency_key"),
+    "notification_outbox": ("idempotency_key", "user_id", "status", "next_attempt_at", "lease_until", "claim",
+                            "created_at", "sent_at"),
+    "telegram_users": ("user_id", "chat_id", "linked_at"),
+    "telegram_link_tokens": ("token_hash", "redeemed_at", "expires_at"),
+    "conversation_contexts": ("updated_at",),
+    "user_routine_profiles": (),
+    "user_suggestions": (),
+    "unknown_inputs": ("timestamp",),
+    "nlu_config": ("version",),
+    "change_stream_tokens": (),
+}
+
+_MISSING = object()
+_NAME = re.compile(r"^[A-Za-z0-9_]+$")
+_INDEX_NAME = re.compile(r"^[A-Za-z0-9_.\-]+$")
+_COMPARE = {"$lt": "<", "$lte": "<=", "$gt": ">", "$gte": ">="}
+_IN_CHUNK = 500  # ids por consulta al leer un lote del cursor
+
+
+class UnsupportedOperation(OperationFailure):
+    """
+    Operación que el almacenamiento embebido no implementa. Es una OperationFailure con el
+    código de error que daría MongoDB sin esa capacidad, así que el llamador la trata igual con
+    ambos backends (por ejemplo, run_in_transaction sigue sin sesión ante el código 20).
+    """
+
+    def __init__(self, message: str, code: int):
+        super().__init__(message, code=code)
+
+
+def open_client(backend: str, mongodb_url: Optional[str] = None, sqlite_path: Optional[str] = None):
+    """Cliente del backend configurado; client[DATABASE_NAME] devuelve la base de datos"""
+    if backend == "mongo":
+        from pymongo import MongoClient
+        return MongoClient(mongodb_url)
+    if backend == "sqlite":
+        return EmbeddedClient(sqlite_path or "data/assistant.db")
+    if backend == "memory":
+        return EmbeddedClient(None)
+    raise ValueError(f"STORAGE_BACKEND desconocido: {backend} (opciones: {', '.join(STORAGE_BACKENDS)})")
+
+
+# =============================================
+# DOCUMENTOS: RUTAS, ACTUALIZACIONES Y PROYECCIONES
+# =============================================
+def get_path(doc: Any, path: str) -> Any:
+    """Valor de una ruta con puntos ("event_data.scheduled_datetime"), o _MISSING si no existe"""
+    value = doc
+    for part in path.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return _MISSING
+        value = value[part]
+    return value
+
+
+def _set_path(doc: Dict[str, Any], path: str, value: Any):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        doc = doc.setdefault(part, {})
+    doc[parts[-1]] = value
+
+
+def _unset_path(doc: Dict[str, Any], path: str):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        doc = doc.get(part)
+        if not isinstance(doc, dict):
+            return
+    doc.pop(parts[-1], None)
+
+
+def _is_operator_dict(condition: Any) -> bool:
+    return isinstance(condition, dict) and bool(condition) and all(key.startswith("$") for key in condition)
+
+
+def apply_update(doc: Dict[str, Any], update: Dict[str, Any], inserting: bool = False):
+    """Aplica una actualización ($set/$unset/$inc/$setOnInsert) o un reemplazo sobre doc"""
+    if not any(key.startswith("$") for key in update):
+        doc_id = doc.get("_id", _MISSING)
+        doc.clear()
+        doc.update(update)
+        if doc_id is not _MISSING:
+            doc["_id"] = doc_id
+        return
+    for op, fields in update.items():
+        if op == "$set" or (op == "$setOnInsert" and inserting):
+            for path, value in fields.items():
+                _set_path(doc, path, value)
+        elif op == "$setOnInsert":
+            continue
+        elif op == "$unset":
+            for path in fields:
+                _unset_path(doc, path)
+        elif op == "$inc":
+            for path, amount in fields.items():
+                current = get_path(doc, path)
+                _set_path(doc, path, (0 if current is _MISSING or current is None else current) + amount)
+        else:
+            raise UnsupportedOperation(f"Operador de actualización no soportado: {op}", code=9)
+
+
+def _upsert_seed(query: Dict[str, Any]) -> Dict[str, Any]:
+    """Documento base de un upsert: los campos con igualdad del filtro"""
+    seed: Dict[str, Any] = {}
+    for key, condition in query.items():
+        if key.startswith("$"):
+            continue
+        if not _is_operator_dict(condition):
+            _set_path(seed, key, condition)
+        elif set(condition) == {"$eq"}:
+            _set_path(seed, key, condition["$eq"])
+    return seed
+
+
+def _normalize_projection(projection: Any) -> Optional[Dict[str, Any]]:
+    if not projection:
+        return None
+    if isinstance(projection, dict):
+        return projection
+    return {field: 1 for field in projection}
+
+
+def project(doc: Dict[str, Any], projection: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Proyección de inclusión ({"campo": 1}) o de exclusión ({"campo": 0})"""
+    if not projection:
+        return doc
+    included = [field for field, flag in projection.items() if flag and field != "_id"]
+    if included:
+        result: Dict[str, Any] = {}
+        if projection.get("_id", 1) and "_id" in doc:
+            result["_id"] = doc["_id"]
+        for field in included:
+            value = get_path(doc, field)
+            if value is not _MISSING:
+                _set_path(result, field, value)
+        return result
+    for field, flag in projection.items():
+        if not flag:
+            _unset_path(doc, field)
+    return doc
+
+
+# =============================================
+# TRADUCCIÓN A SQL
+# =============================================
+def sql_value(value: Any) -> Any:
+    """
+    Valor de una columna o de un parámetro: las fechas en texto ISO (UTC, al milisegundo como
+    BSON), los ObjectId en sus 12 bytes (ordenan igual) y los bool como entero. Con estas
+    codificaciones SQLite compara y ordena como MongoDB dentro de cada tipo.
+    """
+    if value is None or value is _MISSING:
+        return None
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, (int, float, str)):
+        return value
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value.isoformat(timespec="milliseconds")
+    if isinstance(value, ObjectId):
+        return value.binary
+    raise UnsupportedOperation(f"Valor no consultable en el almacenamiento embebido: {type(value).__name__}", code=2)
+
+
+def _placeholders(count: int) -> str:
+    return ", ".join("?" * count)
+
+
+def _condition(column: str, op: str, argument: Any) -> Tuple[str, List[Any]]:
+    """SQL de un operador sobre una columna (null y ausente son NULL)"""
+    if op in ("$eq", "$ne"):
+        value = sql_value(argument)
+        if value is None:
+            return f"{column} IS {'NOT ' if op == '$ne' else ''}NULL", []
+        return (f"{column} = ?", [value]) if op == "$eq" else (f"{column} IS NOT ?", [value])
+    if op in _COMPARE:
+        value = sql_value(argument)
+        if value is None:
+            raise UnsupportedOperation(f"Comparación {op} con null no soportada", code=2)
+        return f"{column} {_COMPARE[op]} ?", [value]
+    if op == "$in":
+        values = [sql_value(item) for item in argument]
+        present = [value for value in values if value is not None]
+        terms = [f"{column} IN ({_placeholders(len(present))})"] if present else []
+        if len(present) < len(values):
+            terms.append(f"{column} IS NULL")
+        return f"({' OR '.join(terms) or '0'})", present
+    if op == "$exists":
+        return f"{column} IS {'NOT ' if argument else ''}NULL", []
+    raise UnsupportedOperation(f"Operador de consulta no soportado: {op}", code=2)
+
+
+# =============================================
+# ALMACENAMIENTO EMBEBIDO
+# =============================================
+class _SQLiteStore:
+    """
+    Conexión SQLite compartida por todas las colecciones de un cliente: un archivo en modo WAL
+    o una base en memoria. Las colecciones la usan siempre con el lock del cliente tomado.
+    """
+
+    def __init__(self, path: Optional[str]):
+        if path:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(path or ":memory:", isolation_level=None, check_same_thread=False)
+        if path:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+
+    def execute(self, sql: str, params: Iterable[Any] = ()) -> sqlite3.Cursor:
+        return self.conn.execute(sql, tuple(params))
+
+    def tables(self) -> List[str]:
+        return [name for (name,) in self.conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+
+    def indexes(self, table: str) -> Dict[str, str]:
+        rows = self.conn.execute("SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = ? "
+                                 "AND sql IS NOT NULL", (table,))
+        return dict(rows.fetchall())
+
+    @contextmanager
+    def transaction(self):
+        """
+        Varias escrituras con un solo commit. Lo aplicado antes de un error se conserva, como
+        en las escrituras sin sesión de MongoDB (cada sentencia de SQLite es atómica).
+        """
+        if self.conn.in_transaction:
+            yield
+            return
+        self.conn.execute("BEGIN")
+        try:
+            yield
+        finally:
+            self.conn.execute("COMMIT")
+
+    def close(self):
+        self.conn.close()
+
+
+class EmbeddedCursor:
+    """Cursor perezoso: la consulta se ejecuta al iterar y los documentos se leen por lotes"""
+
+    def __init__(self, collection: "EmbeddedCollection", query: Optional[Dict[str, Any]], projection: Any):
+        self._collection = collection
+        self._query = query or {}
+        self._projection = _normalize_projection(projection)
+        self._sort: List[Tuple[str, int]] = []
+        self._skip = 0
+        self._limit = 0
+        self._batch_size = 0
+
+    def sort(self, key_or_list: Any, direction: Optional[int] = None) -> "EmbeddedCursor":
+        if isinstance(key_or_list, str):
+            self._sort = [(key_or_list, direction or 1)]
+        else:
+            self._sort = [(field, value) for field, value in key_or_list]
+        return self
+
+    def skip(self, count: int) -> "EmbeddedCursor":
+        self._skip = count
+        return self
+
+    def limit(self, count: int) -> "EmbeddedCursor":
+        self._limit = count
+        return self
+
+    def batch_size(self, size: int) -> "EmbeddedCursor":
+        self._batch_size = size
+        return self
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        return self._collection._iterate(self._query, self._projection, self._sort, self._skip, self._limit,
+                                         self._batch_size or CURSOR_BATCH_SIZE)
+
+
+class EmbeddedCollection:
+    """Colección del repositorio: tabla (id, doc BSON, <campos de COLLECTIONS>) con índices de SQLite"""
+
+    def __init__(self, database: "EmbeddedDatabase", name: str):
+        if name not in COLLECTIONS:
+            raise UnsupportedOperation(f"Colección fuera del almacenamiento embebido: {name} (ver COLLECTIONS)", code=2)
+        self.database = database
+        self.name = name
+        self.fields = COLLECTIONS[name]
+        self._lock = database.lock
+        self._store = database.store
+        self._table = f"{database.name}.{name}"
+        self._ttl: Dict[str, Tuple[str, int]] = {}   # índice -> (columna, expireAfterSeconds)
+        self._next_expire = 0.0
+        columns = ["id", "doc", *(f'"{field}"' for field in self.fields)]
+        self._insert_sql = f'INSERT INTO "{self._table}" ({", ".join(columns)}) VALUES ({_placeholders(len(columns))})'
+        self._update_sql = f'UPDATE "{self._table}" SET {", ".join(f"{column} = ?" for column in columns[1:])} WHERE id = ?'
+        with self._lock:
+            self._create_table()
+
+    # ----- internos (siempre con el lock tomado) -----
+    def _create_table(self):
+        columns = "".join(f', "{field}"' for field in self.fields)
+        self._store.execute(f'CREATE TABLE IF NOT EXISTS "{self._table}" (id PRIMARY KEY NOT NULL, doc BLOB NOT NULL{columns}) WITHOUT ROWID')
+
+    def _column(self, field: str) -> str:
+        if field == "_id":
+            return "id"
+        if field not in self.fields:
+            raise UnsupportedOperation(f"Campo no consultable en {self.name}: {field} (ver COLLECTIONS)", code=2)
+        return f'"{field}"'
+
+    def _where(self, query: Optional[Dict[str, Any]]) -> Tuple[str, List[Any]]:
+        terms: List[str] = []
+        params: List[Any] = []
+        for key, condition in (query or {}).items():
+            if key in ("$or", "$and") and condition:
+                parts = [self._where(sub) for sub in condition]
+                terms.append("(" + (" OR " if key == "$or" else " AND ").join(f"({sql})" for sql, _ in parts) + ")")
+                params.extend(param for _, sub_params in parts for param in sub_params)
+                continue
+            if key.startswith("$"):
+                raise UnsupportedOperation(f"Operador de consulta no soportado: {key}", code=2)
+            column = self._column(key)
+            for op, argument in (condition.items() if _is_operator_dict(condition) else [("$eq", condition)]):
+                sql, values = _condition(column, op, argument)
+                terms.append(sql)
+                params.extend(values)
+        return " AND ".join(terms) or "1", params
+
+    def _select(self, columns: str, query: Optional[Dict[str, Any]], sort: Optional[List[Tuple[str, int]]] = None,
+                skip: int = 0, limit: int = 0) -> Tuple[str, List[Any]]:
+        where, params = self._where(query)
+        sql = f'SELECT {columns} FROM "{self._table}" WHERE {where}'
+        if sort:
+            sql += " ORDER BY " + ", ".join(f"{self._column(field)} {'DESC' if direction < 0 else 'ASC'}"
+                                            for field, direction in sort)
+        if skip or limit:
+            sql += " LIMIT ? OFFSET ?"
+            params += [limit or -1, skip]
+        return sql, params
+
+    def _row(self, doc: Dict[str, Any], raw: bytes) -> List[Any]:
+        return [raw, *(sql_value(get_path(doc, field)) for field in self.fields)]
+
+    def _duplicate(self, error: sqlite3.IntegrityError) -> DuplicateKeyError:
+        return DuplicateKeyError(f"E11000 duplicate key error collection: {self.database.name}.{self.name} ({error})",
+                                 code=11000)
+
+    def _expire(self):
+        now = time.monotonic()
+        if not self._ttl or now < self._next_expire:
+            return
+        self._next_expire = now + TTL_CHECK_SECONDS
+        for column, seconds in self._ttl.values():
+            # Solo caducan las fechas, como en MongoDB
+            cutoff = sql_value(datetime.utcnow() - timedelta(seconds=seconds))
+            self._store.execute(f'DELETE FROM "{self._table}" WHERE {column} < ? AND typeof({column}) = \'text\'', (cutoff,))
+
+    def _find_rows(self, query: Dict[str, Any], sort: Optional[List[Tuple[str, int]]] = None,
+                   limit: int = 0) -> List[Tuple[Any, bytes]]:
+        self._expire()
+        return self._store.execute(*self._select("id, doc", query, sort, limit=limit)).fetchall()
+
+    def _iterate(self, query: Dict[str, Any], projection: Optional[Dict[str, Any]], sort: List[Tuple[str, int]],
+                 skip: int, limit: int, batch_size: int) -> Iterator[Dict[str, Any]]:
+        if limit and limit <= batch_size:
+            with self._lock:
+                self._expire()
+                rows = self._store.execute(*self._select("doc", query, sort, skip, limit)).fetchall()
+            for (raw,) in rows:
+                # Cada lectura devuelve una copia nueva (como pymongo): el llamador puede modificarla
+                yield project(bson.decode(raw), projection)
+            return
+        # Resultados grandes: primero los ids en orden, después los documentos por lotes
+        with self._lock:
+            self._expire()
+            ids = [key for (key,) in self._store.execute(*self._select("id", query, sort, skip, limit))]
+            where, params = self._where(query)
+        for start in range(0, len(ids), batch_size):
+            batch = ids[start:start + batch_size]
+            loaded: Dict[Any, bytes] = {}
+            with self._lock:
+                for chunk_start in range(0, len(batch), _IN_CHUNK):
+                    chunk = batch[chunk_start:chunk_start + _IN_CHUNK]
+                    # El filtro se repite: lo que cambió o se borró desde la primera consulta no sale
+                    loaded.update(self._store.execute(
+                        f'SELECT id, doc FROM "{self._table}" WHERE id IN ({_placeholders(len(chunk))}) AND ({where})',
+                        [*chunk, *params]))
+            for key in batch:
+                if key in loaded:
+                    yield project(bson.decode(loaded[key]), projection)
+
+    def _insert(self, doc: Dict[str, Any]) -> Any:
+        if "_id" not in doc:
+            doc["_id"] = ObjectId()
+        try:
+            self._store.execute(self._insert_sql, [sql_value(doc["_id"]), *self._row(doc, bson.encode(doc))])
+        except sqlite3.IntegrityError as e:
+            raise self._duplicate(e) from None
+        return doc["_id"]
+
+    def _update(self, key: Any, raw: bytes, update: Dict[str, Any]) -> bool:
+        doc = bson.decode(raw)
+        doc_id = doc["_id"]
+        apply_update(doc, update)
+        doc["_id"] = doc_id
+        new_raw = bson.encode(doc)
+        if new_raw == raw:
+            return False
+        try:
+            self._store.execute(self._update_sql, [*self._row(doc, new_raw), key])
+        except sqlite3.IntegrityError as e:
+            raise self._duplicate(e) from None
+        return True
+
+    def _upsert(self, query: Dict[str, Any], update: Dict[str, Any]) -> Any:
+        doc = _upsert_seed(query)
+        apply_update(doc, update, inserting=True)
+        if "_id" not in doc and "_id" in query and not _is_operator_dict(query["_id"]):
+            doc["_id"] = query["_id"]
+        return self._insert(doc)
+
+    def _write(self, query: Dict[str, Any], update: Dict[str, Any], many: bool, upsert: bool) -> Dict[str, Any]:
+        rows = self._find_rows(query, limit=0 if many else 1)
+        if rows:
+            return {"n": len(rows), "nModified": sum(self._update(key, raw, update) for key, raw in rows)}
+        if upsert:
+            return {"n": 1, "nModified": 0, "upserted": self._upsert(query, update)}
+        return {"n": 0, "nModified": 0}
+
+    # ----- API compatible con pymongo -----
+    def create_index(self, keys: Any, unique: bool = False, sparse: bool = False,
+                     expireAfterSeconds: Optional[int] = None, name: Optional[str] = None, **_kwargs) -> str:
+        fields = [(keys, 1)] if isinstance(keys, str) else list(keys)
+        name = name or "_".join(f"{field}_{direction}" for field, direction in fields)
+        if not _INDEX_NAME.match(name):
+            raise ValueError(f"Nombre de índice inválido: {name}")
+        columns = ", ".join(f"{self._column(field)} {'DESC' if direction < 0 else 'ASC'}" for field, direction in fields)
+        sql = f'CREATE {"UNIQUE " if unique else ""}INDEX "{self._table}${name}" ON "{self._table}" ({columns})'
+        with self._lock:
+            for existing_name, existing_sql in self._store.indexes(self._table).items():
+                same_name = existing_name == f"{self._table}${name}"
+                same_key = existing_sql.endswith(f"({columns})")
+                if same_name and existing_sql == sql:
+                    break
+                if same_name and not same_key:
+                    raise OperationFailure(f"Ya existe un índice {name} con otros campos en {self.name}", code=86)
+                if same_name or same_key:
+                    raise OperationFailure(f"Ya existe el índice {existing_name} con otras opciones en {self.name}", code=85)
+            else:
+                try:
+                    self._store.execute(sql)
+                except sqlite3.IntegrityError as e:
+                    raise self._duplicate(e) from None
+            if expireAfterSeconds is not None and len(fields) == 1:
+                self._ttl[name] = (self._column(fields[0][0]), expireAfterSeconds)
+                self._next_expire = 0.0
+        return name
+
+    def drop_index(self, index_or_name: Any):
+        if isinstance(index_or_name, str):
+            name = index_or_name
+        else:
+            name = "_".join(f"{field}_{direction}" for field, direction in index_or_name)
+        with self._lock:
+            if f"{self._table}${name}" not in self._store.indexes(self._table):
+                raise OperationFailure(f"index not found with name [{name}]", code=27)
+            self._store.execute(f'DROP INDEX "{self._table}${name}"')
+            self._ttl.pop(name, None)
+
+    def find(self, filter: Optional[Dict[str, Any]] = None, projection: Any = None, session=None, **_kwargs) -> EmbeddedCursor:
+        return EmbeddedCursor(self, filter, projection)
+
+    def find_one(self, filter: Optional[Dict[str, Any]] = None, projection: Any = None, session=None,
+                 sort: Optional[List[Tuple[str, int]]] = None, **_kwargs) -> Optional[Dict[str, Any]]:
+        cursor = EmbeddedCursor(self, filter, projection).limit(1)
+        if sort:
+            cursor.sort(sort)
+        return next(iter(cursor), None)
+
+    def count_documents(self, filter: Dict[str, Any], session=None, **_kwargs) -> int:
+        with self._lock:
+            self._expire()
+            return self._store.execute(*self._select("COUNT(*)", filter)).fetchone()[0]
+
+    def insert_one(self, document: Dict[str, Any], session=None, **_kwargs) -> InsertOneResult:
+        with self._lock:
+            return InsertOneResult(self._insert(document), True)
+
+    def insert_many(self, documents: Iterable[Dict[str, Any]], ordered: bool = True, session=None,
+                    **_kwargs) -> InsertManyResult:
+        documents = list(documents)
+        self.bulk_write([InsertOne(document) for document in documents], ordered=ordered)
+        return InsertManyResult([document["_id"] for document in documents], True)
+
+    def update_one(self, filter: Dict[str, Any], update: Dict[str, Any], upsert: bool = False, session=None,
+                   **_kwargs) -> UpdateResult:
+        with self._lock:
+            return UpdateResult(self._write(filter, update, many=False, upsert=upsert), True)
+
+    def update_many(self, filter: Dict[str, Any], update: Dict[str, Any], upsert: bool = False, session=None,
+                    **_kwargs) -> UpdateResult:
+        with self._lock, self._store.transaction():
+            return UpdateResult(self._write(filter, update, many=True, upsert=upsert), True)
+
+    def replace_one(self, filter: Dict[str, Any], replacement: Dict[str, Any], upsert: bool = False, session=None,
+                    **_kwargs) -> UpdateResult:
+        if any(key.startswith("$") for key in replacement):
+            raise ValueError("replace_one no acepta operadores de actualización")
+        return self.update_one(filter, replacement, upsert=upsert, session=session)
+
+    def find_one_and_update(self, filter: Dict[str, Any], update: Dict[str, Any], projection: Any = None,
+                            sort: Optional[List[Tuple[str, int]]] = None, upsert: bool = False,
+                            return_document: bool = False, session=None, **_kwargs) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            rows = self._find_rows(filter, sort, limit=1)
+            if rows:
+                key, raw = rows[0]
+                self._update(key, raw, update)
+                before = bson.decode(raw)
+            elif upsert:
+                key, before = sql_value(self._upsert(filter, update)), None
+            else:
+                return None
+            if return_document:
+                result = bson.decode(self._store.execute(f'SELECT doc FROM "{self._table}" WHERE id = ?', (key,)).fetchone()[0])
+            else:
+                result = before
+        return project(result, _normalize_projection(projection)) if result is not None else None
+
+    def delete_one(self, filter: Dict[str, Any], session=None, **_kwargs) -> DeleteResult:
+        with self._lock:
+            where, params = self._where(filter)
+            cursor = self._store.execute(
+                f'DELETE FROM "{self._table}" WHERE id = (SELECT id FROM "{self._table}" WHERE {where} LIMIT 1)', params)
+            return DeleteResult({"n": cursor.rowcount}, True)
+
+    def delete_many(self, filter: Dict[str, Any], session=None, **_kwargs) -> DeleteResult:
+        with self._lock:
+            where, params = self._where(filter)
+            return DeleteResult({"n": self._store.execute(f'DELETE FROM "{self._table}" WHERE {where}', params).rowcount}, True)
+
+    def bulk_write(self, requests: List[Any], ordered: bool = True, session=None, **_kwargs) -> BulkWriteResult:
+        """InsertOne, UpdateOne, UpdateMany y ReplaceOne (las que usa main) con un solo commit"""
+        counts = {"writeErrors": [], "writeConcernErrors": [], "nInserted": 0, "nMatched": 0, "nModified": 0,
+                  "nRemoved": 0, "nUpserted": 0, "upserted": []}
+        with self._lock, self._store.transaction():
+            for position, request in enumerate(requests):
+                try:
+                    if isinstance(request, InsertOne):
+                        self._insert(request._doc)
+                        counts["nInserted"] += 1
+                        continue
+                    if not isinstance(request, (UpdateOne, UpdateMany, ReplaceOne)):
+                        raise UnsupportedOperation(f"Operación de bulk_write no soportada: {type(request).__name__}", code=2)
+                    result = self._write(request._filter, request._doc, isinstance(request, UpdateMany), request._upsert)
+                    if "upserted" in result:
+                        counts["nUpserted"] += 1
+                        counts["upserted"].append({"index": position, "_id": result["upserted"]})
+                    else:
+                        counts["nMatched"] += result["n"]
+                        counts["nModified"] += result["nModified"]
+                except DuplicateKeyError as e:
+                    counts["writeErrors"].append({"index": position, "code": 11000, "errmsg": str(e), "op": request._doc})
+                    if ordered:
+                        break
+        if counts["writeErrors"]:
+            raise BulkWriteError(counts)
+        return BulkWriteResult(counts, True)
+
+    def watch(self, *_args, **_kwargs):
+        raise UnsupportedOperation("El almacenamiento embebido no tiene change streams (solo réplicas de MongoDB)", code=40573)
+
+    def drop(self):
+        """Vacía la colección y elimina sus índices"""
+        with self._lock:
+            self._store.execute(f'DROP TABLE IF EXISTS "{self._table}"')
+            self._create_table()
+            self._ttl.clear()
+
+
+class EmbeddedDatabase:
+    """Base de datos embebida: la tabla de cada colección se crea al primer acceso"""
+
+    def __init__(self, client: "EmbeddedClient", name: str):
+        if not _NAME.match(name):
+            raise ValueError(f"Nombre de base de datos inválido: {name}")
+        self.client = client
+        self.name = name
+        self.lock = client.lock
+        self.store = client.store
+        self._collections: Dict[str, EmbeddedCollection] = {}
+
+    def __getitem__(self, name: str) -> EmbeddedCollection:
+        with self.lock:
+            if name not in self._collections:
+                self._collections[name] = EmbeddedCollection(self, name)
+            return self._collections[name]
+
+    def __getattr__(self, name: str) -> EmbeddedCollection:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def list_collection_names(self) -> List[str]:
+        prefix = f"{self.name}."
+        with self.lock:
+            return sorted(table[len(prefix):] for table in self.store.tables() if table.startswith(prefix))
+
+
+class _EmbeddedAdmin:
+    def command(self, name: str, *_args, **_kwargs) -> Dict[str, Any]:
+        if name == "ping":
+            return {"ok": 1.0}
+        raise UnsupportedOperation(f"Comando no soportado por el almacenamiento embebido: {name}", code=59)
+
+
+class EmbeddedClient:
+    """
+    Cliente del almacenamiento embebido. Un solo lock reentrante serializa el acceso a la
+    conexión SQLite; con path=None la base vive en memoria.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.lock = threading.RLock()
+        # Las colecciones de todas las bases de datos comparten conexión (tablas "<base>.<colección>")
+        self.store = _SQLiteStore(path)
+        self.admin = _EmbeddedAdmin()
+        self._databases: Dict[str, EmbeddedDatabase] = {}
+
+    def __getitem__(self, name: str) -> EmbeddedDatabase:
+        with self.lock:
+            if name not in self._databases:
+                self._databases[name] = EmbeddedDatabase(self, name)
+            return self._databases[name]
+
+    def start_session(self, **_kwargs):
+        # El mismo código que un MongoDB standalone: main sigue sin sesión
+        raise UnsupportedOperation("El almacenamiento embebido no tiene transacciones multi-documento", code=20)
+
+    def close(self):
+        with self.lock:
+            self.store.close()
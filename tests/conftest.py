@@ -0,0 +1,61 @@
+"""
+Configuración común de las pruebas: la API se importa con el almacenamiento en memoria y sin
+Telegram, así que la suite corre sin red (python -m pytest -q desde la raíz del repositorio).
+"""
+import asyncio
+import os
+import sys
+
+import pytest
+
+os.environ["STORAGE_BACKEND"] = "memory"
+os.environ["TELEGRAM_BOT_TOKEN"] = ""
+os.environ["TELEGRAM_CHAT_ID"] = ""
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def loop():
+    """Un solo event loop para las pruebas que llaman corutinas directamente"""
+    event_loop = asyncio.new_event_loop()
+    yield event_loop
+    event_loop.close()
+
+
+@pytest.fixture
+def run(loop):
+    return loop.run_until_complete
+
+
+@pytest.fixture
+def db():
+    """Base de datos vacía en cada prueba"""
+    for name in main.db.list_collection_names():
+        main.db[name].drop()
+    for cache in (main.idempotency_cache, main.search_indexes, main.agenda_indexes, main.calendar_feeds):
+        cache.clear()
+    main._telegram_chat_cache.clear()
+    main._telegram_user_cache.clear()
+    main._recent_update_ids.clear()
+    main.routine_buffer.drain()
+    return main.db
+
+
+@pytest.fixture
+def telegram_outbox(monkeypatch):
+    """Mensajes que la API habría enviado por Telegram: (chat_id, texto)"""
+    sent = []
+
+    async def fake_send(message, chat_id=None, reply_markup=None):
+        sent.append((chat_id, message))
+        return True
+
+    async def fake_api(method, payload):
+        sent.append((payload.get("chat_id"), payload.get("text")))
+        return True
+
+    monkeypatch.setattr(main, "send_telegram_message", fake_send)
+    monkeypatch.setattr(main, "call_telegram_api", fake_api)
+    return sent
@@ -0,0 +1,74 @@
+"""Control de admisión: cola acotada por carril, límite por usuario y 429 con Retry-After"""
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+import main
+
+
+async def hold(admission, user_id, lane, release: asyncio.Event, entered=None):
+    async with admission.slot(user_id, lane):
+        if entered is not None:
+            entered.append(user_id)
+        await release.wait()
+
+
+def test_full_queue_timeout_and_user_limit_are_rejected(run):
+    admission = main.AdmissionController(max_concurrency=1, per_user=1, max_queue=1, queue_timeout=0.05)
+
+    async def scenario():
+        release = asyncio.Event()
+        holder = asyncio.create_task(hold(admission, "alice", "interact", release))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(hold(admission, "bob", "interact", release))
+        await asyncio.sleep(0)
+        try:
+            # La cola del carril ya tiene a bob: carol se rechaza sin esperar
+            with pytest.raises(HTTPException) as full:
+                await hold(admission, "carol", "interact", release)
+            # alice ya tiene su única petición en curso en este carril
+            with pytest.raises(HTTPException) as user_limit:
+                await hold(admission, "alice", "interact", release)
+            # bob no consigue permiso antes de queue_timeout
+            with pytest.raises(HTTPException) as timeout:
+                await waiter
+        finally:
+            release.set()
+            await holder
+        return full.value, user_limit.value, timeout.value
+
+    errors = run(scenario())
+    assert [error.status_code for error in errors] == [429, 429, 429]
+    assert all(error.headers["Retry-After"] == str(main.ADMISSION_RETRY_AFTER) for error in errors)
+    counters = admission.stats()["counters"]
+    assert (counters["rejected_queue_full"], counters["rejected_user_limit"], counters["rejected_timeout"]) == (1, 1, 1)
+    assert admission.stats()["in_flight"] == 0
+
+
+def test_read_lane_is_served_before_queued_messages(run):
+    admission = main.AdmissionController(max_concurrency=1, per_user=2, max_queue=10, queue_timeout=1)
+
+    async def scenario():
+        release, entered = asyncio.Event(), []
+        holder = asyncio.create_task(hold(admission, "alice", "interact", release))
+        await asyncio.sleep(0)
+        waiters = [asyncio.create_task(hold(admission, user_id, lane, release, entered))
+                   for user_id, lane in (("bob", "interact"), ("carol", "read"))]
+        await asyncio.sleep(0)
+        release.set()
+        await asyncio.gather(holder, *waiters)
+        return entered
+
+    assert run(scenario()) == ["carol", "bob"]
+
+
+def test_http_rejection_carries_retry_after(db, monkeypatch):
+    monkeypatch.setattr(main, "admission", main.AdmissionController(max_concurrency=1, per_user=0, max_queue=1, queue_timeout=1))
+    with TestClient(main.app) as client:
+        response = client.post("/reminders", json={"user_id": "alice", "title": "Pagar la luz"})
+
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == str(main.ADMISSION_RETRY_AFTER)
+    assert db.reminders.count_documents({}) == 0
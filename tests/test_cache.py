@@ -0,0 +1,38 @@
+import threading
+import time
+
+from main import LRUTTLCache
+
+
+def test_evicts_least_recently_used():
+    cache = LRUTTLCache(max_size=2, ttl_seconds=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1  # "a" pasa a ser el más reciente
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c"), len(cache)) == (1, 3, 2)
+
+
+def test_entries_expire():
+    cache = LRUTTLCache(max_size=10, ttl_seconds=60)
+    cache.set("a", 1, ttl_seconds=0.01)
+    time.sleep(0.02)
+
+    assert cache.get("a", "caducado") == "caducado"
+
+
+def test_len_takes_the_lock():
+    cache = LRUTTLCache(max_size=10, ttl_seconds=60)
+    cache.set("a", 1)
+    sizes = []
+    reader = threading.Thread(target=lambda: sizes.append(len(cache)))
+
+    with cache._lock:
+        reader.start()
+        reader.join(0.1)
+        assert reader.is_alive() and sizes == []
+    reader.join(1)
+
+    assert sizes == [1]
@@ -0,0 +1,105 @@
+"""Calendario ICS: lo que exporta el feed se vuelve a importar igual, y reimportar no duplica"""
+from datetime import datetime, timedelta
+
+from fastapi.testclient import TestClient
+
+import main
+from ics import IcsParser, render_calendar, render_event
+
+START = datetime(2026, 11, 2, 19, 0)  # 15:00 en Caracas
+STAMP = datetime(2026, 10, 1, 12, 0)
+
+
+def parse_in_chunks(body: bytes, size: int):
+    parser = IcsParser()
+    events = []
+    for position in range(0, len(body), size):
+        events += parser.feed(body[position:position + size])
+    return events + parser.close(), parser
+
+
+def test_render_and_parse_round_trip():
+    summary = "Revisión trimestral; presupuesto, riesgos y próximos pasos con el equipo de operaciones 📈"
+    body = render_calendar("Asistente", [
+        render_event("a@test", START, START + timedelta(hours=1), summary, STAMP,
+                     description="Sala 3\nTraer el informe, impreso", status="CONFIRMED", alarm_minutes=15),
+        render_event("b@test", START, START + timedelta(days=1), "Cumpleaños de Ana", STAMP, all_day=True),
+        render_event("c@test", START, START, "Cancelada", STAMP, status="CANCELLED"),
+    ]).encode("utf-8")
+    assert all(len(line) <= 75 for line in body.split(b"\r\n"))
+
+    # Trozos de 7 bytes: cortan líneas plegadas y caracteres UTF-8 por la mitad
+    events, parser = parse_in_chunks(body, 7)
+    assert parser.skipped == 0
+    assert [event["uid"] for event in events] == ["a@test", "b@test", "c@test"]
+    meeting, birthday, cancelled = events
+    assert meeting["summary"] == summary
+    assert meeting["description"] == "Sala 3\nTraer el informe, impreso"
+    assert (meeting["start"], meeting["end"], meeting["all_day"]) == (START, START + timedelta(hours=1), False)
+    # El día completo se exporta como fecha local y vuelve como las 00:00 locales de ese día
+    assert birthday["all_day"] and birthday["start"] == datetime(2026, 11, 2, 4, 0)
+    assert birthday["end"] - birthday["start"] == timedelta(days=1)
+    assert cancelled["status"] == "CANCELLED"
+
+
+def test_feed_export_import_round_trip(db):
+    db.scheduled_events.insert_one({
+        "user_id": "alice", "event_type": "meeting", "status": "scheduled",
+        "event_data": {"title": "Reunión con Ana, Luis; y Marta", "description": "Llevar la agenda"},
+        "scheduled_at": STAMP, "scheduled_datetime": START, "ends_at": START + timedelta(minutes=45),
+    })
+
+    with TestClient(main.app) as client:
+        created = client.post("/reminders", json={
+            "user_id": "alice", "title": "Pagar la luz", "description": "Factura de octubre",
+            "due_date": (START + timedelta(days=1)).isoformat()
+        })
+        assert created.status_code == 200
+
+        exported = client.get("/calendar/alice.ics")
+        assert exported.status_code == 200
+        assert exported.headers["content-type"].startswith("text/calendar")
+        revalidated = client.get("/calendar/alice.ics", headers={"If-None-Match": exported.headers["etag"]})
+        assert revalidated.status_code == 304
+
+        def upload():
+            # Cuerpo en trozos, como lo envía un cliente que sube un archivo grande
+            yield from (exported.content[position:position + 64] for position in range(0, len(exported.content), 64))
+
+        first = client.post("/calendar/bob/import", content=upload(), headers={"Content-Type": "text/calendar"})
+        again = client.post("/calendar/bob/import", content=exported.content, headers={"Content-Type": "text/calendar"})
+        bob_feed = client.get("/calendar/bob.ics")
+
+    assert first.json() == {"status": "success", "events": 2, "imported": 2, "duplicates": 0, "skipped": 0}
+    assert (again.json()["imported"], again.json()["duplicates"]) == (0, 2)
+    assert db.scheduled_events.count_documents({"user_id": "bob"}) == 2
+
+    imported = {doc["event_data"]["title"]: doc for doc in db.scheduled_events.find({"user_id": "bob"})}
+    meeting = imported["Reunión con Ana, Luis; y Marta"]
+    assert (meeting["scheduled_datetime"], meeting["ends_at"]) == (START, START + timedelta(minutes=45))
+    assert meeting["event_data"]["description"] == "Llevar la agenda"
+    reminder = imported["Pagar la luz"]
+    assert reminder["scheduled_datetime"] == START + timedelta(days=1)
+    assert reminder["event_data"]["description"] == "Factura de octubre"
+
+    # El feed de bob vuelve a traer los mismos eventos con las mismas horas
+    original, _ = parse_in_chunks(exported.content, 4096)
+    copied, _ = parse_in_chunks(bob_feed.content, 4096)
+    fields = lambda events: sorted((event["summary"], event["start"], event["end"], event["description"]) for event in events)
+    assert fields(copied) == fields(original)
+
+
+def test_import_limit_counts_events_flushed_on_close(db, monkeypatch):
+    body = render_calendar("Asistente", [
+        render_event("a@test", START, START + timedelta(hours=1), "Primera", STAMP),
+        render_event("b@test", START, START + timedelta(hours=1), "Segunda", STAMP),
+    ])
+    # Sin salto de línea final, el último END:VEVENT solo sale del parser en close()
+    body = body[:body.rindex("END:VEVENT") + len("END:VEVENT")].encode("utf-8")
+    with TestClient(main.app) as client:
+        monkeypatch.setattr(main, "ICS_IMPORT_MAX_EVENTS", 1)
+        rejected = client.post("/calendar/bob/import", content=body, headers={"Content-Type": "text/calendar"})
+        monkeypatch.setattr(main, "ICS_IMPORT_MAX_EVENTS", 2)
+        accepted = client.post("/calendar/bob/import", content=body, headers={"Content-Type": "text/calendar"})
+    assert rejected.status_code == 413
+    assert accepted.json()["events"] == 2
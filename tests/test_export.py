@@ -0,0 +1,152 @@
+"""
+Exportación en streaming: el permiso de exportación se libera aunque el cliente se corte a
+mitad de la descarga, y una descarga completa termina con la línea de cierre.
+"""
+import gzip
+import time
+from datetime import datetime
+
+import orjson
+from fastapi.testclient import TestClient
+
+import main
+
+
+def wait_until(condition, timeout=3.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return condition()
+
+
+def slow_chunks(events):
+    try:
+        for i in range(50):
+            time.sleep(0.05)
+            yield b"chunk %d" % i
+    finally:
+        events.append("closed")
+
+
+def test_stop_while_generator_runs_releases_and_closes(run):
+    released, events = [], []
+    job = main.ExportJob(slow_chunks(events), lambda: released.append(1))
+
+    async def read_first():
+        stream = job.stream()
+        first = await stream.__anext__()
+        await stream.aclose()  # el cliente se va mientras el productor sigue generando
+        return first
+
+    assert run(read_first()) == b"chunk 0"
+    assert wait_until(lambda: released == [1] and events == ["closed"])
+    job._thread.join(timeout=2)
+    assert not job._thread.is_alive()
+
+
+def test_job_never_started_releases_on_stop():
+    released = []
+    job = main.ExportJob(iter([b"x"]), lambda: released.append(1))
+    job.stop()
+    job.stop()
+    assert released == [1]
+    assert job._thread is None
+
+
+def test_producer_error_reaches_client_and_releases(run):
+    released = []
+
+    def failing():
+        yield b"ok"
+        raise RuntimeError("disco lleno")
+
+    job = main.ExportJob(failing(), lambda: released.append(1))
+
+    async def read_all():
+        received = []
+        try:
+            async for chunk in job.stream():
+                received.append(chunk)
+        except RuntimeError as e:
+            return received, str(e)
+        return received, None
+
+    assert run(read_all()) == ([b"ok"], "disco lleno")
+    assert released == [1]
+
+
+def export_scope(user_id):
+    return {
+        "type": "http", "asgi": {"version": "3.0", "spec_version": "2.4"}, "http_version": "1.1",
+        "method": "GET", "scheme": "http", "path": f"/user/{user_id}/export", "raw_path": b"",
+        "query_string": b"", "root_path": "", "headers": [(b"host", b"testserver")],
+        "client": ("127.0.0.1", 50000), "server": ("testserver", 80),
+    }
+
+
+def test_disconnects_do_not_exhaust_export_slots(db, run):
+    db.interactions.insert_many([{"user_id": "alice", "user_input": f"nota {i}"} for i in range(20)])
+
+    async def receive():
+        await main.asyncio.sleep(3600)
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.body":
+            raise OSError("conexión cerrada por el cliente")
+
+    async def disconnected_export():
+        try:
+            await main.app(export_scope("alice"), receive, send)
+        except Exception:
+            pass
+
+    for _ in range(main.EXPORT_MAX_CONCURRENT + 1):
+        run(disconnected_export())
+
+    # Todos los permisos vuelven a estar libres
+    assert wait_until(_slots_free)
+
+    with TestClient(main.app) as client:
+        response = client.get("/user/alice/export")
+    assert response.status_code == 200
+    lines = [orjson.loads(line) for line in gzip.decompress(response.content).splitlines()]
+    assert sum(1 for line in lines if line["collection"] == "interactions") == 20
+    assert lines[-1]["collection"] == "_export" and lines[-1]["complete"] is True
+    assert lines[-1]["counts"]["interactions"] == 20
+
+
+def test_since_until_filter_on_document_timestamps(db):
+    # Todos los _id son de hoy: el rango solo puede aplicarse a las fechas de los documentos
+    db.interactions.insert_many([
+        {"user_id": "alice", "user_input": "enero", "timestamp": datetime(2026, 1, 1)},
+        {"user_id": "alice", "user_input": "marzo", "timestamp": datetime(2026, 3, 1)},
+    ])
+    db.reminders.insert_one(main.encode_reminder({"user_id": "alice", "title": "febrero", "created_at": datetime(2025, 12, 1),
+                                                  "updated_at": datetime(2026, 2, 1)}))
+    db.scheduled_events.insert_one({"user_id": "alice", "scheduled_at": datetime(2026, 1, 15), "event_data": {}})
+
+    def export(**params):
+        with TestClient(main.app) as client:
+            response = client.get("/user/alice/export", params={"since": "2026-02-01T00:00:00", "until": "2026-03-02T00:00:00", **params})
+        return [orjson.loads(line) for line in gzip.decompress(response.content).splitlines()][:-1]
+
+    lines = export()
+    assert [(line["collection"], line.get("user_input") or line.get("title")) for line in lines] == [
+        ("interactions", "marzo"), ("reminders", "febrero")
+    ]
+    resumed = export(resume=f"interactions:{lines[0]['_id']}")
+    assert [line["collection"] for line in resumed] == ["reminders"]
+
+
+def _slots_free():
+    taken = 0
+    try:
+        while taken < main.EXPORT_MAX_CONCURRENT and main._export_slots.acquire(blocking=False):
+            taken += 1
+        return taken == main.EXPORT_MAX_CONCURRENT
+    finally:
+        for _ in range(taken):
+            main._export_slots.release()
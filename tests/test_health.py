@@ -0,0 +1,66 @@
+"""Sondas /livez y /readyz: las peticiones solo leen la foto que deja el prober"""
+from datetime import datetime, timedelta
+
+from fastapi.testclient import TestClient
+
+import main
+
+
+def readyz(snapshot, monkeypatch):
+    monkeypatch.setattr(main, "health_snapshot", snapshot)
+    # Sin el contexto del TestClient no arranca el startup, así que el prober no pisa la foto
+    return TestClient(main.app).get("/readyz")
+
+
+def test_livez_does_not_depend_on_the_snapshot(monkeypatch):
+    monkeypatch.setattr(main, "health_snapshot", None)
+    response = TestClient(main.app).get("/livez")
+    assert response.status_code == 200
+    assert response.json()["status"] == "alive"
+
+
+def test_readyz_serves_the_snapshot_and_rejects_missing_or_old_ones(db, run, monkeypatch):
+    monkeypatch.setattr(main, "scheduler_last_tick", datetime.utcnow())
+    snapshot = run(main.run_health_probes())
+    assert snapshot["ready"]
+    assert snapshot["checks"]["mongo"]["status"] == "ok"
+    assert snapshot["checks"]["telegram"]["status"] == "disabled"
+    assert snapshot["checks"]["queues"]["outbox_pending"] == 0
+
+    response = readyz(snapshot, monkeypatch)
+    assert response.status_code == 200
+    assert response.json()["status"] == "ready"
+    assert response.json()["checks"]["scheduler"]["status"] == "ok"
+
+    assert readyz(None, monkeypatch).status_code == 503
+    # Un prober que dejó de actualizar la foto no puede mantener el servicio como disponible
+    old = dict(snapshot, checked_at=datetime.utcnow() - timedelta(seconds=main.HEALTH_PROBE_SECONDS * 3 + main.HEALTH_PROBE_TIMEOUT + 1))
+    assert readyz(old, monkeypatch).json() == {"status": "not_ready", "reason": "sin sondeo reciente"}
+
+
+def test_not_ready_when_scheduler_stalls_outbox_backs_up_or_mongo_fails(db, run, monkeypatch):
+    monkeypatch.setattr(main, "scheduler_last_tick", datetime.utcnow() - timedelta(hours=1))
+    stalled = run(main.run_health_probes())
+    assert stalled["checks"]["scheduler"]["status"] == "stale"
+    assert readyz(stalled, monkeypatch).status_code == 503
+
+    monkeypatch.setattr(main, "scheduler_last_tick", datetime.utcnow())
+    monkeypatch.setattr(main, "OUTBOX_READY_MAX_PENDING", 1)
+    db.notification_outbox.insert_many([
+        {"idempotency_key": f"k{position}", "status": main.OutboxStatus.PENDING.value} for position in range(2)
+    ])
+    backed_up = run(main.run_health_probes())
+    assert backed_up["checks"]["queues"] == {**backed_up["checks"]["queues"], "status": "saturated", "outbox_pending": 2}
+    assert readyz(backed_up, monkeypatch).status_code == 503
+
+    def unreachable(*args, **kwargs):
+        raise ConnectionError("sin conexión")
+
+    monkeypatch.setattr(main.client.admin, "command", unreachable)
+    offline = run(main.run_health_probes())
+    assert offline["checks"]["mongo"] == {"status": "failed", "error": "sin conexión"}
+    # Sin base de datos no se cuenta el outbox
+    assert "outbox_pending" not in offline["checks"]["queues"]
+    response = readyz(offline, monkeypatch)
+    assert response.status_code == 503
+    assert response.json()["status"] == "not_ready"
@@ -0,0 +1,32 @@
+"""Idempotencia de POST /reminders: solo con Idempotency-Key explícita"""
+from fastapi.testclient import TestClient
+
+import main
+
+BODY = {"user_id": "alice", "title": "Pagar la luz", "due_date": "2030-01-01T14:00:00"}
+
+
+def test_replay_with_explicit_key_returns_the_same_reminder(db):
+    with TestClient(main.app) as client:
+        first = client.post("/reminders", json=BODY, headers={"Idempotency-Key": "abc"})
+        again = client.post("/reminders", json=BODY, headers={"Idempotency-Key": "abc"})
+        # Otro worker (o un reinicio) no tiene la caché: responde la clave guardada en el documento
+        main.idempotency_cache.clear()
+        other_worker = client.post("/reminders", json=BODY, headers={"Idempotency-Key": "abc"})
+
+    assert first.status_code == again.status_code == other_worker.status_code == 200
+    assert "Idempotent-Replayed" not in first.headers
+    assert again.headers["Idempotent-Replayed"] == "true"
+    assert first.json()["id"] == again.json()["id"] == other_worker.json()["id"]
+    assert db.reminders.count_documents({"user_id": "alice"}) == 1
+
+
+def test_same_reminder_without_key_is_not_deduplicated(db):
+    with TestClient(main.app) as client:
+        first = client.post("/reminders", json=BODY)
+        second = client.post("/reminders", json=BODY)
+        other_key = client.post("/reminders", json=BODY, headers={"Idempotency-Key": "xyz"})
+
+    assert len({first.json()["id"], second.json()["id"], other_key.json()["id"]}) == 3
+    assert db.reminders.count_documents({"user_id": "alice"}) == 3
+    assert db.reminders.count_documents({"idempotency_key": {"$exists": True}}) == 1
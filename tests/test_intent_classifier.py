@@ -0,0 +1,61 @@
+"""Clasificador de intenciones: por debajo de INTENT_MIN_CONFIDENCE manda el motor de palabras clave"""
+import pytest
+
+import main
+import nlu_executor
+from intent_classifier import IntentClassifier
+
+# Etiquetas a propósito distintas de las del motor de palabras clave ("hola" -> greeting)
+EXAMPLES = [("hola equipo", "thank_you"), ("hola a todos", "thank_you"), ("buen día, hola", "thank_you"),
+            ("ayuda por favor", "ask_help"), ("necesito ayuda", "ask_help"), ("qué puedes hacer", "ask_help")]
+
+
+@pytest.fixture
+def model_backend(tmp_path, monkeypatch):
+    model = IntentClassifier.train([text for text, _ in EXAMPLES], [label for _, label in EXAMPLES], hash_bits=12, epochs=30)
+    path = str(tmp_path / "intent_model.npz")
+    model.save(path)
+    monkeypatch.setattr(main, "INTENT_BACKEND", "model")
+    monkeypatch.setattr(main, "INTENT_MODEL_PATH", path)
+    monkeypatch.setattr(main, "intent_model", None)
+    main.load_intent_model()
+    assert main.intent_model is not None
+    return main.intent_model
+
+
+def test_confident_prediction_wins(model_backend, monkeypatch):
+    label, confidence = model_backend.predict_one("hola equipo")
+    assert label == "thank_you"
+    monkeypatch.setattr(main, "INTENT_MIN_CONFIDENCE", confidence)
+
+    assert main.detect_intent("hola equipo") == "thank_you"
+    assert main.detect_intents(["hola equipo"]) == ["thank_you"]
+
+
+def test_low_confidence_falls_back_to_keywords(model_backend, monkeypatch):
+    _, confidence = model_backend.predict_one("hola equipo")
+    monkeypatch.setattr(main, "INTENT_MIN_CONFIDENCE", confidence + 1e-3)
+
+    assert main.detect_intent("hola equipo") == "greeting"
+    assert main.detect_intents(["hola equipo", "necesito ayuda"]) == ["greeting", "ask_help"]
+
+
+def test_missing_model_keeps_keyword_backend(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "INTENT_BACKEND", "model")
+    monkeypatch.setattr(main, "INTENT_MODEL_PATH", str(tmp_path / "no_existe.npz"))
+    monkeypatch.setattr(main, "intent_model", None)
+    main.load_intent_model()
+
+    assert main.intent_model is None
+    assert main.detect_intent("hola") == "greeting"
+
+
+def test_executor_workers_apply_the_same_threshold(model_backend, monkeypatch):
+    _, confidence = model_backend.predict_one("hola equipo")
+    try:
+        nlu_executor.init_worker(None, main.INTENT_MODEL_PATH, confidence + 1e-3)
+        assert nlu_executor.analyze_batch(["hola equipo"])[0]["intent"] == "greeting"
+        nlu_executor.init_worker(None, main.INTENT_MODEL_PATH, confidence)
+        assert nlu_executor.analyze_batch(["hola equipo"])[0]["intent"] == "thank_you"
+    finally:
+        nlu_executor.init_worker(None, None, 0.0)
@@ -0,0 +1,77 @@
+from datetime import datetime, timedelta
+
+import main
+from agenda import UserAgenda
+
+
+def schedule(user_id, when_utc, text="Programar reunión con el equipo mañana a las 3 PM"):
+    return main.handle_meeting_scheduling(
+        text, user_id, {"day": "mañana", "time": "3 PM"}, {"meeting_time": when_utc}
+    )
+
+
+def test_confirmation_shows_local_time(db):
+    # 19:00 UTC son las 15:00 en Caracas (UTC-4)
+    reply = schedule("alice", datetime(2026, 11, 2, 19, 0))
+
+    assert reply.key == "meeting_scheduled"
+    text = reply.render()
+    assert "15:00" in text and "14:45" in text
+    assert "19:00" not in text
+
+
+def test_confirmation_and_conflict_agree_on_the_time(db):
+    meeting = datetime(2026, 11, 2, 19, 0)
+    scheduled = schedule("alice", meeting).render()
+    conflict = schedule("alice", meeting, "Programar revisión mañana a las 3 PM")
+
+    assert conflict.key == "meeting_conflict"
+    assert "15:00" in conflict.render() and "15:00" in scheduled
+
+
+def test_agenda_overlap_and_free_slots():
+    day = datetime(2026, 11, 2)
+    agenda = UserAgenda("alice")
+    # Taller largo que empieza antes: solo se encuentra si la búsqueda retrocede max_length
+    agenda.add(1, day.replace(hour=13), day.replace(hour=17), "Taller")
+    agenda.add(2, day.replace(hour=18), day.replace(hour=18, minute=45), "Revisión")
+
+    assert [event["id"] for event in agenda.overlapping(day.replace(hour=16), day.replace(hour=16, minute=30))] == [1]
+    # Intervalos semiabiertos: terminar o empezar justo en el borde no es choque
+    assert agenda.overlapping(day.replace(hour=17), day.replace(hour=18)) == []
+    assert [event["id"] for event in agenda.overlapping(day.replace(hour=12), day.replace(hour=19))] == [1, 2]
+
+    # 9:00-13:00 locales ocupados; el hueco de 17:00 a 18:00 UTC cabe, 18:45 se redondea a 19:00
+    slots = agenda.free_slots(day.replace(hour=13), timedelta(hours=1), count=3)
+    assert slots == [day.replace(hour=17), day.replace(hour=19), day.replace(hour=20)]
+
+    # Después de las 19:00 locales ya no cabe una hora: salta a las 8:00 locales del día siguiente
+    late = agenda.free_slots(day.replace(hour=23, minute=30), timedelta(hours=1), count=1)
+    assert late == [datetime(2026, 11, 3, 12, 0)]
+
+    agenda.remove(1)
+    assert agenda.overlapping(day.replace(hour=16), day.replace(hour=16, minute=30)) == []
+
+
+def test_conflict_sees_events_saved_by_another_worker(db):
+    meeting = (datetime.utcnow() + timedelta(days=14)).replace(hour=19, minute=0, second=0, microsecond=0)
+    assert schedule("alice", meeting - timedelta(days=1)).key == "meeting_scheduled"
+    assert main.agenda_indexes.get("alice") is not None
+
+    # Otro worker guarda una reunión después de que esta agenda quedó en memoria
+    main.save_scheduled_event("alice", "meeting", {"title": "Comité", "scheduled_datetime": meeting})
+    # Ni un evento cancelado ni uno de día completo ocupan horario
+    main.save_scheduled_event("alice", "all_day", {"title": "Cumpleaños", "scheduled_datetime": meeting + timedelta(hours=2)})
+    cancelled = main.save_scheduled_event("alice", "meeting", {"title": "Anulada", "scheduled_datetime": meeting + timedelta(hours=4)})
+    db.scheduled_events.update_one({"_id": cancelled}, {"$set": {"status": "cancelled"}})
+
+    conflict = schedule("alice", meeting + timedelta(minutes=30), "Programar revisión mañana a las 3 PM")
+    assert conflict.key == "meeting_conflict"
+    assert "Comité" in conflict.render()
+    assert db.scheduled_events.count_documents({"user_id": "alice"}) == 4
+
+    assert schedule("alice", meeting + timedelta(hours=2)).key == "meeting_scheduled"
+    main.agenda_indexes.clear()
+    assert schedule("alice", meeting + timedelta(hours=4)).key == "meeting_scheduled"
+    # Otro usuario no ve la agenda de alice
+    assert schedule("bob", meeting).key == "meeting_scheduled"
@@ -0,0 +1,66 @@
+"""Configuración del NLU: recarga en caliente desde archivo o colección y reemplazo atómico"""
+import json
+import os
+
+import pytest
+
+import nlu
+
+
+@pytest.fixture
+def config_file(tmp_path):
+    with open(nlu.NLU_CONFIG_PATH, encoding="utf-8") as f:
+        config = json.load(f)
+    path = tmp_path / "nlu_config.json"
+
+    def write(**changes):
+        path.write_text(json.dumps({**config, **changes}), encoding="utf-8")
+        # Cada escritura cambia el mtime aunque caiga en el mismo tick del reloj
+        stamp = os.path.getmtime(path) + write.count
+        os.utime(path, (stamp, stamp))
+        write.count += 1
+
+    write.count = 1
+    write(version=1)
+    yield str(path), write
+    nlu.reload_nlu_from_file(force=True)
+
+
+def test_file_reload_swaps_only_when_the_file_changes(config_file):
+    path, write = config_file
+    assert nlu.reload_nlu_from_file(force=True, path=path)
+    before = nlu.get_nlu()
+    assert nlu.reload_nlu_from_file(path=path) is False
+
+    write(version=2, intents={**before.config["intents"], "greeting": ["saludos"]})
+    assert nlu.reload_nlu_from_file(path=path)
+
+    active = nlu.get_nlu()
+    assert active is not before and active.version == 2
+    assert active.detect_intent("saludos a todos") == "greeting"
+    # Quien ya tenía el matcher anterior lo sigue usando sin cambios
+    assert before.detect_intent("saludos a todos") == "unknown"
+    assert before.detect_intent("hola") == "greeting"
+
+
+def test_invalid_config_keeps_the_active_version(config_file):
+    path, write = config_file
+    nlu.reload_nlu_from_file(force=True, path=path)
+    active = nlu.get_nlu()
+
+    write(version=2, intents={"greeting": "hola"})
+    with pytest.raises(ValueError):
+        nlu.reload_nlu_from_file(path=path)
+    assert nlu.get_nlu() is active
+
+
+def test_collection_reload_picks_the_highest_version(db):
+    config = dict(nlu.get_nlu().config)
+    db.nlu_config.insert_many([{**config, "version": 5}, {**config, "version": 7, "days": ["feriado"]}])
+    try:
+        assert nlu.reload_nlu_from_collection(db.nlu_config)
+        assert (nlu.get_nlu().version, nlu.get_nlu().source) == (7, "mongo")
+        assert nlu.get_nlu().find_day("el feriado") == "feriado"
+        assert nlu.reload_nlu_from_collection(db.nlu_config) is False
+    finally:
+        nlu.reload_nlu_from_file(force=True)
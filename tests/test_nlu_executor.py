@@ -0,0 +1,49 @@
+"""Ejecutor del NLU: los mensajes se agrupan en micro-lotes y cada uno recibe su análisis"""
+import asyncio
+
+from nlu_executor import NLUExecutor, analyze_batch
+
+TEXTS = ["hola", "recordarme pagar la luz mañana a las 10 am", "reunión el viernes a las 3 pm", "gracias"] * 3
+
+
+def test_burst_is_split_into_batches_of_batch_size(run):
+    executor = NLUExecutor(mode="thread", workers=2, batch_size=4, batch_wait_ms=50)
+
+    async def burst():
+        await executor.start()
+        try:
+            return await asyncio.gather(*(executor.analyze(text) for text in TEXTS[:10]))
+        finally:
+            executor.shutdown()
+
+    results = run(burst())
+    assert [result["intent"] for result in results] == [result["intent"] for result in analyze_batch(TEXTS[:10])]
+    assert results[1]["due_date"] is not None and "meeting_time" in results[2]
+    stats = executor.stats()
+    assert (stats["batches"], stats["messages"], stats["avg_batch_size"]) == (3, 10, 3.33)
+
+
+def test_lone_message_waits_at_most_batch_wait(run):
+    executor = NLUExecutor(mode="thread", workers=1, batch_size=32, batch_wait_ms=20)
+
+    async def lone():
+        await executor.start()
+        try:
+            loop = asyncio.get_running_loop()
+            started = loop.time()
+            result = await executor.analyze("hola")
+            return result, loop.time() - started
+        finally:
+            executor.shutdown()
+
+    result, elapsed = run(lone())
+    assert result["intent"] == "greeting"
+    assert elapsed < 1
+    assert executor.stats()["batches"] == 1
+
+
+def test_inline_mode_leaves_analysis_to_the_pipeline(run):
+    executor = NLUExecutor(mode="inline")
+    run(executor.start())
+    assert run(executor.analyze("hola")) is None
+    assert executor.stats()["workers"] == 0
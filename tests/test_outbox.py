@@ -0,0 +1,121 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from fastapi.testclient import TestClient
+
+import main
+
+
+def spy_off_loop(monkeypatch, *names):
+    """Registra, para cada función, si se ejecutó dentro del event loop (bloqueándolo)"""
+    calls = []
+    for name in names:
+        original = getattr(main, name)
+
+        def spy(*args, original=original, name=name):
+            try:
+                asyncio.get_running_loop()
+                calls.append((name, "loop"))
+            except RuntimeError:
+                calls.append((name, "thread"))
+            return original(*args)
+
+        monkeypatch.setattr(main, name, spy)
+    return calls
+
+
+def pending_reminder(db, user_id="alice"):
+    reminder = main.encode_reminder({
+        "user_id": user_id, "title": "pagar la luz", "status": "pending",
+        "due_date": datetime.utcnow() + timedelta(minutes=1)
+    })
+    reminder["_id"] = db.reminders.insert_one(reminder).inserted_id
+    return reminder
+
+
+def test_drain_outbox_keeps_storage_off_the_event_loop(db, run, telegram_outbox, monkeypatch):
+    monkeypatch.setattr(main, "DIGEST_WINDOW_SECONDS", 0)
+    main.link_telegram_chat("alice", "111")
+    main.enqueue_notification({"reminder": pending_reminder(db), "kind": "upcoming", "message": "m", "summary": "s"})
+    calls = spy_off_loop(monkeypatch, "claim_outbox_batch", "get_user_chat_ids", "finish_outbox_batch")
+
+    assert run(main.drain_outbox()) == 1
+
+    assert [name for name, _ in calls] == ["claim_outbox_batch", "get_user_chat_ids", "finish_outbox_batch"]
+    assert {where for _, where in calls} == {"thread"}
+    assert db.notification_outbox.find_one({})["status"] == main.OutboxStatus.SENT.value
+    assert telegram_outbox[0][0] == "111"
+
+
+def test_failed_send_is_retried_later(db, run, monkeypatch):
+    monkeypatch.setattr(main, "DIGEST_WINDOW_SECONDS", 0)
+    main.enqueue_notification({"reminder": pending_reminder(db, "nadie"), "kind": "upcoming", "message": "m", "summary": "s"})
+    monkeypatch.setattr(main, "TELEGRAM_FALLBACK_TO_DEFAULT_CHAT", False)
+
+    run(main.drain_outbox())
+
+    row = db.notification_outbox.find_one({})
+    assert row["status"] == main.OutboxStatus.PENDING.value
+    assert row["attempts"] == 1 and row["next_attempt_at"] > datetime.utcnow()
+
+
+def test_reminders_debug_queries_off_the_event_loop(db, monkeypatch):
+    pending_reminder(db)
+    calls = spy_off_loop(monkeypatch, "reminders_validator")
+
+    body = TestClient(main.app).get("/reminders-debug/alice").json()
+
+    assert calls == [("reminders_validator", "thread")]
+    assert body["counts"] == {"pending": 1, "completed": 0, "total": 1}
+
+
+def test_enqueue_writes_one_transaction_per_batch(db, monkeypatch):
+    reminders = [pending_reminder(db, f"user{index}") for index in range(5)]
+    notifications = [{"reminder": reminder, "kind": "upcoming", "message": "m", "summary": "s"} for reminder in reminders]
+    transactions = []
+    original = main.run_in_transaction
+    monkeypatch.setattr(main, "run_in_transaction", lambda callback: transactions.append(1) or original(callback))
+    monkeypatch.setattr(main, "OUTBOX_ENQUEUE_BATCH", 2)
+
+    assert main.enqueue_notifications(notifications) == 5
+    assert len(transactions) == 3
+    assert db.notification_outbox.count_documents({}) == 5
+    assert db.reminders.count_documents({"last_reminded": None}) == 0
+
+    # Reencolar las mismas no duplica el outbox
+    assert main.enqueue_notifications(notifications) == 0
+    assert db.notification_outbox.count_documents({}) == 5
+
+
+def age_outbox(db, seconds, user_id=None):
+    """Retrasa created_at de las filas del outbox como si se hubieran encolado hace un rato"""
+    past = datetime.utcnow() - timedelta(seconds=seconds)
+    db.notification_outbox.update_many({"user_id": user_id} if user_id else {}, {"$set": {"created_at": past}})
+
+
+def test_digest_window_holds_fresh_notifications(db, run, telegram_outbox):
+    assert main.DIGEST_WINDOW_SECONDS > 0
+    main.link_telegram_chat("alice", "111")
+    for kind in ("upcoming", "immediate"):
+        main.enqueue_notification({"reminder": pending_reminder(db), "kind": kind, "message": kind, "summary": kind})
+
+    assert run(main.drain_outbox()) == 0
+    age_outbox(db, main.DIGEST_WINDOW_SECONDS)
+    assert run(main.drain_outbox()) == 2
+    # Las dos salen en un solo mensaje al mismo chat
+    assert [chat_id for chat_id, _ in telegram_outbox] == ["111"]
+
+
+def test_digest_readiness_is_per_chat(db, run, telegram_outbox, monkeypatch):
+    # Sin chat propio, alice y bob comparten el chat por defecto; carol tiene el suyo
+    monkeypatch.setattr(main, "TELEGRAM_FALLBACK_TO_DEFAULT_CHAT", True)
+    monkeypatch.setattr(main, "TELEGRAM_CHAT_ID", "999")
+    main.link_telegram_chat("carol", "333")
+    for user_id in ("alice", "bob", "carol"):
+        main.enqueue_notification({"reminder": pending_reminder(db, user_id), "kind": "upcoming", "message": user_id, "summary": user_id})
+    age_outbox(db, main.DIGEST_WINDOW_SECONDS, "alice")
+
+    # La fila vieja de alice libera todo el chat compartido (también la de bob); carol espera su ventana
+    assert run(main.drain_outbox()) == 2
+    assert [chat_id for chat_id, _ in telegram_outbox] == ["999"]
+    assert db.notification_outbox.find_one({"user_id": "carol"})["status"] == main.OutboxStatus.PENDING.value
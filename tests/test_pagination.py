@@ -0,0 +1,81 @@
+"""Paginación por cursor de /reminders/{user_id}: cada recordatorio sale una vez y en orden"""
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from fastapi.testclient import TestClient
+
+import main
+from reminder_schema import encode_reminder
+
+BASE = datetime(2026, 11, 2, 12, 0)
+
+
+def add_reminders(db):
+    docs = []
+    for position in range(23):
+        # Fechas repetidas (el desempate es el _id) y algunos sin fecha, que van primero
+        due = None if position % 7 == 0 else BASE + timedelta(hours=position % 5)
+        docs.append(encode_reminder({
+            "_id": ObjectId(), "user_id": "alice", "title": f"recordatorio {position}", "due_date": due,
+            "status": "completed" if position == 11 else "pending", "created_at": BASE, "updated_at": BASE
+        }))
+    docs.append(encode_reminder({"_id": ObjectId(), "user_id": "bob", "title": "ajeno", "due_date": BASE,
+                                 "status": "pending", "created_at": BASE, "updated_at": BASE}))
+    db.reminders.insert_many(docs)
+    pending = [doc for doc in docs if doc["user_id"] == "alice" and doc["status"] == "pending"]
+    pending.sort(key=lambda doc: (doc.get("due_date") is not None, doc.get("due_date") or BASE, doc["_id"]))
+    return [str(doc["_id"]) for doc in pending]
+
+
+def walk(client, limit, on_page=None):
+    seen, pages, cursor = [], 0, None
+    while True:
+        params = {"limit": limit, **({"cursor": cursor} if cursor else {})}
+        page = client.get("/reminders/alice", params=params).json()
+        pages += 1
+        seen += [reminder["_id"] for reminder in page["reminders"]]
+        if on_page:
+            on_page(pages)
+        cursor = page["next_cursor"]
+        if cursor is None:
+            return seen, pages, page["total"]
+
+
+def test_pages_cover_every_reminder_once_in_order(db):
+    expected = add_reminders(db)
+    with TestClient(main.app) as client:
+        for limit in (1, 4, 22, 100):
+            seen, pages, total = walk(client, limit)
+            assert seen == expected
+            assert total == len(expected) == 22
+            assert pages == -(-len(expected) // limit)
+
+
+def test_inserts_between_pages_do_not_repeat_or_skip(db):
+    expected = add_reminders(db)
+    late = []
+
+    def insert_before_cursor(page):
+        if page == 2:
+            # Un recordatorio que ordena antes de la posición actual no desplaza las páginas siguientes
+            doc = encode_reminder({"user_id": "alice", "title": "tardío", "due_date": BASE - timedelta(days=1),
+                                   "status": "pending", "created_at": BASE, "updated_at": BASE})
+            db.reminders.insert_one(doc)
+            late.append(str(doc["_id"]))
+
+    with TestClient(main.app) as client:
+        seen, _, _ = walk(client, 5, insert_before_cursor)
+    assert late and late[0] not in seen
+    assert seen == expected
+
+
+def test_invalid_cursor_and_page_limit(db):
+    add_reminders(db)
+    with TestClient(main.app) as client:
+        assert client.get("/reminders/alice", params={"limit": 5, "cursor": "no-es-un-cursor"}).status_code == 400
+        bad_id = main.base64.urlsafe_b64encode(main.orjson.dumps([None, "xyz"])).decode().rstrip("=")
+        assert client.get("/reminders/alice", params={"limit": 5, "cursor": bad_id}).status_code == 400
+        page = client.get("/reminders/alice", params={"limit": main.REMINDERS_MAX_PAGE + 50}).json()
+        assert page["count"] == 22 and page["next_cursor"] is None
+        unpaged = client.get("/reminders/alice").json()
+        assert unpaged["count"] == 22 and "next_cursor" not in unpaged
@@ -0,0 +1,66 @@
+import time
+from datetime import datetime
+
+from fastapi.testclient import TestClient
+
+import main
+from reminder_schema import decode_reminder, encode_reminder, migrate_reminder, serialize_reminder
+
+
+def test_description_survives_encoding_even_if_equal_to_title():
+    doc = encode_reminder({"title": "pagar", "description": "pagar", "created_at": datetime(2026, 1, 1)})
+
+    assert decode_reminder(doc)["description"] == "pagar"
+
+
+def test_legacy_document_keeps_description_when_migrated():
+    legacy = {"_id": 1, "user_id": "alice", "title": "Llamar a Juan", "description": "Recordarme llamar a Juan",
+              "priority": "high", "tags": ["llamada"], "last_reminded": None, "created_at": datetime(2026, 1, 1)}
+
+    public = serialize_reminder(migrate_reminder(legacy))
+
+    assert public["description"] == "Recordarme llamar a Juan"
+    assert (public["priority"], public["tags"]) == ("high", ["llamada"])
+
+
+def test_created_reminder_stores_the_request_as_description(db):
+    text = "Recordarme llamar a Juan mañana a las 10"
+    main.handle_reminder_creation(text, "alice", {}, {"due_date": datetime(2030, 1, 1, 14)})
+
+    assert decode_reminder(db.reminders.find_one({"user_id": "alice"}))["description"] == text
+
+
+def test_meeting_reminder_keeps_its_description(db):
+    text = "Programar reunión con el equipo mañana a las 3 PM"
+    main.handle_meeting_scheduling(text, "alice", {"day": "mañana", "time": "3 PM"}, {"meeting_time": datetime(2030, 1, 1, 19)})
+
+    reminder = decode_reminder(db.reminders.find_one({"user_id": "alice"}))
+    assert reminder["description"] == f"Reunión programada: {text}"
+
+
+def test_legacy_documents_read_by_a_request_are_migrated_in_background(db):
+    db.reminders.insert_one({"user_id": "alice", "title": "Llamar a Juan", "status": "pending",
+                             "due_date": datetime(2030, 1, 1, 14), "created_at": datetime(2026, 1, 1)})
+    with TestClient(main.app) as client:
+        assert client.get("/reminders/alice").json()["count"] == 1
+        deadline = time.monotonic() + 5
+        while (main.reminder_migration_tasks or db.reminders.count_documents({"v": {"$exists": False}})) \
+                and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    assert db.reminders.count_documents({"v": {"$exists": False}}) == 0
+    assert not main.reminder_migration_tasks
+
+
+def test_follow_up_answer_completes_the_pending_reminder(db):
+    request = "Recordarme pagar la luz"
+    main.remember_pending_action("carla", "create_reminder", {}, request)
+
+    main.generate_response_complete("mañana a las 10", "carla")
+
+    reminder = decode_reminder(db.reminders.find_one({"user_id": "carla"}))
+    # La respuesta aporta la fecha; título y descripción siguen siendo los del pedido original
+    assert reminder["description"] == request
+    assert reminder["title"] == main.extract_reminder_title(request)
+    assert reminder["due_date"] == main.parse_natural_time("mañana a las 10:00")
+    assert main.conversation_contexts.get("carla").pending_action is None
@@ -0,0 +1,33 @@
+"""Perfil de rutinas: los incrementos se acumulan en memoria y se escriben por lotes"""
+from datetime import datetime
+
+import main
+
+
+def test_increments_are_buffered_and_flushed_in_one_write(db, monkeypatch):
+    writes = []
+    original = db.user_routine_profiles.bulk_write
+    monkeypatch.setattr(type(db.user_routine_profiles), "bulk_write",
+                        lambda self, requests, **kwargs: writes.append(len(requests)) or original(requests, **kwargs))
+    for _ in range(3):
+        main.update_routine_profile("alice", intent="greeting")
+    main.update_routine_profile("bob", event_kind="reminder", event_time=datetime(2026, 11, 2, 19), title="Pagar la luz")
+
+    # Nada llega a la base de datos hasta el flush, y el flush es una sola escritura
+    assert db.user_routine_profiles.count_documents({}) == 0
+    assert main.flush_routine_profiles() == 2
+    assert writes == [2]
+    alice = main.get_routine_profile("alice")
+    assert (alice["total_interactions"], alice["intents"]) == (3, {"greeting": 3})
+    assert main.get_routine_profile("bob")["titles"] == {"pagar la luz": 1}
+    assert main.flush_routine_profiles() == 0
+
+
+def test_flush_trims_titles_when_crossing_the_threshold(db, monkeypatch):
+    monkeypatch.setattr(main, "ROUTINE_TRIM_EVERY", 4)
+    monkeypatch.setattr(main, "ROUTINE_MAX_TITLES", 2)
+    for title in ("uno", "dos", "dos", "tres", "tres", "tres"):
+        main.update_routine_profile("alice", title=title)
+    main.flush_routine_profiles()
+
+    assert main.get_routine_profile("alice")["titles"] == {"tres": 3, "dos": 2}
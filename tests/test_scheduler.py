@@ -0,0 +1,44 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import main
+
+
+def run_checkers(run):
+    notifications = []
+    notifications += run(main.check_pending_reminders())
+    notifications += run(main.check_immediate_reminders())
+    notifications += run(main.check_overdue_reminders())
+    main.enqueue_notifications(notifications)
+    return [notification["kind"] for notification in notifications]
+
+
+@pytest.mark.parametrize("latency", [timedelta(0), timedelta(milliseconds=300), timedelta(seconds=45)])
+def test_due_queue_wakeups_hit_every_notice_window(db, run, monkeypatch, latency):
+    """Solo con las horas de despertar de la cola (sin reescaneos) salen el aviso previo y el final"""
+    due = datetime.utcnow().replace(microsecond=0) + timedelta(hours=1)
+    reminder_id = db.reminders.insert_one(main.encode_reminder({
+        "user_id": "alice", "title": "pagar la luz", "status": "pending", "due_date": due
+    })).inserted_id
+    queue = main.ReminderDueQueue()
+    queue.horizon = due + timedelta(hours=1)
+    queue.track(reminder_id, due, "alice")
+
+    clock = due - timedelta(minutes=10)
+    monkeypatch.setattr(main, "get_utc_now", lambda: clock.replace(tzinfo=timezone.utc))
+    kinds = []
+    while (wake := queue.next_wake(clock)) is not None:
+        clock = wake + latency
+        kinds += run_checkers(run)
+
+    assert kinds == ["upcoming", "immediate"]
+    assert main.decode_reminder(db.reminders.find_one({"_id": reminder_id}))["status"] == "completed"
+
+
+def test_wake_offsets_fall_inside_checker_windows():
+    upcoming, immediate, overdue = main.REMINDER_WAKE_OFFSETS
+
+    assert main.UPCOMING_NOTICE_MINUTES[0] <= int(upcoming.total_seconds() / 60) <= main.UPCOMING_NOTICE_MINUTES[1]
+    assert 0 <= immediate.total_seconds() <= main.IMMEDIATE_NOTICE_SECONDS
+    assert overdue == timedelta(0)
@@ -0,0 +1,35 @@
+"""Búsqueda: sin change streams, el índice en memoria sigue las ediciones y los borrados"""
+from datetime import datetime, timedelta
+
+from fastapi.testclient import TestClient
+
+import main
+from reminder_schema import encode_reminder, encode_update
+
+
+def titles(client, q):
+    results = client.get("/search/alice", params={"q": q, "scope": "reminders"}).json()["results"]
+    return [result["title"] for result in results]
+
+
+def test_catch_up_reindexes_edits_and_drops_deleted_reminders(db):
+    created = datetime.utcnow() - timedelta(minutes=5)
+    reminder_id = db.reminders.insert_one(encode_reminder({
+        "user_id": "alice", "title": "Pagar la luz", "status": "pending", "created_at": created
+    })).inserted_id
+    db.reminders.insert_one(encode_reminder({
+        "user_id": "alice", "title": "Comprar pan", "status": "pending", "created_at": created
+    }))
+
+    with TestClient(main.app) as client:
+        assert titles(client, "luz") == ["Pagar la luz"]
+
+        db.reminders.update_one({"_id": reminder_id}, {"$set": encode_update({"title": "Pagar el gas", "updated_at": datetime.utcnow()})})
+        assert titles(client, "luz") == []
+        assert titles(client, "gas") == ["Pagar el gas"]
+
+        db.reminders.delete_one({"_id": reminder_id})
+        # Una búsqueda que no lo encontraría igual lo quita del índice
+        assert titles(client, "pan") == ["Comprar pan"]
+        assert main.search_indexes.get("alice").count("reminder") == 1
+        assert main.search_indexes.get("alice").stats()["slots"] == 3  # las búsquedas sin cambios no reindexan
@@ -0,0 +1,262 @@
+"""
+Almacenamiento embebido (storage.py): las consultas de la aplicación dan lo mismo que MongoDB
+(mongomock como referencia), se resuelven con índices de SQLite y lo que queda fuera del
+repositorio lanza UnsupportedOperation.
+"""
+import random
+from datetime import datetime, timedelta, timezone
+
+import bson
+import mongomock
+import pytest
+from pymongo import ReplaceOne, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+
+import main
+from storage import EmbeddedClient, UnsupportedOperation
+
+NOW = datetime(2026, 3, 1, 12, 0)
+
+
+@pytest.fixture
+def reminders():
+    collection = EmbeddedClient(None)["test"].reminders
+    collection.create_index([("user_id", 1), ("due_date", 1)])
+    collection.create_index([("status", 1), ("due_date", 1)])
+    collection.create_index([("idempotency_key", 1)], unique=True, sparse=True)
+    return collection
+
+
+def sample_docs(count=300):
+    rng = random.Random(11)
+    docs = []
+    for position in range(count):
+        doc = {
+            "_id": bson.ObjectId.from_datetime(NOW + timedelta(seconds=position)),
+            "user_id": f"user_{rng.randrange(5)}",
+            "status": rng.choice(["pending", "completed", "cancelled"]),
+            "t": f"recordatorio {position}",
+            "tg": rng.sample(["casa", "trabajo", "salud"], rng.randrange(0, 3)),
+        }
+        roll = rng.random()
+        if roll < 0.1:
+            doc["due_date"] = None
+        elif roll < 0.9:
+            doc["due_date"] = NOW + timedelta(minutes=rng.randrange(-600, 600))
+        if rng.random() < 0.3:
+            doc["last_reminded"] = NOW - timedelta(minutes=rng.randrange(60))
+        if rng.random() < 0.2:
+            doc["immediate_notified"] = True
+        if rng.random() < 0.8:
+            doc["v"] = 2
+        docs.append(doc)
+    return docs
+
+
+QUERIES = [
+    ({"user_id": "user_1"}, [("due_date", 1), ("_id", 1)], 0),
+    ({"user_id": "user_1", "status": "pending"}, [("due_date", 1), ("_id", 1)], 21),
+    ({"user_id": {"$in": ["user_2", "user_3"]}}, [("due_date", -1), ("_id", -1)], 10),
+    ({"status": "pending", "due_date": {"$lte": NOW + timedelta(minutes=5), "$gt": NOW},
+      "$or": [{"last_reminded": None}, {"last_reminded": {"$exists": False}}]}, [], 0),
+    ({"status": "pending", "due_date": {"$lte": NOW + timedelta(minutes=60), "$gt": NOW},
+      "immediate_notified": {"$ne": True}}, [], 0),
+    ({"status": "pending", "due_date": {"$lt": NOW}}, [("due_date", 1), ("_id", 1)], 5),
+    ({"user_id": "user_4", "due_date": None}, [("_id", 1)], 0),
+    ({"due_date": {"$ne": None}}, [("user_id", 1), ("_id", 1)], 0),
+    ({"user_id": "user_0", "$or": [{"due_date": {"$gt": NOW}}, {"due_date": NOW, "_id": {"$gt": bson.ObjectId.from_datetime(NOW)}}]},
+     [("due_date", 1), ("_id", 1)], 0),
+    ({"_id": {"$gte": bson.ObjectId.from_datetime(NOW + timedelta(seconds=100))}}, [("_id", 1)], 7),
+    ({"user_id": "user_2", "_id": {"$lt": bson.ObjectId.from_datetime(NOW + timedelta(seconds=150))}}, [("_id", 1)], 0),
+    ({"v": {"$exists": False}}, [], 0),
+    ({"last_reminded": {"$in": [None, NOW - timedelta(minutes=3)]}}, [], 0),
+]
+
+
+@pytest.mark.parametrize("query,sort,limit", QUERIES)
+def test_queries_match_mongodb(reminders, query, sort, limit):
+    reference = mongomock.MongoClient()["test"].reminders
+    docs = sample_docs()
+    reminders.insert_many([dict(doc) for doc in docs])
+    reference.insert_many([dict(doc) for doc in docs])
+
+    def ids(collection):
+        cursor = collection.find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        if limit:
+            cursor = cursor.limit(limit)
+        found = [doc["_id"] for doc in cursor]
+        return found if sort else sorted(found)
+
+    assert ids(reminders) == ids(reference)
+    assert reminders.count_documents(query) == reference.count_documents(query)
+
+
+def query_plan(collection, query, sort=()):
+    sql, params = collection._select("doc", query, list(sort), limit=20)
+    return " ".join(row[-1] for row in collection._store.execute(f"EXPLAIN QUERY PLAN {sql}", params))
+
+
+def test_queries_use_sqlite_indexes(reminders):
+    reminders.insert_many(sample_docs(50))
+    detail = query_plan(reminders, {"user_id": "user_1"}, [("due_date", 1)])
+    assert "user_id_1_due_date_1" in detail
+    assert "TEMP B-TREE" not in detail  # el orden sale del índice y el límite corta la lectura
+
+    assert "status_1_due_date_1" in query_plan(reminders, {"status": "pending", "due_date": {"$lte": NOW}})
+    assert "PRIMARY KEY" in query_plan(reminders, {"_id": bson.ObjectId()})
+
+
+def test_queries_outside_the_repository_are_rejected(reminders):
+    reminders.insert_one({"user_id": "a", "t": "pagar"})
+    for query in ({"t": "pagar"}, {"user_id": {"$regex": "^a"}}, {"$nor": [{"user_id": "a"}]}):
+        with pytest.raises(UnsupportedOperation) as error:
+            list(reminders.find(query))
+        assert error.value.code == 2
+    with pytest.raises(UnsupportedOperation):
+        list(reminders.find({}).sort("t", 1))
+    with pytest.raises(UnsupportedOperation):
+        reminders.create_index([("t", 1)])
+    with pytest.raises(UnsupportedOperation):
+        EmbeddedClient(None)["test"].notes
+    # Los campos no consultables se guardan y se actualizan igual
+    reminders.update_one({"user_id": "a"}, {"$set": {"t": "pagar la luz"}, "$inc": {"n": 2}})
+    assert reminders.find_one({"user_id": "a"}, {"t": 1, "n": 1, "_id": 0}) == {"t": "pagar la luz", "n": 2}
+
+
+def test_dates_compare_in_utc_at_millisecond_precision(reminders):
+    reminders.insert_one({"_id": 1, "due_date": NOW.replace(microsecond=123456)})
+    assert reminders.count_documents({"due_date": NOW.replace(microsecond=123000)}) == 1
+    aware = (NOW - timedelta(hours=4)).replace(tzinfo=timezone(timedelta(hours=-4)))
+    assert reminders.count_documents({"due_date": {"$gte": aware}}) == 1
+    assert reminders.count_documents({"due_date": {"$gt": NOW + timedelta(milliseconds=200)}}) == 0
+
+
+def test_unique_index_rejects_duplicates_atomically(reminders):
+    reminders.insert_one({"_id": 1, "user_id": "a", "idempotency_key": "k1"})
+    reminders.insert_one({"_id": 2, "user_id": "a", "idempotency_key": "k2"})
+    reminders.insert_one({"_id": 3, "user_id": "a"})
+    reminders.insert_one({"_id": 4, "user_id": "b"})  # varios sin la clave
+
+    with pytest.raises(DuplicateKeyError):
+        reminders.insert_one({"_id": 5, "user_id": "b", "idempotency_key": "k1"})
+    with pytest.raises(DuplicateKeyError):
+        reminders.update_one({"_id": 2}, {"$set": {"idempotency_key": "k1", "user_id": "z"}})
+    with pytest.raises(DuplicateKeyError):
+        reminders.insert_one({"_id": 1})
+
+    assert reminders.find_one({"_id": 2})["user_id"] == "a"
+    assert reminders.count_documents({"user_id": "z"}) == 0
+    assert reminders.count_documents({"_id": 5}) == 0
+    assert reminders.find_one({"idempotency_key": "k2"})["_id"] == 2
+
+
+def test_bulk_writes_report_duplicates_like_pymongo(reminders):
+    reminders.insert_one({"_id": 1, "idempotency_key": "k1"})
+    with pytest.raises(BulkWriteError) as error:
+        reminders.insert_many([{"_id": 2, "idempotency_key": "k1"}, {"_id": 3, "idempotency_key": "k3"}], ordered=False)
+    assert [item["index"] for item in error.value.details["writeErrors"]] == [0]
+    assert error.value.details["nInserted"] == 1
+    # Ordenado: se detiene en el primer error y conserva lo anterior
+    with pytest.raises(BulkWriteError):
+        reminders.insert_many([{"_id": 4}, {"_id": 5, "idempotency_key": "k3"}, {"_id": 6}])
+    assert sorted(doc["_id"] for doc in reminders.find({})) == [1, 3, 4]
+
+    result = reminders.bulk_write([
+        UpdateOne({"_id": 1}, {"$set": {"status": "sent"}}),
+        UpdateOne({"_id": 9, "user_id": "c"}, {"$inc": {"n": 1}}, upsert=True),
+        ReplaceOne({"_id": 3, "v": {"$exists": False}}, {"v": 2, "user_id": "c"}),
+    ], ordered=False)
+    assert (result.matched_count, result.modified_count, result.upserted_ids) == (2, 2, {1: 9})
+    assert reminders.count_documents({"user_id": "c", "v": 2}) == 1
+
+
+def test_updates_deletes_and_find_one_and_update(reminders):
+    reminders.insert_many([{"_id": n, "user_id": "a", "status": "pending", "due_date": NOW} for n in range(5)])
+    assert reminders.update_many({"_id": {"$lt": 3}}, {"$set": {"status": "completed"}}).modified_count == 3
+    assert reminders.count_documents({"status": "pending", "due_date": {"$lte": NOW}}) == 2
+    assert reminders.delete_one({"status": "completed"}).deleted_count == 1
+    assert reminders.delete_many({"status": "completed"}).deleted_count == 2
+    assert [doc["_id"] for doc in reminders.find({"user_id": "a"}).sort("_id", 1)] == [3, 4]
+    claimed = reminders.find_one_and_update({"status": "pending"}, {"$set": {"status": "sent"}},
+                                            sort=[("_id", -1)], return_document=True)
+    assert claimed["_id"] == 4 and claimed["status"] == "sent"
+    before = reminders.find_one_and_update({"status": "pending"}, {"$unset": {"due_date": ""}}, projection={"status": 1})
+    assert before == {"_id": 3, "status": "pending"}
+    assert reminders.count_documents({"due_date": None}) == 1
+
+
+def test_create_and_drop_index(reminders):
+    assert reminders.create_index([("user_id", 1), ("due_date", 1)]) == "user_id_1_due_date_1"
+    with pytest.raises(OperationFailure) as error:
+        reminders.create_index([("user_id", 1), ("due_date", 1)], unique=True)
+    assert error.value.code == 85
+    with pytest.raises(OperationFailure) as error:
+        reminders.create_index([("status", 1)], name="user_id_1_due_date_1")
+    assert error.value.code == 86
+
+    reminders.insert_many([{"v": 7}, {"v": 7}])
+    with pytest.raises(DuplicateKeyError):
+        reminders.create_index([("v", 1)], unique=True)
+    assert reminders.create_index([("v", 1)]) == "v_1"
+    reminders.drop_index("v_1")
+    with pytest.raises(OperationFailure) as error:
+        reminders.drop_index("v_1")
+    assert error.value.code == 27
+
+
+def test_ttl_index_purges_expired_documents():
+    tokens = EmbeddedClient(None)["test"].telegram_link_tokens
+    tokens.create_index([("expires_at", 1)], expireAfterSeconds=0)
+    tokens.insert_many([
+        {"_id": "old", "expires_at": datetime.utcnow() - timedelta(minutes=1)},
+        {"_id": "new", "expires_at": datetime.utcnow() + timedelta(minutes=10)},
+        {"_id": "number", "expires_at": 5},
+    ])
+    tokens._next_expire = 0.0
+    assert sorted(doc["_id"] for doc in tokens.find()) == ["new", "number"]
+
+
+def test_cursor_reads_in_batches_and_skips_changed(reminders):
+    reminders.insert_many([{"_id": n, "user_id": "a"} for n in range(25)])
+    cursor = iter(reminders.find({"user_id": "a"}).sort("_id", 1).batch_size(10))
+    first = [next(cursor)["_id"] for _ in range(10)]
+    reminders.delete_one({"_id": 15})
+    reminders.update_one({"_id": 20}, {"$set": {"user_id": "b"}})
+    assert first + [doc["_id"] for doc in cursor] == [n for n in range(25) if n not in (15, 20)]
+    assert [doc["_id"] for doc in reminders.find({"user_id": "a"}).sort("_id", -1).skip(2).limit(3)] == [22, 21, 19]
+
+
+def test_unsupported_operations_raise_documented_error():
+    client = EmbeddedClient(None)
+    with pytest.raises(UnsupportedOperation) as error:
+        client.start_session()
+    assert isinstance(error.value, OperationFailure) and error.value.code == 20
+    with pytest.raises(UnsupportedOperation) as error:
+        client["test"].reminders.watch()
+    assert error.value.code == 40573
+    with pytest.raises(UnsupportedOperation) as error:
+        client.admin.command("replSetGetStatus")
+    assert error.value.code == 59
+
+
+def test_run_in_transaction_falls_back_without_session(db, monkeypatch):
+    monkeypatch.setattr(main, "_transactions_supported", True)
+    assert main.run_in_transaction(lambda session: session) is None
+    assert main._transactions_supported is False
+
+
+def test_sqlite_file_keeps_documents_and_indexes(tmp_path):
+    path = str(tmp_path / "assistant.db")
+    client = EmbeddedClient(path)
+    client["app"].reminders.create_index([("idempotency_key", 1)], unique=True)
+    client["app"].reminders.insert_one({"_id": "r1", "idempotency_key": "k"})
+    client.close()
+
+    reopened = EmbeddedClient(path)
+    assert reopened["app"].list_collection_names() == ["reminders"]
+    assert reopened["app"].reminders.find_one({"idempotency_key": "k"})["_id"] == "r1"
+    with pytest.raises(DuplicateKeyError):
+        reopened["app"].reminders.insert_one({"idempotency_key": "k"})
+    reopened.close()
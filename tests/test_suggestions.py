@@ -0,0 +1,36 @@
+"""Sugerencias: el job programado combina los patrones de los recordatorios con el perfil de rutinas"""
+from datetime import datetime, timedelta
+
+import main
+from reminder_schema import encode_reminder
+
+MONDAY = datetime(2026, 10, 5, 22, 0)  # lunes 18:00 en Caracas
+
+
+def add_weekly(db, user_id, title, start, weeks=3):
+    db.reminders.insert_many([
+        encode_reminder({"user_id": user_id, "title": title, "status": "completed", "due_date": start + timedelta(weeks=week)})
+        for week in range(weeks)
+    ])
+
+
+def test_job_ranks_patterns_with_the_routine_profile(db):
+    add_weekly(db, "alice", "Gimnasio", MONDAY)
+    add_weekly(db, "alice", "Yoga", MONDAY + timedelta(days=2))
+    add_weekly(db, "bob", "Gimnasio", MONDAY, weeks=2)  # sin semanas suficientes
+    # El perfil de alice dice que "yoga" es lo que más repite; carol solo tiene perfil
+    db.user_routine_profiles.insert_many([
+        {"_id": "alice", "titles": {"yoga": 12, "gimnasio": 3}},
+        {"_id": "carol", "titles": {"leer": 5}},
+    ])
+
+    assert main.build_suggestion_models() == 1
+    main.load_suggestions_cache()
+
+    suggestions = db.user_suggestions.find_one({"_id": "alice"})["suggestions"]
+    assert [(item["title"], item["support"], item["frequency"]) for item in suggestions] == [
+        ("Yoga", 3, 12), ("Gimnasio", 3, 3)
+    ]
+    assert (suggestions[1]["weekday"], suggestions[1]["hour"]) == (0, 18)
+    assert {item["title"] for item in main.get_upcoming_suggestions("alice")} == {"Yoga", "Gimnasio"}
+    assert main.get_upcoming_suggestions("bob") == []
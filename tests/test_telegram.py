@@ -0,0 +1,110 @@
+from datetime import datetime, timedelta
+
+import pytest
+from pymongo.errors import DuplicateKeyError
+
+import main
+
+
+def start_update(chat_id, text, update_id=1):
+    return {"update_id": update_id, "message": {"chat": {"id": chat_id}, "from": {"username": "u"}, "text": text}}
+
+
+def linked_user(db, chat_id):
+    doc = db.telegram_users.find_one({"chat_id": str(chat_id)})
+    return doc["user_id"] if doc else None
+
+
+def test_start_with_raw_user_id_does_not_link(db, run, telegram_outbox):
+    run(main.process_telegram_update(start_update(999, "/start alice")))
+
+    assert db.telegram_users.find_one({"user_id": "alice"}) is None
+    assert "no válido" in telegram_outbox[-1][1]
+
+
+def test_start_with_link_token_links_once(db, run, telegram_outbox):
+    link = main.issue_telegram_link_token("alice")
+    assert link["command"] == f"/start {link['token']}"
+    assert db.telegram_link_tokens.find_one({"token_hash": link["token"]}) is None  # solo se guarda el hash
+
+    run(main.process_telegram_update(start_update(111, link["command"])))
+    assert linked_user(db, 111) == "alice"
+
+    # El mismo token no sirve para re-apuntar el chat de alice a otro chat
+    run(main.process_telegram_update(start_update(999, link["command"])))
+    assert main.get_user_chat_id("alice") == "111"
+    assert linked_user(db, 999) is None
+
+
+def test_expired_link_token_is_rejected(db, run, telegram_outbox):
+    link = main.issue_telegram_link_token("alice")
+    db.telegram_link_tokens.update_one({}, {"$set": {"expires_at": datetime.utcnow() - timedelta(seconds=1)}})
+
+    run(main.process_telegram_update(start_update(111, link["command"])))
+
+    assert linked_user(db, 111) is None
+    assert "caducado" in telegram_outbox[-1][1]
+
+
+def text_update(chat_id, text, update_id=2):
+    return {"update_id": update_id, "message": {"chat": {"id": chat_id}, "from": {}, "text": text}}
+
+
+def test_linking_replaces_automatic_chat_user(db, run, telegram_outbox, monkeypatch):
+    main.ensure_telegram_user_indexes()
+    # Un chat sin vincular escribe primero: queda como tg_555
+    assert main.get_chat_user_id("555") == "tg_555"
+
+    link = main.issue_telegram_link_token("alice")
+    run(main.process_telegram_update(start_update(555, link["command"])))
+
+    assert db.telegram_users.count_documents({"chat_id": "555"}) == 1
+    assert main.get_chat_user_id("555") == "alice"  # sin esperar a que caduque la caché
+    assert not main.get_user_chat_id("tg_555")
+
+    # Lo que llega después por ese chat se guarda a nombre de alice
+    users = []
+    async def fake_interaction(user_id, text, channel):
+        users.append(user_id)
+        return {"response_html": "ok"}
+    monkeypatch.setattr(main, "run_interaction", fake_interaction)
+    run(main.process_telegram_update(text_update(555, "recordarme pagar la luz")))
+    assert users == ["alice"]
+
+
+def test_relinking_user_moves_chat(db, run, telegram_outbox):
+    main.ensure_telegram_user_indexes()
+    main.link_telegram_chat("alice", "111")
+    assert main.get_chat_user_id("111") == "alice"
+
+    main.link_telegram_chat("alice", "222")
+
+    assert main.get_chat_user_id("111") == "tg_111"
+    assert main.get_chat_user_id("222") == "alice"
+
+
+def test_chat_index_is_unique_and_deduplicates(db):
+    db.telegram_users.insert_many([
+        {"user_id": "tg_555", "chat_id": "555", "linked_at": datetime(2026, 1, 1)},
+        {"user_id": "alice", "chat_id": "555", "linked_at": datetime(2026, 1, 2)},
+    ])
+
+    main.ensure_telegram_user_indexes()
+
+    assert [doc["user_id"] for doc in db.telegram_users.find({"chat_id": "555"})] == ["alice"]
+    with pytest.raises(DuplicateKeyError):
+        db.telegram_users.insert_one({"user_id": "bob", "chat_id": "555"})
+
+
+def test_chat_caches_are_bounded_and_remember_missing_chats(db, monkeypatch):
+    monkeypatch.setattr(main, "TELEGRAM_FALLBACK_TO_DEFAULT_CHAT", False)
+    monkeypatch.setattr(main._telegram_chat_cache, "max_size", 2)
+    main.link_telegram_chat("alice", "111")
+
+    assert main.get_user_chat_ids(["alice", "bob", "carol"]) == {"alice": "111", "bob": None, "carol": None}
+    assert len(main._telegram_chat_cache) == 2
+
+    # Un usuario sin chat queda en caché como None: no se vuelve a consultar la colección
+    main._telegram_chat_cache.set("dave", None)
+    db.telegram_users.insert_one({"user_id": "dave", "chat_id": "444"})
+    assert main.get_user_chat_id("dave") is None
@@ -0,0 +1,81 @@
+"""Webhook de Telegram con updates grabados (tests/fixtures/telegram/*.json)"""
+import asyncio
+import json
+import os
+import time
+
+from bson import ObjectId
+from fastapi.testclient import TestClient
+
+import main
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures", "telegram")
+
+
+def load_update(name):
+    with open(os.path.join(FIXTURES, name), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def test_retry_after_503_is_not_dropped_as_duplicate(db, monkeypatch):
+    update = load_update("message.json")
+    client = TestClient(main.app)  # sin lifespan: los workers no están iniciados
+    monkeypatch.setattr(main, "telegram_update_queue", None)
+
+    assert client.post("/telegram/webhook", json=update).status_code == 503
+
+    queue = asyncio.Queue()
+    monkeypatch.setattr(main, "telegram_update_queue", queue)
+    assert client.post("/telegram/webhook", json=update).json() == {"ok": True, "queued": True}
+    assert queue.qsize() == 1
+
+    # Ahora sí es un duplicado
+    assert client.post("/telegram/webhook", json=update).json() == {"ok": True, "duplicate": True}
+    assert queue.qsize() == 1
+
+
+def test_retry_after_full_queue_is_accepted(db, monkeypatch):
+    update = load_update("message.json")
+    queue = asyncio.Queue(maxsize=1)
+    queue.put_nowait({"update_id": 1})
+    monkeypatch.setattr(main, "telegram_update_queue", queue)
+    client = TestClient(main.app)
+
+    assert client.post("/telegram/webhook", json=update).status_code == 503
+    queue.get_nowait()
+    assert client.post("/telegram/webhook", json=update).json()["queued"] is True
+
+
+def test_recorded_updates_end_to_end(db, telegram_outbox):
+    message = load_update("message.json")
+    with TestClient(main.app) as client:
+        assert client.post("/telegram/webhook", json=message).json()["queued"] is True
+        assert wait_for(lambda: db.reminders.count_documents({"user_id": "tg_555"}) == 1)
+        assert wait_for(lambda: any(chat == "555" for chat, _ in telegram_outbox))
+
+        reminder = db.reminders.find_one({"user_id": "tg_555"})
+        callback = load_update("callback_done.json")
+        callback["callback_query"]["data"] = f"done:{reminder['_id']}"
+        assert client.post("/telegram/webhook", json=callback).json()["queued"] is True
+        assert wait_for(lambda: main.decode_reminder(db.reminders.find_one({"_id": reminder["_id"]}))["status"] == "completed")
+
+
+def test_callback_from_other_chat_cannot_complete_reminder(db, run, telegram_outbox):
+    main.link_telegram_chat("alice", "111")
+    reminder_id = db.reminders.insert_one(main.encode_reminder({"user_id": "alice", "title": "pagar", "status": "pending"})).inserted_id
+    callback = load_update("callback_done.json")["callback_query"]
+    callback["data"] = f"done:{reminder_id}"
+
+    run(main.handle_reminder_action(callback))  # el chat 555 no es el de alice
+
+    assert main.decode_reminder(db.reminders.find_one({"_id": ObjectId(reminder_id)}))["status"] == "pending"
+    assert "no encontrado" in telegram_outbox[-1][1]
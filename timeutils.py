@@ -0,0 +1,48 @@
+"""
+Zona horaria del asistente y conversiones local <-> UTC.
+
+Módulo sin dependencias de la aplicación para que lo puedan importar los workers del NLU.
+"""
+from datetime import datetime, timedelta, timezone
+
+import pytz
+
+# 🆕 CONFIGURACIÓN PARA VENEZUELA (Caracas)
+TIMEZONE = pytz.timezone('America/Caracas')  # UTC-4
+
+def get_local_now():
+    """Obtiene la fecha/hora actual en la zona horaria de Venezuela"""
+    return datetime.now(TIMEZONE)
+
+def get_utc_now():
+    """Obtiene la fecha/hora actual en UTC"""
+    return datetime.now(timezone.utc)
+
+def local_to_utc(local_dt):
+    """Convierte datetime local a UTC"""
+    if local_dt.tzinfo is None:
+        local_dt = TIMEZONE.localize(local_dt)
+    return local_dt.astimezone(timezone.utc)
+
+def utc_to_local(utc_dt):
+    """Convierte datetime UTC a local"""
+    if utc_dt.tzinfo is None:
+        utc_dt = utc_dt.replace(tzinfo=timezone.utc)
+    return utc_dt.astimezone(TIMEZONE)
+
+def make_naive(dt):
+    """Convierte datetime aware a naive (sin timezone)"""
+    if dt.tzinfo is not None:
+        return dt.replace(tzinfo=None)
+    return dt
+
+
+def get_next_weekday(weekday: int, reference_date=None):
+    """Obtiene la próxima ocurrencia de un día de la semana"""
+    if reference_date is None:
+        reference_date = get_local_now()
+    
+    days_ahead = weekday - reference_date.weekday()
+    if days_ahead <= 0:
+        days_ahead += 7
+    return reference_date + timedelta(days=days_ahead)